@@ -36,6 +36,13 @@ sys.exit(0 if not s.connect_ex((host,port)) else 1)"; do
 done
 echo "[entrypoint] DB is up."
 
+# Отдельный процесс очереди медиа-заданий (faststart): миграции уже применил сервис app
+if [ "${1:-}" = "media-worker" ]; then
+  echo "[entrypoint] Starting media worker..."
+  export DISABLE_SCHEDULER=1
+  exec python -m flask --app 'movie_lottery:create_app()' media-worker
+fi
+
 # Alembic: миграции (только если конфиг валиден)
 if [ -f "migrations/alembic.ini" ] || [ -f "migrations/env.py" ]; then
   if [ -f "migrations/alembic.ini" ] && grep -q "^script_location\\s*=" migrations/alembic.ini; then
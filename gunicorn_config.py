@@ -19,6 +19,9 @@ timeout = 600  # 10 минут для больших видео файлов
 graceful_timeout = 120
 keepalive = 65  # Keep-alive соединения живыми 65 сек (больше чем default браузеров ~60s)
 
+# Отдача трейлеров через os.sendfile (wsgi.file_wrapper): байты не проходят через Python
+sendfile = True
+
 # Logging
 loglevel = "info"
 accesslog = "-"
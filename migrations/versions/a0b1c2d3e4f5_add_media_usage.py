@@ -0,0 +1,42 @@
+"""add library_movie.poster_file_size and media_usage table for disk usage accounting
+
+Revision ID: a0b1c2d3e4f5
+Revises: z9a0b1c2d3e4
+Create Date: 2026-10-22 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a0b1c2d3e4f5'
+down_revision = 'z9a0b1c2d3e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    table_names = inspector.get_table_names()
+
+    existing_columns = {column['name'] for column in inspector.get_columns('library_movie')}
+    if 'poster_file_size' not in existing_columns:
+        op.add_column('library_movie', sa.Column('poster_file_size', sa.Integer(), nullable=True))
+
+    if 'media_usage' not in table_names:
+        op.create_table(
+            'media_usage',
+            sa.Column('kind', sa.String(length=16), nullable=False),
+            sa.Column('total_bytes', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+            sa.Column('file_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('recounted_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+            sa.PrimaryKeyConstraint('kind')
+        )
+
+
+def downgrade():
+    op.drop_table('media_usage')
+    op.drop_column('library_movie', 'poster_file_size')
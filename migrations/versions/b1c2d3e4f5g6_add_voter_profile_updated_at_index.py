@@ -0,0 +1,29 @@
+"""add index on poll_voter_profile.updated_at for leaderboard sync
+
+Revision ID: b1c2d3e4f5g6
+Revises: a0b1c2d3e4f5
+Create Date: 2026-10-23 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b1c2d3e4f5g6'
+down_revision = 'a0b1c2d3e4f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    indexes = {index['name'] for index in inspector.get_indexes('poll_voter_profile')}
+
+    if 'ix_poll_voter_profile_updated_at' not in indexes:
+        op.create_index('ix_poll_voter_profile_updated_at', 'poll_voter_profile', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('ix_poll_voter_profile_updated_at', table_name='poll_voter_profile')
@@ -0,0 +1,38 @@
+"""add per-poll voter rollup so deleting a poll discounts compacted votes
+
+Revision ID: c2d3e4f5g6h7
+Revises: b1c2d3e4f5g6
+Create Date: 2026-10-24 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d3e4f5g6h7'
+down_revision = 'b1c2d3e4f5g6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    if 'poll_voter_rollup' not in inspector.get_table_names():
+        op.create_table(
+            'poll_voter_rollup',
+            sa.Column('poll_id', sa.String(length=8), nullable=False),
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('voter_token', sa.String(length=64), nullable=False),
+            sa.Column('votes_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('votes_points', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('last_vote_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['poll_id'], ['poll.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('poll_id', 'month', 'voter_token')
+        )
+
+
+def downgrade():
+    op.drop_table('poll_voter_rollup')
@@ -0,0 +1,53 @@
+"""add poll_voter_stats aggregate table
+
+Revision ID: q0r1s2t3u4v5
+Revises: p9q0r1s2t3u4
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'q0r1s2t3u4v5'
+down_revision = 'p9q0r1s2t3u4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    vote_indexes = {index['name'] for index in inspector.get_indexes('vote')}
+    if 'ix_vote_voter_token_voted_at' not in vote_indexes:
+        op.create_index('ix_vote_voter_token_voted_at', 'vote', ['voter_token', 'voted_at'], unique=False)
+
+    if 'poll_voter_stats' in inspector.get_table_names():
+        return
+
+    # Агрегаты голосов по токену: количество, сумма баллов и время последнего голоса
+    op.create_table(
+        'poll_voter_stats',
+        sa.Column('voter_token', sa.String(length=64), nullable=False),
+        sa.Column('votes_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('votes_points', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('last_vote_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.PrimaryKeyConstraint('voter_token')
+    )
+    op.create_index('ix_poll_voter_stats_last_vote_at', 'poll_voter_stats', ['last_vote_at'], unique=False)
+
+    # Заполняем агрегаты по уже существующим голосам одним запросом
+    op.execute(
+        "INSERT INTO poll_voter_stats (voter_token, votes_count, votes_points, last_vote_at, updated_at) "
+        "SELECT voter_token, COUNT(*), COALESCE(SUM(points_awarded), 0), MAX(voted_at), CURRENT_TIMESTAMP "
+        "FROM vote GROUP BY voter_token"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_poll_voter_stats_last_vote_at', table_name='poll_voter_stats')
+    op.drop_table('poll_voter_stats')
+    op.drop_index('ix_vote_voter_token_voted_at', table_name='vote')
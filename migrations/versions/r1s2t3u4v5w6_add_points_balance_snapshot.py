@@ -0,0 +1,78 @@
+"""add points_balance_snapshot table for ledger reconciliation
+
+Revision ID: r1s2t3u4v5w6
+Revises: q0r1s2t3u4v5
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'r1s2t3u4v5w6'
+down_revision = 'q0r1s2t3u4v5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    table_names = inspector.get_table_names()
+
+    if 'points_transaction' in table_names:
+        transaction_indexes = {index['name'] for index in inspector.get_indexes('points_transaction')}
+        if 'ix_points_transaction_voter_token_id' not in transaction_indexes:
+            op.create_index(
+                'ix_points_transaction_voter_token_id',
+                'points_transaction',
+                ['voter_token', 'id'],
+                unique=False,
+            )
+
+    if 'points_balance_snapshot' in table_names:
+        return
+
+    # Снимки баланса: баланс по журналу после last_transaction_id и найденное расхождение
+    op.create_table(
+        'points_balance_snapshot',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('voter_token', sa.String(length=64), nullable=False),
+        sa.Column('balance', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('last_transaction_id', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('drift', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ix_points_balance_snapshot_voter_token_id',
+        'points_balance_snapshot',
+        ['voter_token', 'id'],
+        unique=False,
+    )
+
+    # Текущие балансы профилей принимаются за отправную точку сверки
+    if 'points_transaction' in table_names:
+        op.execute(
+            "INSERT INTO points_balance_snapshot (voter_token, balance, last_transaction_id, drift, created_at) "
+            "SELECT p.token, COALESCE(p.total_points, 0), "
+            "COALESCE((SELECT MAX(t.id) FROM points_transaction t WHERE t.voter_token = p.token), 0), "
+            "0, CURRENT_TIMESTAMP FROM poll_voter_profile p"
+        )
+    else:
+        op.execute(
+            "INSERT INTO points_balance_snapshot (voter_token, balance, last_transaction_id, drift, created_at) "
+            "SELECT token, COALESCE(total_points, 0), 0, 0, CURRENT_TIMESTAMP FROM poll_voter_profile"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_points_balance_snapshot_voter_token_id', table_name='points_balance_snapshot')
+    op.drop_table('points_balance_snapshot')
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'points_transaction' in inspector.get_table_names():
+        transaction_indexes = {index['name'] for index in inspector.get_indexes('points_transaction')}
+        if 'ix_points_transaction_voter_token_id' in transaction_indexes:
+            op.drop_index('ix_points_transaction_voter_token_id', table_name='points_transaction')
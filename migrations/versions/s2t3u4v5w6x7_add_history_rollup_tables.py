@@ -0,0 +1,65 @@
+"""add monthly rollup tables for vote and points history retention
+
+Revision ID: s2t3u4v5w6x7
+Revises: r1s2t3u4v5w6
+Create Date: 2026-10-19 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 's2t3u4v5w6x7'
+down_revision = 'r1s2t3u4v5w6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    table_names = inspector.get_table_names()
+
+    if 'points_monthly_rollup' not in table_names:
+        op.create_table(
+            'points_monthly_rollup',
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('voter_token', sa.String(length=64), nullable=False),
+            sa.Column('transaction_type', sa.String(length=30), nullable=False),
+            sa.Column('transactions_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('amount_total', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('credit_total', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('debit_total', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.PrimaryKeyConstraint('month', 'voter_token', 'transaction_type')
+        )
+
+    if 'vote_monthly_rollup' not in table_names:
+        op.create_table(
+            'vote_monthly_rollup',
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('voter_token', sa.String(length=64), nullable=False),
+            sa.Column('votes_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('votes_points', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('last_vote_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('month', 'voter_token')
+        )
+
+    if 'poll_vote_rollup' not in table_names:
+        op.create_table(
+            'poll_vote_rollup',
+            sa.Column('poll_id', sa.String(length=8), nullable=False),
+            sa.Column('movie_id', sa.Integer(), nullable=False),
+            sa.Column('votes_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('votes_points', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('last_vote_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['poll_id'], ['poll.id'], ondelete='CASCADE'),
+            sa.ForeignKeyConstraint(['movie_id'], ['poll_movie.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('poll_id', 'movie_id')
+        )
+
+
+def downgrade():
+    op.drop_table('poll_vote_rollup')
+    op.drop_table('vote_monthly_rollup')
+    op.drop_table('points_monthly_rollup')
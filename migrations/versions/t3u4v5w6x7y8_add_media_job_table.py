@@ -0,0 +1,52 @@
+"""add media_job table for the background media processing queue
+
+Revision ID: t3u4v5w6x7y8
+Revises: s2t3u4v5w6x7
+Create Date: 2026-10-19 18:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 't3u4v5w6x7y8'
+down_revision = 's2t3u4v5w6x7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'media_job' in inspector.get_table_names():
+        return
+
+    op.create_table(
+        'media_job',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('job_type', sa.String(length=32), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='queued'),
+        sa.Column('progress', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default=sa.text('3')),
+        sa.Column('batch_id', sa.String(length=32), nullable=True),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('worker_id', sa.String(length=64), nullable=True),
+        sa.Column('run_after', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_media_job_status_run_after', 'media_job', ['status', 'run_after'], unique=False)
+    op.create_index('ix_media_job_batch_id', 'media_job', ['batch_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_media_job_batch_id', table_name='media_job')
+    op.drop_index('ix_media_job_status_run_after', table_name='media_job')
+    op.drop_table('media_job')
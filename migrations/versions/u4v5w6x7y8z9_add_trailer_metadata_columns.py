@@ -0,0 +1,40 @@
+"""add moov metadata columns for local trailers
+
+Revision ID: u4v5w6x7y8z9
+Revises: t3u4v5w6x7y8
+Create Date: 2026-10-19 20:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'u4v5w6x7y8z9'
+down_revision = 't3u4v5w6x7y8'
+branch_labels = None
+depends_on = None
+
+
+_COLUMNS = (
+    ('trailer_duration', sa.Float()),
+    ('trailer_codecs', sa.String(length=255)),
+    ('trailer_width', sa.Integer()),
+    ('trailer_height', sa.Integer()),
+    ('trailer_faststart', sa.Boolean()),
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {column['name'] for column in sa.inspect(bind).get_columns('library_movie')}
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        for name, column_type in _COLUMNS:
+            if name not in existing:
+                batch_op.add_column(sa.Column(name, column_type, nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        for name, _ in reversed(_COLUMNS):
+            batch_op.drop_column(name)
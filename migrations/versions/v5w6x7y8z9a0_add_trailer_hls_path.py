@@ -0,0 +1,30 @@
+"""add HLS master playlist path for local trailers
+
+Revision ID: v5w6x7y8z9a0
+Revises: u4v5w6x7y8z9
+Create Date: 2026-10-19 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'v5w6x7y8z9a0'
+down_revision = 'u4v5w6x7y8z9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {column['name'] for column in sa.inspect(bind).get_columns('library_movie')}
+    if 'trailer_hls_path' in existing:
+        return
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('trailer_hls_path', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        batch_op.drop_column('trailer_hls_path')
@@ -0,0 +1,38 @@
+"""add poster frame, sprite and WebVTT thumbnail paths for local trailers
+
+Revision ID: w6x7y8z9a0b1
+Revises: v5w6x7y8z9a0
+Create Date: 2026-10-19 22:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'w6x7y8z9a0b1'
+down_revision = 'v5w6x7y8z9a0'
+branch_labels = None
+depends_on = None
+
+
+_COLUMNS = (
+    'trailer_poster_frame_path',
+    'trailer_sprite_path',
+    'trailer_thumbnails_path',
+)
+
+
+def upgrade():
+    bind = op.get_bind()
+    existing = {column['name'] for column in sa.inspect(bind).get_columns('library_movie')}
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        for name in _COLUMNS:
+            if name not in existing:
+                batch_op.add_column(sa.Column(name, sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('library_movie', schema=None) as batch_op:
+        for name in reversed(_COLUMNS):
+            batch_op.drop_column(name)
@@ -0,0 +1,45 @@
+"""add trailer_upload table for resumable trailer uploads
+
+Revision ID: x7y8z9a0b1c2
+Revises: w6x7y8z9a0b1
+Create Date: 2026-10-19 23:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'x7y8z9a0b1c2'
+down_revision = 'w6x7y8z9a0b1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'trailer_upload' in inspector.get_table_names():
+        return
+
+    op.create_table(
+        'trailer_upload',
+        sa.Column('id', sa.String(length=32), nullable=False),
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('relative_path', sa.String(length=500), nullable=False),
+        sa.Column('mime_type', sa.String(length=100), nullable=True),
+        sa.Column('upload_length', sa.BigInteger(), nullable=False),
+        sa.Column('upload_offset', sa.BigInteger(), nullable=False, server_default=sa.text('0')),
+        sa.Column('checksum', sa.String(length=64), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['movie_id'], ['library_movie.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_trailer_upload_movie_id', 'trailer_upload', ['movie_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_trailer_upload_movie_id', table_name='trailer_upload')
+    op.drop_table('trailer_upload')
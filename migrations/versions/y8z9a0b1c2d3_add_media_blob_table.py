@@ -0,0 +1,43 @@
+"""add media_blob table for content-addressed trailer and poster storage
+
+Revision ID: y8z9a0b1c2d3
+Revises: x7y8z9a0b1c2
+Create Date: 2026-10-20 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'y8z9a0b1c2d3'
+down_revision = 'x7y8z9a0b1c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if 'media_blob' in inspector.get_table_names():
+        return
+
+    op.create_table(
+        'media_blob',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('relative_path', sa.String(length=500), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('ref_count', sa.Integer(), nullable=False, server_default=sa.text('0')),
+        sa.Column('created_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('relative_path')
+    )
+    op.create_index('ix_media_blob_sha256', 'media_blob', ['sha256'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_media_blob_sha256', table_name='media_blob')
+    op.drop_table('media_blob')
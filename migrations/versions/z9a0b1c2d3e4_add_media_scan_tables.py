@@ -0,0 +1,61 @@
+"""add media_scan_state and media_scan_entry tables for the media integrity scanner
+
+Revision ID: z9a0b1c2d3e4
+Revises: y8z9a0b1c2d3
+Create Date: 2026-10-21 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'z9a0b1c2d3e4'
+down_revision = 'y8z9a0b1c2d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    table_names = inspector.get_table_names()
+
+    if 'media_scan_state' not in table_names:
+        op.create_table(
+            'media_scan_state',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('pass_number', sa.Integer(), nullable=False, server_default=sa.text('1')),
+            sa.Column('file_cursor', sa.String(length=500), nullable=True),
+            sa.Column('files_done', sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column('movie_cursor', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('movies_done', sa.Boolean(), nullable=False, server_default=sa.false()),
+            sa.Column('pass_started_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+            sa.Column('last_pass_finished_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+            sa.PrimaryKeyConstraint('id')
+        )
+
+    if 'media_scan_entry' not in table_names:
+        op.create_table(
+            'media_scan_entry',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('relative_path', sa.String(length=500), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=True),
+            sa.Column('mtime', sa.Float(), nullable=True),
+            sa.Column('issue', sa.String(length=16), nullable=True),
+            sa.Column('expected_size', sa.BigInteger(), nullable=True),
+            sa.Column('movie_id', sa.Integer(), nullable=True),
+            sa.Column('seen_pass', sa.Integer(), nullable=False, server_default=sa.text('0')),
+            sa.Column('detected_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=False, server_default=sa.text('CURRENT_TIMESTAMP')),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('relative_path')
+        )
+        op.create_index('ix_media_scan_entry_issue', 'media_scan_entry', ['issue'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_media_scan_entry_issue', table_name='media_scan_entry')
+    op.drop_table('media_scan_entry')
+    op.drop_table('media_scan_state')
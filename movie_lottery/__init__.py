@@ -10,6 +10,7 @@ from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.middleware.shared_data import SharedDataMiddleware
 from flask_socketio import SocketIO
 
 from .diagnostic_middleware import start_diagnostics, checkpoint, finish_diagnostics
@@ -65,6 +66,18 @@ def create_app():
         except OSError as exc:
             app.logger.warning('Не удалось создать директорию для трейлеров %s: %s', trailer_dir, exc)
 
+    # Постеры с именами по SHA-256 отдаются статикой, не доходя до Flask;
+    # промахи (ещё не созданные копии) middleware передаёт приложению
+    if app.config.get('POSTER_STATIC_MIDDLEWARE'):
+        # media_delivery не импортирует модели: до db.init_app это безопасно
+        from .utils.media_delivery import POSTER_STATIC_URL_PATH
+
+        app.wsgi_app = SharedDataMiddleware(
+            app.wsgi_app,
+            {POSTER_STATIC_URL_PATH: app.config.get('POSTER_UPLOAD_DIR')},
+            cache_timeout=31536000,
+        )
+
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
     checkpoint("ProxyFix configured")
 
@@ -76,13 +89,22 @@ def create_app():
 
     with app.app_context():
         from .utils.helpers import (
+            ensure_history_rollup_tables,
             ensure_library_movie_columns,
+            ensure_media_blob_table,
+            ensure_media_job_table,
+            ensure_media_scan_tables,
+            ensure_media_usage_table,
             ensure_poll_movie_points_column,
             ensure_poll_movie_ban_column,
             ensure_poll_forced_winner_column,
             ensure_poll_voter_user_id_column,
+            ensure_voter_profile_updated_at_index,
+            ensure_points_snapshot_table,
             ensure_poll_tables,
+            ensure_trailer_upload_table,
             ensure_vote_points_column,
+            ensure_voter_stats_table,
             ensure_voter_streak_columns,
         )
 
@@ -94,6 +116,15 @@ def create_app():
         ensure_poll_forced_winner_column()
         ensure_library_movie_columns()
         ensure_voter_streak_columns()
+        ensure_voter_profile_updated_at_index()
+        ensure_voter_stats_table()
+        ensure_points_snapshot_table()
+        ensure_history_rollup_tables()
+        ensure_media_job_table()
+        ensure_trailer_upload_table()
+        ensure_media_blob_table()
+        ensure_media_scan_tables()
+        ensure_media_usage_table()
 
     from . import models
     checkpoint("Models imported")
@@ -126,6 +157,9 @@ def create_app():
             return False
         if os.environ.get('FLASK_DEBUG_RELOADER'):
             return False
+        # Отдельные процессы (media-worker) не должны дублировать задачи планировщика
+        if os.environ.get('DISABLE_SCHEDULER'):
+            return False
         
         # Для gunicorn: используем файловую блокировку (только Unix/Linux)
         # Только первый процесс, который захватит lock, запустит scheduler
@@ -155,7 +189,13 @@ def create_app():
             return False
     
     if not scheduler.running and _should_start_scheduler():
-        from .utils.helpers import finalize_poll, vladivostok_now
+        from .utils.helpers import (
+            compact_history,
+            ensure_points_ledger_partitions,
+            finalize_poll,
+            reconcile_points_balances,
+            vladivostok_now,
+        )
         from .models import MovieSchedule, Poll
         
         def cleanup_schedules_job():
@@ -172,6 +212,69 @@ def create_app():
             replace_existing=True
         )
         
+        # Брошенные возобновляемые загрузки трейлеров
+        def cleanup_trailer_uploads_job():
+            from .utils.resumable_uploads import cleanup_expired_uploads
+
+            with app.app_context():
+                try:
+                    count = cleanup_expired_uploads()
+                    if count > 0:
+                        app.logger.info("Удалено брошенных загрузок трейлеров: %d", count)
+                except Exception as e:
+                    app.logger.warning("Ошибка очистки загрузок трейлеров: %s", e)
+
+        scheduler.add_job(
+            func=cleanup_trailer_uploads_job,
+            trigger=IntervalTrigger(hours=1),
+            id='cleanup_trailer_uploads',
+            name='Remove expired resumable trailer uploads',
+            replace_existing=True
+        )
+
+        # Файлы хранилища, на которые не осталось ссылок: обработчики запросов и задания
+        # только снимают ссылки, а сам проход по media_blob выполняется здесь
+        def collect_media_blobs_job():
+            from .utils.media_store import collect_orphan_blobs
+
+            with app.app_context():
+                try:
+                    count = collect_orphan_blobs()
+                    if count > 0:
+                        app.logger.info("Удалено неиспользуемых медиафайлов: %d", count)
+                except Exception as e:
+                    app.logger.warning("Ошибка очистки хранилища медиафайлов: %s", e)
+
+        scheduler.add_job(
+            func=collect_media_blobs_job,
+            trigger=IntervalTrigger(hours=1),
+            id='collect_media_blobs',
+            name='Remove unreferenced content-addressed media',
+            replace_existing=True
+        )
+
+        # Инкрементальная проверка медиакаталога: брошенные, пропавшие и повреждённые файлы
+        if app.config.get('MEDIA_SCAN_ENABLED'):
+            def media_scan_job():
+                from .utils.media_scan import scan_media_step
+
+                with app.app_context():
+                    try:
+                        summary = scan_media_step()
+                        if summary['pass_finished']:
+                            app.logger.info("Проверка медиафайлов: проход %d завершён", summary['pass'])
+                    except Exception as e:
+                        db.session.rollback()
+                        app.logger.warning("Ошибка проверки медиафайлов: %s", e)
+
+            scheduler.add_job(
+                func=media_scan_job,
+                trigger=IntervalTrigger(minutes=max(1, app.config.get('MEDIA_SCAN_INTERVAL_MINUTES') or 10)),
+                id='media_scan',
+                name='Incremental media integrity scan',
+                replace_existing=True
+            )
+
         # Периодическая проверка истёкших опросов и присвоение бейджей
         # Проверяем каждые 10 секунд для быстрого срабатывания
         def finalize_expired_polls_job():
@@ -199,6 +302,88 @@ def create_app():
             replace_existing=True
         )
         
+        # Инкрементальная сверка балансов с журналом баллов (от последних снимков)
+        def reconcile_points_job():
+            with app.app_context():
+                try:
+                    result = reconcile_points_balances()
+                    if result['drifted']:
+                        app.logger.warning(
+                            "Сверка баллов: проверено %d, расхождений %d, исправлено %d",
+                            result['checked'], result['drifted'], result['fixed'],
+                        )
+                except Exception as e:
+                    app.logger.warning("Ошибка сверки балансов с журналом: %s", e)
+
+        scheduler.add_job(
+            func=reconcile_points_job,
+            trigger=IntervalTrigger(minutes=app.config.get('POINTS_RECONCILE_INTERVAL_MINUTES', 10)),
+            id='reconcile_points',
+            name='Reconcile voter balances with the points ledger',
+            replace_existing=True
+        )
+
+        # Перестройка лидерборда этого процесса: подхватывает изменения других процессов и «остывшие» серии
+        def refresh_leaderboard_job():
+            from .utils.leaderboard import refresh_leaderboard
+
+            with app.app_context():
+                try:
+                    refresh_leaderboard()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.warning("Ошибка перестройки лидерборда: %s", e)
+
+        scheduler.add_job(
+            func=refresh_leaderboard_job,
+            trigger=IntervalTrigger(seconds=max(1, app.config.get('LEADERBOARD_REFRESH_SECONDS') or 300)),
+            id='refresh_leaderboard',
+            name='Rebuild the in-memory voter leaderboard',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True,
+        )
+
+        # Политика хранения: свёртка старых Vote/PointsTransaction в месячные агрегаты
+        def compact_history_job():
+            with app.app_context():
+                try:
+                    ensure_points_ledger_partitions()
+                    compact_history()
+                except Exception as e:
+                    app.logger.warning("Ошибка свёртки истории голосов и баллов: %s", e)
+
+        if app.config.get('HISTORY_RETENTION_MONTHS', 0) > 0:
+            scheduler.add_job(
+                func=compact_history_job,
+                trigger=IntervalTrigger(hours=app.config.get('HISTORY_RETENTION_INTERVAL_HOURS', 6)),
+                id='compact_history',
+                name='Compact old votes and points ledger into monthly rollups',
+                replace_existing=True
+            )
+
+        # Очередь медиа-заданий без отдельного worker-процесса (только при явном MEDIA_WORKER_MODE=inline)
+        def media_jobs_job():
+            from .utils import media_jobs  # noqa: F401 — регистрирует обработчики заданий
+            from .utils.job_queue import default_worker_id, process_pending_jobs
+
+            with app.app_context():
+                try:
+                    process_pending_jobs(default_worker_id('inline'))
+                except Exception as e:
+                    app.logger.warning("Ошибка обработки очереди медиа-заданий: %s", e)
+
+        if app.config.get('MEDIA_WORKER_MODE', 'external') == 'inline':
+            scheduler.add_job(
+                func=media_jobs_job,
+                trigger=IntervalTrigger(seconds=app.config.get('MEDIA_WORKER_POLL_SECONDS', 5)),
+                id='media_jobs',
+                name='Process queued media jobs',
+                replace_existing=True,
+                max_instances=1,
+                coalesce=True,
+            )
+
         scheduler.start()
         checkpoint("Scheduler started (single instance with file lock)")
         
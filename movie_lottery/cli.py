@@ -1,42 +1,417 @@
+import signal
+import threading
+
 import click
 from flask.cli import with_appcontext
-from sqlalchemy import func
+from sqlalchemy import Date, and_, cast, func, insert, literal, select, true, union_all, update
 
 from . import db
-from .models import PollVoterProfile, Vote
+from .models import LibraryMovie, MediaBlob, PollVoterProfile, PollVoterStats, Vote, VoteMonthlyRollup
+from .utils.helpers import compact_history, partition_points_ledger, reconcile_points_balances
+
+
+def _token_ranges(chunk_size):
+    """Yield (first, last) voter token bounds covering profiles in keyset chunks."""
+    if not chunk_size:
+        yield None, None
+        return
+
+    last_token = None
+    while True:
+        query = select(PollVoterProfile.token).order_by(PollVoterProfile.token).limit(chunk_size)
+        if last_token is not None:
+            query = query.where(PollVoterProfile.token > last_token)
+        tokens = db.session.execute(query).scalars().all()
+        if not tokens:
+            return
+        yield tokens[0], tokens[-1]
+        last_token = tokens[-1]
+
+
+def _within_range(column, first, last):
+    if first is None:
+        return true()
+    return and_(column >= first, column <= last)
+
+
+def _greatest(left, right):
+    if db.engine.dialect.name == 'postgresql':
+        return func.greatest(left, right)
+    return func.max(left, right)
+
+
+def _vote_date():
+    if db.engine.dialect.name == 'postgresql':
+        return cast(Vote.voted_at, Date)
+    return func.date(Vote.voted_at)
+
+
+def _vote_day_number():
+    if db.engine.dialect.name == 'postgresql':
+        return cast(Vote.voted_at, Date) - literal('2000-01-01').cast(Date)
+    return cast(func.julianday(func.date(Vote.voted_at)), db.Integer)
+
+
+def _run_backfill(label, build_statements, chunk_size, dry_run):
+    """Execute set-based statements per token chunk; dry-run rolls every chunk back."""
+    changed = 0
+    chunks = 0
+    for first, last in _token_ranges(chunk_size):
+        for statement in build_statements(first, last):
+            changed += db.session.execute(statement).rowcount or 0
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        chunks += 1
+
+    verb = "Would update" if dry_run else "Updated"
+    click.echo(f"{verb} {changed} {label} in {chunks} chunk(s).")
+    return changed
 
 
 def register_cli(app):
+    chunk_option = click.option(
+        "--chunk-size",
+        type=int,
+        default=0,
+        show_default=True,
+        help="Voter profiles per transaction (0 = single statement).",
+    )
+    dry_run_option = click.option(
+        "--dry-run",
+        is_flag=True,
+        help="Report how many rows would change and roll back.",
+    )
+
     @app.cli.command("backfill-poll-voter-points")
+    @chunk_option
+    @dry_run_option
     @with_appcontext
-    def backfill_poll_voter_points():
-        """Backfill points_accrued_total using historical positive vote awards."""
-        results = (
-            db.session.query(Vote.voter_token, func.sum(Vote.points_awarded))
-            .filter(Vote.points_awarded > 0)
-            .group_by(Vote.voter_token)
-            .all()
-        )
+    def backfill_poll_voter_points(chunk_size, dry_run):
+        """Backfill points_accrued_total using historical positive vote awards.
 
-        updated = 0
-        skipped_missing_profiles = 0
+        Only raw vote rows are considered: months compacted by the retention
+        policy keep net sums only and are not included, so the total never
+        decreases (like max_voting_streak in backfill-voting-streaks).
+        """
+        def statements(first, last):
+            awards = (
+                select(
+                    Vote.voter_token.label('voter_token'),
+                    func.sum(Vote.points_awarded).label('total_awarded'),
+                )
+                .where(Vote.points_awarded > 0, _within_range(Vote.voter_token, first, last))
+                .group_by(Vote.voter_token)
+                .subquery('awards')
+            )
+            accrued = _greatest(func.coalesce(PollVoterProfile.points_accrued_total, 0), awards.c.total_awarded)
+            yield (
+                update(PollVoterProfile)
+                .where(
+                    PollVoterProfile.token == awards.c.voter_token,
+                    PollVoterProfile.points_accrued_total.is_distinct_from(accrued),
+                )
+                .values(points_accrued_total=accrued)
+                .execution_options(synchronize_session=False)
+            )
+
+        _run_backfill("profiles", statements, chunk_size, dry_run)
+
+    @app.cli.command("backfill-voting-streaks")
+    @chunk_option
+    @dry_run_option
+    @with_appcontext
+    def backfill_voting_streaks(chunk_size, dry_run):
+        """Recompute voting_streak, max_voting_streak and last_vote_date from vote history.
 
-        for voter_token, total_awarded in results:
-            profile = PollVoterProfile.query.get(voter_token)
-            if not profile:
-                skipped_missing_profiles += 1
-                continue
+        Consecutive voting days are grouped with the gaps-and-islands technique
+        (day number minus row number) entirely in SQL. max_voting_streak never
+        decreases, so streaks from compacted history are preserved.
+        """
+        def statements(first, last):
+            days = (
+                select(
+                    Vote.voter_token.label('voter_token'),
+                    _vote_day_number().label('day_number'),
+                    _vote_date().label('vote_date'),
+                )
+                .where(_within_range(Vote.voter_token, first, last))
+                .distinct()
+                .subquery('days')
+            )
+            islands = select(
+                days.c.voter_token,
+                days.c.vote_date,
+                (
+                    days.c.day_number
+                    - func.row_number().over(partition_by=days.c.voter_token, order_by=days.c.day_number)
+                ).label('island'),
+            ).subquery('islands')
+            runs = (
+                select(
+                    islands.c.voter_token,
+                    func.count().label('length'),
+                    func.max(islands.c.vote_date).label('last_date'),
+                )
+                .group_by(islands.c.voter_token, islands.c.island)
+                .subquery('runs')
+            )
+            totals = (
+                select(
+                    runs.c.voter_token,
+                    func.max(runs.c.length).label('max_streak'),
+                    func.max(runs.c.last_date).label('last_date'),
+                )
+                .group_by(runs.c.voter_token)
+                .subquery('totals')
+            )
+            streaks = (
+                select(
+                    runs.c.voter_token,
+                    runs.c.length.label('current_streak'),
+                    totals.c.max_streak,
+                    totals.c.last_date,
+                )
+                .join(
+                    totals,
+                    and_(totals.c.voter_token == runs.c.voter_token, totals.c.last_date == runs.c.last_date),
+                )
+                .subquery('streaks')
+            )
+            max_streak = _greatest(func.coalesce(PollVoterProfile.max_voting_streak, 0), streaks.c.max_streak)
+            yield (
+                update(PollVoterProfile)
+                .where(
+                    PollVoterProfile.token == streaks.c.voter_token,
+                    (
+                        PollVoterProfile.voting_streak.is_distinct_from(streaks.c.current_streak)
+                        | PollVoterProfile.max_voting_streak.is_distinct_from(max_streak)
+                        | PollVoterProfile.last_vote_date.is_distinct_from(streaks.c.last_date)
+                    ),
+                )
+                .values(
+                    voting_streak=streaks.c.current_streak,
+                    max_voting_streak=max_streak,
+                    last_vote_date=streaks.c.last_date,
+                )
+                .execution_options(synchronize_session=False)
+            )
 
-            new_total = int(total_awarded or 0)
-            if profile.points_accrued_total != new_total:
-                profile.points_accrued_total = new_total
-                updated += 1
+        _run_backfill("profiles", statements, chunk_size, dry_run)
 
-        db.session.commit()
+    @app.cli.command("backfill-vote-counters")
+    @chunk_option
+    @dry_run_option
+    @with_appcontext
+    def backfill_vote_counters(chunk_size, dry_run):
+        """Rebuild poll_voter_stats from raw votes plus compacted monthly rollups."""
+        def statements(first, last):
+            sources = union_all(
+                select(
+                    Vote.voter_token.label('voter_token'),
+                    func.count(Vote.id).label('votes_count'),
+                    func.coalesce(func.sum(Vote.points_awarded), 0).label('votes_points'),
+                    func.max(Vote.voted_at).label('last_vote_at'),
+                )
+                .where(_within_range(Vote.voter_token, first, last))
+                .group_by(Vote.voter_token),
+                select(
+                    VoteMonthlyRollup.voter_token,
+                    func.sum(VoteMonthlyRollup.votes_count),
+                    func.sum(VoteMonthlyRollup.votes_points),
+                    func.max(VoteMonthlyRollup.last_vote_at),
+                )
+                .where(_within_range(VoteMonthlyRollup.voter_token, first, last))
+                .group_by(VoteMonthlyRollup.voter_token),
+            ).subquery('sources')
+            counters = (
+                select(
+                    sources.c.voter_token,
+                    func.sum(sources.c.votes_count).label('votes_count'),
+                    func.sum(sources.c.votes_points).label('votes_points'),
+                    func.max(sources.c.last_vote_at).label('last_vote_at'),
+                )
+                .group_by(sources.c.voter_token)
+                .subquery('counters')
+            )
 
-        click.echo(f"Processed {len(results)} voter tokens with positive awards.")
-        click.echo(f"Updated {updated} profiles.")
-        if skipped_missing_profiles:
-            click.echo(
-                f"Skipped {skipped_missing_profiles} tokens with missing profiles."
+            yield (
+                update(PollVoterStats)
+                .where(
+                    PollVoterStats.voter_token == counters.c.voter_token,
+                    (
+                        PollVoterStats.votes_count.is_distinct_from(counters.c.votes_count)
+                        | PollVoterStats.votes_points.is_distinct_from(counters.c.votes_points)
+                        | PollVoterStats.last_vote_at.is_distinct_from(counters.c.last_vote_at)
+                    ),
+                )
+                .values(
+                    votes_count=counters.c.votes_count,
+                    votes_points=counters.c.votes_points,
+                    last_vote_at=counters.c.last_vote_at,
+                    updated_at=func.current_timestamp(),
+                )
+                .execution_options(synchronize_session=False)
             )
+            yield insert(PollVoterStats).from_select(
+                ['voter_token', 'votes_count', 'votes_points', 'last_vote_at', 'updated_at'],
+                select(
+                    counters.c.voter_token,
+                    counters.c.votes_count,
+                    counters.c.votes_points,
+                    counters.c.last_vote_at,
+                    func.current_timestamp(),
+                ).where(
+                    ~select(PollVoterStats.voter_token)
+                    .where(PollVoterStats.voter_token == counters.c.voter_token)
+                    .exists()
+                ),
+            )
+            # Счётчики токенов, у которых не осталось ни голосов, ни агрегатов
+            yield (
+                update(PollVoterStats)
+                .where(
+                    _within_range(PollVoterStats.voter_token, first, last),
+                    ~select(counters.c.voter_token)
+                    .where(counters.c.voter_token == PollVoterStats.voter_token)
+                    .exists(),
+                    (PollVoterStats.votes_count != 0)
+                    | (PollVoterStats.votes_points != 0)
+                    | PollVoterStats.last_vote_at.is_not(None),
+                )
+                .values(votes_count=0, votes_points=0, last_vote_at=None, updated_at=func.current_timestamp())
+                .execution_options(synchronize_session=False)
+            )
+
+        _run_backfill("vote counter rows", statements, chunk_size, dry_run)
+
+    @app.cli.command("reconcile-points")
+    @click.option("--batch-size", type=int, default=None, help="Tokens per transaction.")
+    @click.option("--no-fix", is_flag=True, help="Only report drift, do not correct balances.")
+    @with_appcontext
+    def reconcile_points(batch_size, no_fix):
+        """Verify voter balances against the points ledger since the last snapshots."""
+        result = reconcile_points_balances(
+            batch_size=batch_size,
+            grace_seconds=0,
+            autofix=False if no_fix else None,
+        )
+
+        click.echo(f"Checked {result['checked']} voter tokens.")
+        click.echo(f"Found {result['drifted']} balances drifting from the ledger.")
+        if result['fixed']:
+            click.echo(f"Corrected {result['fixed']} balances.")
+
+    @app.cli.command("compact-history")
+    @click.option("--months", type=int, default=None, help="Override HISTORY_RETENTION_MONTHS.")
+    @with_appcontext
+    def compact_history_command(months):
+        """Roll votes and ledger rows older than the retention period into monthly tables."""
+        result = compact_history(retention_months=months)
+        if result['cutoff'] is None:
+            click.echo("Retention is disabled (set HISTORY_RETENTION_MONTHS or pass --months).")
+            return
+
+        click.echo(f"Compacted history before {result['cutoff'].date().isoformat()}.")
+        click.echo(f"Votes rolled up: {result['votes']}.")
+        click.echo(f"Ledger rows rolled up: {result['points_transactions']}.")
+        if result['dropped_partitions']:
+            click.echo(f"Dropped partitions: {', '.join(result['dropped_partitions'])}.")
+
+    @app.cli.command("partition-points-ledger")
+    @with_appcontext
+    def partition_points_ledger_command():
+        """Convert points_transaction into a monthly range-partitioned table (PostgreSQL)."""
+        try:
+            converted = partition_points_ledger()
+        except RuntimeError as exc:
+            raise click.ClickException(str(exc))
+
+        if converted:
+            click.echo("points_transaction is now partitioned by month.")
+        else:
+            click.echo("points_transaction is already partitioned.")
+
+    @app.cli.command("media-worker")
+    @click.option("--concurrency", type=int, default=None, help="Parallel jobs (default: MEDIA_WORKER_CONCURRENCY, capped by CPU cores).")
+    @click.option("--once", is_flag=True, help="Process the jobs that are ready and exit.")
+    @with_appcontext
+    def media_worker(concurrency, once):
+        """Run queued media jobs (faststart) in a separate worker process."""
+        from .utils import media_jobs  # noqa: F401 — регистрирует обработчики заданий
+        from .utils.job_queue import process_pending_jobs, run_worker
+
+        if once:
+            processed = process_pending_jobs(concurrency=concurrency)
+            click.echo(f"Processed {processed} job(s).")
+            return
+
+        stop_event = threading.Event()
+
+        def _stop(signum, frame):
+            click.echo("Stopping media worker after current jobs...")
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        run_worker(concurrency=concurrency, stop_event=stop_event)
+
+    @app.cli.command("dedupe-media")
+    @with_appcontext
+    def dedupe_media():
+        """Move trailers and posters with legacy names into the SHA-256 store."""
+        from .utils.media_jobs import clear_trailer_derivatives, enqueue_trailer_postprocessing
+        from .utils.media_store import KIND_POSTER, KIND_TRAILER, adopt_legacy_file, is_stored_blob
+
+        adopted = missing = 0
+        for movie in LibraryMovie.query.order_by(LibraryMovie.id).all():
+            if movie.trailer_file_path and not is_stored_blob(movie.trailer_file_path):
+                new_path = adopt_legacy_file(movie.trailer_file_path, KIND_TRAILER)
+                if new_path:
+                    movie.trailer_file_path = new_path
+                    clear_trailer_derivatives(movie)
+                    enqueue_trailer_postprocessing(movie)
+                    adopted += 1
+                else:
+                    missing += 1
+            if movie.poster_file_path and not is_stored_blob(movie.poster_file_path):
+                new_path = adopt_legacy_file(movie.poster_file_path, KIND_POSTER)
+                if new_path:
+                    movie.poster_file_path = new_path
+                    adopted += 1
+                else:
+                    missing += 1
+            db.session.commit()
+
+        click.echo(f"Moved {adopted} file(s) into the media store.")
+        if missing:
+            click.echo(f"Missing on disk: {missing} file(s).")
+
+    @app.cli.command("publish-media")
+    @click.option("--skip-existing/--overwrite", default=True, help="Skip objects already in the bucket.")
+    @with_appcontext
+    def publish_media_command(skip_existing):
+        """Upload stored trailers, posters and their derivatives to the S3 storage backend."""
+        from .utils.media_jobs import trailer_derivative_dir
+        from .utils.media_storage import get_media_storage, publish_media, publish_media_tree
+        from .utils.media_store import KIND_POSTER
+
+        storage = get_media_storage()
+        if not storage.remote:
+            raise click.ClickException("MEDIA_STORAGE_BACKEND is 'local', nothing to publish.")
+
+        uploaded = skipped = 0
+        for relative_path, kind in db.session.execute(
+            select(MediaBlob.relative_path, MediaBlob.kind).order_by(MediaBlob.id)
+        ).all():
+            if skip_existing and storage.exists(relative_path):
+                skipped += 1
+            else:
+                publish_media(relative_path)
+                uploaded += 1
+            kinds = ('variants',) if kind == KIND_POSTER else ('hls', 'thumbs')
+            for derivative in kinds:
+                uploaded += publish_media_tree(trailer_derivative_dir(relative_path, derivative))
+
+        click.echo(f"Uploaded {uploaded} object(s), skipped {skipped} already stored file(s).")
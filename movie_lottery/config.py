@@ -76,6 +76,201 @@ class Config:
         TRAILER_MAX_FILE_SIZE = int(os.environ.get('TRAILER_MAX_FILE_SIZE', 200 * 1024 * 1024))
     except (TypeError, ValueError):
         TRAILER_MAX_FILE_SIZE = 200 * 1024 * 1024
+    try:
+        # Незавершённая возобновляемая загрузка удаляется после этого срока без новых кусков
+        TRAILER_UPLOAD_EXPIRY_HOURS = int(os.environ.get('TRAILER_UPLOAD_EXPIRY_HOURS', 24))
+    except (TypeError, ValueError):
+        TRAILER_UPLOAD_EXPIRY_HOURS = 24
+
+    # Хранилище медиафайлов: 'local' (только TRAILER_MEDIA_ROOT) или 's3' (S3-совместимый бакет,
+    # например MinIO; диск остаётся рабочей копией для ffmpeg, отдача — presigned URL)
+    MEDIA_STORAGE_BACKEND = os.environ.get('MEDIA_STORAGE_BACKEND', 'local').strip().lower()
+    MEDIA_S3_BUCKET = os.environ.get('MEDIA_S3_BUCKET')
+    MEDIA_S3_PREFIX = os.environ.get('MEDIA_S3_PREFIX', '')
+    MEDIA_S3_ENDPOINT_URL = os.environ.get('MEDIA_S3_ENDPOINT_URL')
+    MEDIA_S3_REGION = os.environ.get('MEDIA_S3_REGION')
+    MEDIA_S3_ACCESS_KEY_ID = os.environ.get('MEDIA_S3_ACCESS_KEY_ID')
+    MEDIA_S3_SECRET_ACCESS_KEY = os.environ.get('MEDIA_S3_SECRET_ACCESS_KEY')
+    try:
+        MEDIA_S3_PRESIGN_SECONDS = int(os.environ.get('MEDIA_S3_PRESIGN_SECONDS', 3600))
+    except (TypeError, ValueError):
+        MEDIA_S3_PRESIGN_SECONDS = 3600
+
+    # Отдача медиафайлов фронтовым сервером: '' (сам Flask), 'x-accel' (nginx) или 'x-sendfile'
+    MEDIA_OFFLOAD_MODE = os.environ.get('MEDIA_OFFLOAD_MODE', '').strip().lower()
+    # internal-location nginx, указывающий на TRAILER_MEDIA_ROOT
+    MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+    # Подписанные ссылки на трейлеры: окно жизни ссылки (действует от TTL до 2×TTL)
+    try:
+        MEDIA_URL_TTL_SECONDS = int(os.environ.get('MEDIA_URL_TTL_SECONDS', 3600))
+    except (TypeError, ValueError):
+        MEDIA_URL_TTL_SECONDS = 3600
+    # Лимиты потоков трейлеров, которые отдаёт сам gunicorn (0 — без лимита). Каждый поток
+    # держит поток worker'а (GUNICORN_THREADS=4), поэтому по умолчанию один остаётся для API
+    try:
+        MEDIA_STREAM_MAX_CONCURRENT = int(os.environ.get('MEDIA_STREAM_MAX_CONCURRENT', 3))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_MAX_CONCURRENT = 3
+    try:
+        MEDIA_STREAM_MAX_PER_IP = int(os.environ.get('MEDIA_STREAM_MAX_PER_IP', 2))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_MAX_PER_IP = 2
+    try:
+        MEDIA_STREAM_MAX_PER_VOTER = int(os.environ.get('MEDIA_STREAM_MAX_PER_VOTER', 2))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_MAX_PER_VOTER = 2
+    try:
+        MEDIA_STREAM_RETRY_AFTER_SECONDS = int(os.environ.get('MEDIA_STREAM_RETRY_AFTER_SECONDS', 5))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_RETRY_AFTER_SECONDS = 5
+    # Ограничение скорости отдачи (байт/с, 0 — без ограничения): на клиента и на все потоки
+    try:
+        MEDIA_STREAM_RATE_BYTES = int(os.environ.get('MEDIA_STREAM_RATE_BYTES', 0))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_RATE_BYTES = 0
+    try:
+        MEDIA_STREAM_GLOBAL_RATE_BYTES = int(os.environ.get('MEDIA_STREAM_GLOBAL_RATE_BYTES', 0))
+    except (TypeError, ValueError):
+        MEDIA_STREAM_GLOBAL_RATE_BYTES = 0
+
+    # Прогрев page cache: после создания опроса первые мегабайты его трейлеров
+    # (MP4 и начало каждого качества HLS) подгружаются с диска в фоне
+    TRAILER_PREWARM_ENABLED = os.environ.get('TRAILER_PREWARM_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    try:
+        TRAILER_PREWARM_MEGABYTES = int(os.environ.get('TRAILER_PREWARM_MEGABYTES', 16))
+    except (TypeError, ValueError):
+        TRAILER_PREWARM_MEGABYTES = 16
+
+    # Разрешить старые неподписанные ссылки /api/trailers/<id>/stream (обходят оплату просмотра)
+    TRAILER_ALLOW_UNSIGNED_STREAM = os.environ.get('TRAILER_ALLOW_UNSIGNED_STREAM', '0').lower() in ('1', 'true', 'yes')
+
+    # Очередь фоновой обработки медиа (faststart):
+    # 'external' — отдельный процесс `flask media-worker` (по умолчанию),
+    # 'inline' — задания выполняет планировщик веб-приложения (один контейнер без worker'а)
+    MEDIA_WORKER_MODE = os.environ.get('MEDIA_WORKER_MODE', 'external').strip().lower()
+    try:
+        # 0 — по числу ядер CPU (больше ядер не используется)
+        MEDIA_WORKER_CONCURRENCY = int(os.environ.get('MEDIA_WORKER_CONCURRENCY', 0))
+    except (TypeError, ValueError):
+        MEDIA_WORKER_CONCURRENCY = 0
+    try:
+        MEDIA_WORKER_POLL_SECONDS = int(os.environ.get('MEDIA_WORKER_POLL_SECONDS', 5))
+    except (TypeError, ValueError):
+        MEDIA_WORKER_POLL_SECONDS = 5
+    try:
+        MEDIA_JOB_MAX_ATTEMPTS = int(os.environ.get('MEDIA_JOB_MAX_ATTEMPTS', 3))
+    except (TypeError, ValueError):
+        MEDIA_JOB_MAX_ATTEMPTS = 3
+    try:
+        MEDIA_JOB_RETRY_DELAY_SECONDS = int(os.environ.get('MEDIA_JOB_RETRY_DELAY_SECONDS', 30))
+    except (TypeError, ValueError):
+        MEDIA_JOB_RETRY_DELAY_SECONDS = 30
+    try:
+        # Задание в статусе running без отчёта о прогрессе дольше этого срока считается брошенным
+        MEDIA_JOB_STALE_SECONDS = int(os.environ.get('MEDIA_JOB_STALE_SECONDS', 900))
+    except (TypeError, ValueError):
+        MEDIA_JOB_STALE_SECONDS = 900
+
+    # Инкрементальная проверка TRAILER_MEDIA_ROOT: за шаг — не больше MEDIA_SCAN_BATCH_SIZE файлов и фильмов
+    MEDIA_SCAN_ENABLED = os.environ.get('MEDIA_SCAN_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    try:
+        MEDIA_SCAN_INTERVAL_MINUTES = int(os.environ.get('MEDIA_SCAN_INTERVAL_MINUTES', 10))
+    except (TypeError, ValueError):
+        MEDIA_SCAN_INTERVAL_MINUTES = 10
+    try:
+        MEDIA_SCAN_BATCH_SIZE = int(os.environ.get('MEDIA_SCAN_BATCH_SIZE', 500))
+    except (TypeError, ValueError):
+        MEDIA_SCAN_BATCH_SIZE = 500
+    try:
+        # Временные и неучтённые файлы моложе этого срока не трогаем: их может дописывать загрузка или задание
+        MEDIA_SCAN_GRACE_SECONDS = int(os.environ.get('MEDIA_SCAN_GRACE_SECONDS', 86400))
+    except (TypeError, ValueError):
+        MEDIA_SCAN_GRACE_SECONDS = 86400
+    # Удалять найденные брошенные файлы автоматически (иначе — только отчёт и ручная очистка)
+    MEDIA_SCAN_RECLAIM = os.environ.get('MEDIA_SCAN_RECLAIM', '0').lower() in ('1', 'true', 'yes')
+
+    # Адаптивный поток HLS для трейлеров: качества в формате 'высота:кбит/с,...'
+    TRAILER_HLS_ENABLED = os.environ.get('TRAILER_HLS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    TRAILER_HLS_RENDITIONS = os.environ.get('TRAILER_HLS_RENDITIONS', '360:800,720:2500,1080:5000')
+    try:
+        TRAILER_HLS_SEGMENT_SECONDS = int(os.environ.get('TRAILER_HLS_SEGMENT_SECONDS', 6))
+    except (TypeError, ValueError):
+        TRAILER_HLS_SEGMENT_SECONDS = 6
+    try:
+        TRAILER_HLS_TIMEOUT_SECONDS = int(os.environ.get('TRAILER_HLS_TIMEOUT_SECONDS', 1800))
+    except (TypeError, ValueError):
+        TRAILER_HLS_TIMEOUT_SECONDS = 1800
+
+    # Кадр-постер и спрайт миниатюр для перемотки (WebVTT) после загрузки трейлера
+    TRAILER_THUMBNAILS_ENABLED = os.environ.get('TRAILER_THUMBNAILS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    try:
+        TRAILER_THUMBNAIL_INTERVAL_SECONDS = int(os.environ.get('TRAILER_THUMBNAIL_INTERVAL_SECONDS', 10))
+    except (TypeError, ValueError):
+        TRAILER_THUMBNAIL_INTERVAL_SECONDS = 10
+    try:
+        TRAILER_THUMBNAIL_WIDTH = int(os.environ.get('TRAILER_THUMBNAIL_WIDTH', 160))
+    except (TypeError, ValueError):
+        TRAILER_THUMBNAIL_WIDTH = 160
+
+    # Облегчённые копии трейлеров (?quality=low и медленные клиенты): собираются по первому
+    # запросу, хранятся в <TRAILER_UPLOAD_DIR>/low/ и вытесняются по LRU сверх TRAILER_LOW_QUALITY_CACHE_MB
+    TRAILER_LOW_QUALITY_ENABLED = os.environ.get('TRAILER_LOW_QUALITY_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    try:
+        TRAILER_LOW_QUALITY_HEIGHT = int(os.environ.get('TRAILER_LOW_QUALITY_HEIGHT', 480))
+    except (TypeError, ValueError):
+        TRAILER_LOW_QUALITY_HEIGHT = 480
+    try:
+        TRAILER_LOW_QUALITY_VIDEO_KBPS = int(os.environ.get('TRAILER_LOW_QUALITY_VIDEO_KBPS', 700))
+    except (TypeError, ValueError):
+        TRAILER_LOW_QUALITY_VIDEO_KBPS = 700
+    try:
+        TRAILER_LOW_QUALITY_AUDIO_KBPS = int(os.environ.get('TRAILER_LOW_QUALITY_AUDIO_KBPS', 96))
+    except (TypeError, ValueError):
+        TRAILER_LOW_QUALITY_AUDIO_KBPS = 96
+    try:
+        TRAILER_LOW_QUALITY_CACHE_MB = int(os.environ.get('TRAILER_LOW_QUALITY_CACHE_MB', 2048))
+    except (TypeError, ValueError):
+        TRAILER_LOW_QUALITY_CACHE_MB = 2048
+
+    # Квоты места под файлы фильмов в МБ (0 — без ограничения): загрузка сверх квоты отклоняется
+    try:
+        MEDIA_QUOTA_TOTAL_MB = int(os.environ.get('MEDIA_QUOTA_TOTAL_MB', 0))
+    except (TypeError, ValueError):
+        MEDIA_QUOTA_TOTAL_MB = 0
+    try:
+        MEDIA_QUOTA_TRAILERS_MB = int(os.environ.get('MEDIA_QUOTA_TRAILERS_MB', 0))
+    except (TypeError, ValueError):
+        MEDIA_QUOTA_TRAILERS_MB = 0
+    try:
+        MEDIA_QUOTA_POSTERS_MB = int(os.environ.get('MEDIA_QUOTA_POSTERS_MB', 0))
+    except (TypeError, ValueError):
+        MEDIA_QUOTA_POSTERS_MB = 0
+
+    # Уменьшенные копии постеров (WebP и JPEG) для сетки библиотеки: ширины в пикселях
+    POSTER_VARIANTS_ENABLED = os.environ.get('POSTER_VARIANTS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    POSTER_VARIANT_WIDTHS = os.environ.get('POSTER_VARIANT_WIDTHS', '160,320,640')
+    try:
+        # Параллельные загрузки при миграции постеров (одна Session с пулом соединений)
+        POSTER_MIGRATION_CONCURRENCY = int(os.environ.get('POSTER_MIGRATION_CONCURRENCY', 8))
+    except (TypeError, ValueError):
+        POSTER_MIGRATION_CONCURRENCY = 8
+
+    # Атласы постеров для сетки библиотеки: миниатюры фильмов с id из одного
+    # диапазона (POSTER_ATLAS_SIZE) собраны в один WebP-спрайт
+    POSTER_ATLAS_ENABLED = os.environ.get('POSTER_ATLAS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    try:
+        POSTER_ATLAS_SIZE = int(os.environ.get('POSTER_ATLAS_SIZE', 64))
+    except (TypeError, ValueError):
+        POSTER_ATLAS_SIZE = 64
+    try:
+        POSTER_ATLAS_TILE_WIDTH = int(os.environ.get('POSTER_ATLAS_TILE_WIDTH', 160))
+    except (TypeError, ValueError):
+        POSTER_ATLAS_TILE_WIDTH = 160
+    # Постеры из хранилища SHA-256 по статическим URL /media/posters/... (имя меняется вместе с содержимым)
+    POSTER_STATIC_URLS = os.environ.get('POSTER_STATIC_URLS', '1').lower() in ('1', 'true', 'yes')
+    # Отдавать /media/posters/ через WSGI-middleware; отключите, если этот путь обслуживает nginx
+    POSTER_STATIC_MIDDLEWARE = os.environ.get('POSTER_STATIC_MIDDLEWARE', '1').lower() in ('1', 'true', 'yes')
 
     # Web Push notifications (VAPID)
     VAPID_PRIVATE_KEY = os.environ.get('VAPID_PRIVATE_KEY')
@@ -95,3 +290,45 @@ class Config:
         RELEASES_CACHE_TTL = int(os.environ.get('RELEASES_CACHE_TTL', 3600 * 6))  # 6 часов по умолчанию
     except (TypeError, ValueError):
         RELEASES_CACHE_TTL = 3600 * 6
+
+    # Лидерборд голосующих: период полной пересборки индекса из БД (секунды)
+    try:
+        LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 300))
+    except (TypeError, ValueError):
+        LEADERBOARD_REFRESH_SECONDS = 300
+    # Насколько назад от последней синхронизации перечитываются изменённые профили (секунды)
+    try:
+        LEADERBOARD_SYNC_OVERLAP_SECONDS = int(os.environ.get('LEADERBOARD_SYNC_OVERLAP_SECONDS', 60))
+    except (TypeError, ValueError):
+        LEADERBOARD_SYNC_OVERLAP_SECONDS = 60
+
+    # Сверка балансов с журналом баллов (points_transaction)
+    try:
+        POINTS_RECONCILE_INTERVAL_MINUTES = int(os.environ.get('POINTS_RECONCILE_INTERVAL_MINUTES', 10))
+    except (TypeError, ValueError):
+        POINTS_RECONCILE_INTERVAL_MINUTES = 10
+
+    try:
+        POINTS_RECONCILE_BATCH_SIZE = int(os.environ.get('POINTS_RECONCILE_BATCH_SIZE', 500))
+    except (TypeError, ValueError):
+        POINTS_RECONCILE_BATCH_SIZE = 500
+
+    try:
+        POINTS_RECONCILE_GRACE_SECONDS = int(os.environ.get('POINTS_RECONCILE_GRACE_SECONDS', 60))
+    except (TypeError, ValueError):
+        POINTS_RECONCILE_GRACE_SECONDS = 60
+
+    # Исправлять ли total_points по журналу при обнаружении расхождения
+    POINTS_RECONCILE_AUTOFIX = os.environ.get('POINTS_RECONCILE_AUTOFIX', 'true').lower() == 'true'
+
+    # Политика хранения истории: Vote и PointsTransaction старше N месяцев
+    # сворачиваются в месячные агрегаты (0 — хранить всё построчно)
+    try:
+        HISTORY_RETENTION_MONTHS = int(os.environ.get('HISTORY_RETENTION_MONTHS', 0))
+    except (TypeError, ValueError):
+        HISTORY_RETENTION_MONTHS = 0
+
+    try:
+        HISTORY_RETENTION_INTERVAL_HOURS = int(os.environ.get('HISTORY_RETENTION_INTERVAL_HOURS', 6))
+    except (TypeError, ValueError):
+        HISTORY_RETENTION_INTERVAL_HOURS = 6
@@ -1,8 +1,11 @@
+import json
 from datetime import datetime, timedelta
 from flask import current_app
+from sqlalchemy import event
 from sqlalchemy.exc import OperationalError, ProgrammingError
 from . import db
 from .utils.helpers import vladivostok_now
+from .utils.media_delivery import sign_media_url, sign_trailer_asset_url
 
 class MovieIdentifier(db.Model):
     __tablename__ = 'movie_identifier'
@@ -38,6 +41,7 @@ class LibraryMovie(db.Model):
     search_name = db.Column(db.String(200), nullable=True)
     poster = db.Column(db.String(500), nullable=True)  # Внешний URL (устаревшее)
     poster_file_path = db.Column(db.String(500), nullable=True)  # Локальный путь к постеру
+    poster_file_size = db.Column(db.Integer, nullable=True)  # Размер локального постера (учёт места)
     year = db.Column(db.String(10), nullable=True)
     description = db.Column(db.Text, nullable=True)
     rating_kp = db.Column(db.Float, nullable=True)
@@ -46,6 +50,16 @@ class LibraryMovie(db.Model):
     trailer_file_path = db.Column(db.String(500), nullable=True)
     trailer_mime_type = db.Column(db.String(100), nullable=True)
     trailer_file_size = db.Column(db.Integer, nullable=True)
+    # Метаданные из moov трейлера (заполняются сканером MP4 без ffmpeg)
+    trailer_duration = db.Column(db.Float, nullable=True)
+    trailer_codecs = db.Column(db.String(255), nullable=True)
+    trailer_width = db.Column(db.Integer, nullable=True)
+    trailer_height = db.Column(db.Integer, nullable=True)
+    trailer_faststart = db.Column(db.Boolean, nullable=True)
+    trailer_hls_path = db.Column(db.String(500), nullable=True)  # master.m3u8 относительно TRAILER_MEDIA_ROOT
+    trailer_poster_frame_path = db.Column(db.String(500), nullable=True)  # Кадр-постер из трейлера
+    trailer_sprite_path = db.Column(db.String(500), nullable=True)  # Спрайт миниатюр для перемотки
+    trailer_thumbnails_path = db.Column(db.String(500), nullable=True)  # WebVTT с координатами миниатюр в спрайте
     added_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
     bumped_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
     badge = db.Column(db.String(30), nullable=True)  # Бейдж: favorite, ban, watchlist, top, watched, new или custom_ID
@@ -73,6 +87,61 @@ class LibraryMovie(db.Model):
         except (OperationalError, ProgrammingError):
             return False
 
+    def signed_trailer_url(self, voter_token):
+        """
+        Подписанный URL трейлера для зрителя ``voter_token`` (выдаётся только после
+        оплаты просмотра). Путь, размер и MIME-тип файла — в токене, стриминг не ходит в БД.
+        """
+        if not self.has_local_trailer:
+            return None
+        return sign_media_url(
+            f'/api/trailers/{self.id}/stream',
+            self.id,
+            voter_token,
+            self.trailer_file_path,
+            self.trailer_file_size,
+            self.trailer_mime_type,
+        )
+
+    def _trailer_asset_url(self, attribute, kind):
+        """URL производного файла трейлера (<каталог трейлеров>/<kind>/...) для статической отдачи."""
+        try:
+            asset_path = getattr(self, attribute)
+        except (OperationalError, ProgrammingError):
+            return None
+        marker = f'/{kind}/'
+        if not asset_path or marker not in f'/{asset_path}':
+            return None
+        return f"/api/trailers/{kind}/{f'/{asset_path}'.split(marker, 1)[1]}"
+
+    @property
+    def trailer_hls_url(self):
+        """URL мастер-плейлиста HLS; сегменты отдаются как статика."""
+        return self._trailer_asset_url('trailer_hls_path', 'hls')
+
+    @property
+    def trailer_poster_frame_url(self):
+        return self._trailer_asset_url('trailer_poster_frame_path', 'thumbs')
+
+    @property
+    def trailer_sprite_url(self):
+        return self._trailer_asset_url('trailer_sprite_path', 'thumbs')
+
+    @property
+    def trailer_thumbnails_url(self):
+        """URL дорожки WebVTT с миниатюрами для перемотки."""
+        return self._trailer_asset_url('trailer_thumbnails_path', 'thumbs')
+
+    def signed_trailer_previews(self, voter_token):
+        """Подписанные кадр-постер, спрайт и дорожка миниатюр (voter_token=None — без привязки к зрителю)."""
+        if not self.has_local_trailer:
+            return None
+        return {
+            'poster_frame': sign_trailer_asset_url(self.trailer_poster_frame_url, 'thumbs', voter_token),
+            'sprite': sign_trailer_asset_url(self.trailer_sprite_url, 'thumbs', voter_token),
+            'thumbnails': sign_trailer_asset_url(self.trailer_thumbnails_url, 'thumbs', voter_token),
+        }
+
     def refresh_ban_status(self):
         """Переводит фильм из бана в watchlist после истечения срока."""
         if self.badge != 'ban' or not self.ban_until:
@@ -260,6 +329,8 @@ class Poll(db.Model):
     finalized = db.Column(db.Boolean, nullable=False, default=False, server_default=db.text('FALSE'))  # True после применения бейджа
     movies = db.relationship('PollMovie', backref='poll', lazy=True, cascade="all, delete-orphan")
     votes = db.relationship('Vote', backref='poll', lazy=True, cascade="all, delete-orphan")
+    # Голоса, свёрнутые политикой хранения (см. PollVoteRollup)
+    vote_rollups = db.relationship('PollVoteRollup', lazy=True, cascade="all, delete-orphan")
 
     def __init__(self, **kwargs):
         super(Poll, self).__init__(**kwargs)
@@ -283,13 +354,8 @@ class Poll(db.Model):
         if forced_winner:
             return [forced_winner]
 
-        if not self.votes:
-            return []
-        
         # Подсчитываем голоса для каждого фильма
-        vote_counts = {}
-        for vote in self.votes:
-            vote_counts[vote.movie_id] = vote_counts.get(vote.movie_id, 0) + 1
+        vote_counts = self.get_vote_counts()
         
         if not vote_counts:
             return []
@@ -302,10 +368,17 @@ class Poll(db.Model):
     def get_vote_counts(self):
         """Возвращает словарь {movie_id: количество голосов}"""
         vote_counts = {}
+        for rollup in self.vote_rollups:
+            vote_counts[rollup.movie_id] = vote_counts.get(rollup.movie_id, 0) + (rollup.votes_count or 0)
         for vote in self.votes:
             vote_counts[vote.movie_id] = vote_counts.get(vote.movie_id, 0) + 1
         return vote_counts
 
+    @property
+    def total_votes(self):
+        """Количество голосов с учётом свёрнутых в PollVoteRollup."""
+        return len(self.votes) + sum(rollup.votes_count or 0 for rollup in self.vote_rollups)
+
 class PollMovie(db.Model):
     __tablename__ = 'poll_movie'
     id = db.Column(db.Integer, primary_key=True)
@@ -356,6 +429,7 @@ class PollVoterProfile(db.Model):
         nullable=False,
         default=vladivostok_now,
         onupdate=vladivostok_now,
+        index=True,  # Лидерборд подтягивает по нему изменения других процессов
     )
     # Streak fields for consecutive voting bonus
     voting_streak = db.Column(db.Integer, nullable=False, default=0, server_default=db.text('0'))
@@ -384,12 +458,40 @@ class Vote(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('poll_id', 'voter_token', name='unique_voter_per_poll'),
+        db.Index('ix_vote_voter_token_voted_at', 'voter_token', 'voted_at'),
+    )
+
+
+class PollVoterStats(db.Model):
+    """Агрегированная статистика голосов по токену (для админской страницы).
+
+    Обновляется в местах создания голосов, чтобы список участников не
+    загружал все голоса ради подсчёта количества и суммы баллов.
+    """
+    __tablename__ = 'poll_voter_stats'
+
+    voter_token = db.Column(db.String(64), primary_key=True)
+    votes_count = db.Column(db.Integer, nullable=False, default=0, server_default=db.text('0'))
+    votes_points = db.Column(db.Integer, nullable=False, default=0, server_default=db.text('0'))
+    last_vote_at = db.Column(db.DateTime, nullable=True, index=True)
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=vladivostok_now,
+        onupdate=vladivostok_now,
     )
 
 
 class PointsTransaction(db.Model):
-    """История всех операций с баллами пользователей."""
+    """История всех операций с баллами пользователей.
+
+    Журнал только дополняется: он является источником истины для баланса,
+    а PollVoterProfile.total_points сверяется с ним (см. PointsBalanceSnapshot).
+    """
     __tablename__ = 'points_transaction'
+    __table_args__ = (
+        db.Index('ix_points_transaction_voter_token_id', 'voter_token', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     voter_token = db.Column(db.String(64), nullable=False, index=True)
@@ -444,6 +546,83 @@ class PointsTransaction(db.Model):
         return labels.get(self.transaction_type, self.transaction_type)
 
 
+@event.listens_for(PointsTransaction, 'before_update')
+@event.listens_for(PointsTransaction, 'before_delete')
+def _forbid_points_transaction_changes(mapper, connection, target):
+    raise ValueError('Журнал points_transaction только дополняется: изменение записей запрещено')
+
+
+class PointsBalanceSnapshot(db.Model):
+    """Снимок баланса голосующего на момент сверки с журналом баллов.
+
+    ``balance`` — баланс по журналу после записи ``last_transaction_id``,
+    ``drift`` — расхождение PollVoterProfile.total_points с журналом,
+    найденное при создании снимка (0, если баланс сошёлся).
+    """
+    __tablename__ = 'points_balance_snapshot'
+    __table_args__ = (
+        db.Index('ix_points_balance_snapshot_voter_token_id', 'voter_token', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    voter_token = db.Column(db.String(64), nullable=False)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    last_transaction_id = db.Column(db.Integer, nullable=False, default=0)
+    drift = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+
+
+class PointsMonthlyRollup(db.Model):
+    """Свёрнутые по месяцам записи журнала баллов (политика хранения)."""
+    __tablename__ = 'points_monthly_rollup'
+
+    month = db.Column(db.Date, primary_key=True)
+    voter_token = db.Column(db.String(64), primary_key=True)
+    transaction_type = db.Column(db.String(30), primary_key=True)
+    transactions_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_total = db.Column(db.Integer, nullable=False, default=0)
+    credit_total = db.Column(db.Integer, nullable=False, default=0)
+    debit_total = db.Column(db.Integer, nullable=False, default=0)
+
+
+class VoteMonthlyRollup(db.Model):
+    """Свёрнутые по месяцам голоса одного токена (политика хранения)."""
+    __tablename__ = 'vote_monthly_rollup'
+
+    month = db.Column(db.Date, primary_key=True)
+    voter_token = db.Column(db.String(64), primary_key=True)
+    votes_count = db.Column(db.Integer, nullable=False, default=0)
+    votes_points = db.Column(db.Integer, nullable=False, default=0)
+    last_vote_at = db.Column(db.DateTime, nullable=True)
+
+
+class PollVoteRollup(db.Model):
+    """Свёрнутые голоса опроса по фильмам: итоги опроса переживают очистку Vote."""
+    __tablename__ = 'poll_vote_rollup'
+
+    poll_id = db.Column(db.String(8), db.ForeignKey('poll.id', ondelete='CASCADE'), primary_key=True)
+    movie_id = db.Column(db.Integer, db.ForeignKey('poll_movie.id', ondelete='CASCADE'), primary_key=True)
+    votes_count = db.Column(db.Integer, nullable=False, default=0)
+    votes_points = db.Column(db.Integer, nullable=False, default=0)
+    last_vote_at = db.Column(db.DateTime, nullable=True)
+
+
+class PollVoterRollup(db.Model):
+    """Свёрнутые голоса токена в опросе по месяцам.
+
+    Вклад опроса в ``vote_monthly_rollup`` и ``poll_voter_stats``: при удалении
+    опроса он вычитается, хотя построчных голосов уже нет.
+    """
+    __tablename__ = 'poll_voter_rollup'
+
+    poll_id = db.Column(db.String(8), db.ForeignKey('poll.id', ondelete='CASCADE'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)
+    voter_token = db.Column(db.String(64), primary_key=True)
+    votes_count = db.Column(db.Integer, nullable=False, default=0)
+    votes_points = db.Column(db.Integer, nullable=False, default=0)
+    last_vote_at = db.Column(db.DateTime, nullable=True)
+
+
 class PushSubscription(db.Model):
     """Подписки на push-уведомления о новых голосах."""
     __tablename__ = 'push_subscription'
@@ -461,3 +640,161 @@ class PushSubscription(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
 
     profile = db.relationship('PollVoterProfile', back_populates='push_subscriptions')
+
+
+class MediaJob(db.Model):
+    """Задание фоновой обработки медиа (faststart и т.п.).
+
+    Очередь хранится в БД и переживает перезапуски: worker забирает задания
+    со статусом ``queued`` и ``run_after`` в прошлом, при ошибке задание
+    возвращается в очередь с задержкой, пока не исчерпаны ``max_attempts``.
+    """
+    __tablename__ = 'media_job'
+    __table_args__ = (
+        db.Index('ix_media_job_status_run_after', 'status', 'run_after'),
+        db.Index('ix_media_job_batch_id', 'batch_id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(32), nullable=False)
+    payload = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    batch_id = db.Column(db.String(32), nullable=True)
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    worker_id = db.Column(db.String(64), nullable=True)
+    run_after = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        def _load(value):
+            if not value:
+                return None
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
+
+        return {
+            'id': self.id,
+            'job_type': self.job_type,
+            'status': self.status,
+            'progress': self.progress or 0,
+            'attempts': self.attempts or 0,
+            'max_attempts': self.max_attempts,
+            'batch_id': self.batch_id,
+            'payload': _load(self.payload),
+            'result': _load(self.result),
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class TrailerUpload(db.Model):
+    """Возобновляемая загрузка трейлера (протокол tus).
+
+    Куски дописываются прямо в итоговый файл ``relative_path`` по смещению
+    ``upload_offset``; после последнего куска проверяется SHA-256 и файл
+    становится трейлером фильма.
+    """
+    __tablename__ = 'trailer_upload'
+
+    id = db.Column(db.String(32), primary_key=True)
+    movie_id = db.Column(db.Integer, db.ForeignKey('library_movie.id', ondelete='CASCADE'), nullable=False, index=True)
+    relative_path = db.Column(db.String(500), nullable=False)
+    mime_type = db.Column(db.String(100), nullable=True)
+    upload_length = db.Column(db.BigInteger, nullable=False)
+    upload_offset = db.Column(db.BigInteger, nullable=False, default=0)
+    checksum = db.Column(db.String(64), nullable=True)  # Ожидаемый SHA-256 (hex) всего файла
+    created_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+
+class MediaBlob(db.Model):
+    """Медиафайл, хранящийся по SHA-256 содержимого (одинаковые байты — один файл).
+
+    ``ref_count`` — сколько ссылок на ``relative_path`` из
+    ``LibraryMovie.trailer_file_path`` и ``LibraryMovie.poster_file_path``.
+    Файлы с нулевым счётчиком удаляет ``collect_orphan_blobs``.
+    """
+    __tablename__ = 'media_blob'
+
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, index=True)
+    kind = db.Column(db.String(16), nullable=False)  # trailer или poster
+    relative_path = db.Column(db.String(500), nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
+
+
+class MediaScanState(db.Model):
+    """Состояние инкрементальной проверки TRAILER_MEDIA_ROOT (одна строка).
+
+    Проверка идёт короткими шагами: ``file_cursor`` — последний
+    просмотренный файл (пути обходятся в лексикографическом порядке),
+    ``movie_cursor`` — последний проверенный ``LibraryMovie.id``. Когда оба
+    прохода дошли до конца, ``pass_number`` увеличивается.
+    """
+    __tablename__ = 'media_scan_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    pass_number = db.Column(db.Integer, nullable=False, default=1)
+    file_cursor = db.Column(db.String(500), nullable=True)
+    files_done = db.Column(db.Boolean, nullable=False, default=False)
+    movie_cursor = db.Column(db.Integer, nullable=False, default=0)
+    movies_done = db.Column(db.Boolean, nullable=False, default=False)
+    pass_started_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now)
+    last_pass_finished_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
+
+
+class MediaUsage(db.Model):
+    """Суммы размеров файлов фильмов по видам (``trailer``, ``poster``).
+
+    Обновляются на ту же разницу, что и ``LibraryMovie.trailer_file_size`` /
+    ``poster_file_size``, поэтому отчёт не обходит медиакаталог. Файл,
+    общий для нескольких фильмов, входит в сумму каждого из них; место на
+    диске и квоты считаются по ``media_blob``.
+    """
+    __tablename__ = 'media_usage'
+
+    kind = db.Column(db.String(16), primary_key=True)
+    total_bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    file_count = db.Column(db.Integer, nullable=False, default=0)
+    recounted_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
+
+
+class MediaScanEntry(db.Model):
+    """Файл медиакаталога, увиденный проверкой (индекс размера и mtime), или найденная проблема.
+
+    ``issue``: ``orphan`` — на файл никто не ссылается, ``temp`` — брошенный
+    временный файл, ``size_mismatch`` — размер не совпадает с записанным в БД,
+    ``missing`` — фильм ссылается на файл, которого нет на диске.
+    """
+    __tablename__ = 'media_scan_entry'
+    __table_args__ = (
+        db.Index('ix_media_scan_entry_issue', 'issue'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    relative_path = db.Column(db.String(500), nullable=False, unique=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    mtime = db.Column(db.Float, nullable=True)
+    issue = db.Column(db.String(16), nullable=True)
+    expected_size = db.Column(db.BigInteger, nullable=True)
+    movie_id = db.Column(db.Integer, nullable=True)
+    seen_pass = db.Column(db.Integer, nullable=False, default=0)
+    detected_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=vladivostok_now, onupdate=vladivostok_now)
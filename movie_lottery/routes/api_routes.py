@@ -6,10 +6,10 @@ import re
 import secrets
 import threading
 import uuid
-from collections import defaultdict
 from datetime import datetime, time, timedelta, timezone
-from flask import Blueprint, request, jsonify, current_app
-from sqlalchemy import func
+from flask import Blueprint, Response, request, jsonify, current_app, redirect, url_for
+from werkzeug.http import http_date
+from sqlalchemy import func, select, union_all
 from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 from flask_socketio import emit, disconnect
 
@@ -29,6 +29,7 @@ from ..utils.websocket_manager import (
     send_admin_notification,
 )
 from ..models import (
+    MediaJob,
     CustomBadge,
     Movie,
     Lottery,
@@ -38,16 +39,94 @@ from ..models import (
     PollCreatorToken,
     PollMovie,
     PollVoterProfile,
+    PollVoterStats,
+    PointsTransaction,
     PushSubscription,
+    TrailerUpload,
     Vote,
+    VoteMonthlyRollup,
 )
 from ..utils.kinopoisk import get_movie_data_from_kinopoisk, get_movies_by_release_date
-from ..utils.video_processing import apply_faststart
+from ..utils.job_queue import JOB_QUEUED, JOB_RUNNING, enqueue_job, get_batch_status, retry_job
+from ..utils.media_jobs import (
+    JOB_POSTER_MIGRATION,
+    clear_trailer_derivatives,
+    POSTER_VARIANT_FORMATS,
+    enqueue_faststart,
+    enqueue_low_quality_trailer,
+    enqueue_poster_atlas,
+    enqueue_poster_variants,
+    enqueue_trailer_postprocessing,
+    ensure_poster_variant,
+    find_low_quality_trailer,
+    inspect_trailer,
+    local_poster_url,
+    movies_without_local_poster,
+    pick_poster_width,
+    poster_srcset,
+    poster_static_url,
+    poster_variant_path,
+    poster_webp_srcset,
+)
+from ..utils.media_scan import media_scan_report, reclaim_media_issues, scan_media_step
+from ..utils.media_storage import ensure_local_media, remote_media_url
+from ..utils.media_usage import (
+    MediaQuotaExceeded,
+    check_media_quota,
+    media_usage_report,
+    movie_media_size,
+    recount_media_usage,
+    set_movie_poster,
+    track_media_size,
+)
+from ..utils.media_store import (
+    KIND_POSTER,
+    KIND_TRAILER,
+    BlobWriter,
+    adopt_file,
+    release_media,
+)
+from ..utils.stream_limits import StreamLimitExceeded, acquire_stream_slot
+from ..utils.page_cache import prewarm_poll_trailers
+from ..utils.poster_downloads import download_poster, fix_poster_url
+from ..utils.resumable_uploads import (
+    TUS_CHECKSUM_ALGORITHMS,
+    TUS_EXTENSIONS,
+    TUS_VERSION,
+    UploadError,
+    append_chunk,
+    create_upload,
+    discard_upload,
+    finish_upload,
+    parse_upload_metadata,
+    upload_absolute_path,
+)
+from ..utils.video_processing import should_apply_faststart
+from ..utils.media_delivery import (
+    get_offload_mode,
+    load_media_token,
+    media_file_stat,
+    media_version,
+    resolve_media_path,
+    send_media_file,
+    sign_playlist_uris,
+    sign_trailer_asset_url,
+    sign_vtt_image_uris,
+    trailer_asset_scope,
+)
+from ..utils.leaderboard import (
+    LEADERBOARD_METRICS,
+    forget_leaderboard_voter,
+    get_leaderboard,
+    track_leaderboard_profile,
+)
 from ..utils.helpers import (
+    VLADIVOSTOK_TZ,
     build_external_url,
     build_telegram_share_url,
     calculate_streak_bonus,
     change_voter_points_balance,
+    discount_poll_from_voter_stats,
     ensure_background_photo,
     ensure_poll_tables,
     ensure_voter_profile,
@@ -61,10 +140,13 @@ from ..utils.helpers import (
     get_voter_streak_info,
     get_voter_transactions,
     get_voter_transactions_summary,
+    get_vote_rollup_totals,
+    vote_rollup_period_conditions,
     get_badge_label,
     get_winner_badge,
     log_points_transaction,
     prevent_caching,
+    record_vote_in_voter_stats,
     rotate_voter_token,
     update_poll_settings,
     update_voter_streak,
@@ -145,19 +227,6 @@ def _get_trailer_settings():
     }
 
 
-def _remove_trailer_file(movie, settings):
-    if not movie or not movie.trailer_file_path:
-        return
-
-    media_root = settings.get('media_root') or ''
-    absolute_path = os.path.join(media_root, movie.trailer_file_path)
-    try:
-        if os.path.exists(absolute_path):
-            os.remove(absolute_path)
-    except OSError as exc:
-        current_app.logger.warning('Не удалось удалить старый трейлер %s: %s', absolute_path, exc)
-
-
 def _get_poster_settings():
     """Возвращает настройки для хранения постеров."""
     config = current_app.config
@@ -174,80 +243,41 @@ def _get_poster_settings():
 
 def _download_and_save_poster(poster_url, movie_id):
     """
-    Скачивает постер по URL и сохраняет локально.
-    Возвращает относительный путь к файлу или None при ошибке.
+    Скачивает постер по URL и сохраняет в хранилище (по SHA-256 содержимого).
+    Возвращает относительный путь к файлу или None при ошибке;
+    ссылка на файл учитывается в сессии, commit — у вызывающего.
     """
     if not poster_url:
         return None
 
     settings = _get_poster_settings()
-    upload_dir = settings.get('upload_dir')
-
-    if not upload_dir:
+    if not settings.get('media_root'):
         current_app.logger.warning('Директория для постеров не настроена')
         return None
 
-    # Исправляем URL если нужно
-    fixed_url = _fix_poster_url(poster_url)
-
     try:
-        import requests
-        response = requests.get(fixed_url, timeout=15, stream=True)
-        response.raise_for_status()
-
-        # Определяем расширение файла
-        content_type = response.headers.get('Content-Type', '').lower()
-        if 'jpeg' in content_type or 'jpg' in content_type:
-            ext = '.jpg'
-        elif 'png' in content_type:
-            ext = '.png'
-        elif 'webp' in content_type:
-            ext = '.webp'
-        else:
-            ext = '.jpg'  # По умолчанию
-
-        filename = f"poster_{movie_id}{ext}"
-        os.makedirs(upload_dir, exist_ok=True)
-        absolute_path = os.path.join(upload_dir, filename)
-
-        with open(absolute_path, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                f.write(chunk)
+        check_media_quota(KIND_POSTER, 0)
+    except MediaQuotaExceeded as exc:
+        # Карточка останется с внешним URL постера
+        current_app.logger.warning('Постер фильма %s не скачан: %s', movie_id, exc)
+        return None
 
-        relative_path = os.path.join(settings.get('relative_dir', 'posters'), filename)
-        current_app.logger.info('Постер сохранён: %s', relative_path)
+    try:
+        # Хэш считается по мере скачивания — одинаковые постеры хранятся один раз
+        writer, ext = download_poster(poster_url)
+        relative_path = writer.commit(ext)
+        # Уменьшенные копии и атлас для сетки библиотеки строит worker
+        enqueue_poster_variants(movie_id, relative_path)
+        enqueue_poster_atlas(movie_id)
+
+        current_app.logger.info('Постер фильма %s сохранён: %s', movie_id, relative_path)
         return relative_path
 
     except Exception as exc:
-        current_app.logger.warning('Не удалось скачать постер %s: %s', fixed_url, exc)
+        current_app.logger.warning('Не удалось скачать постер %s: %s', poster_url, exc)
         return None
 
 
-def _remove_poster_file(movie):
-    """Удаляет локальный файл постера."""
-    if not movie:
-        return
-
-    try:
-        poster_path = movie.poster_file_path
-    except Exception:
-        return
-
-    if not poster_path:
-        return
-
-    settings = _get_poster_settings()
-    media_root = settings.get('media_root') or ''
-    absolute_path = os.path.join(media_root, poster_path)
-
-    try:
-        if os.path.exists(absolute_path):
-            os.remove(absolute_path)
-            current_app.logger.info('Постер удалён: %s', absolute_path)
-    except OSError as exc:
-        current_app.logger.warning('Не удалось удалить постер %s: %s', absolute_path, exc)
-
-
 def _serialize_library_movie(movie):
     # Безопасно получаем атрибуты трейлера, которые могут отсутствовать в БД
     try:
@@ -268,6 +298,18 @@ def _serialize_library_movie(movie):
     except Exception:
         trailer_view_cost = None
 
+    # Метаданные moov трейлера (длительность, кодеки, размер кадра)
+    try:
+        trailer_metadata = {
+            'duration': movie.trailer_duration,
+            'codecs': movie.trailer_codecs.split(',') if movie.trailer_codecs else [],
+            'width': movie.trailer_width,
+            'height': movie.trailer_height,
+            'faststart': movie.trailer_faststart,
+        } if has_local_trailer else None
+    except Exception:
+        trailer_metadata = None
+
     # Безопасно получаем локальный постер
     try:
         poster_file_path = movie.poster_file_path
@@ -278,7 +320,7 @@ def _serialize_library_movie(movie):
 
     # Если есть локальный постер - используем его, иначе внешний URL
     if has_local_poster:
-        poster_url = f'/api/posters/{movie.id}'
+        poster_url = local_poster_url(movie.id, poster_file_path)
     else:
         poster_url = _fix_poster_url(movie.poster)
     
@@ -289,6 +331,8 @@ def _serialize_library_movie(movie):
         'search_name': movie.search_name,
         'year': movie.year,
         'poster': poster_url,
+        'poster_srcset': poster_srcset(movie.id, poster_file_path) if has_local_poster else None,
+        'poster_webp_srcset': poster_webp_srcset(poster_file_path) if has_local_poster else None,
         'has_local_poster': has_local_poster,
         'description': movie.description,
         'rating_kp': movie.rating_kp,
@@ -306,6 +350,7 @@ def _serialize_library_movie(movie):
         'trailer_mime_type': trailer_mime_type,
         'trailer_file_size': trailer_file_size,
         'has_local_trailer': has_local_trailer,
+        'trailer_metadata': trailer_metadata,
         'trailer_view_cost': trailer_view_cost,
     }
 
@@ -549,7 +594,9 @@ def delete_voter_profile(voter_token):
     try:
         # Delete votes first to avoid FK constraint issues
         db.session.query(Vote).filter(Vote.voter_token == voter_token).delete(synchronize_session=False)
+        db.session.query(PollVoterStats).filter(PollVoterStats.voter_token == voter_token).delete(synchronize_session=False)
         deleted = db.session.query(PollVoterProfile).filter(PollVoterProfile.token == voter_token).delete(synchronize_session=False)
+        forget_leaderboard_voter(voter_token)
         db.session.commit()
     except Exception as exc:
         db.session.rollback()
@@ -855,48 +902,126 @@ def _apply_vote_filters(query, filters):
     return query
 
 
-def _group_votes_by_token(tokens, filters):
-    votes_by_token = defaultdict(list)
-    if not tokens:
-        return votes_by_token
+def _aggregate_votes_by_token(tokens, filters):
+    """Считает голоса токенов страницы одним GROUP BY с учётом фильтров.
 
-    vote_query = (
-        db.session.query(Vote, Poll, PollMovie)
-        .join(Poll, Vote.poll_id == Poll.id)
-        .join(PollMovie, Vote.movie_id == PollMovie.id)
+    Используется только при фильтрах по опросу или датам — без них значения
+    берутся из poll_voter_stats.
+    """
+    aggregates = {}
+    if not tokens:
+        return aggregates
+
+    aggregate_query = (
+        db.session.query(
+            Vote.voter_token,
+            func.count(Vote.id),
+            func.coalesce(func.sum(Vote.points_awarded), 0),
+            func.max(Vote.voted_at),
+        )
         .filter(Vote.voter_token.in_(tokens))
     )
+    aggregate_query = _apply_vote_filters(aggregate_query, filters)
 
-    vote_query = _apply_vote_filters(vote_query, filters)
-    vote_query = vote_query.order_by(Vote.voted_at.desc())
-
-    for vote, poll, poll_movie in vote_query.all():
-        votes_by_token[vote.voter_token].append({
-            'poll_id': vote.poll_id,
-            'poll_title': getattr(poll, 'title', None),
-            'poll_created_at': poll.created_at.isoformat() if poll and poll.created_at else None,
-            'poll_expires_at': poll.expires_at.isoformat() if poll and poll.expires_at else None,
-            'movie_id': vote.movie_id,
-            'movie_name': poll_movie.name if poll_movie else None,
-            'movie_year': poll_movie.year if poll_movie else None,
-            'points_awarded': vote.points_awarded,
-            'voted_at': vote.voted_at.isoformat() if vote.voted_at else None,
-        })
+    for voter_token, votes_count, votes_points, last_vote_at in aggregate_query.group_by(Vote.voter_token).all():
+        aggregates[voter_token] = {
+            'votes_count': int(votes_count or 0),
+            'votes_points': int(votes_points or 0),
+            'last_vote_at': last_vote_at,
+        }
+
+    # Голоса старше срока хранения свёрнуты помесячно без разбивки по опросам,
+    # поэтому добавляются только для фильтра по датам
+    if not filters.get('poll_id'):
+        rollups = get_vote_rollup_totals(tokens, filters.get('date_from'), filters.get('date_to'))
+        for voter_token, rollup in rollups.items():
+            stats = aggregates.setdefault(
+                voter_token,
+                {'votes_count': 0, 'votes_points': 0, 'last_vote_at': None},
+            )
+            stats['votes_count'] += rollup['votes_count']
+            stats['votes_points'] += rollup['votes_points']
+            if rollup['last_vote_at'] and (
+                stats['last_vote_at'] is None or stats['last_vote_at'] < rollup['last_vote_at']
+            ):
+                stats['last_vote_at'] = rollup['last_vote_at']
+
+    return aggregates
+
+
+def _filtered_vote_totals_subquery(filters):
+    """Голоса токенов с учётом фильтров одним GROUP BY — те же значения, что у
+    ``_aggregate_votes_by_token``, но для сортировки всего списка в SQL."""
+    raw_votes = _apply_vote_filters(
+        db.session.query(
+            Vote.voter_token.label('voter_token'),
+            func.count(Vote.id).label('votes_count'),
+            func.coalesce(func.sum(Vote.points_awarded), 0).label('votes_points'),
+            func.max(Vote.voted_at).label('last_vote_at'),
+        ),
+        filters,
+    ).group_by(Vote.voter_token)
+    parts = [raw_votes.statement]
+    if not filters.get('poll_id'):
+        parts.append(
+            select(
+                VoteMonthlyRollup.voter_token.label('voter_token'),
+                func.coalesce(func.sum(VoteMonthlyRollup.votes_count), 0).label('votes_count'),
+                func.coalesce(func.sum(VoteMonthlyRollup.votes_points), 0).label('votes_points'),
+                func.max(VoteMonthlyRollup.last_vote_at).label('last_vote_at'),
+            )
+            .where(*vote_rollup_period_conditions(filters.get('date_from'), filters.get('date_to')))
+            .group_by(VoteMonthlyRollup.voter_token)
+        )
+    combined = union_all(*parts).subquery('vote_parts')
+    return (
+        select(
+            combined.c.voter_token,
+            func.sum(combined.c.votes_count).label('votes_count'),
+            func.sum(combined.c.votes_points).label('votes_points'),
+            func.max(combined.c.last_vote_at).label('last_vote_at'),
+        )
+        .group_by(combined.c.voter_token)
+        .subquery('filtered_votes')
+    )
+
+
+def _serialize_voter_vote(vote, poll, poll_movie):
+    return {
+        'poll_id': vote.poll_id,
+        'poll_title': getattr(poll, 'title', None),
+        'poll_created_at': poll.created_at.isoformat() if poll and poll.created_at else None,
+        'poll_expires_at': poll.expires_at.isoformat() if poll and poll.expires_at else None,
+        'movie_id': vote.movie_id,
+        'movie_name': poll_movie.name if poll_movie else None,
+        'movie_year': poll_movie.year if poll_movie else None,
+        'points_awarded': vote.points_awarded,
+        'voted_at': vote.voted_at.isoformat() if vote.voted_at else None,
+    }
 
-    return votes_by_token
+
+def _serialize_voter_stats_item(profile, stats):
+    earned_total = profile.points_accrued_total or 0
+    last_vote_at = stats.get('last_vote_at') if stats else None
+    return {
+        'voter_token': profile.token,
+        'user_id': profile.user_id,
+        'device_label': profile.device_label,
+        'total_points': profile.total_points or 0,
+        'points_accrued_total': earned_total,
+        'points_earned_total': earned_total,
+        'filtered_points': stats.get('votes_points', 0) if stats else 0,
+        'created_at': profile.created_at.isoformat() if profile.created_at else None,
+        'updated_at': profile.updated_at.isoformat() if profile.updated_at else None,
+        'last_vote_at': last_vote_at.isoformat() if last_vote_at else None,
+        'votes_count': stats.get('votes_count', 0) if stats else 0,
+    }
 
 
 def _fix_poster_url(poster_url):
     """Исправляет URL постера с нерабочего домена на рабочий."""
-    if not poster_url:
-        return poster_url
     # image.openmoviedb.com больше не работает, заменяем на avatars.mds.yandex.net
-    if 'image.openmoviedb.com/kinopoisk-images/' in poster_url:
-        return poster_url.replace(
-            'image.openmoviedb.com/kinopoisk-images/',
-            'avatars.mds.yandex.net/get-kinopoisk-image/'
-        )
-    return poster_url
+    return fix_poster_url(poster_url)
 
 
 def _serialize_poll_movie(movie):
@@ -925,7 +1050,7 @@ def _serialize_poll_movie(movie):
     if library_movie:
         try:
             if library_movie.poster_file_path:
-                poster = f'/api/posters/{library_movie.id}'
+                poster = local_poster_url(library_movie.id, library_movie.poster_file_path)
         except Exception:
             pass
     
@@ -1407,7 +1532,7 @@ def add_library_movie():
         if not has_local:
             poster_path = _download_and_save_poster(poster_url, movie_for_poster.id)
             if poster_path:
-                movie_for_poster.poster_file_path = poster_path
+                set_movie_poster(movie_for_poster, poster_path)
 
     # Add poster to background when movie is added to library
     if poster_url:
@@ -1499,7 +1624,7 @@ def add_library_movie_from_url():
         if not has_local:
             poster_path = _download_and_save_poster(poster_url, movie_for_poster.id)
             if poster_path:
-                movie_for_poster.poster_file_path = poster_path
+                set_movie_poster(movie_for_poster, poster_path)
 
     # Add poster to background
     if poster_url:
@@ -1523,9 +1648,21 @@ def add_library_movie_from_url():
 @api_bp.route('/library/<int:movie_id>', methods=['DELETE'])
 def remove_library_movie(movie_id):
     library_movie = LibraryMovie.query.get_or_404(movie_id)
-    _remove_trailer_file(library_movie, _get_trailer_settings())
-    _remove_poster_file(library_movie)
+    trailer_path = library_movie.trailer_file_path
+    poster_path = library_movie.poster_file_path
+    trailer_size = movie_media_size(library_movie, KIND_TRAILER)
+    poster_size = movie_media_size(library_movie, KIND_POSTER)
+    for upload in TrailerUpload.query.filter_by(movie_id=library_movie.id).all():
+        discard_upload(upload)
     db.session.delete(library_movie)
+    db.session.flush()
+    track_media_size(KIND_TRAILER, trailer_size, None)
+    track_media_size(KIND_POSTER, poster_size, None)
+    # Файлы удаляются, только если на те же байты не ссылаются другие фильмы
+    release_media(trailer_path, KIND_TRAILER)
+    release_media(poster_path, KIND_POSTER)
+    if poster_path:
+        enqueue_poster_atlas(movie_id)
     db.session.commit()
     return jsonify({"success": True, "message": "Фильм удален из библиотеки."})
 
@@ -1558,38 +1695,55 @@ def upload_local_trailer(movie_id):
     if max_size and file_size and file_size > max_size:
         return jsonify({"success": False, "message": "Размер файла превышает допустимый лимит."}), 400
 
+    try:
+        check_media_quota(KIND_TRAILER, file_size, movie_media_size(library_movie, KIND_TRAILER))
+    except MediaQuotaExceeded as exc:
+        return jsonify({"success": False, "message": str(exc), "quota": exc.scope}), 413
+
     original_ext = os.path.splitext(trailer_file.filename)[1].lower()
     guessed_ext = mimetypes.guess_extension(mimetype or '') or ''
     safe_ext = original_ext if original_ext else guessed_ext
-    filename = f"movie_{movie_id}_{uuid.uuid4().hex}{safe_ext}"
-
-    os.makedirs(settings['upload_dir'], exist_ok=True)
-    absolute_path = os.path.join(settings['upload_dir'], filename)
-    previous_trailer_path = library_movie.trailer_file_path
 
+    # SHA-256 считается по мере записи потока; одинаковые трейлеры хранятся один раз
     try:
-        trailer_file.save(absolute_path)
+        with BlobWriter(KIND_TRAILER) as writer:
+            for block in iter(lambda: trailer_file.stream.read(1024 * 1024), b''):
+                writer.write(block)
+            relative_path = writer.commit(safe_ext)
     except Exception as exc:
+        db.session.rollback()
         current_app.logger.exception('Не удалось сохранить трейлер: %s', exc)
         return jsonify({"success": False, "message": "Не удалось сохранить трейлер на сервере."}), 500
 
-    # Apply faststart optimization for web playback
-    faststart_result = apply_faststart(absolute_path)
-    if faststart_result['success'] and faststart_result['new_size']:
-        file_size = faststart_result['new_size']
-    elif not faststart_result['success']:
-        current_app.logger.warning('Не удалось применить faststart: %s', faststart_result['message'])
+    absolute_path = resolve_media_path(settings['media_root'], relative_path)
+    return jsonify(_attach_trailer_file(library_movie, settings, relative_path, absolute_path, mimetype, writer.size))
+
 
-    relative_path = os.path.join(settings.get('relative_dir', 'trailers'), filename)
+def _attach_trailer_file(library_movie, settings, relative_path, absolute_path, mimetype, file_size):
+    """Сделать сохранённый файл трейлером фильма и поставить его обработку в очередь (с commit)."""
+    previous_trailer_path = library_movie.trailer_file_path
+    previous_size = movie_media_size(library_movie, KIND_TRAILER)
     library_movie.trailer_file_path = relative_path
     library_movie.trailer_mime_type = mimetype or None
     library_movie.trailer_file_size = file_size if file_size else None
+    track_media_size(KIND_TRAILER, previous_size, movie_media_size(library_movie, KIND_TRAILER))
+    clear_trailer_derivatives(library_movie)
     library_movie.bumped_at = vladivostok_now()
 
     if previous_trailer_path:
-        temp_movie = LibraryMovie(trailer_file_path=previous_trailer_path)
-        _remove_trailer_file(temp_movie, settings)
-
+        db.session.flush()
+        release_media(previous_trailer_path, KIND_TRAILER)
+
+    # Заголовки боксов MP4 читаются сразу (несколько КБ); ремукс ffmpeg нужен,
+    # только если moov в конце файла, и его выполняет worker.
+    # Упаковку HLS обработчик faststart ставит сам, уже для итогового файла
+    faststart_job = None
+    postprocessing_jobs = []
+    already_optimized = inspect_trailer(library_movie, absolute_path)
+    if not already_optimized and should_apply_faststart(absolute_path):
+        faststart_job = enqueue_faststart(library_movie)
+    else:
+        postprocessing_jobs = enqueue_trailer_postprocessing(library_movie)
     db.session.commit()
 
     identifier = None
@@ -1602,12 +1756,173 @@ def upload_local_trailer(movie_id):
     data['is_on_client'] = False
     data['torrent_hash'] = None
 
-    return jsonify({"success": True, "movie": data})
+    return {
+        "success": True,
+        "movie": data,
+        "faststart_job": faststart_job.to_dict() if faststart_job else None,
+        "postprocessing_jobs": [job.to_dict() for job in postprocessing_jobs],
+    }
+
+
+def _tus_response(response, status=None):
+    if status is not None:
+        response.status_code = status
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    return prevent_caching(response)
+
+
+def _tus_error(message, status):
+    return _tus_response(jsonify({"success": False, "message": message}), status)
+
+
+def _trailer_upload_headers(response, upload):
+    response.headers['Upload-Offset'] = str(upload.upload_offset)
+    response.headers['Upload-Length'] = str(upload.upload_length)
+    response.headers['Upload-Expires'] = http_date(upload.expires_at.replace(tzinfo=VLADIVOSTOK_TZ))
+    return response
+
+
+@api_bp.route('/trailer-uploads', methods=['OPTIONS'])
+def trailer_upload_options():
+    """Возможности сервера загрузок (tus discovery)."""
+    response = _tus_response(current_app.make_response(('', 204)))
+    response.headers['Tus-Version'] = TUS_VERSION
+    response.headers['Tus-Extension'] = TUS_EXTENSIONS
+    response.headers['Tus-Checksum-Algorithm'] = TUS_CHECKSUM_ALGORITHMS
+    max_size = _get_trailer_settings().get('max_size')
+    if max_size:
+        response.headers['Tus-Max-Size'] = str(max_size)
+    return response
+
+
+@api_bp.route('/movies/<int:movie_id>/trailer-uploads', methods=['POST'])
+def create_trailer_upload(movie_id):
+    """Создать возобновляемую загрузку трейлера (tus creation)."""
+    library_movie = LibraryMovie.query.get_or_404(movie_id)
+    settings = _get_trailer_settings()
+    if not settings.get('upload_dir'):
+        return _tus_error("Директория загрузки трейлеров не настроена.", 500)
+
+    try:
+        upload_length = int(request.headers.get('Upload-Length', ''))
+    except ValueError:
+        return _tus_error("Нужен заголовок Upload-Length с размером файла.", 400)
+
+    try:
+        check_media_quota(KIND_TRAILER, upload_length, movie_media_size(library_movie, KIND_TRAILER))
+    except MediaQuotaExceeded as exc:
+        return _tus_error(str(exc), 413)
+
+    try:
+        metadata = parse_upload_metadata(request.headers.get('Upload-Metadata'))
+        upload = create_upload(library_movie, settings, upload_length, metadata)
+    except UploadError as exc:
+        return _tus_error(str(exc), exc.status)
+    db.session.commit()
+
+    upload_url = f'/api/trailer-uploads/{upload.id}'
+    response = _tus_response(jsonify({"success": True, "upload_id": upload.id, "upload_url": upload_url}), 201)
+    response.headers['Location'] = upload_url
+    return _trailer_upload_headers(response, upload)
+
+
+@api_bp.route('/trailer-uploads/<upload_id>', methods=['GET'])
+def get_trailer_upload(upload_id):
+    """Текущее смещение загрузки (HEAD — для tus-клиентов после обрыва)."""
+    upload = db.session.get(TrailerUpload, upload_id)
+    if upload is None:
+        return _tus_error("Загрузка не найдена или истекла.", 404)
+
+    response = _tus_response(jsonify({
+        "success": True,
+        "upload_id": upload.id,
+        "movie_id": upload.movie_id,
+        "offset": upload.upload_offset,
+        "length": upload.upload_length,
+    }))
+    return _trailer_upload_headers(response, upload)
+
+
+@api_bp.route('/trailer-uploads/<upload_id>', methods=['PATCH'])
+def patch_trailer_upload(upload_id):
+    """Дописать кусок файла; последний кусок завершает загрузку."""
+    if request.mimetype != 'application/offset+octet-stream':
+        return _tus_error("Content-Type должен быть application/offset+octet-stream.", 415)
+
+    # Строка не блокируется: параллельный PATCH отсекает flock файла в append_chunk
+    upload = db.session.get(TrailerUpload, upload_id, populate_existing=True)
+    if upload is None:
+        return _tus_error("Загрузка не найдена или истекла.", 404)
+
+    try:
+        client_offset = int(request.headers.get('Upload-Offset', ''))
+    except ValueError:
+        return _tus_error("Нужен заголовок Upload-Offset.", 400)
+    if client_offset != upload.upload_offset:
+        response = _tus_error("Upload-Offset не совпадает с загруженным объёмом.", 409)
+        return _trailer_upload_headers(response, upload)
+
+    try:
+        append_chunk(upload, request.stream, request.content_length, request.headers.get('Upload-Checksum'))
+    except UploadError as exc:
+        db.session.rollback()
+        return _tus_error(str(exc), exc.status)
+
+    if upload.upload_offset < upload.upload_length:
+        return _trailer_upload_headers(_tus_response(current_app.make_response(('', 204))), upload)
+
+    try:
+        digest = finish_upload(upload)
+    except UploadError as exc:
+        # Файл целиком не совпал с ожидаемым — загрузку придётся начать заново
+        discard_upload(upload)
+        db.session.commit()
+        return _tus_error(str(exc), exc.status)
+
+    library_movie = db.session.get(LibraryMovie, upload.movie_id)
+    if library_movie is None:
+        discard_upload(upload)
+        db.session.commit()
+        return _tus_error("Фильм удалён из библиотеки.", 404)
+
+    # Хэш уже посчитан по мере приёма кусков: файл переносится в хранилище без копирования
+    upload_length = upload.upload_length
+    settings = _get_trailer_settings()
+    relative_path = adopt_file(
+        upload_absolute_path(upload),
+        digest,
+        upload_length,
+        KIND_TRAILER,
+        os.path.splitext(upload.relative_path)[1],
+    )
+    db.session.delete(upload)
+    payload = _attach_trailer_file(
+        library_movie,
+        settings,
+        relative_path,
+        resolve_media_path(settings['media_root'], relative_path),
+        upload.mime_type,
+        upload_length,
+    )
+    response = _tus_response(jsonify(payload))
+    response.headers['Upload-Offset'] = str(upload_length)
+    return response
+
+
+@api_bp.route('/trailer-uploads/<upload_id>', methods=['DELETE'])
+def delete_trailer_upload(upload_id):
+    """Отменить загрузку и удалить недогруженный файл (tus termination)."""
+    upload = db.session.get(TrailerUpload, upload_id)
+    if upload is None:
+        return _tus_error("Загрузка не найдена или истекла.", 404)
+    discard_upload(upload)
+    db.session.commit()
+    return _tus_response(current_app.make_response(('', 204)))
 
 
 @api_bp.route('/trailers/apply-faststart', methods=['POST'])
 def batch_apply_faststart():
-    """Apply faststart optimization to all existing trailers."""
+    """Поставить faststart для всех трейлеров в очередь одним пакетом."""
     settings = _get_trailer_settings()
     upload_dir = settings.get('upload_dir')
 
@@ -1623,22 +1938,18 @@ def batch_apply_faststart():
         LibraryMovie.trailer_file_path != ''
     ).all()
 
+    batch_id = uuid.uuid4().hex
     results = {
         'total': len(movies_with_trailers),
-        'processed': 0,
+        'queued': 0,
         'skipped': 0,
-        'failed': 0,
         'details': []
     }
 
     for movie in movies_with_trailers:
-        # Construct absolute path from relative path
-        relative_path = movie.trailer_file_path
-        # Remove the relative_dir prefix if present to get just the filename
-        filename = os.path.basename(relative_path)
-        absolute_path = os.path.join(upload_dir, filename)
+        absolute_path = resolve_media_path(settings.get('media_root') or '', movie.trailer_file_path)
 
-        if not os.path.exists(absolute_path):
+        if absolute_path is None or not os.path.exists(absolute_path):
             results['skipped'] += 1
             results['details'].append({
                 'movie_id': movie.id,
@@ -1648,114 +1959,201 @@ def batch_apply_faststart():
             })
             continue
 
-        faststart_result = apply_faststart(absolute_path)
-
-        if faststart_result['success']:
-            # Update file size in DB if changed
-            if faststart_result['new_size']:
-                movie.trailer_file_size = faststart_result['new_size']
-
-            results['processed'] += 1
-            results['details'].append({
-                'movie_id': movie.id,
-                'name': movie.name,
-                'status': 'processed',
-                'message': faststart_result['message']
-            })
-        else:
-            results['failed'] += 1
+        if inspect_trailer(movie, absolute_path) or not should_apply_faststart(absolute_path):
+            # moov уже в начале — ffmpeg не запускаем и файл не копируем;
+            # трейлерам без HLS (загружены до его появления) ставим упаковку
+            postprocessing_jobs = [] if movie.trailer_hls_path else enqueue_trailer_postprocessing(movie, batch_id=batch_id)
+            if postprocessing_jobs:
+                results['queued'] += 1
+                results['details'].append({
+                    'movie_id': movie.id,
+                    'name': movie.name,
+                    'status': 'queued',
+                    'job_id': postprocessing_jobs[0].id,
+                    'message': 'Faststart не требуется, упаковка HLS',
+                })
+                continue
+            results['skipped'] += 1
             results['details'].append({
                 'movie_id': movie.id,
                 'name': movie.name,
-                'status': 'failed',
-                'message': faststart_result['message']
+                'status': 'skipped',
+                'message': 'Faststart не требуется'
             })
+            continue
+
+        job = enqueue_faststart(movie, batch_id=batch_id)
+        results['queued'] += 1
+        results['details'].append({
+            'movie_id': movie.id,
+            'name': movie.name,
+            'status': 'queued',
+            'job_id': job.id,
+        })
 
     db.session.commit()
 
+    # Worker обрабатывает пакет параллельно (не больше числа ядер CPU)
     return jsonify({
         "success": True,
-        "message": f"Обработано: {results['processed']}, пропущено: {results['skipped']}, ошибок: {results['failed']}",
+        "message": f"В очереди: {results['queued']}, пропущено: {results['skipped']}",
+        "batch_id": batch_id,
+        "status_url": f"/api/jobs?batch={batch_id}",
         "results": results
-    })
+    }), 202
+
+
+@api_bp.route('/jobs/<int:job_id>', methods=['GET'])
+def get_media_job(job_id):
+    """Статус и прогресс фонового задания."""
+    job = MediaJob.query.get_or_404(job_id)
+    return prevent_caching(jsonify(job.to_dict()))
+
+
+@api_bp.route('/jobs', methods=['GET'])
+def get_media_jobs_batch():
+    """Сводка по пакету заданий (?batch=<id>)."""
+    batch_id = (request.args.get('batch') or '').strip()
+    if not batch_id:
+        return jsonify({"error": "Не указан пакет заданий"}), 400
+    status = get_batch_status(batch_id)
+    if not status['total']:
+        return jsonify({"error": "Пакет заданий не найден"}), 404
+    return prevent_caching(jsonify(status))
+
+
+@api_bp.route('/jobs/<int:job_id>/retry', methods=['POST'])
+def retry_media_job(job_id):
+    """Повторно поставить упавшее задание в очередь."""
+    job = MediaJob.query.get_or_404(job_id)
+    if not retry_job(job):
+        return jsonify({"error": "Повторить можно только задание со статусом failed"}), 409
+    db.session.commit()
+    return jsonify(job.to_dict())
 
 
 @api_bp.route('/posters/migrate-all', methods=['POST'])
 def migrate_all_posters():
-    """Скачивает все постеры локально для фильмов без локальных постеров."""
-    movies = LibraryMovie.query.all()
+    """Поставить в очередь скачивание постеров всех фильмов без локальных постеров."""
+    # Повторный запрос не плодит задания: возвращаем уже идущую миграцию
+    job = _active_poster_migration_job()
+    created = job is None
+    if created:
+        job = enqueue_job(JOB_POSTER_MIGRATION, {})
+        db.session.commit()
 
-    results = {
-        'total': len(movies),
-        'downloaded': 0,
-        'skipped': 0,
-        'failed': 0,
-        'details': []
-    }
+    return jsonify({
+        "success": True,
+        "message": "Миграция постеров запущена" if created else "Миграция постеров уже выполняется",
+        "job": job.to_dict(),
+        "status_url": "/api/posters/migration",
+    }), 202
+
+
+@api_bp.route('/posters/migration', methods=['GET'])
+def poster_migration_status():
+    """Прогресс миграции постеров: последнее задание и сколько фильмов ещё без постера."""
+    total = LibraryMovie.query.filter(LibraryMovie.poster.isnot(None), LibraryMovie.poster != '').count()
+    remaining = db.session.execute(
+        select(func.count()).select_from(movies_without_local_poster().subquery())
+    ).scalar() or 0
+    job = (
+        MediaJob.query.filter_by(job_type=JOB_POSTER_MIGRATION)
+        .order_by(MediaJob.id.desc())
+        .first()
+    )
+    return prevent_caching(jsonify({
+        "total": total,
+        "downloaded": total - remaining,
+        "remaining": remaining,
+        "job": job.to_dict() if job else None,
+    }))
 
-    for movie in movies:
-        # Проверяем, есть ли уже локальный постер
-        try:
-            has_local = bool(movie.poster_file_path)
-        except Exception:
-            has_local = False
 
-        if has_local:
-            results['skipped'] += 1
-            results['details'].append({
-                'movie_id': movie.id,
-                'name': movie.name,
-                'status': 'skipped',
-                'message': 'Постер уже скачан'
-            })
-            continue
+def _active_poster_migration_job():
+    return (
+        MediaJob.query.filter(
+            MediaJob.job_type == JOB_POSTER_MIGRATION,
+            MediaJob.status.in_((JOB_QUEUED, JOB_RUNNING)),
+        )
+        .order_by(MediaJob.id.desc())
+        .first()
+    )
 
-        if not movie.poster:
-            results['skipped'] += 1
-            results['details'].append({
-                'movie_id': movie.id,
-                'name': movie.name,
-                'status': 'skipped',
-                'message': 'Нет URL постера'
-            })
-            continue
 
-        poster_path = _download_and_save_poster(movie.poster, movie.id)
+def _admin_secret_error():
+    """Ответ с ошибкой, если в Authorization нет верного ADMIN_SECRET_KEY, иначе None."""
+    admin_secret = os.environ.get('ADMIN_SECRET_KEY')
+    if not admin_secret:
+        return jsonify({'error': 'Admin access disabled (ADMIN_SECRET_KEY not set)'}), 403
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return jsonify({'error': 'Missing Authorization header'}), 401
+    if auth_header[7:] != admin_secret:
+        current_app.logger.warning('Unauthorized admin request %s from %s', request.path, request.remote_addr)
+        return jsonify({'error': 'Invalid admin secret'}), 403
+    return None
+
+
+@api_bp.route('/admin/media-scan', methods=['GET'])
+def media_scan_status():
+    """Отчёт проверки медиафайлов: состояние прохода, число проблем, список (?issue=&limit=)."""
+    error = _admin_secret_error()
+    if error:
+        return error
+    limit = min(max(request.args.get('limit', 100, type=int) or 100, 1), 1000)
+    try:
+        report = media_scan_report(issue=request.args.get('issue') or None, limit=limit)
+        db.session.commit()
+    except (ProgrammingError, OperationalError) as exc:
+        db.session.rollback()
+        current_app.logger.warning('Таблицы проверки медиафайлов недоступны: %s', exc)
+        return jsonify({'error': 'Проверка медиафайлов недоступна. Выполните миграции.'}), 503
+    return prevent_caching(jsonify(report))
+
+
+@api_bp.route('/admin/media-scan/step', methods=['POST'])
+def media_scan_run_step():
+    """Выполнить шаг проверки сейчас, не дожидаясь планировщика."""
+    error = _admin_secret_error()
+    if error:
+        return error
+    return jsonify(scan_media_step(batch_size=request.args.get('batch', type=int)))
 
-        if poster_path:
-            try:
-                movie.poster_file_path = poster_path
-                results['downloaded'] += 1
-                results['details'].append({
-                    'movie_id': movie.id,
-                    'name': movie.name,
-                    'status': 'downloaded',
-                    'message': f'Сохранено: {poster_path}'
-                })
-            except Exception as exc:
-                results['failed'] += 1
-                results['details'].append({
-                    'movie_id': movie.id,
-                    'name': movie.name,
-                    'status': 'failed',
-                    'message': f'Ошибка сохранения: {exc}'
-                })
-        else:
-            results['failed'] += 1
-            results['details'].append({
-                'movie_id': movie.id,
-                'name': movie.name,
-                'status': 'failed',
-                'message': 'Не удалось скачать постер'
-            })
 
+@api_bp.route('/admin/media-scan/reclaim', methods=['POST'])
+def media_scan_reclaim():
+    """Удалить найденные брошенные файлы (orphan и temp), каждый проверяется повторно."""
+    error = _admin_secret_error()
+    if error:
+        return error
+    return jsonify(reclaim_media_issues(limit=request.args.get('limit', type=int)))
+
+
+
+@api_bp.route('/admin/media-usage', methods=['GET'])
+def media_usage():
+    """Место, занятое трейлерами и постерами: итоги, квоты и самые «тяжёлые» фильмы (?limit=, ?movie_id=)."""
+    error = _admin_secret_error()
+    if error:
+        return error
+    limit = max(1, min(request.args.get('limit', 20, type=int), 500))
+    report = media_usage_report(limit=limit, movie_id=request.args.get('movie_id', type=int))
+    # Первое обращение записывает пересчитанные итоги
     db.session.commit()
+    return jsonify(report)
 
-    return jsonify({
-        "success": True,
-        "message": f"Скачано: {results['downloaded']}, пропущено: {results['skipped']}, ошибок: {results['failed']}",
-        "results": results
-    })
+
+@api_bp.route('/admin/media-usage/recount', methods=['POST'])
+def media_usage_recount():
+    """Пересчитать итоги по library_movie, если они разошлись с файлами фильмов."""
+    error = _admin_secret_error()
+    if error:
+        return error
+    recount_media_usage()
+    report = media_usage_report()
+    db.session.commit()
+    return jsonify({"success": True, **report})
 
 
 @api_bp.route('/library/<int:movie_id>/points', methods=['PUT'])
@@ -1826,6 +2224,25 @@ def update_library_movie_ban_cost_per_month(movie_id):
     })
 
 
+@api_bp.route('/library/<int:movie_id>/trailer-preview', methods=['GET'])
+def library_trailer_preview(movie_id):
+    """Подписанные ссылки на трейлер и превью для предпросмотра в библиотеке (только администратор)."""
+    # Ссылки не привязаны к зрителю, поэтому выдаются только по ADMIN_SECRET_KEY:
+    # остальные смотрят трейлер через оплату в опросе (watch_trailer_in_poll)
+    error = _admin_secret_error()
+    if error:
+        return error
+    library_movie = LibraryMovie.query.get_or_404(movie_id)
+    if not library_movie.has_local_trailer:
+        return jsonify({"success": False, "message": "Трейлер не загружен."}), 404
+    return prevent_caching(jsonify({
+        "success": True,
+        "trailer_url": library_movie.signed_trailer_url(None),
+        "trailer_mime_type": library_movie.trailer_mime_type,
+        "trailer_previews": library_movie.signed_trailer_previews(None),
+    }))
+
+
 @api_bp.route('/library/<int:movie_id>/trailer-view-cost', methods=['PUT'])
 def update_library_movie_trailer_view_cost(movie_id):
     """Обновление цены за просмотр трейлера для фильма"""
@@ -1982,6 +2399,9 @@ def create_poll():
 
     db.session.commit()
 
+    # Голосующие откроют трейлеры опроса в ближайшие минуты — подгружаем их начало в page cache
+    prewarm_poll_trailers(new_poll)
+
     # Финализация опроса (применение бейджа победителю) теперь выполняется
     # периодической задачей scheduler'а каждые 10 секунд
 
@@ -2058,7 +2478,7 @@ def get_poll(poll_id):
         "has_voted": bool(existing_vote),
         "voted_movie": voted_movie_data,
         "voted_points_delta": voted_points_delta,
-        "total_votes": len(poll.votes),
+        "total_votes": poll.total_votes,
         "points_balance": points_balance,
         "points_earned_total": points_earned_total,
         "voter_token": voter_token,
@@ -2090,6 +2510,7 @@ def delete_poll(poll_id):
         return jsonify({"error": "Вы не являетесь создателем этого опроса"}), 403
 
     poll_id_deleted = poll.id
+    discount_poll_from_voter_stats(poll.id)
     db.session.delete(poll)
     db.session.commit()
 
@@ -2185,6 +2606,7 @@ def vote_in_poll(poll_id):
         points_awarded=points_awarded,
     )
     db.session.add(new_vote)
+    record_vote_in_voter_stats(voter_token, points_awarded)
 
     balance_before = profile.total_points or 0  # баланс до начисления
     new_balance = change_voter_points_balance(
@@ -2509,6 +2931,7 @@ def custom_vote(poll_id):
         points_awarded=points_awarded,
     )
     db.session.add(new_vote)
+    record_vote_in_voter_stats(voter_token, points_awarded)
 
     db.session.commit()
 
@@ -2596,7 +3019,7 @@ def get_poll_results(poll_id):
     return prevent_caching(jsonify({
         "poll_id": poll.id,
         "movies": movies_with_votes,
-        "total_votes": len(poll.votes),
+        "total_votes": poll.total_votes,
         "winners": [
             {
                 "id": w.id,
@@ -2664,7 +3087,7 @@ def get_my_polls():
             "expires_at": poll.expires_at.isoformat(),
             "is_expired": poll.is_expired,
             "closed_by_ban": bool(poll.forced_winner_movie_id),
-            "total_votes": len(poll.votes),
+            "total_votes": poll.total_votes,
             "movies_count": len(poll.movies),
             "notifications_enabled": bool(poll.notifications_enabled),
             "winner_badge": poll_winner_badge,
@@ -2690,6 +3113,28 @@ def get_my_polls():
     return prevent_caching(jsonify({"polls": polls_data}))
 
 
+# Effective connection type (Network Information API / Client Hints), при котором MP4 отдаётся облегчённым
+_SLOW_CONNECTION_TYPES = {'slow-2g', '2g', '3g'}
+_SLOW_DOWNLINK_MBPS = 1.5
+
+
+def _prefers_low_quality(payload):
+    """Клиент просит облегчённый трейлер явно или сообщает о медленном соединении."""
+    if payload.get('quality') == 'low':
+        return True
+    connection = payload.get('connection') if isinstance(payload.get('connection'), dict) else {}
+    if connection.get('save_data') or request.headers.get('Save-Data', '').lower() == 'on':
+        return True
+    effective_type = connection.get('effective_type') or request.headers.get('ECT')
+    if effective_type and str(effective_type).lower() in _SLOW_CONNECTION_TYPES:
+        return True
+    try:
+        downlink = float(connection.get('downlink') or request.headers.get('Downlink') or 0)
+    except (TypeError, ValueError):
+        return False
+    return 0 < downlink < _SLOW_DOWNLINK_MBPS
+
+
 @api_bp.route('/polls/<poll_id>/watch-trailer', methods=['POST'])
 def watch_trailer_in_poll(poll_id):
     """Просмотр трейлера фильма в опросе с оплатой баллами"""
@@ -2768,14 +3213,33 @@ def watch_trailer_in_poll(poll_id):
     profile = ensure_voter_profile(voter_token, device_label=device_label)
     points_accrued = profile.points_accrued_total or 0
 
-    # Формируем URL для трейлера
-    settings = _get_trailer_settings()
-    trailer_url = f"/api/trailers/{library_movie.id}/stream"
+    # Подписанный URL привязан к voter_token: по чужой ссылке трейлер не отдаётся
+    trailer_url = library_movie.signed_trailer_url(voter_token)
+    low_quality_url = None
+    if trailer_url and current_app.config.get('TRAILER_LOW_QUALITY_ENABLED'):
+        low_quality_url = f'{trailer_url}&quality=low'
+        if _prefers_low_quality(payload):
+            trailer_url = low_quality_url
+            # Копия собирается по первому запросу медленного клиента; пока её нет,
+            # stream_trailer отдаёт по этой ссылке исходный файл
+            trailer_path = library_movie.trailer_file_path
+            try:
+                if find_low_quality_trailer(trailer_path) is None and enqueue_low_quality_trailer(trailer_path):
+                    db.session.commit()
+            except (ProgrammingError, OperationalError) as exc:
+                db.session.rollback()
+                current_app.logger.warning('Не удалось поставить облегчённую копию трейлера в очередь: %s', exc)
 
     response = prevent_caching(jsonify({
         "success": True,
         "trailer_url": trailer_url,
         "trailer_mime_type": library_movie.trailer_mime_type,
+        "low_quality_url": low_quality_url,
+        # Адаптивный поток, если HLS уже упакован; иначе плеер берёт trailer_url
+        "hls_url": sign_trailer_asset_url(library_movie.trailer_hls_url, 'hls', voter_token),
+        # Кадр-постер и дорожка WebVTT с миниатюрами — без обращения к видеофайлу
+        "poster_frame_url": sign_trailer_asset_url(library_movie.trailer_poster_frame_url, 'thumbs', voter_token),
+        "thumbnails_url": sign_trailer_asset_url(library_movie.trailer_thumbnails_url, 'thumbs', voter_token),
         "movie_name": movie.name,
         "cost_deducted": trailer_cost,
         "points_balance": new_balance,
@@ -2788,99 +3252,233 @@ def watch_trailer_in_poll(poll_id):
 @api_bp.route('/trailers/<int:movie_id>/stream', methods=['GET'])
 def stream_trailer(movie_id):
     """Отдача видеофайла трейлера"""
-    from flask import send_file, Response
-    
-    library_movie = LibraryMovie.query.get_or_404(movie_id)
-    
-    if not library_movie.has_local_trailer:
-        return jsonify({"error": "Трейлер не найден"}), 404
+    from flask import redirect
 
     settings = _get_trailer_settings()
     media_root = settings.get('media_root') or ''
-    
+
+    token = request.args.get('token')
+    expected_size = None
+    if token:
+        # Подписанная ссылка из watch_trailer_in_poll или библиотеки: путь, размер и
+        # MIME-тип уже в токене, поэтому Range-запросы плеера не ходят в БД
+        payload = load_media_token(token, movie_id, request.cookies.get(VOTER_TOKEN_COOKIE))
+        if payload is None or not payload.get('p'):
+            return jsonify({"error": "Ссылка на трейлер недействительна или устарела"}), 403
+        relative_path = payload['p']
+        mime_type = payload.get('m') or 'video/mp4'
+        expected_size = payload.get('s')
+        # Версия в токене — SHA-256 содержимого: по этой ссылке байты не меняются.
+        # Ссылка выдана конкретному зрителю, поэтому кэш только в его браузере
+        immutable = bool(payload.get('h'))
+        private = True
+        # Лимит на зрителя — по отпечатку из подписи: cookie клиент может сменить на каждый запрос
+        stream_voter_key = payload.get('v')
+    elif current_app.config.get('TRAILER_ALLOW_UNSIGNED_STREAM'):
+        library_movie = LibraryMovie.query.get_or_404(movie_id)
+
+        if not library_movie.has_local_trailer:
+            return jsonify({"error": "Трейлер не найден"}), 404
+
+        relative_path = library_movie.trailer_file_path
+        mime_type = library_movie.trailer_mime_type or 'video/mp4'
+
+        # ?v=<версия> — SHA-256 содержимого: новые байты получают новое имя, а одно
+        # имя может быть общим для нескольких фильмов с одинаковым трейлером
+        requested_version = request.args.get('v')
+        current_version = media_version(relative_path)
+        if requested_version and requested_version != current_version:
+            response = redirect(url_for('api.stream_trailer', movie_id=movie_id, v=current_version))
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        immutable = bool(requested_version)
+        private = False
+        stream_voter_key = request.cookies.get(VOTER_TOKEN_COOKIE)
+    else:
+        return jsonify({"error": "Для просмотра трейлера нужна подписанная ссылка"}), 403
+
+    if request.args.get('quality') == 'low':
+        # Сборку копии ставит watch_trailer_in_poll — стриминг в БД не пишет. Пока
+        # копии нет, плеер уходит на исходный файл: один URL отдаёт одни и те же байты
+        low_path = find_low_quality_trailer(relative_path)
+        if low_path is None:
+            args = request.args.to_dict()
+            args.pop('quality')
+            response = redirect(url_for('api.stream_trailer', movie_id=movie_id, **args))
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        relative_path = low_path
+        mime_type = 'video/mp4'
+        expected_size = None
+        # Вытесненная копия пересобирается под тем же именем — URL копии не версионирован
+        immutable = False
+
+    # Файл в S3: плеер уходит на presigned URL и шлёт Range-запросы прямо в бакет
+    remote_url = remote_media_url(relative_path, mime_type)
+    if remote_url:
+        response = redirect(remote_url, code=302)
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+
     # trailer_file_path хранится как "trailers/filename.mp4"
     # media_root = instance/media
     # Итоговый путь: instance/media/trailers/filename.mp4
-    # Нормализуем путь для кроссплатформенности
-    normalized_file_path = library_movie.trailer_file_path.replace('\\', '/').replace('/', os.sep)
-    trailer_path = os.path.normpath(os.path.join(media_root, normalized_file_path))
-    
-    # Защита от path traversal: проверяем, что путь не выходит за пределы media_root
-    normalized_media_root = os.path.normpath(media_root)
-    if not trailer_path.startswith(normalized_media_root + os.sep) and trailer_path != normalized_media_root:
-        current_app.logger.warning('Path traversal attempt detected: %s', trailer_path)
+    trailer_path = resolve_media_path(media_root, relative_path)
+    if trailer_path is None:
+        current_app.logger.warning('Path traversal attempt detected: %s', relative_path)
         return jsonify({"error": "Недопустимый путь к файлу"}), 400
-    
-    current_app.logger.debug('Streaming trailer: media_root=%s, file_path=%s, full_path=%s', 
-                             media_root, library_movie.trailer_file_path, trailer_path)
 
-    if not os.path.exists(trailer_path):
+    current_app.logger.debug('Streaming trailer: media_root=%s, file_path=%s, full_path=%s',
+                             media_root, relative_path, trailer_path)
+
+    file_stat = media_file_stat(trailer_path)
+    if file_stat is None:
         current_app.logger.error('Файл трейлера не найден: %s', trailer_path)
         return jsonify({"error": "Файл трейлера не найден"}), 404
 
-    mime_type = library_movie.trailer_mime_type or 'video/mp4'
+    if expected_size is not None and file_stat.st_size != expected_size:
+        # Файл изменился после выдачи ссылки — клиент должен запросить новую
+        return jsonify({"error": "Трейлер обновлён, откройте его заново"}), 404
+
+    return _send_limited_media(
+        trailer_path, relative_path, mime_type, file_stat, immutable=immutable, private=private,
+        voter_key=stream_voter_key,
+    )
 
-    # Поддержка Range requests для видео
-    file_size = os.path.getsize(trailer_path)
-    range_header = request.headers.get('Range')
 
-    if range_header:
-        # Парсим Range header
-        byte_start = 0
-        byte_end = file_size - 1
-        
-        range_match = re.match(r'bytes=(\d*)-(\d*)', range_header)
-        if range_match:
-            start_str, end_str = range_match.groups()
-            if start_str:
-                byte_start = int(start_str)
-            if end_str:
-                byte_end = int(end_str)
-        
-        byte_end = min(byte_end, file_size - 1)
-        content_length = byte_end - byte_start + 1
-
-        def generate():
-            with open(trailer_path, 'rb') as f:
-                f.seek(byte_start)
-                remaining = content_length
-                chunk_size = 1024 * 1024  # 1MB chunks для быстрого стриминга
-                while remaining > 0:
-                    chunk = f.read(min(chunk_size, remaining))
-                    if not chunk:
-                        break
-                    remaining -= len(chunk)
-                    yield chunk
-
-        response = Response(
-            generate(),
-            status=206,
-            mimetype=mime_type,
-            direct_passthrough=True
+def _send_limited_media(absolute_path, relative_path, mime_type, file_stat, immutable=False, private=False,
+                        voter_key=None):
+    """
+    send_media_file под лимитами одновременных потоков (и скорости, если она ограничена).
+    При offload поток gunicorn освобождается сразу — считать нечего.
+
+    ``voter_key`` — ключ лимита на зрителя: отпечаток ``v`` из проверенного токена
+    ссылки, а для неподписанных запросов — cookie voter_token (None — без лимита на зрителя).
+    """
+    if get_offload_mode() is not None:
+        return send_media_file(
+            absolute_path, relative_path, mime_type, file_stat, immutable=immutable, private=private,
         )
-        response.headers['Content-Range'] = f'bytes {byte_start}-{byte_end}/{file_size}'
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Length'] = content_length
-        response.headers['Content-Type'] = mime_type
-        # Запрет кэширования для корректной работы после замены трейлера
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+
+    try:
+        lease = acquire_stream_slot(request.remote_addr, voter_key)
+    except StreamLimitExceeded as exc:
+        current_app.logger.info('Лимит потоков (%s) исчерпан для %s', exc.scope, request.remote_addr)
+        response = jsonify({
+            "error": "Слишком много одновременных просмотров, попробуйте чуть позже",
+            "scope": exc.scope,
+        })
+        response.status_code = 429
+        response.headers['Retry-After'] = str(exc.retry_after)
+        response.headers['Cache-Control'] = 'no-store'
         return response
-    else:
-        response = send_file(
-            trailer_path,
-            mimetype=mime_type,
-            as_attachment=False,
+
+    try:
+        response = send_media_file(
+            absolute_path, relative_path, mime_type, file_stat, immutable=immutable, private=private,
         )
-        response.headers['Accept-Ranges'] = 'bytes'
-        response.headers['Content-Length'] = file_size
-        # Запрет кэширования для корректной работы после замены трейлера
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+    except Exception:
+        lease.release()
+        raise
+    return lease.attach(response)
+
+
+_TRAILER_ASSET_MIME_TYPES = {
+    'hls': {
+        '.m3u8': 'application/vnd.apple.mpegurl',
+        '.ts': 'video/mp2t',
+    },
+    'thumbs': {
+        '.jpg': 'image/jpeg',
+        '.vtt': 'text/vtt',
+    },
+}
+
+_TRAILER_ASSET_SIGNERS = {
+    '.m3u8': sign_playlist_uris,
+    '.vtt': sign_vtt_image_uris,
+}
+
+
+def _send_trailer_asset(kind, asset):
+    """Статическая отдача производного файла трейлера из <каталог трейлеров>/<kind> (без запросов к БД)."""
+    mime_type = _TRAILER_ASSET_MIME_TYPES[kind].get(os.path.splitext(asset)[1].lower())
+    if mime_type is None:
+        return jsonify({"error": "Файл не найден"}), 404
+
+    # Сегменты и кадры — производные платного трейлера: нужна подписанная ссылка. Зрителю опроса
+    # её выдаёт watch_trailer_in_poll после оплаты, библиотеке — карточка фильма (без привязки к зрителю)
+    token = request.args.get('token')
+    if token:
+        payload = load_media_token(token, trailer_asset_scope(kind, asset), request.cookies.get(VOTER_TOKEN_COOKIE))
+        if payload is None:
+            return jsonify({"error": "Ссылка на трейлер недействительна или устарела"}), 403
+        stream_voter_key = payload.get('v')
+    elif current_app.config.get('TRAILER_ALLOW_UNSIGNED_STREAM'):
+        stream_voter_key = request.cookies.get(VOTER_TOKEN_COOKIE)
+    else:
+        return jsonify({"error": "Для просмотра трейлера нужна подписанная ссылка"}), 403
+
+    settings = _get_trailer_settings()
+    relative_dir = settings.get('relative_dir', 'trailers')
+    asset_root = os.path.join(settings.get('media_root') or '', relative_dir, kind)
+    # Путь проверяется относительно каталога kind — выйти к самим трейлерам нельзя
+    asset_path = resolve_media_path(asset_root, asset)
+    if asset_path is None:
+        return jsonify({"error": "Недопустимый путь к файлу"}), 400
+
+    relative_path = f'{relative_dir}/{kind}/{asset}'
+    signer = _TRAILER_ASSET_SIGNERS.get(os.path.splitext(asset)[1].lower())
+    if signer is None:
+        # Сегменты и картинки из S3 — перенаправлением; плейлисты и дорожки WebVTT
+        # отдаём сами, чтобы относительные ссылки в них вели обратно сюда
+        remote_url = remote_media_url(relative_path, mime_type)
+        if remote_url:
+            response = redirect(remote_url, code=302)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+
+    file_stat = media_file_stat(asset_path)
+    if file_stat is None and ensure_local_media(relative_path):
+        file_stat = media_file_stat(asset_path)
+    if file_stat is None:
+        return jsonify({"error": "Файл не найден"}), 404
+
+    if token and signer is not None:
+        # Ссылки плейлиста на сегменты и дорожки на спрайт несут тот же токен, иначе плеер получит 403
+        try:
+            with open(asset_path, encoding='utf-8') as text_file:
+                content = signer(text_file.read(), token)
+        except OSError as exc:
+            current_app.logger.error('Не удалось прочитать %s: %s', asset_path, exc)
+            return jsonify({"error": "Файл не найден"}), 404
+        response = Response(content, mimetype=mime_type)
+        response.headers['Cache-Control'] = 'private, no-cache'
         return response
 
+    # Каталог назван по версии файла трейлера, поэтому содержимое по URL не меняется;
+    # ссылка с токеном выдана конкретному зрителю — только в его кэш
+    private = bool(token)
+    if kind == 'hls' and not asset.endswith('.m3u8'):
+        # Сегменты HLS — те же байты трейлера, они подчиняются лимитам потоков
+        return _send_limited_media(
+            asset_path, relative_path, mime_type, file_stat, immutable=True, private=private,
+            voter_key=stream_voter_key,
+        )
+    return send_media_file(asset_path, relative_path, mime_type, file_stat, immutable=True, private=private)
+
+
+@api_bp.route('/trailers/hls/<path:asset>', methods=['GET'])
+def get_trailer_hls_asset(asset):
+    """Плейлисты и сегменты HLS."""
+    return _send_trailer_asset('hls', asset)
+
+
+@api_bp.route('/trailers/thumbs/<path:asset>', methods=['GET'])
+def get_trailer_thumbnail_asset(asset):
+    """Кадр-постер, спрайт миниатюр и дорожка WebVTT трейлера."""
+    return _send_trailer_asset('thumbs', asset)
+
 
 @api_bp.route('/movies/<int:kinopoisk_id>/trailer-info', methods=['GET'])
 def get_trailer_info(kinopoisk_id):
@@ -2903,8 +3501,6 @@ def get_trailer_info(kinopoisk_id):
 @api_bp.route('/posters/<int:movie_id>', methods=['GET'])
 def get_poster(movie_id):
     """Отдача локального постера фильма"""
-    from flask import send_file
-    
     library_movie = LibraryMovie.query.get_or_404(movie_id)
     
     try:
@@ -2915,41 +3511,80 @@ def get_poster(movie_id):
     if not poster_path:
         return jsonify({"error": "Постер не найден"}), 404
 
+    # Постеры из хранилища SHA-256 отдаёт статика — старый URL только перенаправляет на неё
+    requested_width = request.args.get('w', type=int)
+    static_url = poster_static_url(poster_path)
+    if static_url:
+        width = pick_poster_width(requested_width)
+        if width:
+            static_url = poster_static_url(poster_variant_path(poster_path, width, _negotiated_poster_format()))
+        response = redirect(static_url, code=302)
+        if requested_width:
+            response.vary.add('Accept')
+        return response
+
     settings = _get_poster_settings()
     media_root = settings.get('media_root') or ''
     
-    # Нормализуем путь для кроссплатформенности
-    normalized_path = poster_path.replace('\\', '/').replace('/', os.sep)
-    absolute_path = os.path.normpath(os.path.join(media_root, normalized_path))
-    
-    # Защита от path traversal: проверяем, что путь не выходит за пределы media_root
-    normalized_media_root = os.path.normpath(media_root)
-    if not absolute_path.startswith(normalized_media_root + os.sep) and absolute_path != normalized_media_root:
-        current_app.logger.warning('Path traversal attempt detected for poster: %s', absolute_path)
+    # Защита от path traversal: путь не должен выходить за пределы media_root
+    absolute_path = resolve_media_path(media_root, poster_path)
+    if absolute_path is None:
+        current_app.logger.warning('Path traversal attempt detected for poster: %s', poster_path)
         return jsonify({"error": "Недопустимый путь к файлу"}), 400
     
-    if not os.path.exists(absolute_path):
+    file_stat = media_file_stat(absolute_path)
+    if file_stat is None and ensure_local_media(poster_path):
+        file_stat = media_file_stat(absolute_path)
+    if file_stat is None:
         current_app.logger.error('Файл постера не найден: %s', absolute_path)
         return jsonify({"error": "Файл постера не найден"}), 404
 
-    # Определяем MIME-тип по расширению
-    ext = os.path.splitext(absolute_path)[1].lower()
-    mime_types = {
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.png': 'image/png',
-        '.webp': 'image/webp',
-    }
-    mime_type = mime_types.get(ext, 'image/jpeg')
+    # ?w=<ширина> — уменьшенная копия для карточек (WebP, если браузер его принимает)
+    if requested_width:
+        response = _send_poster_variant(poster_path, media_root, requested_width)
+        if response is None:
+            # Копию сделать не удалось — отдаём оригинал, но ненадолго, чтобы позже получить копию
+            response = send_media_file(
+                absolute_path, poster_path, _poster_mime_type(absolute_path), file_stat, max_age=300,
+            )
+        response.vary.add('Accept')
+        return response
 
-    response = send_file(
-        absolute_path,
-        mimetype=mime_type,
-        as_attachment=False,
-    )
     # Кешируем постеры на долгий срок
-    response.headers['Cache-Control'] = 'public, max-age=31536000'
-    return response
+    return send_media_file(absolute_path, poster_path, _poster_mime_type(absolute_path), file_stat, max_age=31536000)
+
+
+_POSTER_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+}
+
+
+def _poster_mime_type(path):
+    return _POSTER_MIME_TYPES.get(os.path.splitext(path)[1].lower(), 'image/jpeg')
+
+
+def _negotiated_poster_format():
+    """WebP, если браузер явно принимает его, иначе JPEG."""
+    accepts_webp = any(mimetype == 'image/webp' and quality > 0 for mimetype, quality in request.accept_mimetypes)
+    return POSTER_VARIANT_FORMATS[0] if accepts_webp else POSTER_VARIANT_FORMATS[-1]
+
+
+def _send_poster_variant(poster_path, media_root, requested_width):
+    """Отдать копию постера нужной ширины; None, если копии нет и создать её не удалось."""
+    width = pick_poster_width(requested_width)
+    if width is None:
+        return None
+    # Постеры, скачанные раньше, уменьшаются при первом запросе
+    variant_path = ensure_poster_variant(poster_path, width, _negotiated_poster_format())
+    variant_absolute = resolve_media_path(media_root, variant_path) if variant_path else None
+    variant_stat = media_file_stat(variant_absolute) if variant_absolute else None
+    if variant_stat is None:
+        return None
+
+    return send_media_file(variant_absolute, variant_path, _poster_mime_type(variant_absolute), variant_stat, max_age=31536000)
 
 
 # --- Маршруты для управления бейджами ---
@@ -3165,10 +3800,30 @@ def list_voter_stats():
             'created_at': PollVoterProfile.created_at,
             'updated_at': PollVoterProfile.updated_at,
         }
+        if filters['requires_vote_filters']:
+            # С фильтрами по опросу или датам сортируем по тем же отфильтрованным
+            # значениям, что показываются в строках
+            vote_totals = _filtered_vote_totals_subquery(filters)
+            stats_sort_map = {
+                'votes_count': vote_totals.c.votes_count,
+                'votes_points': vote_totals.c.votes_points,
+                'filtered_points': vote_totals.c.votes_points,
+                'last_vote_at': vote_totals.c.last_vote_at,
+            }
+        else:
+            # Без фильтров — по агрегатам poll_voter_stats
+            stats_sort_map = {
+                'votes_count': func.coalesce(PollVoterStats.votes_count, 0),
+                'votes_points': func.coalesce(PollVoterStats.votes_points, 0),
+                'filtered_points': func.coalesce(PollVoterStats.votes_points, 0),
+                'last_vote_at': PollVoterStats.last_vote_at,
+            }
         sort_by = request.args.get('sort_by', 'updated_at')
-        sort_column = sort_map.get(sort_by, PollVoterProfile.updated_at)
+        sort_column = stats_sort_map.get(sort_by) if sort_by in stats_sort_map else sort_map.get(sort_by, PollVoterProfile.updated_at)
         sort_order = request.args.get('sort_order', 'desc').lower()
         order_clause = sort_column.asc() if sort_order == 'asc' else sort_column.desc()
+        if sort_by == 'last_vote_at':
+            order_clause = order_clause.nullslast()
 
         query = PollVoterProfile.query
 
@@ -3182,39 +3837,48 @@ def list_voter_stats():
             query = query.filter(PollVoterProfile.user_id.ilike(f"%{filters['user_id']}%"))
 
         if filters['requires_vote_filters']:
-            query = query.join(PollVoterProfile.votes)
-            query = _apply_vote_filters(query, filters)
-            query = query.distinct()
+            # В список попадают токены с голосами, подходящими под фильтры
+            query = query.join(vote_totals, vote_totals.c.voter_token == PollVoterProfile.token)
+            query = query.add_columns(
+                vote_totals.c.votes_count, vote_totals.c.votes_points, vote_totals.c.last_vote_at,
+            )
+        elif sort_by in stats_sort_map:
+            query = query.outerjoin(PollVoterStats, PollVoterStats.voter_token == PollVoterProfile.token)
 
-        query = query.order_by(order_clause)
+        query = query.order_by(order_clause, PollVoterProfile.token)
 
         pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-        profiles = pagination.items
-        tokens = [profile.token for profile in profiles if profile.token]
-        votes_map = _group_votes_by_token(tokens, filters)
+
+        if filters['requires_vote_filters']:
+            profiles = []
+            stats_map = {}
+            for profile, votes_count, votes_points, last_vote_at in pagination.items:
+                profiles.append(profile)
+                stats_map[profile.token] = {
+                    'votes_count': int(votes_count or 0),
+                    'votes_points': int(votes_points or 0),
+                    'last_vote_at': last_vote_at,
+                }
+        else:
+            profiles = pagination.items
+            tokens = [profile.token for profile in profiles if profile.token]
+            stats_map = {
+                stats.voter_token: {
+                    'votes_count': stats.votes_count or 0,
+                    'votes_points': stats.votes_points or 0,
+                    'last_vote_at': stats.last_vote_at,
+                }
+                for stats in (
+                    PollVoterStats.query.filter(PollVoterStats.voter_token.in_(tokens)).all()
+                    if tokens else []
+                )
+            }
 
         items = []
         for profile in profiles:
-            votes = votes_map.get(profile.token, [])
-            filtered_points = sum((vote.get('points_awarded') or 0) for vote in votes)
-            last_vote_at = votes[0]['voted_at'] if votes else None
-            earned_total = profile.points_accrued_total or 0
-            streak_info = get_voter_streak_info(profile)
-            items.append({
-                'voter_token': profile.token,
-                'user_id': profile.user_id,
-                'device_label': profile.device_label,
-                'total_points': profile.total_points or 0,
-                'points_accrued_total': earned_total,
-                'points_earned_total': earned_total,
-                'filtered_points': filtered_points,
-                'created_at': profile.created_at.isoformat() if profile.created_at else None,
-                'updated_at': profile.updated_at.isoformat() if profile.updated_at else None,
-                'last_vote_at': last_vote_at,
-                'votes_count': len(votes),
-                'votes': votes,
-                'streak': streak_info,
-            })
+            item = _serialize_voter_stats_item(profile, stats_map.get(profile.token))
+            item['streak'] = get_voter_streak_info(profile)
+            items.append(item)
 
         payload = {
             'page': pagination.page,
@@ -3241,33 +3905,103 @@ def list_voter_stats():
 
 
 
+@api_bp.route('/polls/leaderboard', methods=['GET'])
+def poll_leaderboard():
+    """Лидерборд по баллам или сериям голосований с местом текущего пользователя."""
+    metric = request.args.get('metric', 'total_points')
+    if metric not in LEADERBOARD_METRICS:
+        return jsonify({
+            'error': 'Неизвестная метрика',
+            'allowed_metrics': list(LEADERBOARD_METRICS),
+        }), 400
+
+    try:
+        limit = int(request.args.get('limit', 10))
+    except (TypeError, ValueError):
+        limit = 10
+    limit = max(1, min(100, limit))
+
+    try:
+        offset = int(request.args.get('offset', 0))
+    except (TypeError, ValueError):
+        offset = 0
+    offset = max(0, offset)
+
+    try:
+        identity = _resolve_voter_identity()
+        payload = get_leaderboard(
+            metric,
+            limit=limit,
+            offset=offset,
+            voter_token=identity.get('voter_token'),
+        )
+    except (OperationalError, ProgrammingError) as exc:
+        db.session.rollback()
+        current_app.logger.warning('Не удалось построить лидерборд: %s', exc)
+        return jsonify({'error': 'Сервис временно недоступен'}), 503
+
+    payload['limit'] = limit
+    payload['offset'] = offset
+    return prevent_caching(jsonify(payload))
+
+
 @api_bp.route('/polls/voter-stats/<string:voter_token>', methods=['GET'])
 def voter_stats_details(voter_token):
     filters = _prepare_voter_filters(request.args)
     profile = PollVoterProfile.query.get_or_404(voter_token)
-    votes_map = _group_votes_by_token([profile.token], filters)
-    votes = votes_map.get(profile.token, [])
-    filtered_points = sum((vote.get('points_awarded') or 0) for vote in votes)
 
-    earned_total = profile.points_accrued_total or 0
-    payload = {
-        'voter_token': profile.token,
-        'user_id': profile.user_id,
-        'device_label': profile.device_label,
-        'total_points': profile.total_points or 0,
-        'points_accrued_total': earned_total,
-        'points_earned_total': earned_total,
-        'filtered_points': filtered_points,
-        'created_at': profile.created_at.isoformat() if profile.created_at else None,
-        'updated_at': profile.updated_at.isoformat() if profile.updated_at else None,
-        'last_vote_at': votes[0]['voted_at'] if votes else None,
-        'votes_count': len(votes),
-        'votes': votes,
-    }
+    if filters['requires_vote_filters']:
+        stats = _aggregate_votes_by_token([profile.token], filters).get(profile.token)
+    else:
+        stats_row = PollVoterStats.query.get(profile.token)
+        stats = {
+            'votes_count': stats_row.votes_count or 0,
+            'votes_points': stats_row.votes_points or 0,
+            'last_vote_at': stats_row.last_vote_at,
+        } if stats_row else None
+
+    payload = _serialize_voter_stats_item(profile, stats)
+    payload['streak'] = get_voter_streak_info(profile)
 
     return prevent_caching(jsonify(payload))
 
 
+@api_bp.route('/polls/voter-stats/<string:voter_token>/votes', methods=['GET'])
+def voter_stats_votes(voter_token):
+    """Постраничный список голосов токена (загружается по требованию)."""
+    filters = _prepare_voter_filters(request.args)
+    profile = PollVoterProfile.query.get_or_404(voter_token)
+
+    page = max(1, request.args.get('page', 1, type=int) or 1)
+    per_page = request.args.get('per_page', 25, type=int) or 25
+    per_page = min(max(per_page, 1), 100)
+
+    vote_query = (
+        db.session.query(Vote, Poll, PollMovie)
+        .join(Poll, Vote.poll_id == Poll.id)
+        .join(PollMovie, Vote.movie_id == PollMovie.id)
+        .filter(Vote.voter_token == profile.token)
+    )
+    vote_query = _apply_vote_filters(vote_query, filters)
+    rows = (
+        vote_query.order_by(Vote.voted_at.desc(), Vote.id.desc())
+        .offset((page - 1) * per_page)
+        .limit(per_page + 1)
+        .all()
+    )
+
+    has_more = len(rows) > per_page
+    votes = [_serialize_voter_vote(vote, poll, poll_movie) for vote, poll, poll_movie in rows[:per_page]]
+
+    return prevent_caching(jsonify({
+        'voter_token': profile.token,
+        'votes': votes,
+        'page': page,
+        'per_page': per_page,
+        'has_more': has_more,
+    }))
+
+
 @api_bp.route('/polls/voter-stats/<string:voter_token>/device-label', methods=['PATCH'])
 def update_voter_device_label(voter_token):
     data = _get_json_payload()
@@ -3315,8 +4049,20 @@ def update_voter_total_points(voter_token):
         return jsonify({'error': 'total_points должен быть целым числом'}), 400
 
     profile = PollVoterProfile.query.get_or_404(voter_token)
+    balance_before = profile.total_points or 0
     profile.total_points = new_points
     profile.updated_at = vladivostok_now()
+    track_leaderboard_profile(profile)
+    if new_points != balance_before:
+        # Ручная правка тоже попадает в журнал, иначе сверка сочтёт её расхождением
+        log_points_transaction(
+            voter_token=profile.token,
+            transaction_type=PointsTransaction.TYPE_ADMIN,
+            amount=new_points - balance_before,
+            balance_before=balance_before,
+            balance_after=new_points,
+            description='Ручное изменение баланса',
+        )
     db.session.commit()
 
     earned_total = profile.points_accrued_total or 0
@@ -3349,6 +4095,7 @@ def update_voter_user_id(voter_token):
     profile = PollVoterProfile.query.get_or_404(voter_token)
     profile.user_id = normalized_user_id
     profile.updated_at = vladivostok_now()
+    track_leaderboard_profile(profile)
     db.session.commit()
 
     earned_total = profile.points_accrued_total or 0
@@ -3379,6 +4126,7 @@ def update_voter_points_accrued_total(voter_token):
     profile = PollVoterProfile.query.get_or_404(voter_token)
     profile.points_accrued_total = new_value
     profile.updated_at = vladivostok_now()
+    track_leaderboard_profile(profile)
     db.session.commit()
 
     earned_total = profile.points_accrued_total or 0
@@ -3588,7 +4336,7 @@ def _serialize_schedule(schedule):
     poster_url = None
     if movie:
         if movie.poster_file_path:
-            poster_url = f"/api/posters/{movie.id}"
+            poster_url = local_poster_url(movie.id, movie.poster_file_path)
         else:
             poster_url = movie.poster
     
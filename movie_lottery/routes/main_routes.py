@@ -1,16 +1,32 @@
 import os
+import posixpath
 
-from flask import Blueprint, render_template, current_app, request, send_file, Response, send_from_directory
+from flask import Blueprint, render_template, current_app, request, send_file, Response, send_from_directory, redirect
 from sqlalchemy.exc import OperationalError, ProgrammingError
 
 from .. import db
-from ..models import Lottery, LibraryMovie, MovieIdentifier, Poll
+from ..models import Lottery, LibraryMovie, MediaBlob, MovieIdentifier, Poll
 from ..utils.helpers import (
     get_background_photos,
     build_external_url,
     build_telegram_share_url,
     get_custom_vote_cost,
 )
+from ..utils.media_delivery import media_file_stat, resolve_media_path, send_media_file
+from ..utils.media_jobs import (
+    POSTER_STATIC_URL_PATH,
+    POSTER_VARIANT_FORMATS,
+    ensure_poster_variant,
+    library_poster_atlas_styles,
+    local_poster_url,
+    poster_atlas_dir,
+    poster_srcset,
+    poster_static_url,
+    poster_variant_widths,
+    poster_webp_srcset,
+)
+from ..utils.media_storage import ensure_local_media, remote_media_url
+from ..utils.media_store import KIND_POSTER, kind_subdir
 
 main_bp = Blueprint('main', __name__)
 
@@ -194,9 +210,13 @@ def library():
             movie.torrent_hash = None
             
             # Вычисляем URL постера (локальный или внешний)
+            movie.poster_srcset = None
+            movie.poster_webp_srcset = None
             try:
                 if movie.poster_file_path:
-                    movie.poster_url = f'/api/posters/{movie.id}'
+                    movie.poster_url = local_poster_url(movie.id, movie.poster_file_path)
+                    movie.poster_srcset = poster_srcset(movie.id, movie.poster_file_path)
+                    movie.poster_webp_srcset = poster_webp_srcset(movie.poster_file_path)
                 elif movie.poster:
                     # Исправляем URL с нерабочего домена
                     poster = movie.poster
@@ -214,6 +234,16 @@ def library():
             # Безопасно вычисляем свойства для шаблона
             # has_local_trailer уже обрабатывает исключения внутри, возвращая False при ошибке
 
+        # Атласы постеров: сетка грузит один спрайт на диапазон фильмов вместо картинки на карточку
+        try:
+            atlas_styles = library_poster_atlas_styles(library_movies)
+        except (OperationalError, ProgrammingError) as exc:
+            current_app.logger.warning("Не удалось поставить сборку атласа постеров: %s", exc)
+            db.session.rollback()
+            atlas_styles = {}
+        for movie in library_movies:
+            movie.poster_atlas_style = atlas_styles.get(movie.id)
+
         trailer_config = {
             'max_size': current_app.config.get('TRAILER_MAX_FILE_SIZE'),
             'allowed_mime_types': current_app.config.get('TRAILER_ALLOWED_MIME_TYPES') or [],
@@ -312,6 +342,70 @@ def view_poll_results(poll_id):
 def admin_poll_points():
     return render_template('admin_poll_points.html')
 
+@main_bp.route(f'{POSTER_STATIC_URL_PATH}/variants/<version>/<filename>')
+def poster_static_variant(version, filename):
+    """
+    Копия постера, которой ещё нет на диске. Готовые файлы /media/posters/
+    отдаёт nginx или WSGI-middleware, сюда доходят только промахи.
+    """
+    width, _, fmt = filename.partition('.')
+    if fmt not in POSTER_VARIANT_FORMATS or not width.isdigit() or int(width) not in poster_variant_widths():
+        return {"error": "Копия постера не найдена"}, 404
+
+    blob = MediaBlob.query.filter_by(sha256=version, kind=KIND_POSTER).first()
+    if blob is None:
+        return {"error": "Копия постера не найдена"}, 404
+
+    variant_path = ensure_poster_variant(blob.relative_path, int(width), fmt)
+    if variant_path is None:
+        # Уменьшить не удалось (нет ffmpeg) — отдаём оригинал, он тоже лежит в статике
+        original_url = poster_static_url(blob.relative_path)
+        if original_url is None:
+            return {"error": "Копия постера не найдена"}, 404
+        return redirect(original_url, code=302)
+
+    absolute_path = resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', variant_path)
+    file_stat = media_file_stat(absolute_path)
+    if file_stat is None:
+        return {"error": "Копия постера не найдена"}, 404
+    mimetype = 'image/webp' if fmt == 'webp' else 'image/jpeg'
+    return send_media_file(absolute_path, variant_path, mimetype, file_stat, immutable=True)
+
+
+@main_bp.route(f'{POSTER_STATIC_URL_PATH}/sha256/<prefix>/<filename>')
+def poster_static_original(prefix, filename):
+    """
+    Постер из хранилища, которого нет на диске этого узла (драйвер s3):
+    перенаправляем на presigned URL бакета.
+    """
+    relative_path = posixpath.join(kind_subdir(KIND_POSTER), 'sha256', prefix, filename)
+    if resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', relative_path) is None:
+        return {"error": "Постер не найден"}, 404
+    remote_url = remote_media_url(relative_path)
+    if remote_url is None:
+        return {"error": "Постер не найден"}, 404
+    response = redirect(remote_url, code=302)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@main_bp.route(f'{POSTER_STATIC_URL_PATH}/atlas/<filename>')
+def poster_static_atlas(filename):
+    """Атлас постеров или его карта, когда /media/posters/ не отдаёт статика."""
+    stem, _, ext = filename.rpartition('.')
+    if ext not in ('webp', 'json') or not stem or '/' in filename:
+        return {"error": "Атлас не найден"}, 404
+    relative_path = posixpath.join(poster_atlas_dir(), filename)
+    absolute_path = resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', relative_path)
+    file_stat = media_file_stat(absolute_path)
+    if file_stat is None and ensure_local_media(relative_path):
+        file_stat = media_file_stat(absolute_path)
+    if file_stat is None:
+        return {"error": "Атлас не найден"}, 404
+    mimetype = 'image/webp' if ext == 'webp' else 'application/json'
+    return send_media_file(absolute_path, relative_path, mimetype, file_stat, immutable=True)
+
+
 @main_bp.route('/admin/init-db', methods=['POST'])
 def init_db():
     """
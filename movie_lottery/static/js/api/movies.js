@@ -194,27 +194,112 @@ export async function fetchMagnetSearchStatus(kinopoiskId) {
     return await response.json();
 }
 
+const TRAILER_CHUNK_SIZE = 8 * 1024 * 1024;
+const TRAILER_UPLOAD_RETRIES = 5;
+
+function encodeUploadMetadata(values) {
+    return Object.entries(values)
+        .filter(([, value]) => value)
+        .map(([key, value]) => `${key} ${btoa(unescape(encodeURIComponent(String(value))))}`)
+        .join(',');
+}
+
+async function sha256Base64(blob) {
+    if (!window.crypto?.subtle) return null;
+    const digest = await window.crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+    return btoa(String.fromCharCode(...new Uint8Array(digest)));
+}
+
+function trailerUploadKey(movieId, file) {
+    return `trailerUpload:${movieId}:${file.name}:${file.size}:${file.lastModified}`;
+}
+
+async function fetchUploadOffset(uploadUrl) {
+    const response = await fetch(uploadUrl, { method: 'HEAD', headers: { 'Tus-Resumable': '1.0.0' } });
+    if (!response.ok) return null;
+    return Number(response.headers.get('Upload-Offset'));
+}
+
+async function createTrailerUpload(movieId, file) {
+    const response = await fetch(`/api/movies/${movieId}/trailer-uploads`, {
+        method: 'POST',
+        headers: {
+            'Tus-Resumable': '1.0.0',
+            'Upload-Length': String(file.size),
+            'Upload-Metadata': encodeUploadMetadata({ filename: file.name, filetype: file.type }),
+        },
+    });
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        throw new Error(data.message || 'Не удалось начать загрузку трейлера.');
+    }
+    return response.headers.get('Location') || data.upload_url;
+}
+
 /**
- * Загружает локальный трейлер для фильма из библиотеки.
+ * Загружает локальный трейлер для фильма из библиотеки кусками (протокол tus).
+ * После обрыва связи загрузка продолжается с последнего принятого байта,
+ * в том числе после перезагрузки страницы.
  * @param {number|string} movieId - ID фильма в библиотеке.
  * @param {File} file - Файл трейлера.
+ * @param {(fraction: number) => void} [onProgress] - Доля загруженного (0..1).
  * @returns {Promise<object>} - Обновлённые данные фильма.
  */
-export async function uploadLocalTrailer(movieId, file) {
-    const formData = new FormData();
-    formData.append('trailer', file);
+export async function uploadLocalTrailer(movieId, file, onProgress) {
+    const storageKey = trailerUploadKey(movieId, file);
+    let uploadUrl = localStorage.getItem(storageKey);
+    let offset = uploadUrl ? await fetchUploadOffset(uploadUrl).catch(() => null) : null;
+    if (offset === null || Number.isNaN(offset)) {
+        uploadUrl = await createTrailerUpload(movieId, file);
+        localStorage.setItem(storageKey, uploadUrl);
+        offset = 0;
+    }
 
-    const response = await fetch(`/api/movies/${movieId}/trailer-local`, {
-        method: 'POST',
-        body: formData,
-    });
+    let failures = 0;
+    while (true) {
+        const chunk = file.slice(offset, offset + TRAILER_CHUNK_SIZE);
+        const headers = {
+            'Tus-Resumable': '1.0.0',
+            'Upload-Offset': String(offset),
+            'Content-Type': 'application/offset+octet-stream',
+        };
+        const checksum = await sha256Base64(chunk);
+        if (checksum) headers['Upload-Checksum'] = `sha256 ${checksum}`;
 
-    const data = await response.json().catch(() => ({}));
-    if (!response.ok) {
-        throw new Error(data.message || data.error || 'Не удалось загрузить трейлер.');
-    }
+        let response;
+        try {
+            response = await fetch(uploadUrl, { method: 'PATCH', headers, body: chunk });
+        } catch (error) {
+            response = null;
+        }
 
-    return data;
+        if (!response || response.status >= 500 || response.status === 409 || response.status === 460) {
+            // Обрыв или рассинхронизация: узнаём, сколько сервер принял, и продолжаем
+            failures += 1;
+            if (failures > TRAILER_UPLOAD_RETRIES) {
+                throw new Error('Не удалось загрузить трейлер: нет связи с сервером.');
+            }
+            await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** (failures - 1)));
+            const serverOffset = await fetchUploadOffset(uploadUrl).catch(() => null);
+            if (serverOffset !== null && !Number.isNaN(serverOffset)) offset = serverOffset;
+            continue;
+        }
+
+        if (!response.ok) {
+            localStorage.removeItem(storageKey);
+            const data = await response.json().catch(() => ({}));
+            throw new Error(data.message || data.error || 'Не удалось загрузить трейлер.');
+        }
+
+        failures = 0;
+        offset = Number(response.headers.get('Upload-Offset'));
+        if (onProgress) onProgress(file.size ? offset / file.size : 1);
+
+        if (offset >= file.size) {
+            localStorage.removeItem(storageKey);
+            return await response.json();
+        }
+    }
 }
 
 /**
@@ -223,6 +308,19 @@ export async function uploadLocalTrailer(movieId, file) {
  * @param {number|null} trailerViewCost - Новая цена (null для сброса к значению по умолчанию).
  * @returns {Promise<object>} - Результат операции.
  */
+export async function fetchLibraryTrailerPreview(movieId, adminSecret) {
+    const response = await fetch(`/api/library/${movieId}/trailer-preview`, {
+        headers: { Authorization: `Bearer ${adminSecret}` },
+    });
+    const data = await response.json().catch(() => ({}));
+    if (!response.ok) {
+        const error = new Error(data.message || data.error || 'Не удалось получить ссылку на трейлер.');
+        error.status = response.status;
+        throw error;
+    }
+    return data;
+}
+
 export async function updateLibraryMovieTrailerViewCost(movieId, trailerViewCost) {
     const response = await fetch(`/api/library/${movieId}/trailer-view-cost`, {
         method: 'PUT',
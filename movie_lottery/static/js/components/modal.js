@@ -274,7 +274,6 @@ function createWinnerCardHTML(movieData, isLibrary) {
                   </div>
                   <div class="trailer-preview-container" style="display: none;">
                     <video class="trailer-preview-video" controls preload="metadata">
-                        <source src="/api/trailers/${escapeHtml(String(movieData.id))}/stream?t=${Date.now()}" type="video/mp4">
                         Ваш браузер не поддерживает воспроизведение видео.
                     </video>
                     <button class="trailer-preview-close-btn" type="button">✕ Закрыть</button>
@@ -747,7 +746,22 @@ export class ModalManager {
         const trailerPreviewCloseBtn = this.body.querySelector('.trailer-preview-close-btn');
 
         if (trailerPreviewBtn && trailerPreviewContainer && trailerPreviewVideo) {
-            trailerPreviewBtn.addEventListener('click', () => {
+            trailerPreviewBtn.addEventListener('click', async () => {
+                // Подписанную ссылку выдаёт сервер только администратору — запрашиваем при первом просмотре
+                if (!trailerPreviewVideo.getAttribute('src')) {
+                    if (!actions.onPreviewTrailer) return;
+                    trailerPreviewBtn.disabled = true;
+                    try {
+                        const preview = await actions.onPreviewTrailer(trailerPreviewBtn.dataset.movieId);
+                        if (!preview?.trailer_url) return;
+                        if (preview.trailer_previews?.poster_frame) {
+                            trailerPreviewVideo.poster = preview.trailer_previews.poster_frame;
+                        }
+                        trailerPreviewVideo.src = preview.trailer_url;
+                    } finally {
+                        trailerPreviewBtn.disabled = false;
+                    }
+                }
                 trailerPreviewContainer.style.display = 'block';
                 trailerPreviewBtn.style.display = 'none';
                 trailerPreviewVideo.play().catch(() => {
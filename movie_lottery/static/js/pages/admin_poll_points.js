@@ -29,6 +29,9 @@ const modalState = {
     dateFilter: null,
 };
 
+// Размер страницы голосов токена в раскрывающемся списке
+const VOTES_PER_PAGE = 25;
+
 // Кастомные бейджи
 let customBadges = [];
 
@@ -108,12 +111,8 @@ function formatDateTime(isoString, withTime = true) {
     return formatVladivostokDateTime(isoString, withTime) || '—';
 }
 
-function buildVotesMarkup(votes = []) {
-    if (!votes.length) {
-        return '<p class="admin-hint">Нет голосов под выбранные фильтры.</p>';
-    }
-
-    const rows = votes.map((vote) => `
+function buildVoteRows(votes = []) {
+    return votes.map((vote) => `
         <tr>
             <td><code>${escapeHtml(vote.poll_id)}</code></td>
             <td>${escapeHtml(vote.movie_name || '—')}</td>
@@ -121,10 +120,24 @@ function buildVotesMarkup(votes = []) {
             <td>${vote.points_awarded > 0 ? '+' : ''}${vote.points_awarded}</td>
         </tr>
     `).join('');
+}
+
+function buildLoadMoreVotesMarkup(nextPage) {
+    return `
+        <button type="button" class="load-more-votes-btn load-transactions-btn" data-next-page="${nextPage}">
+            Загрузить ещё
+        </button>
+    `;
+}
+
+function buildVotesMarkup(votes = [], hasMore = false, page = 1) {
+    if (!votes.length) {
+        return '<p class="admin-hint">Нет голосов под выбранные фильтры.</p>';
+    }
 
     return `
         <details class="votes-list">
-            <summary>Голоса (${votes.length})</summary>
+            <summary>Голоса (<span class="votes-count">${votes.length}</span>)</summary>
             <table class="votes-table">
                 <thead>
                     <tr>
@@ -135,16 +148,16 @@ function buildVotesMarkup(votes = []) {
                     </tr>
                 </thead>
                 <tbody>
-                    ${rows}
+                    ${buildVoteRows(votes)}
                 </tbody>
             </table>
+            ${hasMore ? buildLoadMoreVotesMarkup(page + 1) : ''}
         </details>
     `;
 }
 
-function buildTransactionsMarkup(voterToken, votes = []) {
+function buildTransactionsMarkup(voterToken, voteCount = 0) {
     // Показываем кнопку открытия модального окна
-    const voteCount = votes.length;
     const hasVotes = voteCount > 0;
     
     return `
@@ -152,7 +165,13 @@ function buildTransactionsMarkup(voterToken, votes = []) {
             <button type="button" class="open-transactions-modal-btn cta-button secondary" data-voter-token="${escapeHtml(voterToken)}">
                 📋 История
             </button>
-            ${hasVotes ? `<p class="admin-hint">Голосов: ${voteCount}</p>` : ''}
+            ${hasVotes ? `
+                <div class="votes-list-container" data-voter-token="${escapeHtml(voterToken)}">
+                    <button type="button" class="load-votes-btn load-transactions-btn" data-voter-token="${escapeHtml(voterToken)}">
+                        Голосов: ${voteCount}
+                    </button>
+                </div>
+            ` : ''}
         </div>
     `;
 }
@@ -546,12 +565,12 @@ function closeMovieDetailsModal() {
 }
 
 function buildRow(item) {
-    const votes = item.votes || [];
+    const votesCount = Number(item.votes_count) || 0;
     const filteredPoints = item.filtered_points || 0;
-    const votesBadge = votes.length
-        ? `<span class="badge"><strong>${votes.length}</strong> голосов · ${filteredPoints >= 0 ? '+' : ''}${filteredPoints} pts</span>`
+    const votesBadge = votesCount
+        ? `<span class="badge"><strong>${votesCount}</strong> голосов · ${filteredPoints >= 0 ? '+' : ''}${filteredPoints} pts</span>`
         : '<span class="badge">—</span>';
-    const lastVote = votes.length ? votes[0].voted_at : null;
+    const lastVote = item.last_vote_at || null;
     const deviceLabel = item.device_label || '';
     const userId = item.user_id || '';
 
@@ -631,7 +650,7 @@ function buildRow(item) {
                 <div class="admin-hint">Создан: ${formatDateTime(item.created_at, false)}</div>
             </td>
             <td>
-                ${buildTransactionsMarkup(item.voter_token, votes)}
+                ${buildTransactionsMarkup(item.voter_token, votesCount)}
             </td>
         </tr>
     `;
@@ -1621,6 +1640,68 @@ function handleAccruedPointsKeydown(event) {
     }
 }
 
+/**
+ * Запрашивает страницу голосов токена с текущими фильтрами опроса и дат
+ */
+async function fetchVoterVotesPage(voterToken, page = 1) {
+    const params = new URLSearchParams({ page, per_page: VOTES_PER_PAGE });
+    if (state.pollId) params.set('poll_id', state.pollId);
+    if (state.dateFrom) params.set('date_from', state.dateFrom);
+    if (state.dateTo) params.set('date_to', state.dateTo);
+
+    const response = await fetch(
+        buildPollApiUrl(`/api/polls/voter-stats/${encodeURIComponent(voterToken)}/votes?${params.toString()}`),
+        { headers: buildHeaders(), credentials: 'include' }
+    );
+    if (!response.ok) {
+        throw new Error('Не удалось загрузить голоса');
+    }
+    return response.json();
+}
+
+/**
+ * Загружает первую страницу голосов токена по требованию
+ */
+async function loadVoterVotes(container, voterToken) {
+    container.innerHTML = '<div class="loader"></div>';
+    try {
+        const data = await fetchVoterVotesPage(voterToken, 1);
+        container.innerHTML = buildVotesMarkup(data.votes || [], Boolean(data.has_more), data.page || 1);
+        const details = container.querySelector('details');
+        if (details) details.open = true;
+    } catch (error) {
+        console.error(error);
+        container.innerHTML = `<p class="admin-hint">${escapeHtml(error.message || 'Не удалось загрузить голоса')}</p>`;
+    }
+}
+
+/**
+ * Догружает следующую страницу голосов и дописывает строки в уже открытую таблицу
+ */
+async function loadMoreVoterVotes(container, voterToken, button) {
+    const page = Number(button.dataset.nextPage) || 2;
+    button.disabled = true;
+    try {
+        const data = await fetchVoterVotesPage(voterToken, page);
+        const votes = data.votes || [];
+        container.querySelector('.votes-table tbody')?.insertAdjacentHTML('beforeend', buildVoteRows(votes));
+        const counter = container.querySelector('.votes-count');
+        if (counter) {
+            counter.textContent = container.querySelectorAll('.votes-table tbody tr').length;
+        }
+        if (data.has_more && votes.length) {
+            button.dataset.nextPage = page + 1;
+            button.disabled = false;
+        } else {
+            button.remove();
+        }
+    } catch (error) {
+        console.error(error);
+        button.disabled = false;
+        setMessage(error.message || 'Не удалось загрузить голоса', 'error');
+    }
+}
+
 function handleTransactionsClick(event) {
     // Открытие модального окна транзакций
     const btn = event.target.closest('.open-transactions-modal-btn');
@@ -1631,6 +1712,27 @@ function handleTransactionsClick(event) {
         }
         return;
     }
+
+    // Следующая страница голосов в уже раскрытом списке
+    const moreVotesBtn = event.target.closest('.load-more-votes-btn');
+    if (moreVotesBtn) {
+        const container = moreVotesBtn.closest('.votes-list-container');
+        const voterToken = container?.dataset.voterToken;
+        if (container && voterToken) {
+            loadMoreVoterVotes(container, voterToken, moreVotesBtn);
+        }
+        return;
+    }
+
+    // Список голосов под строкой токена
+    const votesBtn = event.target.closest('.load-votes-btn');
+    if (votesBtn) {
+        const container = votesBtn.closest('.votes-list-container');
+        const voterToken = votesBtn.dataset.voterToken;
+        if (container && voterToken) {
+            loadVoterVotes(container, voterToken);
+        }
+    }
 }
 
 function handleMovieLinkClick(event) {
@@ -8,6 +8,7 @@ import { formatDate as formatVladivostokDate, formatDateTimeShort as formatVladi
 import PushNotificationManager from '../utils/pushNotifications.js';
 
 const POLL_THEME_STORAGE_KEY = 'lastPollTheme';
+const LIBRARY_ADMIN_SECRET_KEY = 'libraryAdminSecret';
 
 const escapeHtml = (unsafeValue) => {
     const value = unsafeValue == null ? '' : String(unsafeValue);
@@ -2418,6 +2419,25 @@ document.addEventListener('DOMContentLoaded', async () => {
                     throw error;
                 }
             },
+            onPreviewTrailer: async (movieId) => {
+                // Ссылка на трейлер не привязана к зрителю, поэтому её выдают только по админскому секрету
+                let secret = sessionStorage.getItem(LIBRARY_ADMIN_SECRET_KEY);
+                if (!secret) {
+                    secret = window.prompt('Введите админский секрет для предпросмотра трейлера');
+                    if (!secret) return null;
+                }
+                try {
+                    const preview = await movieApi.fetchLibraryTrailerPreview(movieId, secret);
+                    sessionStorage.setItem(LIBRARY_ADMIN_SECRET_KEY, secret);
+                    return preview;
+                } catch (error) {
+                    if (error.status === 401 || error.status === 403) {
+                        sessionStorage.removeItem(LIBRARY_ADMIN_SECRET_KEY);
+                    }
+                    notify(error.message || 'Не удалось открыть трейлер.', 'error');
+                    return null;
+                }
+            },
             onSaveTrailerViewCost: async (movieId, trailerViewCost) => {
                 try {
                     const result = await movieApi.updateLibraryMovieTrailerViewCost(movieId, trailerViewCost);
@@ -158,6 +158,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     let isTrailerModalOpen = false;
     let lastTrailerSource = null;
     let lastTrailerMimeType = null;
+    let trailerFallbackSource = null; // MP4, если адаптивный поток HLS не воспроизвёлся
     let lastTrailerMovieName = null;
     let currentStreak = null;
     const PLACEHOLDER_POSTER = 'https://via.placeholder.com/200x300.png?text=No+Image';
@@ -592,6 +593,13 @@ document.addEventListener('DOMContentLoaded', async () => {
         });
 
         trailerPlayer.on('error', () => {
+            if (trailerFallbackSource) {
+                const fallback = trailerFallbackSource;
+                console.warn('HLS не воспроизводится, переключаемся на MP4');
+                trailerPlayer.error(null);
+                loadAndPlayTrailer(fallback.src, fallback.type);
+                return;
+            }
             console.error('Video.js ошибка воспроизведения');
             showTrailerError('Не удалось загрузить трейлер');
         });
@@ -692,7 +700,7 @@ document.addEventListener('DOMContentLoaded', async () => {
             const response = await fetch(buildPollApiUrl(`/api/polls/${pollId}/watch-trailer`), {
                 method: 'POST',
                 headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({ movie_id: movie.id }),
+                body: JSON.stringify({ movie_id: movie.id, connection: getConnectionInfo() }),
                 credentials: 'include'
             });
 
@@ -708,8 +716,16 @@ document.addEventListener('DOMContentLoaded', async () => {
                 showToast(`−${result.cost_deducted} баллов за просмотр трейлера`, 'info');
             }
 
-            // Загружаем и воспроизводим трейлер
-            loadAndPlayTrailer(result.trailer_url, result.trailer_mime_type);
+            // Загружаем и воспроизводим трейлер: адаптивный HLS, если он уже упакован
+            if (result.hls_url) {
+                loadAndPlayTrailer(result.hls_url, 'application/x-mpegURL', {
+                    src: result.trailer_url,
+                    type: result.trailer_mime_type || 'video/mp4'
+                });
+            } else {
+                loadAndPlayTrailer(result.trailer_url, result.trailer_mime_type);
+            }
+            applyTrailerPreviews(result.poster_frame_url, result.thumbnails_url);
 
         } catch (error) {
             console.error('Ошибка при загрузке трейлера:', error);
@@ -717,6 +733,17 @@ document.addEventListener('DOMContentLoaded', async () => {
         }
     }
 
+    // Сведения о соединении (Network Information API): на медленной сети сервер отдаст облегчённый MP4
+    function getConnectionInfo() {
+        const connection = navigator.connection;
+        if (!connection) return null;
+        return {
+            save_data: Boolean(connection.saveData),
+            effective_type: connection.effectiveType || null,
+            downlink: connection.downlink ?? null
+        };
+    }
+
     // Открывает модальное окно плеера сразу с индикатором загрузки
     function openTrailerModalLoading(movieName) {
         if (!trailerPlayerModal) return;
@@ -752,7 +779,7 @@ document.addEventListener('DOMContentLoaded', async () => {
     }
 
     // Загружает и воспроизводит трейлер (после получения URL от сервера)
-    function loadAndPlayTrailer(trailerUrl, mimeType) {
+    function loadAndPlayTrailer(trailerUrl, mimeType, fallbackSource = null) {
         if (!trailerPlayer) {
             // Инициализируем плеер если ещё не инициализирован
             initVideoJsPlayer();
@@ -764,6 +791,7 @@ document.addEventListener('DOMContentLoaded', async () => {
 
         lastTrailerSource = trailerUrl;
         lastTrailerMimeType = mimeType || 'video/mp4';
+        trailerFallbackSource = fallbackSource;
 
         // Устанавливаем источник через Video.js API
         trailerPlayer.src({
@@ -792,6 +820,31 @@ document.addEventListener('DOMContentLoaded', async () => {
         });
     }
 
+    function applyTrailerPreviews(posterUrl, thumbnailsUrl) {
+        if (!trailerPlayer) return;
+
+        // Кадр-постер виден, пока буферизуется видео
+        trailerPlayer.poster(posterUrl || '');
+
+        // Дорожка прошлого трейлера: плеер один на все фильмы опроса
+        const textTracks = trailerPlayer.remoteTextTracks();
+        for (let i = textTracks.length - 1; i >= 0; i -= 1) {
+            const track = textTracks[i];
+            if (track.kind === 'metadata' && track.label === 'thumbnails') {
+                trailerPlayer.removeRemoteTextTrack(track);
+            }
+        }
+
+        // Дорожка миниатюр для перемотки (WebVTT со ссылками на спрайт)
+        if (thumbnailsUrl) {
+            trailerPlayer.addRemoteTextTrack({
+                kind: 'metadata',
+                label: 'thumbnails',
+                src: thumbnailsUrl
+            }, false);
+        }
+    }
+
     function openTrailerModal(movieName, trailerUrl, mimeType) {
         if (!trailerPlayerModal) return;
 
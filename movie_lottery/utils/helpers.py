@@ -1,12 +1,12 @@
 import random
 import secrets
 import string
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 from urllib.parse import urljoin, quote_plus
 
 from flask import current_app, url_for
-from sqlalchemy import inspect, text
-from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy import case, func, inspect, or_, text
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
 
 from .. import db
 
@@ -24,14 +24,27 @@ from ..models import (
     CustomBadge,
     LibraryMovie,
     Lottery,
+    MediaBlob,
+    MediaJob,
+    MediaScanEntry,
+    MediaScanState,
+    MediaUsage,
     Poll,
     PollCreatorToken,
     PollSettings,
     PollMovie,
     PollVoterProfile,
+    PollVoterStats,
+    PollVoteRollup,
+    PollVoterRollup,
+    PointsBalanceSnapshot,
+    PointsMonthlyRollup,
     PointsTransaction,
+    TrailerUpload,
     Vote,
+    VoteMonthlyRollup,
 )
+from .leaderboard import forget_leaderboard_voter, invalidate_leaderboard, track_leaderboard_profile
 
 
 class _FallbackVoterProfile:
@@ -224,6 +237,23 @@ def ensure_poll_voter_user_id_column():
         return False
 
 
+_TRAILER_METADATA_COLUMNS = {
+    'trailer_duration': ('DOUBLE PRECISION', 'FLOAT'),
+    'trailer_codecs': ('VARCHAR(255)', 'VARCHAR(255)'),
+    'trailer_width': ('INTEGER', 'INTEGER'),
+    'trailer_height': ('INTEGER', 'INTEGER'),
+    'trailer_faststart': ('BOOLEAN', 'BOOLEAN'),
+    'trailer_hls_path': ('VARCHAR(500)', 'VARCHAR(500)'),
+    'trailer_poster_frame_path': ('VARCHAR(500)', 'VARCHAR(500)'),
+    'trailer_sprite_path': ('VARCHAR(500)', 'VARCHAR(500)'),
+    'trailer_thumbnails_path': ('VARCHAR(500)', 'VARCHAR(500)'),
+}
+# Размер локального постера для учёта места (как trailer_file_size у трейлера)
+_POSTER_SIZE_COLUMNS = {
+    'poster_file_size': ('INTEGER', 'INTEGER'),
+}
+
+
 def ensure_library_movie_columns():
     """Ensure optional columns for the library exist (bumped_at, points)."""
     engine = db.engine
@@ -252,6 +282,9 @@ def ensure_library_movie_columns():
         missing_columns.append('ban_cost')
     if 'ban_cost_per_month' not in existing_columns:
         missing_columns.append('ban_cost_per_month')
+    for column_name in {**_TRAILER_METADATA_COLUMNS, **_POSTER_SIZE_COLUMNS}:
+        if column_name not in existing_columns:
+            missing_columns.append(column_name)
 
     if not missing_columns:
         return False
@@ -323,6 +356,17 @@ def ensure_library_movie_columns():
                 else:
                     connection.execute(text("ALTER TABLE library_movie ADD COLUMN ban_cost_per_month INTEGER"))
 
+            # Метаданные трейлера из moov и размер постера: простые nullable-колонки
+            for column_name, (pg_type, sqlite_type) in {**_TRAILER_METADATA_COLUMNS, **_POSTER_SIZE_COLUMNS}.items():
+                if column_name not in missing_columns:
+                    continue
+                if dialect == 'postgresql':
+                    connection.execute(text(
+                        f"ALTER TABLE library_movie ADD COLUMN IF NOT EXISTS {column_name} {pg_type}"
+                    ))
+                else:
+                    connection.execute(text(f"ALTER TABLE library_movie ADD COLUMN {column_name} {sqlite_type}"))
+
         logger = getattr(current_app, 'logger', None)
         message = (
             'Автоматически добавлены отсутствующие колонки в library_movie: '
@@ -959,9 +1003,15 @@ def rotate_voter_token(profile, update_votes=False):
     if getattr(profile, '_is_fallback', False):
         return new_token
 
+    forget_leaderboard_voter(old_token)
+    track_leaderboard_profile(profile)
+    # Новый токен начинает журнал баллов с текущего баланса
+    open_points_snapshot(new_token, profile.total_points or 0)
+
     if update_votes:
         try:
             Vote.query.filter_by(voter_token=old_token).update({'voter_token': new_token})
+            PollVoterStats.query.filter_by(voter_token=old_token).update({'voter_token': new_token})
             db.session.flush()
         except (ProgrammingError, OperationalError) as exc:
             fallback = _handle_missing_voter_table(
@@ -988,6 +1038,9 @@ def change_voter_points_balance(voter_token, delta, device_label=None, commit=Fa
     if getattr(profile, '_is_fallback', False):
         return profile.total_points or 0
 
+    if delta:
+        track_leaderboard_profile(profile)
+
     if commit:
         db.session.commit()
     else:
@@ -1142,6 +1195,7 @@ def update_voter_streak(profile):
             profile.max_voting_streak = new_streak
         
         profile.updated_at = now
+        track_leaderboard_profile(profile)
     except (AttributeError, TypeError):
         # Колонки streak ещё не существуют в БД
         pass
@@ -1296,6 +1350,255 @@ def ensure_voter_streak_columns():
         return False
 
 
+# --- Voter Stats Aggregates ---
+
+def ensure_voter_profile_updated_at_index():
+    """Создаёт индекс poll_voter_profile.updated_at для синхронизации лидерборда."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    if 'poll_voter_profile' not in inspector.get_table_names():
+        return False
+
+    profile_indexes = {index['name'] for index in inspector.get_indexes('poll_voter_profile')}
+    if 'ix_poll_voter_profile_updated_at' in profile_indexes:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_poll_voter_profile_updated_at "
+                "ON poll_voter_profile (updated_at)"
+            ))
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создан индекс ix_poll_voter_profile_updated_at.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать индекс ix_poll_voter_profile_updated_at.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_voter_stats_table():
+    """Создаёт таблицу poll_voter_stats и заполняет её по истории голосов."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'vote' not in table_names:
+        return False
+
+    vote_indexes = {index['name'] for index in inspector.get_indexes('vote')}
+    needs_table = 'poll_voter_stats' not in table_names
+    needs_index = 'ix_vote_voter_token_voted_at' not in vote_indexes
+
+    if not (needs_table or needs_index):
+        return False
+
+    try:
+        with engine.begin() as connection:
+            if needs_index:
+                connection.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_vote_voter_token_voted_at "
+                    "ON vote (voter_token, voted_at)"
+                ))
+
+            if needs_table:
+                PollVoterStats.__table__.create(bind=connection, checkfirst=True)
+                connection.execute(text(
+                    "INSERT INTO poll_voter_stats "
+                    "(voter_token, votes_count, votes_points, last_vote_at, updated_at) "
+                    "SELECT voter_token, COUNT(*), COALESCE(SUM(points_awarded), 0), "
+                    "MAX(voted_at), CURRENT_TIMESTAMP "
+                    "FROM vote GROUP BY voter_token"
+                ))
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана и заполнена таблица poll_voter_stats.'
+        if not needs_table:
+            message = 'Автоматически создан индекс ix_vote_voter_token_voted_at.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу poll_voter_stats.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def record_vote_in_voter_stats(voter_token, points_awarded, voted_at=None):
+    """
+    Учитывает новый голос в агрегатах poll_voter_stats.
+
+    Вызывается в той же транзакции, что и создание Vote, поэтому агрегат
+    откатывается вместе с голосом. Обновление выполняется одним UPDATE
+    с инкрементом на стороне БД, чтобы параллельные голоса не терялись.
+    """
+    if not voter_token:
+        return False
+
+    voted_at = voted_at or vladivostok_now()
+    points = int(points_awarded or 0)
+
+    try:
+        updated = PollVoterStats.query.filter_by(voter_token=voter_token).update(
+            {
+                PollVoterStats.votes_count: PollVoterStats.votes_count + 1,
+                PollVoterStats.votes_points: PollVoterStats.votes_points + points,
+                PollVoterStats.last_vote_at: db.case(
+                    (PollVoterStats.last_vote_at.is_(None), voted_at),
+                    (PollVoterStats.last_vote_at < voted_at, voted_at),
+                    else_=PollVoterStats.last_vote_at,
+                ),
+                PollVoterStats.updated_at: vladivostok_now(),
+            },
+            synchronize_session=False,
+        )
+        if not updated:
+            try:
+                with db.session.begin_nested():
+                    db.session.add(PollVoterStats(
+                        voter_token=voter_token,
+                        votes_count=1,
+                        votes_points=points,
+                        last_vote_at=voted_at,
+                    ))
+            except IntegrityError:
+                # Строку параллельно создал другой запрос — просто инкрементируем её
+                return record_vote_in_voter_stats(voter_token, points, voted_at)
+        return True
+    except (ProgrammingError, OperationalError) as exc:
+        logger = getattr(current_app, 'logger', None)
+        if logger:
+            logger.warning('Не удалось обновить статистику голосующего %s: %s', voter_token, exc)
+        return False
+
+
+def _discount_poll_from_vote_rollups(poll_id):
+    """
+    Вычесть свёрнутые голоса опроса из ``vote_monthly_rollup``; вернуть их
+    вклад по токенам ``{token: [голоса, баллы]}``.
+    """
+    contributions = {}
+    compacted = PollVoterRollup.query.filter_by(poll_id=poll_id).all()
+    for poll_rollup in compacted:
+        totals = contributions.setdefault(poll_rollup.voter_token, [0, 0])
+        totals[0] += poll_rollup.votes_count or 0
+        totals[1] += poll_rollup.votes_points or 0
+
+        rollup = db.session.get(VoteMonthlyRollup, (poll_rollup.month, poll_rollup.voter_token))
+        if rollup is None:
+            continue
+        rollup.votes_count = (rollup.votes_count or 0) - (poll_rollup.votes_count or 0)
+        rollup.votes_points = (rollup.votes_points or 0) - (poll_rollup.votes_points or 0)
+        if rollup.votes_count <= 0:
+            db.session.delete(rollup)
+            continue
+        other_count, other_last_vote_at = (
+            db.session.query(
+                func.coalesce(func.sum(PollVoterRollup.votes_count), 0),
+                func.max(PollVoterRollup.last_vote_at),
+            )
+            .filter(
+                PollVoterRollup.month == poll_rollup.month,
+                PollVoterRollup.voter_token == poll_rollup.voter_token,
+                PollVoterRollup.poll_id != poll_id,
+            )
+            .one()
+        )
+        # Голоса, свёрнутые до появления poll_voter_rollup, не разложены по опросам —
+        # для такого месяца прежняя дата последнего голоса остаётся
+        if rollup.votes_count <= int(other_count or 0):
+            rollup.last_vote_at = other_last_vote_at
+
+    for poll_rollup in compacted:
+        db.session.delete(poll_rollup)
+    db.session.flush()
+    return contributions
+
+
+def discount_poll_from_voter_stats(poll_id):
+    """
+    Вычитает голоса опроса из агрегатов перед его удалением.
+
+    Голоса удаляются каскадно вместе с опросом, поэтому сначала одним
+    GROUP BY собираем вклад опроса по токенам — построчные голоса и уже
+    свёрнутые (``poll_voter_rollup``, они же вычитаются из месячных
+    агрегатов), — а last_vote_at пересчитываем только для затронутых
+    токенов по оставшимся голосам и агрегатам.
+    """
+    try:
+        contributions = _discount_poll_from_vote_rollups(poll_id)
+        rows = (
+            db.session.query(
+                Vote.voter_token,
+                db.func.count(Vote.id),
+                db.func.coalesce(db.func.sum(Vote.points_awarded), 0),
+            )
+            .filter(Vote.poll_id == poll_id)
+            .group_by(Vote.voter_token)
+            .all()
+        )
+        for voter_token, votes_count, votes_points in rows:
+            totals = contributions.setdefault(voter_token, [0, 0])
+            totals[0] += int(votes_count or 0)
+            totals[1] += int(votes_points or 0)
+        if not contributions:
+            return 0
+
+        for voter_token, (votes_count, votes_points) in contributions.items():
+            last_raw_vote_at = (
+                db.session.query(db.func.max(Vote.voted_at))
+                .filter(Vote.voter_token == voter_token, Vote.poll_id != poll_id)
+                .scalar()
+            )
+            last_rollup_vote_at = (
+                db.session.query(db.func.max(VoteMonthlyRollup.last_vote_at))
+                .filter(VoteMonthlyRollup.voter_token == voter_token)
+                .scalar()
+            )
+            candidates = [value for value in (last_raw_vote_at, last_rollup_vote_at) if value is not None]
+            PollVoterStats.query.filter_by(voter_token=voter_token).update(
+                {
+                    PollVoterStats.votes_count: PollVoterStats.votes_count - votes_count,
+                    PollVoterStats.votes_points: PollVoterStats.votes_points - votes_points,
+                    PollVoterStats.last_vote_at: max(candidates) if candidates else None,
+                    PollVoterStats.updated_at: vladivostok_now(),
+                },
+                synchronize_session=False,
+            )
+        return len(contributions)
+    except (ProgrammingError, OperationalError) as exc:
+        db.session.rollback()
+        logger = getattr(current_app, 'logger', None)
+        if logger:
+            logger.warning('Не удалось обновить статистику голосующих для опроса %s: %s', poll_id, exc)
+        return 0
+
+
 # --- Points Transaction Logging ---
 
 def ensure_points_transaction_table():
@@ -1408,7 +1711,11 @@ def log_points_transaction(
         commit: Делать ли commit после записи
 
     Returns:
-        PointsTransaction или None при ошибке
+        PointsTransaction
+
+    Журнал — источник истины для баланса, поэтому ошибка записи не
+    проглатывается: сессия откатывается вместе с изменением баланса,
+    а исключение пробрасывается вызывающему коду.
     """
     # Сначала убедимся, что таблица существует
     ensure_points_transaction_table()
@@ -1471,16 +1778,11 @@ def log_points_transaction(
             db.session.flush()
 
         return transaction
-    except (ProgrammingError, OperationalError) as exc:
-        db.session.rollback()
-        if logger:
-            logger.warning('Не удалось записать транзакцию баллов: %s', exc)
-        return None
     except Exception as exc:
         db.session.rollback()
         if logger:
-            logger.warning('Ошибка записи транзакции: %s', exc)
-        return None
+            logger.error('Не удалось записать транзакцию баллов, операция отменена: %s', exc)
+        raise
 
 
 def get_voter_transactions(voter_token, limit=50, offset=0, transaction_type=None):
@@ -1515,29 +1817,56 @@ def get_voter_transactions_summary(voter_token):
     """
     Получает сводку по транзакциям пользователя.
 
+    Учитывает и построчные записи журнала, и месячные агрегаты, в которые
+    свёрнута история старше срока хранения.
+
     Returns:
         dict с total_earned, total_spent, transaction_count
     """
     ensure_points_transaction_table()
 
     try:
-        transactions = PointsTransaction.query.filter_by(voter_token=voter_token).all()
-
-        total_earned = sum(t.amount for t in transactions if t.amount > 0)
-        total_spent = abs(sum(t.amount for t in transactions if t.amount < 0))
+        by_type = {}
+        total_earned = 0
+        total_spent = 0
+
+        raw_rows = (
+            db.session.query(
+                PointsTransaction.transaction_type,
+                func.count(PointsTransaction.id),
+                func.coalesce(func.sum(PointsTransaction.amount), 0),
+                func.coalesce(func.sum(case((PointsTransaction.amount > 0, PointsTransaction.amount), else_=0)), 0),
+                func.coalesce(func.sum(case((PointsTransaction.amount < 0, -PointsTransaction.amount), else_=0)), 0),
+            )
+            .filter(PointsTransaction.voter_token == voter_token)
+            .group_by(PointsTransaction.transaction_type)
+            .all()
+        )
+        rollup_rows = (
+            db.session.query(
+                PointsMonthlyRollup.transaction_type,
+                func.coalesce(func.sum(PointsMonthlyRollup.transactions_count), 0),
+                func.coalesce(func.sum(PointsMonthlyRollup.amount_total), 0),
+                func.coalesce(func.sum(PointsMonthlyRollup.credit_total), 0),
+                func.coalesce(func.sum(PointsMonthlyRollup.debit_total), 0),
+            )
+            .filter(PointsMonthlyRollup.voter_token == voter_token)
+            .group_by(PointsMonthlyRollup.transaction_type)
+            .all()
+        )
 
         # Группировка по типам
-        by_type = {}
-        for t in transactions:
-            if t.transaction_type not in by_type:
-                by_type[t.transaction_type] = {'count': 0, 'total': 0}
-            by_type[t.transaction_type]['count'] += 1
-            by_type[t.transaction_type]['total'] += t.amount
+        for transaction_type, count, amount, earned, spent in list(raw_rows) + list(rollup_rows):
+            entry = by_type.setdefault(transaction_type, {'count': 0, 'total': 0})
+            entry['count'] += int(count or 0)
+            entry['total'] += int(amount or 0)
+            total_earned += int(earned or 0)
+            total_spent += int(spent or 0)
 
         return {
             'total_earned': total_earned,
             'total_spent': total_spent,
-            'transaction_count': len(transactions),
+            'transaction_count': sum(entry['count'] for entry in by_type.values()),
             'by_type': by_type,
         }
     except (ProgrammingError, OperationalError):
@@ -1549,3 +1878,882 @@ def get_voter_transactions_summary(voter_token):
             'by_type': {},
         }
 
+
+# --- Points Ledger Snapshots & Reconciliation ---
+
+def ensure_points_snapshot_table():
+    """Создаёт таблицу снимков баланса и фиксирует стартовые балансы профилей."""
+    ensure_points_transaction_table()
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'poll_voter_profile' not in table_names or 'points_transaction' not in table_names:
+        return False
+
+    transaction_indexes = {index['name'] for index in inspector.get_indexes('points_transaction')}
+    needs_index = 'ix_points_transaction_voter_token_id' not in transaction_indexes
+    needs_table = 'points_balance_snapshot' not in table_names
+
+    if not (needs_table or needs_index):
+        return False
+
+    try:
+        with engine.begin() as connection:
+            if needs_index:
+                connection.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_points_transaction_voter_token_id "
+                    "ON points_transaction (voter_token, id)"
+                ))
+
+            if needs_table:
+                PointsBalanceSnapshot.__table__.create(bind=connection, checkfirst=True)
+                # Текущие балансы принимаются за отправную точку сверки
+                connection.execute(text(
+                    "INSERT INTO points_balance_snapshot "
+                    "(voter_token, balance, last_transaction_id, drift, created_at) "
+                    "SELECT p.token, COALESCE(p.total_points, 0), "
+                    "COALESCE((SELECT MAX(t.id) FROM points_transaction t WHERE t.voter_token = p.token), 0), "
+                    "0, CURRENT_TIMESTAMP "
+                    "FROM poll_voter_profile p"
+                ))
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана таблица points_balance_snapshot.'
+        if not needs_table:
+            message = 'Автоматически создан индекс ix_points_transaction_voter_token_id.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу points_balance_snapshot.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def open_points_snapshot(voter_token, balance):
+    """Зафиксировать стартовый баланс токена, у которого ещё нет записей в журнале."""
+    if not voter_token:
+        return None
+
+    snapshot = PointsBalanceSnapshot(
+        voter_token=voter_token,
+        balance=int(balance or 0),
+        last_transaction_id=0,
+    )
+    db.session.add(snapshot)
+    return snapshot
+
+
+def _latest_points_snapshots_subquery(tokens):
+    return (
+        db.session.query(
+            PointsBalanceSnapshot.voter_token.label('voter_token'),
+            func.max(PointsBalanceSnapshot.id).label('snapshot_id'),
+        )
+        .filter(PointsBalanceSnapshot.voter_token.in_(tokens))
+        .group_by(PointsBalanceSnapshot.voter_token)
+        .subquery()
+    )
+
+
+def _reconcile_points_batch(tokens, high_water_mark, autofix, result):
+    latest = _latest_points_snapshots_subquery(tokens)
+
+    snapshots = {
+        snapshot.voter_token: snapshot
+        for snapshot in PointsBalanceSnapshot.query.join(
+            latest, PointsBalanceSnapshot.id == latest.c.snapshot_id
+        ).all()
+    }
+
+    # Сумма записей журнала после последнего снимка каждого токена (до high-water mark)
+    ledger_rows = (
+        db.session.query(
+            PointsTransaction.voter_token,
+            func.coalesce(func.sum(PointsTransaction.amount), 0),
+            func.max(PointsTransaction.id),
+        )
+        .outerjoin(latest, latest.c.voter_token == PointsTransaction.voter_token)
+        .outerjoin(PointsBalanceSnapshot, PointsBalanceSnapshot.id == latest.c.snapshot_id)
+        .filter(
+            PointsTransaction.voter_token.in_(tokens),
+            PointsTransaction.id <= high_water_mark,
+            PointsTransaction.id > func.coalesce(PointsBalanceSnapshot.last_transaction_id, 0),
+        )
+        .group_by(PointsTransaction.voter_token)
+        .all()
+    )
+
+    # Баланс профиля, приведённый к high-water mark: более свежие записи вычитаются
+    # в том же запросе, чтобы параллельные начисления не считались расхождением
+    newer_amount = (
+        db.session.query(func.coalesce(func.sum(PointsTransaction.amount), 0))
+        .filter(
+            PointsTransaction.voter_token == PollVoterProfile.token,
+            PointsTransaction.id > high_water_mark,
+        )
+        .correlate(PollVoterProfile)
+        .scalar_subquery()
+    )
+    profile_balances = dict(
+        db.session.query(
+            PollVoterProfile.token,
+            func.coalesce(PollVoterProfile.total_points, 0) - newer_amount,
+        )
+        .filter(PollVoterProfile.token.in_(tokens))
+        .all()
+    )
+
+    logger = getattr(current_app, 'logger', None)
+
+    for voter_token, delta, last_transaction_id in ledger_rows:
+        snapshot = snapshots.get(voter_token)
+        expected = (snapshot.balance if snapshot else 0) + int(delta or 0)
+        profile_balance = profile_balances.get(voter_token)
+        drift = 0 if profile_balance is None else int(profile_balance) - expected
+
+        if drift:
+            result['drifted'] += 1
+            if logger:
+                logger.warning(
+                    '[POINTS] Баланс %s расходится с журналом на %+d (журнал: %s)',
+                    voter_token[:8], drift, expected,
+                )
+            if autofix:
+                PollVoterProfile.query.filter_by(token=voter_token).update(
+                    {PollVoterProfile.total_points: PollVoterProfile.total_points - drift},
+                    synchronize_session=False,
+                )
+                result['fixed'] += 1
+
+        db.session.add(PointsBalanceSnapshot(
+            voter_token=voter_token,
+            balance=expected,
+            last_transaction_id=last_transaction_id,
+            drift=drift,
+        ))
+        result['checked'] += 1
+
+
+def reconcile_points_balances(batch_size=None, grace_seconds=None, autofix=None):
+    """
+    Сверить балансы голосующих с журналом баллов начиная с последних снимков.
+
+    Обрабатываются только записи журнала новее максимального
+    ``last_transaction_id`` среди снимков и не моложе ``grace_seconds``
+    (чтобы не гоняться за транзакциями, которые ещё коммитятся). Для каждого
+    затронутого токена ожидаемый баланс = баланс последнего снимка + сумма
+    новых записей; он сравнивается с PollVoterProfile.total_points, после чего
+    пишется новый снимок. Полная история журнала не перечитывается.
+
+    Returns:
+        dict с checked, drifted, fixed и high_water_mark
+    """
+    config = current_app.config
+    if batch_size is None:
+        batch_size = config.get('POINTS_RECONCILE_BATCH_SIZE', 500)
+    if grace_seconds is None:
+        grace_seconds = config.get('POINTS_RECONCILE_GRACE_SECONDS', 60)
+    if autofix is None:
+        autofix = config.get('POINTS_RECONCILE_AUTOFIX', True)
+    batch_size = max(1, int(batch_size))
+
+    result = {'checked': 0, 'drifted': 0, 'fixed': 0, 'high_water_mark': None}
+
+    try:
+        watermark = db.session.query(func.max(PointsBalanceSnapshot.last_transaction_id)).scalar() or 0
+        cutoff = vladivostok_now() - timedelta(seconds=max(0, int(grace_seconds)))
+        high_water_mark = (
+            db.session.query(func.max(PointsTransaction.id))
+            .filter(PointsTransaction.created_at <= cutoff)
+            .scalar()
+        )
+        if not high_water_mark or high_water_mark <= watermark:
+            return result
+
+        # Токены упорядочены по последней записи: если задача прервётся между
+        # пакетами, watermark не перескочит через необработанные токены
+        candidates = (
+            db.session.query(PointsTransaction.voter_token)
+            .filter(
+                PointsTransaction.id > watermark,
+                PointsTransaction.id <= high_water_mark,
+            )
+            .group_by(PointsTransaction.voter_token)
+            .order_by(func.max(PointsTransaction.id))
+            .all()
+        )
+        tokens = [row[0] for row in candidates]
+
+        for start in range(0, len(tokens), batch_size):
+            _reconcile_points_batch(tokens[start:start + batch_size], high_water_mark, autofix, result)
+            db.session.commit()
+
+        result['high_water_mark'] = high_water_mark
+    except (ProgrammingError, OperationalError) as exc:
+        db.session.rollback()
+        logger = getattr(current_app, 'logger', None)
+        if logger:
+            logger.warning('Не удалось сверить балансы с журналом баллов: %s', exc)
+        return result
+
+    if result['fixed']:
+        invalidate_leaderboard()
+
+    return result
+
+
+# --- History Retention & Monthly Rollups ---
+
+_ROLLUP_MODELS = (PointsMonthlyRollup, VoteMonthlyRollup, PollVoteRollup, PollVoterRollup)
+
+
+def ensure_history_rollup_tables():
+    """Создаёт таблицы месячных агрегатов для политики хранения истории."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'poll' not in table_names or 'poll_movie' not in table_names:
+        return False
+
+    missing = [model for model in _ROLLUP_MODELS if model.__tablename__ not in table_names]
+    if not missing:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            for model in missing:
+                model.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически созданы таблицы агрегатов: ' + ', '.join(m.__tablename__ for m in missing)
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицы месячных агрегатов.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_media_job_table():
+    """Создаёт таблицу очереди фоновых заданий обработки медиа."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'library_movie' not in table_names or 'media_job' in table_names:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            MediaJob.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана таблица media_job.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу media_job.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_media_blob_table():
+    """Создаёт таблицу медиафайлов, хранящихся по SHA-256 содержимого."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'library_movie' not in table_names or 'media_blob' in table_names:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            MediaBlob.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана таблица media_blob.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу media_blob.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_media_scan_tables():
+    """Создаёт таблицы инкрементальной проверки медиакаталога."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'library_movie' not in table_names:
+        return False
+    missing = [
+        model for model in (MediaScanState, MediaScanEntry)
+        if model.__tablename__ not in table_names
+    ]
+    if not missing:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            for model in missing:
+                model.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически созданы таблицы проверки медиафайлов: ' + ', '.join(
+            model.__tablename__ for model in missing
+        )
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицы проверки медиафайлов.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_media_usage_table():
+    """Создаёт таблицу итогов занятого места (строки заполняет первый пересчёт)."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'library_movie' not in table_names or MediaUsage.__tablename__ in table_names:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            MediaUsage.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана таблица media_usage'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу media_usage.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def ensure_trailer_upload_table():
+    """Создаёт таблицу возобновляемых загрузок трейлеров."""
+    engine = db.engine
+
+    try:
+        inspector = inspect(engine)
+    except Exception:
+        return False
+
+    table_names = inspector.get_table_names()
+    if 'library_movie' not in table_names or 'trailer_upload' in table_names:
+        return False
+
+    try:
+        with engine.begin() as connection:
+            TrailerUpload.__table__.create(bind=connection, checkfirst=True)
+
+        logger = getattr(current_app, 'logger', None)
+        message = 'Автоматически создана таблица trailer_upload.'
+        if logger:
+            logger.info(message)
+        else:
+            print(message)
+        return True
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        message = 'Не удалось автоматически создать таблицу trailer_upload.'
+        if logger:
+            logger.warning('%s Ошибка: %s', message, exc)
+        else:
+            print(f"{message} Ошибка: {exc}")
+        return False
+
+
+def _add_months(value, months):
+    month_index = value.year * 12 + value.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_history_retention_cutoff(retention_months=None, now=None):
+    """Первый день месяца, с которого история хранится построчно (или None)."""
+    if retention_months is None:
+        retention_months = current_app.config.get('HISTORY_RETENTION_MONTHS', 0)
+    try:
+        retention_months = int(retention_months or 0)
+    except (TypeError, ValueError):
+        return None
+    if retention_months <= 0:
+        return None
+
+    today = (now or vladivostok_now()).date()
+    cutoff = _add_months(today.replace(day=1), -retention_months)
+    return datetime.combine(cutoff, datetime.min.time())
+
+
+def _month_bucket(column):
+    if db.engine.dialect.name == 'postgresql':
+        return func.date_trunc('month', column)
+    return func.strftime('%Y-%m-01', column)
+
+
+def _as_month(value):
+    if isinstance(value, datetime):
+        return value.date().replace(day=1)
+    if isinstance(value, date):
+        return value.replace(day=1)
+    return date.fromisoformat(str(value)[:10]).replace(day=1)
+
+
+def _compact_votes(cutoff, result):
+    eligible_votes = (
+        db.session.query(Vote.id)
+        .join(Poll, Poll.id == Vote.poll_id)
+        .filter(
+            Vote.voted_at < cutoff,
+            or_(Poll.finalized.is_(True), Poll.expires_at < cutoff),
+        )
+    )
+    eligible_ids = eligible_votes.subquery()
+
+    month = _month_bucket(Vote.voted_at)
+    voter_rows = (
+        db.session.query(
+            month,
+            Vote.voter_token,
+            func.count(Vote.id),
+            func.coalesce(func.sum(Vote.points_awarded), 0),
+            func.max(Vote.voted_at),
+        )
+        .filter(Vote.id.in_(db.select(eligible_ids.c.id)))
+        .group_by(month, Vote.voter_token)
+        .all()
+    )
+    if not voter_rows:
+        return
+
+    for bucket, voter_token, votes_count, votes_points, last_vote_at in voter_rows:
+        key = (_as_month(bucket), voter_token)
+        rollup = db.session.get(VoteMonthlyRollup, key)
+        if rollup is None:
+            rollup = VoteMonthlyRollup(month=key[0], voter_token=voter_token, votes_count=0, votes_points=0)
+            db.session.add(rollup)
+        rollup.votes_count = (rollup.votes_count or 0) + int(votes_count or 0)
+        rollup.votes_points = (rollup.votes_points or 0) + int(votes_points or 0)
+        if last_vote_at and (rollup.last_vote_at is None or rollup.last_vote_at < last_vote_at):
+            rollup.last_vote_at = last_vote_at
+
+    poll_rows = (
+        db.session.query(
+            Vote.poll_id,
+            Vote.movie_id,
+            func.count(Vote.id),
+            func.coalesce(func.sum(Vote.points_awarded), 0),
+            func.max(Vote.voted_at),
+        )
+        .filter(Vote.id.in_(db.select(eligible_ids.c.id)))
+        .group_by(Vote.poll_id, Vote.movie_id)
+        .all()
+    )
+    for poll_id, movie_id, votes_count, votes_points, last_vote_at in poll_rows:
+        rollup = db.session.get(PollVoteRollup, (poll_id, movie_id))
+        if rollup is None:
+            rollup = PollVoteRollup(poll_id=poll_id, movie_id=movie_id, votes_count=0, votes_points=0)
+            db.session.add(rollup)
+        rollup.votes_count = (rollup.votes_count or 0) + int(votes_count or 0)
+        rollup.votes_points = (rollup.votes_points or 0) + int(votes_points or 0)
+        if last_vote_at and (rollup.last_vote_at is None or rollup.last_vote_at < last_vote_at):
+            rollup.last_vote_at = last_vote_at
+
+    # Вклад каждого опроса по токенам: discount_poll_from_voter_stats вычтет его при удалении опроса
+    poll_voter_rows = (
+        db.session.query(
+            Vote.poll_id,
+            month,
+            Vote.voter_token,
+            func.count(Vote.id),
+            func.coalesce(func.sum(Vote.points_awarded), 0),
+            func.max(Vote.voted_at),
+        )
+        .filter(Vote.id.in_(db.select(eligible_ids.c.id)))
+        .group_by(Vote.poll_id, month, Vote.voter_token)
+        .all()
+    )
+    for poll_id, bucket, voter_token, votes_count, votes_points, last_vote_at in poll_voter_rows:
+        key = (poll_id, _as_month(bucket), voter_token)
+        rollup = db.session.get(PollVoterRollup, key)
+        if rollup is None:
+            rollup = PollVoterRollup(
+                poll_id=poll_id, month=key[1], voter_token=voter_token, votes_count=0, votes_points=0,
+            )
+            db.session.add(rollup)
+        rollup.votes_count = (rollup.votes_count or 0) + int(votes_count or 0)
+        rollup.votes_points = (rollup.votes_points or 0) + int(votes_points or 0)
+        if last_vote_at and (rollup.last_vote_at is None or rollup.last_vote_at < last_vote_at):
+            rollup.last_vote_at = last_vote_at
+
+    db.session.flush()
+    result['votes'] = Vote.query.filter(
+        Vote.id.in_(db.select(eligible_ids.c.id))
+    ).delete(synchronize_session=False)
+
+
+def _compact_points_transactions(cutoff, result):
+    # Сворачиваются только записи, уже покрытые снимком сверки баланса:
+    # reconcile_points_balances читает журнал строго после last_transaction_id
+    reconciled_up_to = (
+        db.session.query(func.max(PointsBalanceSnapshot.last_transaction_id))
+        .filter(PointsBalanceSnapshot.voter_token == PointsTransaction.voter_token)
+        .correlate(PointsTransaction)
+        .scalar_subquery()
+    )
+    eligible = (
+        PointsTransaction.created_at < cutoff,
+        PointsTransaction.id <= func.coalesce(reconciled_up_to, 0),
+    )
+
+    month = _month_bucket(PointsTransaction.created_at)
+    rows = (
+        db.session.query(
+            month,
+            PointsTransaction.voter_token,
+            PointsTransaction.transaction_type,
+            func.count(PointsTransaction.id),
+            func.coalesce(func.sum(PointsTransaction.amount), 0),
+            func.coalesce(func.sum(case((PointsTransaction.amount > 0, PointsTransaction.amount), else_=0)), 0),
+            func.coalesce(func.sum(case((PointsTransaction.amount < 0, -PointsTransaction.amount), else_=0)), 0),
+        )
+        .filter(*eligible)
+        .group_by(month, PointsTransaction.voter_token, PointsTransaction.transaction_type)
+        .all()
+    )
+    if not rows:
+        return
+
+    for bucket, voter_token, transaction_type, count, amount_total, credit_total, debit_total in rows:
+        key = (_as_month(bucket), voter_token, transaction_type)
+        rollup = db.session.get(PointsMonthlyRollup, key)
+        if rollup is None:
+            rollup = PointsMonthlyRollup(
+                month=key[0],
+                voter_token=voter_token,
+                transaction_type=transaction_type,
+                transactions_count=0,
+                amount_total=0,
+                credit_total=0,
+                debit_total=0,
+            )
+            db.session.add(rollup)
+        rollup.transactions_count = (rollup.transactions_count or 0) + int(count or 0)
+        rollup.amount_total = (rollup.amount_total or 0) + int(amount_total or 0)
+        rollup.credit_total = (rollup.credit_total or 0) + int(credit_total or 0)
+        rollup.debit_total = (rollup.debit_total or 0) + int(debit_total or 0)
+
+    db.session.flush()
+    # Массовое удаление минует ORM-запрет на изменение журнала: это
+    # единственное разрешённое удаление, и оно идёт вместе с агрегатами
+    result['points_transactions'] = PointsTransaction.query.filter(*eligible).delete(
+        synchronize_session=False
+    )
+
+
+def compact_history(retention_months=None, now=None):
+    """
+    Свернуть Vote и PointsTransaction старше срока хранения в месячные агрегаты.
+
+    Каждая таблица сворачивается в своей транзакции: агрегаты и удаление
+    исходных строк фиксируются вместе. Голоса сворачиваются только для
+    финализированных (или давно истёкших) опросов, записи журнала — только
+    после того, как их покрыл снимок сверки баланса.
+
+    Returns:
+        dict с cutoff, votes, points_transactions и dropped_partitions
+    """
+    cutoff = get_history_retention_cutoff(retention_months, now=now)
+    result = {'cutoff': cutoff, 'votes': 0, 'points_transactions': 0, 'dropped_partitions': []}
+    if cutoff is None:
+        return result
+
+    logger = getattr(current_app, 'logger', None)
+
+    for compact in (_compact_votes, _compact_points_transactions):
+        try:
+            compact(cutoff, result)
+            db.session.commit()
+        except (ProgrammingError, OperationalError) as exc:
+            db.session.rollback()
+            if logger:
+                logger.warning('Не удалось свернуть историю (%s): %s', compact.__name__, exc)
+
+    if is_points_ledger_partitioned():
+        result['dropped_partitions'] = drop_empty_points_ledger_partitions(cutoff)
+
+    if logger and (result['votes'] or result['points_transactions']):
+        logger.info(
+            'Свёрнута история до %s: голосов %d, записей журнала %d',
+            cutoff.date().isoformat(), result['votes'], result['points_transactions'],
+        )
+    return result
+
+
+def vote_rollup_period_conditions(date_from=None, date_to=None):
+    """Условия на vote_monthly_rollup: месяцы, целиком лежащие в периоде."""
+    # Агрегат месячный, поэтому месяц, попадающий в период частично, не учитывается
+    conditions = []
+    if date_from:
+        first_month = _as_month(date_from)
+        if datetime.combine(first_month, datetime.min.time()) < date_from:
+            first_month = _add_months(first_month, 1)
+        conditions.append(VoteMonthlyRollup.month >= first_month)
+    if date_to:
+        next_month = _add_months(_as_month(date_to), 1)
+        if datetime.combine(next_month, datetime.min.time()) - date_to > timedelta(seconds=1):
+            next_month = _as_month(date_to)
+        conditions.append(VoteMonthlyRollup.month < next_month)
+    return conditions
+
+
+def get_vote_rollup_totals(tokens, date_from=None, date_to=None):
+    """Свёрнутые голоса токенов за месяцы, целиком попадающие в период."""
+    totals = {}
+    if not tokens:
+        return totals
+
+    query = db.session.query(
+        VoteMonthlyRollup.voter_token,
+        func.coalesce(func.sum(VoteMonthlyRollup.votes_count), 0),
+        func.coalesce(func.sum(VoteMonthlyRollup.votes_points), 0),
+        func.max(VoteMonthlyRollup.last_vote_at),
+    ).filter(
+        VoteMonthlyRollup.voter_token.in_(tokens),
+        *vote_rollup_period_conditions(date_from, date_to),
+    )
+
+    try:
+        rows = query.group_by(VoteMonthlyRollup.voter_token).all()
+    except (ProgrammingError, OperationalError):
+        db.session.rollback()
+        return totals
+
+    for voter_token, votes_count, votes_points, last_vote_at in rows:
+        totals[voter_token] = {
+            'votes_count': int(votes_count or 0),
+            'votes_points': int(votes_points or 0),
+            'last_vote_at': last_vote_at,
+        }
+    return totals
+
+
+# --- Points Ledger Partitioning (PostgreSQL) ---
+
+def _points_partition_name(month):
+    return f"points_transaction_p{month.year:04d}_{month.month:02d}"
+
+
+def is_points_ledger_partitioned():
+    """Проверяет, секционирована ли таблица points_transaction (только PostgreSQL)."""
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    try:
+        with db.engine.connect() as connection:
+            return connection.execute(text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid "
+                "WHERE c.relname = 'points_transaction'"
+            )).first() is not None
+    except Exception:
+        return False
+
+
+def ensure_points_ledger_partitions(months_ahead=1, now=None):
+    """Создаёт помесячные секции журнала на текущий и следующие месяцы."""
+    if not is_points_ledger_partitioned():
+        return []
+
+    start = (now or vladivostok_now()).date().replace(day=1)
+    created = []
+    with db.engine.begin() as connection:
+        for offset in range(0, months_ahead + 1):
+            month = _add_months(start, offset)
+            name = _points_partition_name(month)
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF points_transaction "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            ))
+            created.append(name)
+    return created
+
+
+def drop_empty_points_ledger_partitions(cutoff):
+    """Удаляет опустевшие после свёртки секции журнала старше cutoff."""
+    dropped = []
+    try:
+        with db.engine.begin() as connection:
+            names = [row[0] for row in connection.execute(text(
+                "SELECT c.relname FROM pg_inherits i "
+                "JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE p.relname = 'points_transaction'"
+            ))]
+            for name in names:
+                try:
+                    year, month = name.rsplit('_p', 1)[1].split('_')
+                    upper = _add_months(date(int(year), int(month), 1), 1)
+                except (IndexError, ValueError):
+                    continue  # секция по умолчанию и прочие
+                if datetime.combine(upper, datetime.min.time()) > cutoff:
+                    continue
+                if connection.execute(text(f"SELECT 1 FROM {name} LIMIT 1")).first() is None:
+                    connection.execute(text(f"DROP TABLE {name}"))
+                    dropped.append(name)
+    except Exception as exc:
+        logger = getattr(current_app, 'logger', None)
+        if logger:
+            logger.warning('Не удалось удалить старые секции журнала баллов: %s', exc)
+    return dropped
+
+
+def partition_points_ledger():
+    """
+    Перевести points_transaction в таблицу, секционированную по месяцам created_at.
+
+    Выполняется одной транзакцией: старая таблица переименовывается, строки
+    переносятся в новую секционированную таблицу, последовательность id
+    сохраняется. Первичный ключ становится (id, created_at) — этого требует
+    PostgreSQL; id по-прежнему выдаётся одной последовательностью.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        raise RuntimeError('Секционирование журнала поддерживается только в PostgreSQL')
+    if is_points_ledger_partitioned():
+        return False
+
+    with db.engine.begin() as connection:
+        bounds = connection.execute(text(
+            "SELECT MIN(created_at), MAX(created_at) FROM points_transaction"
+        )).first()
+        today = vladivostok_now().date().replace(day=1)
+        first_month = _as_month(bounds[0]) if bounds and bounds[0] else today
+        last_month = max(_as_month(bounds[1]) if bounds and bounds[1] else today, today)
+
+        connection.execute(text("ALTER TABLE points_transaction RENAME TO points_transaction_unpartitioned"))
+        connection.execute(text(
+            "ALTER SEQUENCE points_transaction_id_seq OWNED BY NONE"
+        ))
+        connection.execute(text("""
+            CREATE TABLE points_transaction (
+                id INTEGER NOT NULL DEFAULT nextval('points_transaction_id_seq'),
+                voter_token VARCHAR(64) NOT NULL,
+                transaction_type VARCHAR(30) NOT NULL,
+                amount INTEGER NOT NULL,
+                balance_before INTEGER NOT NULL,
+                balance_after INTEGER NOT NULL,
+                description VARCHAR(255),
+                movie_name VARCHAR(200),
+                poll_id VARCHAR(8),
+                created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (id, created_at)
+            ) PARTITION BY RANGE (created_at)
+        """))
+        connection.execute(text(
+            "ALTER SEQUENCE points_transaction_id_seq OWNED BY points_transaction.id"
+        ))
+        connection.execute(text(
+            "CREATE TABLE points_transaction_default PARTITION OF points_transaction DEFAULT"
+        ))
+
+        month = first_month
+        while month <= _add_months(last_month, 1):
+            connection.execute(text(
+                f"CREATE TABLE {_points_partition_name(month)} PARTITION OF points_transaction "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            ))
+            month = _add_months(month, 1)
+
+        connection.execute(text(
+            "INSERT INTO points_transaction "
+            "(id, voter_token, transaction_type, amount, balance_before, balance_after, "
+            "description, movie_name, poll_id, created_at) "
+            "SELECT id, voter_token, transaction_type, amount, balance_before, balance_after, "
+            "description, movie_name, poll_id, COALESCE(created_at, NOW()) "
+            "FROM points_transaction_unpartitioned"
+        ))
+        connection.execute(text("DROP TABLE points_transaction_unpartitioned"))
+
+        connection.execute(text(
+            "CREATE INDEX ix_points_transaction_voter_token ON points_transaction (voter_token)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX ix_points_transaction_created_at ON points_transaction (created_at)"
+        ))
+        connection.execute(text(
+            "CREATE INDEX ix_points_transaction_voter_token_id ON points_transaction (voter_token, id)"
+        ))
+
+    return True
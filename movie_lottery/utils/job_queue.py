@@ -0,0 +1,278 @@
+"""
+Персистентная очередь фоновых заданий (таблица ``media_job``).
+
+HTTP-запрос только ставит задание в очередь (``enqueue_job``) и сразу
+отвечает. Задания выполняет пул потоков worker-процесса
+(``flask media-worker``) или, при MEDIA_WORKER_MODE=inline, планировщик
+веб-приложения. Задание захватывается условным UPDATE по статусу, поэтому
+несколько worker-процессов не возьмут одно и то же задание дважды.
+
+Обработчики регистрируются декоратором ``register_job_handler`` и получают
+payload и функцию ``report_progress(percent)``; исключение в обработчике
+возвращает задание в очередь с экспоненциальной задержкой, пока не
+исчерпаны попытки.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from .. import db
+from ..models import MediaJob
+from .helpers import vladivostok_now
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+_JOB_HANDLERS = {}
+
+
+def register_job_handler(job_type):
+    """Декоратор: зарегистрировать обработчик заданий типа ``job_type``."""
+    def decorator(func):
+        _JOB_HANDLERS[job_type] = func
+        return func
+    return decorator
+
+
+def _config_int(name, default):
+    try:
+        return int(current_app.config.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_worker_concurrency(requested=None):
+    """Число параллельных заданий: не больше числа ядер CPU."""
+    cpu_count = os.cpu_count() or 1
+    value = requested if requested is not None else _config_int('MEDIA_WORKER_CONCURRENCY', 0)
+    if not value or value <= 0:
+        return cpu_count
+    return max(1, min(value, cpu_count))
+
+
+def default_worker_id(suffix=None):
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    if suffix:
+        worker_id = f'{worker_id}-{suffix}'
+    return worker_id[:64]
+
+
+def enqueue_job(job_type, payload=None, batch_id=None, max_attempts=None):
+    """Добавить задание в сессию; сохраняется вместе с commit вызывающего кода."""
+    if job_type not in _JOB_HANDLERS:
+        raise ValueError(f'Неизвестный тип задания: {job_type}')
+
+    job = MediaJob(
+        job_type=job_type,
+        payload=json.dumps(payload or {}),
+        status=JOB_QUEUED,
+        progress=0,
+        attempts=0,
+        max_attempts=max_attempts or _config_int('MEDIA_JOB_MAX_ATTEMPTS', 3),
+        batch_id=batch_id,
+        run_after=vladivostok_now(),
+    )
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+
+def requeue_stale_jobs(now=None):
+    """Вернуть в очередь задания, чей worker пропал (locked_at слишком давно)."""
+    now = now or vladivostok_now()
+    stale_before = now - timedelta(seconds=_config_int('MEDIA_JOB_STALE_SECONDS', 900))
+    result = db.session.execute(
+        update(MediaJob)
+        .where(MediaJob.status == JOB_RUNNING, MediaJob.locked_at < stale_before)
+        .values(status=JOB_QUEUED, worker_id=None, locked_at=None, run_after=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount or 0
+
+
+def claim_next_job(worker_id):
+    """Атомарно захватить следующее готовое задание или вернуть None."""
+    for _ in range(5):
+        now = vladivostok_now()
+        job_id = db.session.execute(
+            select(MediaJob.id)
+            .where(MediaJob.status == JOB_QUEUED, MediaJob.run_after <= now)
+            .order_by(MediaJob.run_after, MediaJob.id)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        claimed = db.session.execute(
+            update(MediaJob)
+            .where(MediaJob.id == job_id, MediaJob.status == JOB_QUEUED)
+            .values(
+                status=JOB_RUNNING,
+                worker_id=worker_id,
+                locked_at=now,
+                attempts=MediaJob.attempts + 1,
+                progress=0,
+                updated_at=now,
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(MediaJob, job_id, populate_existing=True)
+        # Задание перехватил другой worker — пробуем следующее
+    return None
+
+
+def _report_progress(job_id, percent):
+    percent = max(0, min(int(percent), 100))
+    now = vladivostok_now()
+    # Отчёт о прогрессе продлевает захват: длинное задание не считается брошенным
+    db.session.execute(
+        update(MediaJob)
+        .where(MediaJob.id == job_id, MediaJob.status == JOB_RUNNING)
+        .values(progress=percent, locked_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def run_job(job):
+    """Выполнить захваченное задание и записать результат или ошибку."""
+    job_id = job.id
+    handler = _JOB_HANDLERS.get(job.job_type)
+    try:
+        if handler is None:
+            raise RuntimeError(f'Нет обработчика для заданий типа {job.job_type}')
+        payload = json.loads(job.payload or '{}')
+        result = handler(payload, lambda percent: _report_progress(job_id, percent))
+    except Exception as exc:
+        db.session.rollback()
+        job = db.session.get(MediaJob, job_id, populate_existing=True)
+        now = vladivostok_now()
+        job.error = str(exc)[:2000]
+        job.worker_id = None
+        job.locked_at = None
+        if (job.attempts or 0) >= (job.max_attempts or 1):
+            job.status = JOB_FAILED
+            job.finished_at = now
+            logger.warning('Задание %s (%s) завершилось ошибкой: %s', job_id, job.job_type, exc)
+        else:
+            delay = _config_int('MEDIA_JOB_RETRY_DELAY_SECONDS', 30) * 2 ** max((job.attempts or 1) - 1, 0)
+            job.status = JOB_QUEUED
+            job.run_after = now + timedelta(seconds=delay)
+            logger.info('Задание %s (%s) будет повторено через %d с: %s', job_id, job.job_type, delay, exc)
+        db.session.commit()
+        return False
+
+    job = db.session.get(MediaJob, job_id, populate_existing=True)
+    job.status = JOB_DONE
+    job.progress = 100
+    job.result = json.dumps(result) if result is not None else None
+    job.error = None
+    job.locked_at = None
+    job.finished_at = vladivostok_now()
+    db.session.commit()
+    return True
+
+
+def _drain_queue(app, worker_id, stop_event, max_jobs):
+    processed = 0
+    with app.app_context():
+        try:
+            while not stop_event.is_set() and (max_jobs is None or processed < max_jobs):
+                job = claim_next_job(worker_id)
+                if job is None:
+                    break
+                run_job(job)
+                processed += 1
+        except (ProgrammingError, OperationalError) as exc:
+            db.session.rollback()
+            logger.warning('Ошибка очереди заданий: %s', exc)
+        finally:
+            db.session.remove()
+    return processed
+
+
+def process_pending_jobs(worker_id=None, concurrency=None, max_jobs=None, stop_event=None):
+    """Выполнить готовые задания пулом из ``concurrency`` потоков; вернуть их число."""
+    app = current_app._get_current_object()
+    worker_id = worker_id or default_worker_id()
+    stop_event = stop_event or threading.Event()
+    concurrency = get_worker_concurrency(concurrency)
+
+    try:
+        requeue_stale_jobs()
+    except (ProgrammingError, OperationalError) as exc:
+        db.session.rollback()
+        logger.warning('Не удалось вернуть зависшие задания в очередь: %s', exc)
+        return 0
+
+    if concurrency == 1:
+        return _drain_queue(app, worker_id, stop_event, max_jobs)
+
+    # ffmpeg работает в дочернем процессе, поэтому потоки дают настоящий параллелизм
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='media-job') as pool:
+        futures = [
+            pool.submit(_drain_queue, app, f'{worker_id}-{index}'[:64], stop_event, max_jobs)
+            for index in range(concurrency)
+        ]
+        return sum(future.result() for future in futures)
+
+
+def run_worker(concurrency=None, poll_interval=None, stop_event=None):
+    """Главный цикл worker-процесса: выполнять задания, пока не попросят остановиться."""
+    stop_event = stop_event or threading.Event()
+    poll_interval = poll_interval or _config_int('MEDIA_WORKER_POLL_SECONDS', 5)
+    worker_id = default_worker_id()
+    logger.info('Worker %s запущен, параллельных заданий: %d', worker_id, get_worker_concurrency(concurrency))
+
+    while not stop_event.is_set():
+        processed = process_pending_jobs(worker_id, concurrency=concurrency, stop_event=stop_event)
+        if not processed:
+            stop_event.wait(poll_interval)
+
+
+def get_batch_status(batch_id):
+    """Сводка по пакету заданий: счётчики статусов и средний прогресс."""
+    jobs = MediaJob.query.filter_by(batch_id=batch_id).order_by(MediaJob.id).all()
+    counts = {status: 0 for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+    for job in jobs:
+        counts[job.status] = counts.get(job.status, 0) + 1
+    progress = round(sum(job.progress or 0 for job in jobs) / len(jobs)) if jobs else 0
+    return {
+        'batch_id': batch_id,
+        'total': len(jobs),
+        'counts': counts,
+        'progress': progress,
+        'finished': bool(jobs) and counts[JOB_QUEUED] == 0 and counts[JOB_RUNNING] == 0,
+        'jobs': [job.to_dict() for job in jobs],
+    }
+
+
+def retry_job(job):
+    """Вернуть упавшее задание в очередь с новым набором попыток."""
+    if job.status != JOB_FAILED:
+        return False
+    now = vladivostok_now()
+    job.status = JOB_QUEUED
+    job.attempts = 0
+    job.progress = 0
+    job.error = None
+    job.run_after = now
+    job.finished_at = None
+    job.updated_at = now
+    return True
@@ -0,0 +1,347 @@
+"""
+Кэшированный лидерборд голосующих (баллы и серии голосований).
+
+Для каждой метрики в памяти процесса хранится ``SortedList`` ключей
+``(-значение, токен)``: вставка и удаление ключа — O(log n), топ-N — срез,
+а место пользователя — бинарный поиск, без сортировки таблицы профилей.
+
+Индекс строится из БД при первом запросе, а дальше поддерживается
+инкрементально: ``track_leaderboard_profile`` из
+``change_voter_points_balance``/``update_voter_streak`` откладывает снимок
+профиля в ``session.info`` и он применяется только после успешного commit.
+
+Индекс живёт в памяти процесса, как и счётчики ``stream_limits``, поэтому
+изменения других worker'ов gunicorn (и CLI) он подтягивает сам: перед
+ответом читаются профили с ``updated_at`` новее последней синхронизации
+(индекс ``ix_poll_voter_profile_updated_at``) — обычно несколько строк.
+Окно синхронизации захватывает LEADERBOARD_SYNC_OVERLAP_SECONDS назад,
+чтобы не пропустить транзакции, закоммиченные позже, чем записан их
+``updated_at``. Удалённые профили и «остывшие» серии видны только после
+перестройки: её раз в LEADERBOARD_REFRESH_SECONDS выполняет задание
+планировщика (``refresh_leaderboard``), а в процессах без планировщика
+индекс, устаревший на два интервала, перестраивается в фоновом потоке —
+запросы тем временем читают прежний. Выборка идёт без блокировки индекса;
+изменения, закоммиченные за это время, применяются поверх нового индекса.
+"""
+import threading
+import time
+from datetime import timedelta
+
+from flask import current_app
+from sortedcontainers import SortedList
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from .. import db
+from ..models import PollVoterProfile
+
+# Метрики лидерборда: баланс, всего заработано, текущая и максимальная серия
+LEADERBOARD_METRICS = ('total_points', 'points_earned', 'current_streak', 'max_streak')
+
+_PENDING_KEY = 'leaderboard_pending'
+_DEFAULT_REFRESH_SECONDS = 300
+_DEFAULT_SYNC_OVERLAP_SECONDS = 60
+
+
+class _SortedBoard:
+    """Отсортированный по убыванию значения индекс одной метрики."""
+
+    def __init__(self, values=None):
+        self._values = dict(values or {})
+        self._keys = SortedList((-value, token) for token, value in self._values.items())
+
+    def __len__(self):
+        return len(self._keys)
+
+    def set(self, token, value):
+        old_value = self._values.get(token)
+        if old_value == value:
+            return
+        if old_value is not None:
+            self._keys.discard((-old_value, token))
+        self._values[token] = value
+        self._keys.add((-value, token))
+
+    def remove(self, token):
+        old_value = self._values.pop(token, None)
+        if old_value is not None:
+            self._keys.discard((-old_value, token))
+
+    def get(self, token):
+        return self._values.get(token)
+
+    def rank(self, token):
+        """Место с учётом равенства значений (1, 1, 3, ...)."""
+        value = self._values.get(token)
+        if value is None:
+            return None
+        return self._keys.bisect_left((-value,)) + 1
+
+    def top(self, limit, offset=0):
+        result = []
+        for neg_value, token in self._keys.islice(offset, offset + limit):
+            result.append((self._keys.bisect_left((neg_value,)) + 1, token, -neg_value))
+        return result
+
+
+class _LeaderboardState:
+    """Индексы всех метрик одного приложения."""
+
+    def __init__(self):
+        self.boards = {metric: _SortedBoard() for metric in LEADERBOARD_METRICS}
+        self.labels = {}
+        self.built_at = None
+        # Время БД (vladivostok_now), с которого читаются изменения других процессов
+        self.synced_at = None
+        self.lock = threading.RLock()
+        # Пока идёт перестройка — изменения после commit, которые нужно применить поверх неё
+        self.replay = None
+
+
+_state_lock = threading.Lock()
+
+
+def _get_state():
+    extensions = current_app.extensions
+    state = extensions.get('leaderboard')
+    if state is None:
+        with _state_lock:
+            state = extensions.setdefault('leaderboard', _LeaderboardState())
+    return state
+
+
+def _snapshot_metrics(profile, today=None):
+    """Снять значения метрик с профиля (ORM-объекта или строки выборки)."""
+    streak = getattr(profile, 'voting_streak', 0) or 0
+    last_vote_date = getattr(profile, 'last_vote_date', None)
+    if today is not None and (last_vote_date is None or (today - last_vote_date).days > 1):
+        # Та же логика, что и в get_voter_streak_info: пропуск дня обнуляет серию
+        streak = 0
+
+    return {
+        'total_points': getattr(profile, 'total_points', 0) or 0,
+        'points_earned': getattr(profile, 'points_accrued_total', 0) or 0,
+        'current_streak': streak,
+        'max_streak': getattr(profile, 'max_voting_streak', 0) or 0,
+    }
+
+
+def _refresh_interval():
+    try:
+        return int(current_app.config.get('LEADERBOARD_REFRESH_SECONDS', _DEFAULT_REFRESH_SECONDS))
+    except (RuntimeError, TypeError, ValueError):
+        return _DEFAULT_REFRESH_SECONDS
+
+
+def _sync_overlap():
+    try:
+        seconds = int(current_app.config.get('LEADERBOARD_SYNC_OVERLAP_SECONDS', _DEFAULT_SYNC_OVERLAP_SECONDS))
+    except (RuntimeError, TypeError, ValueError):
+        seconds = _DEFAULT_SYNC_OVERLAP_SECONDS
+    return timedelta(seconds=max(seconds, 0))
+
+
+def _profile_rows(since=None):
+    query = db.session.query(
+        PollVoterProfile.token,
+        PollVoterProfile.user_id,
+        PollVoterProfile.total_points,
+        PollVoterProfile.points_accrued_total,
+        PollVoterProfile.voting_streak,
+        PollVoterProfile.last_vote_date,
+        PollVoterProfile.max_voting_streak,
+    )
+    if since is not None:
+        query = query.filter(PollVoterProfile.updated_at >= since)
+    return query.all()
+
+
+def _load_boards():
+    from .helpers import vladivostok_now
+
+    today = vladivostok_now().date()
+    labels = {}
+    values = {metric: {} for metric in LEADERBOARD_METRICS}
+    for row in _profile_rows():
+        labels[row.token] = row.user_id
+        for metric, value in _snapshot_metrics(row, today=today).items():
+            values[metric][row.token] = value
+
+    boards = {metric: _SortedBoard(values[metric]) for metric in LEADERBOARD_METRICS}
+    return boards, labels
+
+
+def _apply_entry(state, token, entry):
+    if entry is None:
+        state.labels.pop(token, None)
+        for board in state.boards.values():
+            board.remove(token)
+        return
+    user_id, metrics = entry
+    state.labels[token] = user_id
+    for metric, value in metrics.items():
+        state.boards[metric].set(token, value)
+
+
+def _apply_entries(state, entries):
+    """Применить снимки профилей (под state.lock); во время перестройки — и поверх нового индекса."""
+    if state.replay is not None:
+        # Выборка перестройки могла уже пройти — применим и поверх нового индекса
+        state.replay.update(entries)
+    if state.built_at is None:
+        # Индекс ещё не построен — он прочитает актуальные данные из БД
+        return
+    for token, entry in entries.items():
+        _apply_entry(state, token, entry)
+
+
+def _rebuild(state):
+    """Перестроить индекс; вернуть False, если перестройка уже идёт в другом потоке."""
+    from .helpers import vladivostok_now
+
+    with state.lock:
+        if state.replay is not None:
+            return False
+        state.replay = {}
+    started_at = vladivostok_now()
+    try:
+        boards, labels = _load_boards()
+    except Exception:
+        with state.lock:
+            state.replay = None
+        raise
+    with state.lock:
+        replay, state.replay = state.replay, None
+        state.boards = boards
+        state.labels = labels
+        for token, entry in replay.items():
+            _apply_entry(state, token, entry)
+        state.built_at = time.monotonic()
+        state.synced_at = started_at
+    return True
+
+
+def _sync_changes(state):
+    """Подтянуть профили, изменённые с последней синхронизации (в том числе другими процессами)."""
+    from .helpers import vladivostok_now
+
+    with state.lock:
+        synced_at = state.synced_at
+    if synced_at is None:
+        return
+    started_at = vladivostok_now()
+    today = started_at.date()
+    rows = _profile_rows(since=synced_at - _sync_overlap())
+    entries = {row.token: (row.user_id, _snapshot_metrics(row, today=today)) for row in rows}
+    with state.lock:
+        _apply_entries(state, entries)
+        if state.synced_at is not None and state.synced_at < started_at:
+            state.synced_at = started_at
+
+
+def refresh_leaderboard():
+    """Перестроить индекс из БД (задание планировщика); True — перестроен."""
+    return _rebuild(_get_state())
+
+
+def _refresh_in_background(app, state):
+    def _run():
+        with app.app_context():
+            try:
+                _rebuild(state)
+            except Exception as exc:
+                app.logger.warning('Ошибка перестройки лидерборда: %s', exc)
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=_run, name='leaderboard-refresh', daemon=True).start()
+
+
+def _ensure_built(state):
+    with state.lock:
+        if state.built_at is None:
+            # Первый запрос процесса: без индекса отвечать нечем, остальные ждут под блокировкой
+            _rebuild(state)
+            return
+        built_at = state.built_at
+        rebuilding = state.replay is not None
+    if not rebuilding and time.monotonic() - built_at >= 2 * _refresh_interval():
+        # Процесс без планировщика: индекс обновляется в фоне, запрос читает прежний
+        _refresh_in_background(current_app._get_current_object(), state)
+
+
+def invalidate_leaderboard():
+    """Сбросить индекс: следующий запрос перестроит его из БД."""
+    state = _get_state()
+    with state.lock:
+        state.built_at = None
+
+
+def track_leaderboard_profile(profile):
+    """Запомнить новые значения профиля; применяются после commit сессии."""
+    token = getattr(profile, 'token', None)
+    if not token or getattr(profile, '_is_fallback', False):
+        return
+    pending = db.session.info.setdefault(_PENDING_KEY, {})
+    pending[token] = (getattr(profile, 'user_id', None), _snapshot_metrics(profile))
+
+
+def forget_leaderboard_voter(voter_token):
+    """Убрать голосующего из лидерборда после commit (удаление, смена токена)."""
+    if not voter_token:
+        return
+    db.session.info.setdefault(_PENDING_KEY, {})[voter_token] = None
+
+
+def _apply_pending(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+    state = _get_state()
+    with state.lock:
+        _apply_entries(state, pending)
+
+
+def _discard_pending(session, *args):
+    session.info.pop(_PENDING_KEY, None)
+
+
+event.listen(db.session, 'after_commit', _apply_pending)
+event.listen(db.session, 'after_rollback', _discard_pending)
+
+
+def get_leaderboard(metric, limit=10, offset=0, voter_token=None):
+    """Вернуть топ по метрике и (опционально) место конкретного голосующего."""
+    if metric not in LEADERBOARD_METRICS:
+        raise ValueError(f'Неизвестная метрика лидерборда: {metric}')
+
+    state = _get_state()
+    try:
+        _ensure_built(state)
+        _sync_changes(state)
+    except (ProgrammingError, OperationalError):
+        db.session.rollback()
+        raise
+
+    with state.lock:
+        board = state.boards[metric]
+        labels = state.labels
+        items = [
+            {
+                'rank': rank,
+                'user_id': labels.get(token),
+                'value': value,
+                'is_me': bool(voter_token) and token == voter_token,
+            }
+            for rank, token, value in board.top(limit, offset)
+        ]
+        me = None
+        if voter_token and board.get(voter_token) is not None:
+            me = {
+                'rank': board.rank(voter_token),
+                'user_id': labels.get(voter_token),
+                'value': board.get(voter_token),
+            }
+        total = len(board)
+
+    return {'metric': metric, 'total': total, 'items': items, 'me': me}
@@ -0,0 +1,484 @@
+"""
+Отдача медиафайлов (трейлеров и постеров) без прокачки байтов через Python.
+
+Два режима:
+- offload: приложение только проверяет доступ и возвращает заголовок
+  ``X-Accel-Redirect`` (nginx) или ``X-Sendfile`` (Apache/lighttpd),
+  байты и Range отдаёт фронтовой сервер;
+- in-process: диапазон отдаётся через ``wsgi.file_wrapper``, который gunicorn
+  превращает в ``os.sendfile`` ровно на ``Content-Length`` байт.
+
+Кэширование: файл в хранилище назван по SHA-256 содержимого (у файлов со
+старыми именами — ``movie_<id>_<uuid>``), поэтому имя служит версией URL:
+по одной версии всегда отдаются одни и те же байты, даже если файл общий
+для нескольких фильмов. Ответ по версионированному URL помечается
+``immutable``, а сильный ETag и Last-Modified позволяют условные запросы.
+
+Подписанные ссылки: ``sign_media_url`` выдаёт токен под HMAC (itsdangerous)
+с идентификатором ресурса, сроком действия и отпечатком voter_token зрителя.
+Для трейлера в токен кладутся ещё путь, размер, MIME-тип и версия файла,
+поэтому Range-запросы плеера проверяются без обращения к БД. Токен только
+подписан, а не зашифрован: путь файла в хранилище — это его SHA-256, и
+скрывать его незачем (библиотека и так отдаёт ``trailer_file_path``).
+Срок округляется до окна MEDIA_URL_TTL_SECONDS, так что в пределах окна URL
+не меняется.
+Токен на каталог HLS или превью действует для всех его файлов:
+``sign_playlist_uris`` и ``sign_vtt_image_uris`` дописывают его к ссылкам
+плейлистов на сегменты и дорожки WebVTT на спрайт.
+
+Range (RFC 7233): поддерживаются ``a-b``, ``a-``, суффиксы ``-N`` и наборы
+диапазонов (ответ ``multipart/byteranges``); невыполнимый диапазон даёт 416,
+синтаксически некорректный заголовок игнорируется (отдаётся весь файл).
+"""
+import hashlib
+import os
+import posixpath
+import re
+import time
+import uuid
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from flask import Response, current_app, request
+from itsdangerous import BadSignature, URLSafeSerializer
+
+OFFLOAD_X_ACCEL = 'x-accel'
+OFFLOAD_X_SENDFILE = 'x-sendfile'
+
+# Постеры из хранилища SHA-256 отдаются статикой: имя файла меняется вместе с содержимым,
+# поэтому nginx или WSGI-middleware могут кэшировать их навсегда без обращения к приложению
+POSTER_STATIC_URL_PATH = '/media/posters'
+
+_STREAM_CHUNK_SIZE = 1024 * 1024  # 1MB — только для серверов без sendfile
+_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Больше диапазонов в одном запросе не обслуживаем — защита от «нарезки» файла
+_MAX_RANGES = 16
+_MEDIA_URL_SALT = 'media-url'
+_DEFAULT_MEDIA_URL_TTL = 3600
+_PLAYLIST_URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]*)"')
+_VTT_IMAGE_CUE_RE = re.compile(r'^[^\s#]+\.(?:jpe?g|png|webp)(?:#\S*)?$', re.IGNORECASE)
+
+
+def get_offload_mode():
+    """Текущий режим offload ('x-accel', 'x-sendfile') или None."""
+    mode = (current_app.config.get('MEDIA_OFFLOAD_MODE') or '').strip().lower()
+    if mode in (OFFLOAD_X_ACCEL, OFFLOAD_X_SENDFILE):
+        return mode
+    return None
+
+
+def build_offload_response(absolute_path, relative_path, mimetype):
+    """Ответ без тела: файл отдаст nginx/Apache по внутреннему заголовку."""
+    mode = get_offload_mode()
+    if mode is None:
+        return None
+
+    response = Response(status=200, mimetype=mimetype)
+    if mode == OFFLOAD_X_ACCEL:
+        prefix = current_app.config.get('MEDIA_ACCEL_REDIRECT_PREFIX') or '/protected-media/'
+        location = prefix.rstrip('/') + '/' + quote(relative_path.replace('\\', '/').lstrip('/'))
+        response.headers['X-Accel-Redirect'] = location
+    else:
+        response.headers['X-Sendfile'] = absolute_path
+    # Content-Length выставит фронтовой сервер по реальному файлу
+    response.headers.pop('Content-Length', None)
+    return response
+
+
+def _server_bounds_file_wrapper(environ):
+    """gunicorn ограничивает sendfile значением Content-Length, прочие — нет."""
+    if not environ.get('wsgi.file_wrapper'):
+        return False
+    return str(environ.get('SERVER_SOFTWARE', '')).lower().startswith('gunicorn')
+
+
+def _iter_file_range(path, start, length):
+    with open(path, 'rb') as file_obj:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(_STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def file_range_body(path, start, end, file_size):
+    """Тело ответа для байтов [start, end] файла.
+
+    Если сервер умеет отдавать файл через sendfile с ограничением длины
+    (или диапазон идёт до конца файла), возвращается ``wsgi.file_wrapper``
+    с файлом, спозиционированным на ``start``. Иначе — генератор чанков.
+    """
+    length = end - start + 1
+    environ = request.environ
+    file_wrapper = environ.get('wsgi.file_wrapper')
+
+    if file_wrapper and (end == file_size - 1 or _server_bounds_file_wrapper(environ)):
+        file_obj = open(path, 'rb')
+        try:
+            file_obj.seek(start)
+        except OSError:
+            file_obj.close()
+            raise
+        return file_wrapper(file_obj, _STREAM_CHUNK_SIZE)
+
+    return _iter_file_range(path, start, length)
+
+
+def build_partial_response(path, start, end, file_size, mimetype):
+    """206 Partial Content для одного диапазона."""
+    response = Response(
+        file_range_body(path, start, end, file_size),
+        status=206,
+        mimetype=mimetype,
+        direct_passthrough=True,
+    )
+    response.headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(end - start + 1)
+    return response
+
+
+def build_full_response(path, file_size, mimetype):
+    """200 со всем файлом (через wsgi.file_wrapper, если он есть)."""
+    body = file_range_body(path, 0, file_size - 1, file_size) if file_size else b''
+    response = Response(body, status=200, mimetype=mimetype, direct_passthrough=True)
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(file_size)
+    return response
+
+
+def parse_byte_ranges(range_header, file_size):
+    """Разобрать заголовок Range в список диапазонов ``(start, end)`` включительно.
+
+    Возвращает None, если заголовок нужно проигнорировать (другая единица,
+    синтаксическая ошибка, слишком много диапазонов), и пустой список, если
+    ни один диапазон не попадает в файл (ответ 416). Пересекающиеся и
+    смежные диапазоны объединяются.
+    """
+    if not range_header:
+        return None
+    unit, _, range_set = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not range_set.strip():
+        return None
+
+    specs = [spec.strip() for spec in range_set.split(',')]
+    specs = [spec for spec in specs if spec]
+    if not specs or len(specs) > _MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        first, dash, last = spec.partition('-')
+        first, last = first.strip(), last.strip()
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+
+        if not first:
+            # Суффикс: последние N байт (bytes=-500)
+            if not last:
+                return None
+            suffix_length = int(last)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            ranges.append((max(file_size - suffix_length, 0), file_size - 1))
+            continue
+
+        start = int(first)
+        end = int(last) if last else None
+        if end is not None and end < start:
+            return None
+        if start >= file_size:
+            continue
+        ranges.append((start, file_size - 1 if end is None else min(end, file_size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _multipart_parts(ranges, file_size, mimetype, boundary):
+    parts = []
+    for start, end in ranges:
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+        ).encode('latin-1')
+        parts.append((head, start, end))
+    tail = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+    return parts, tail
+
+
+def _iter_multipart(path, parts, tail):
+    for index, (head, start, end) in enumerate(parts):
+        if index:
+            yield b'\r\n'
+        yield head
+        yield from _iter_file_range(path, start, end - start + 1)
+    yield tail
+
+
+def build_multipart_response(path, ranges, file_size, mimetype):
+    """206 multipart/byteranges для нескольких непересекающихся диапазонов."""
+    boundary = uuid.uuid4().hex
+    parts, tail = _multipart_parts(ranges, file_size, mimetype, boundary)
+    content_length = len(tail) + sum(len(head) + end - start + 1 for head, start, end in parts)
+    content_length += 2 * (len(parts) - 1)  # CRLF перед каждой следующей частью
+
+    response = Response(
+        _iter_multipart(path, parts, tail),
+        status=206,
+        content_type=f'multipart/byteranges; boundary={boundary}',
+        direct_passthrough=True,
+    )
+    response.headers['Accept-Ranges'] = 'bytes'
+    response.headers['Content-Length'] = str(content_length)
+    return response
+
+
+def build_range_not_satisfiable(file_size):
+    response = Response(status=416)
+    response.headers['Content-Range'] = f'bytes */{file_size}'
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def media_file_stat(path):
+    """Результат os.stat или None, если файла нет."""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def media_version(relative_path):
+    """Версия файла для URL — имя без расширения (SHA-256 содержимого для файлов хранилища)."""
+    if not relative_path:
+        return None
+    filename = posixpath.basename(relative_path.replace('\\', '/'))
+    return posixpath.splitext(filename)[0] or None
+
+
+def _media_url_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt=_MEDIA_URL_SALT)
+
+
+def _media_url_ttl():
+    try:
+        ttl = int(current_app.config.get('MEDIA_URL_TTL_SECONDS', _DEFAULT_MEDIA_URL_TTL))
+    except (TypeError, ValueError):
+        ttl = _DEFAULT_MEDIA_URL_TTL
+    return max(ttl, 60)
+
+
+def _voter_fingerprint(voter_token):
+    """Отпечаток voter_token для токена: сам токен зрителя в URL не попадает."""
+    if not voter_token:
+        return None
+    return hashlib.sha256(voter_token.encode('utf-8')).hexdigest()[:16]
+
+
+def sign_media_token(resource_id, voter_token=None, relative_path=None, file_size=None, mimetype=None):
+    """
+    Токен доступа к ресурсу: действует от TTL до 2×TTL с момента выдачи.
+    С ``relative_path`` токен описывает сам файл — обработчику не нужна БД.
+    """
+    ttl = _media_url_ttl()
+    expires_at = (int(time.time()) // ttl + 2) * ttl
+    payload = {
+        'id': resource_id,
+        'e': expires_at,
+        'v': _voter_fingerprint(voter_token),
+    }
+    if relative_path:
+        payload.update({
+            'p': relative_path,
+            's': file_size,
+            'm': mimetype,
+            'h': media_version(relative_path),
+        })
+    return _media_url_serializer().dumps(payload)
+
+
+def sign_media_url(base_url, resource_id, voter_token=None, relative_path=None, file_size=None, mimetype=None):
+    """Подписанный URL на ресурс, привязанный к зрителю ``voter_token`` (None — к любому)."""
+    token = sign_media_token(resource_id, voter_token, relative_path, file_size, mimetype)
+    return f'{base_url}?token={token}'
+
+
+def load_media_token(token, resource_id, voter_token=None):
+    """
+    Проверить подпись, срок и зрителя ссылки; None, если ссылка
+    недействительна или выдана другому voter_token.
+    """
+    try:
+        payload = _media_url_serializer().loads(token)
+    except BadSignature:
+        return None
+    if not isinstance(payload, dict) or payload.get('id') != resource_id:
+        return None
+    try:
+        if int(payload.get('e') or 0) < time.time():
+            return None
+    except (TypeError, ValueError):
+        return None
+    if payload.get('v') and payload['v'] != _voter_fingerprint(voter_token):
+        return None
+    return payload
+
+
+def trailer_asset_scope(kind, asset):
+    """
+    Ресурс токена для производного файла — каталог версии трейлера (``<kind>/<sha256>``).
+    Каталог общий для всех фильмов с теми же байтами трейлера, и токен действует на любой его файл.
+    """
+    version_dir = asset.replace('\\', '/').lstrip('/').split('/', 1)[0]
+    return f'{kind}/{version_dir}'
+
+
+def sign_trailer_asset_url(asset_url, kind, voter_token=None):
+    """
+    Подписанный URL производного файла трейлера (``/api/trailers/<kind>/...``):
+    для зрителя — после оплаты просмотра, без ``voter_token`` — для администратора библиотеки.
+    """
+    if not asset_url:
+        return None
+    asset = asset_url.split(f'/api/trailers/{kind}/', 1)[1]
+    return sign_media_url(asset_url, trailer_asset_scope(kind, asset), voter_token)
+
+
+def _uri_with_token(uri, token):
+    path, hash_sign, fragment = uri.partition('#')
+    separator = '&' if '?' in path else '?'
+    return f'{path}{separator}token={token}{hash_sign}{fragment}'
+
+
+def sign_playlist_uris(playlist, token):
+    """
+    Добавить ``token`` ко всем ссылкам плейлиста HLS: строкам URI и
+    атрибутам ``URI="..."`` (EXT-X-MAP, EXT-X-MEDIA и т.п.).
+    """
+    lines = []
+    for line in playlist.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('#'):
+            line = _PLAYLIST_URI_ATTRIBUTE_RE.sub(
+                lambda match: f'URI="{_uri_with_token(match.group(1), token)}"', line
+            )
+        elif stripped:
+            line = _uri_with_token(stripped, token)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def sign_vtt_image_uris(track, token):
+    """Добавить ``token`` к ссылкам на картинки в репликах WebVTT (``sprite.jpg#xywh=...``)."""
+    lines = []
+    for line in track.splitlines():
+        if _VTT_IMAGE_CUE_RE.match(line.strip()):
+            line = _uri_with_token(line.strip(), token)
+        lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+def resolve_media_path(media_root, relative_path):
+    """Абсолютный путь файла внутри media_root или None при попытке выйти за его пределы."""
+    normalized_file_path = relative_path.replace('\\', '/').replace('/', os.sep)
+    absolute_path = os.path.normpath(os.path.join(media_root, normalized_file_path))
+    normalized_media_root = os.path.normpath(media_root)
+    if not absolute_path.startswith(normalized_media_root + os.sep) and absolute_path != normalized_media_root:
+        return None
+    return absolute_path
+
+
+def media_etag(relative_path, stat_result):
+    """Сильный ETag: имя файла, размер и mtime (faststart перезаписывает файл на месте)."""
+    return f'{media_version(relative_path)}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}'
+
+
+def media_last_modified(stat_result):
+    return datetime.fromtimestamp(int(stat_result.st_mtime), tz=timezone.utc)
+
+
+def is_not_modified(etag, last_modified):
+    """Проверка If-None-Match / If-Modified-Since для ответа 304."""
+    if request.headers.get('If-None-Match'):
+        # If-None-Match сравнивается слабо и имеет приоритет над датой
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    if since is not None and last_modified is not None:
+        return last_modified <= since
+    return False
+
+
+def range_is_current(etag, last_modified):
+    """If-Range: диапазон отдаётся, только если клиент держит ту же версию файла."""
+    raw_value = (request.headers.get('If-Range') or '').strip()
+    if not raw_value:
+        return True
+    if raw_value.startswith('W/'):
+        # Слабый валидатор в If-Range не допускается (RFC 7233, 3.2)
+        return False
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None and last_modified is not None:
+        return if_range.date == last_modified
+    return False
+
+
+def apply_media_cache_headers(response, etag, last_modified, immutable=False, max_age=None, private=False):
+    """
+    Валидаторы и Cache-Control для медиа-ответа (200, 206 и 304).
+    ``private`` — URL выдан конкретному зрителю и не должен попадать в общие кэши.
+    """
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    scope = 'private' if private else 'public'
+    if immutable:
+        response.headers['Cache-Control'] = f'{scope}, max-age={_IMMUTABLE_MAX_AGE}, immutable'
+    elif max_age:
+        response.headers['Cache-Control'] = f'{scope}, max-age={int(max_age)}'
+    else:
+        # URL без версии может указывать на новый файл — только с ревалидацией
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def send_media_file(absolute_path, relative_path, mimetype, file_stat, immutable=False, max_age=None, private=False):
+    """Полный цикл отдачи файла: 304, offload, If-Range, Range (206/416) или 200."""
+    etag = media_etag(relative_path, file_stat)
+    last_modified = media_last_modified(file_stat)
+
+    if is_not_modified(etag, last_modified):
+        response = Response(status=304)
+        return apply_media_cache_headers(response, etag, last_modified, immutable, max_age, private)
+
+    # Offload: байты и Range отдаёт nginx/Apache, поток gunicorn сразу свободен
+    response = build_offload_response(absolute_path, relative_path, mimetype)
+    if response is None:
+        file_size = file_stat.st_size
+        ranges = None
+        if request.method in ('GET', 'HEAD') and range_is_current(etag, last_modified):
+            # If-Range не совпал — файл заменён, отдаём его целиком
+            ranges = parse_byte_ranges(request.headers.get('Range'), file_size)
+
+        if ranges is None:
+            response = build_full_response(absolute_path, file_size, mimetype)
+        elif not ranges:
+            response = build_range_not_satisfiable(file_size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = build_partial_response(absolute_path, start, end, file_size, mimetype)
+        else:
+            response = build_multipart_response(absolute_path, ranges, file_size, mimetype)
+
+    return apply_media_cache_headers(response, etag, last_modified, immutable, max_age, private)
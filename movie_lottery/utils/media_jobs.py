@@ -0,0 +1,952 @@
+"""Обработчики фоновых заданий для медиафайлов (регистрируются в job_queue)."""
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from flask import current_app
+from sqlalchemy import or_, select
+
+from .. import db
+from ..models import LibraryMovie, MediaJob
+from .job_queue import JOB_QUEUED, JOB_RUNNING, enqueue_job, register_job_handler
+from .media_delivery import POSTER_STATIC_URL_PATH, media_version, resolve_media_path
+from .poster_downloads import build_http_session, download_poster
+from .media_storage import (
+    delete_remote_media,
+    ensure_local_media,
+    get_media_storage,
+    publish_media,
+    publish_media_tree,
+)
+from .media_store import (
+    INCOMING_PREFIX,
+    KIND_POSTER,
+    KIND_TRAILER,
+    adopt_file,
+    hash_file,
+    is_stored_blob,
+    kind_subdir,
+    register_purge_hook,
+    release_media,
+    store_relative_dir,
+)
+from .media_usage import MediaQuotaExceeded, check_media_quota, movie_media_size, set_movie_poster, track_media_size
+from .video_processing import (
+    apply_faststart,
+    build_poster_atlas,
+    build_poster_variants,
+    build_low_quality_trailer,
+    build_trailer_previews,
+    inspect_mp4,
+    package_hls,
+    parse_hls_renditions,
+    resize_poster,
+    select_hls_renditions,
+)
+
+JOB_FASTSTART = 'faststart'
+JOB_HLS = 'hls'
+JOB_THUMBNAILS = 'thumbnails'
+JOB_POSTER_VARIANTS = 'poster_variants'
+JOB_POSTER_MIGRATION = 'poster_migration'
+JOB_POSTER_ATLAS = 'poster_atlas'
+JOB_LOW_QUALITY_TRAILER = 'low_quality_trailer'
+
+POSTER_VARIANT_FORMATS = ('webp', 'jpg')
+
+# Атлас: не больше 8 плиток в ряд, плитка с пропорциями постера 2:3
+POSTER_ATLAS_COLUMNS = 8
+
+# Каталоги производных файлов: <подкаталог трейлеров>/<kind>/<версия файла>.
+# Версия файла в хранилище — его SHA-256, поэтому фильмы с одинаковым
+# трейлером пользуются одними и теми же HLS и превью.
+_DERIVATIVE_KINDS = ('hls', 'thumbs', 'low')
+
+# Облегчённые копии трейлеров для медленных клиентов: не чаще раза в столько
+# секунд обновляется время последнего обращения (atime) для вытеснения LRU
+LOW_QUALITY_TOUCH_SECONDS = 300
+
+
+def trailer_derivative_dir(relative_path, kind):
+    relative_path = (relative_path or '').replace(os.sep, '/')
+    top_dir = relative_path.split('/', 1)[0] if '/' in relative_path else ''
+    return posixpath.join(top_dir, kind, media_version(relative_path))
+
+
+def trailer_hls_dir(relative_path):
+    """Каталог HLS трейлера: <подкаталог трейлеров>/hls/<версия файла>."""
+    return trailer_derivative_dir(relative_path, 'hls')
+
+
+@register_purge_hook(KIND_TRAILER)
+def remove_trailer_derivatives(relative_path, media_root):
+    """Удалить производные файлы трейлера (HLS, превью), построенные по ``relative_path``."""
+    if not relative_path:
+        return
+    for kind in _DERIVATIVE_KINDS:
+        relative_dir = trailer_derivative_dir(relative_path, kind)
+        derivative_dir = resolve_media_path(media_root or '', relative_dir)
+        if derivative_dir and os.path.isdir(derivative_dir):
+            shutil.rmtree(derivative_dir, ignore_errors=True)
+        delete_remote_media(relative_dir=relative_dir)
+
+
+def poster_variant_widths():
+    """Ширины уменьшенных копий постеров из POSTER_VARIANT_WIDTHS (по возрастанию)."""
+    config = current_app.config
+    if not config.get('POSTER_VARIANTS_ENABLED'):
+        return []
+    widths = set()
+    for item in str(config.get('POSTER_VARIANT_WIDTHS') or '').split(','):
+        try:
+            width = int(item.strip())
+        except ValueError:
+            continue
+        if width > 0:
+            widths.add(width)
+    return sorted(widths)
+
+
+def pick_poster_width(requested_width):
+    """Наименьшая настроенная ширина не меньше запрошенной (или наибольшая)."""
+    widths = poster_variant_widths()
+    if not widths or not requested_width or requested_width <= 0:
+        return None
+    for width in widths:
+        if width >= requested_width:
+            return width
+    return widths[-1]
+
+
+def poster_variant_path(relative_path, width, fmt):
+    """Копия постера: <подкаталог постеров>/variants/<версия файла>/<ширина>.<формат>."""
+    return posixpath.join(trailer_derivative_dir(relative_path, 'variants'), f'{width}.{fmt}')
+
+
+def _is_sha256(value):
+    return len(value) == 64 and all(ch in '0123456789abcdef' for ch in value)
+
+
+def poster_static_url(relative_path):
+    """
+    Статический URL файла из каталога постеров или None, если имя файла
+    не зависит от содержимого (старые poster_<id>.jpg).
+    """
+    if not relative_path or not current_app.config.get('POSTER_STATIC_URLS'):
+        return None
+    parts = relative_path.replace(os.sep, '/').split('/')
+    if parts[0] != kind_subdir(KIND_POSTER) or len(parts) < 3:
+        return None
+    # posters/sha256/<ab>/<хэш>.<ext> или posters/variants/<хэш>/<ширина>.<формат>
+    stored_blob = parts[1] == 'sha256' and len(parts) == 4
+    blob_variant = parts[1] == 'variants' and len(parts) == 4 and _is_sha256(parts[2])
+    if not stored_blob and not blob_variant:
+        return None
+    return posixpath.join(POSTER_STATIC_URL_PATH, *parts[1:])
+
+
+def local_poster_url(movie_id, relative_path):
+    """URL локального постера: статический для хранилища SHA-256, иначе через /api/posters/<id>."""
+    return poster_static_url(relative_path) or f'/api/posters/{movie_id}'
+
+
+def poster_srcset(movie_id, relative_path=None):
+    """
+    Значение srcset для <img> локального постера или None, если копии отключены.
+
+    Для постеров из хранилища — статические JPEG-копии, для старых файлов —
+    /api/posters/<id>?w= с выбором формата по Accept.
+    """
+    widths = poster_variant_widths()
+    if not widths:
+        return None
+    if poster_static_url(relative_path):
+        return ', '.join(
+            f'{poster_static_url(poster_variant_path(relative_path, width, "jpg"))} {width}w' for width in widths
+        )
+    return ', '.join(f'/api/posters/{movie_id}?w={width} {width}w' for width in widths)
+
+
+def poster_webp_srcset(relative_path):
+    """srcset статических WebP-копий для <source type="image/webp"> (только для хранилища SHA-256)."""
+    widths = poster_variant_widths()
+    if not widths or not poster_static_url(relative_path):
+        return None
+    return ', '.join(
+        f'{poster_static_url(poster_variant_path(relative_path, width, "webp"))} {width}w' for width in widths
+    )
+
+
+def ensure_poster_variant(relative_path, width, fmt):
+    """Относительный путь копии постера, при необходимости создав её; None, если это не удалось."""
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+    variant_path = poster_variant_path(relative_path, width, fmt)
+    variant_absolute = resolve_media_path(media_root, variant_path)
+    if variant_absolute is None:
+        return None
+    if not os.path.exists(variant_absolute):
+        source_path = ensure_local_media(relative_path)
+        if source_path is None or not resize_poster(source_path, variant_absolute, width)['success']:
+            return None
+        publish_media(variant_path)
+    return variant_path
+
+
+@register_purge_hook(KIND_POSTER)
+def remove_poster_variants(relative_path, media_root):
+    """Удалить уменьшенные копии постера вместе с исходным файлом."""
+    relative_dir = trailer_derivative_dir(relative_path, 'variants')
+    variants_dir = resolve_media_path(media_root or '', relative_dir)
+    if variants_dir and os.path.isdir(variants_dir):
+        shutil.rmtree(variants_dir, ignore_errors=True)
+    delete_remote_media(relative_dir=relative_dir)
+
+
+def clear_trailer_derivatives(movie):
+    """Сбросить пути производных файлов: они относятся к прежнему файлу трейлера."""
+    movie.trailer_hls_path = None
+    movie.trailer_poster_frame_path = None
+    movie.trailer_sprite_path = None
+    movie.trailer_thumbnails_path = None
+
+
+def store_trailer_metadata(movie, metadata):
+    """Сохранить метаданные moov (длительность, кодеки, размер кадра) в LibraryMovie."""
+    metadata = metadata or {}
+    movie.trailer_duration = metadata.get('duration')
+    movie.trailer_codecs = ','.join(metadata.get('codecs') or [])[:255] or None
+    movie.trailer_width = metadata.get('width')
+    movie.trailer_height = metadata.get('height')
+    movie.trailer_faststart = metadata.get('faststart')
+    return bool(metadata)
+
+
+def inspect_trailer(movie, absolute_path):
+    """Просканировать боксы MP4 трейлера и сохранить метаданные; True — faststart не нужен."""
+    metadata = inspect_mp4(absolute_path)
+    store_trailer_metadata(movie, metadata)
+    return bool(metadata and metadata['faststart'])
+
+
+def enqueue_faststart(movie, batch_id=None):
+    """Поставить faststart для текущего файла трейлера фильма в очередь."""
+    return enqueue_job(
+        JOB_FASTSTART,
+        {'movie_id': movie.id, 'relative_path': movie.trailer_file_path, 'batch_id': batch_id},
+        batch_id=batch_id,
+    )
+
+
+def enqueue_trailer_postprocessing(movie, batch_id=None):
+    """Поставить в очередь обработку готового (faststart) трейлера; вернуть список заданий."""
+    jobs = []
+    payload = {'movie_id': movie.id, 'relative_path': movie.trailer_file_path}
+    # Превью дешевле HLS и нужны интерфейсу раньше — ставим их первыми
+    if current_app.config.get('TRAILER_THUMBNAILS_ENABLED'):
+        jobs.append(enqueue_job(JOB_THUMBNAILS, payload, batch_id=batch_id))
+    if current_app.config.get('TRAILER_HLS_ENABLED'):
+        jobs.append(enqueue_job(JOB_HLS, payload, batch_id=batch_id))
+    return jobs
+
+
+def enqueue_poster_variants(movie_id, relative_path, batch_id=None):
+    """Поставить в очередь уменьшенные копии нового постера (commit — у вызывающего)."""
+    if not poster_variant_widths():
+        return None
+    return enqueue_job(
+        JOB_POSTER_VARIANTS,
+        {'movie_id': movie_id, 'relative_path': relative_path},
+        batch_id=batch_id,
+    )
+
+
+@register_job_handler(JOB_FASTSTART)
+def run_faststart_job(payload, report_progress):
+    movie = db.session.get(LibraryMovie, payload.get('movie_id'))
+    relative_path = payload.get('relative_path')
+    if movie is None or not relative_path or movie.trailer_file_path != relative_path:
+        return {'status': 'skipped', 'message': 'Трейлер удалён или заменён'}
+
+    config = current_app.config
+    absolute_path = resolve_media_path(config.get('TRAILER_MEDIA_ROOT') or '', relative_path)
+    if absolute_path is None:
+        raise RuntimeError('Недопустимый путь к файлу трейлера')
+
+    if ensure_local_media(relative_path) is None:
+        return {'status': 'skipped', 'message': 'Файл не найден'}
+
+    # Результат пишется отдельным файлом хранилища: исходный blob может
+    # принадлежать и другим фильмам, перезаписывать его на месте нельзя
+    ext = os.path.splitext(relative_path)[1].lower()
+    incoming_dir = resolve_media_path(config.get('TRAILER_MEDIA_ROOT') or '', store_relative_dir(KIND_TRAILER))
+    os.makedirs(incoming_dir, exist_ok=True)
+    output_path = os.path.join(incoming_dir, f'{INCOMING_PREFIX}faststart-{payload.get("movie_id")}-{time.time_ns()}{ext}')
+
+    report_progress(5)
+    try:
+        faststart_result = apply_faststart(absolute_path, output_path=output_path)
+        if not faststart_result['success']:
+            raise RuntimeError(faststart_result['message'])
+        report_progress(90)
+
+        # Трейлер могли заменить, пока работал ffmpeg
+        db.session.refresh(movie)
+        if movie.trailer_file_path != relative_path:
+            return {'status': 'skipped', 'message': 'Трейлер заменён во время обработки'}
+
+        if faststart_result['new_size']:
+            previous_size = movie_media_size(movie, KIND_TRAILER)
+            movie.trailer_file_size = faststart_result['new_size']
+            track_media_size(KIND_TRAILER, previous_size, movie.trailer_file_size)
+        store_trailer_metadata(movie, faststart_result.get('metadata'))
+
+        if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+            # Новые байты — новый хэш и новое имя, кэш по старому URL не отдаст прежний файл
+            sha256, size = hash_file(output_path)
+            movie.trailer_file_path = adopt_file(output_path, sha256, size, KIND_TRAILER, ext)
+            db.session.flush()
+            release_media(relative_path, KIND_TRAILER)
+            if movie.trailer_file_path != relative_path:
+                clear_trailer_derivatives(movie)
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+    # Следующие этапы (превью, HLS) строятся уже по итоговому файлу
+    enqueue_trailer_postprocessing(movie, batch_id=payload.get('batch_id'))
+    db.session.commit()
+    return {
+        'status': 'skipped' if faststart_result.get('skipped') else 'processed',
+        'message': faststart_result['message'],
+        'new_size': faststart_result['new_size'],
+        'trailer_file_path': movie.trailer_file_path,
+    }
+
+
+@register_job_handler(JOB_HLS)
+def run_hls_job(payload, report_progress):
+    movie = db.session.get(LibraryMovie, payload.get('movie_id'))
+    relative_path = payload.get('relative_path')
+    if movie is None or not relative_path or movie.trailer_file_path != relative_path:
+        return {'status': 'skipped', 'message': 'Трейлер удалён или заменён'}
+
+    config = current_app.config
+    media_root = config.get('TRAILER_MEDIA_ROOT') or ''
+    absolute_path = resolve_media_path(media_root, relative_path)
+    hls_relative_dir = trailer_hls_dir(relative_path)
+    output_dir = resolve_media_path(media_root, hls_relative_dir)
+    if absolute_path is None or output_dir is None:
+        raise RuntimeError('Недопустимый путь к файлу трейлера')
+    if ensure_local_media(relative_path) is None:
+        return {'status': 'skipped', 'message': 'Файл не найден'}
+
+    if os.path.exists(os.path.join(output_dir, 'master.m3u8')):
+        # Тот же файл уже упакован для другого фильма — каталог HLS общий
+        movie.trailer_hls_path = posixpath.join(hls_relative_dir, 'master.m3u8')
+        db.session.commit()
+        return {'status': 'skipped', 'message': 'HLS уже собран', 'trailer_hls_path': movie.trailer_hls_path}
+
+    metadata = inspect_mp4(absolute_path) or {}
+    renditions = select_hls_renditions(
+        parse_hls_renditions(config.get('TRAILER_HLS_RENDITIONS')),
+        metadata.get('height') or movie.trailer_height,
+    )
+    if not renditions:
+        return {'status': 'skipped', 'message': 'Не заданы качества HLS'}
+    # Для не-MP4 файлов (webm) аудио не определить по боксам — считаем, что оно есть
+    has_audio = metadata.get('has_audio', True) if metadata else True
+
+    report_progress(5)
+    last_report = [0.0]
+
+    def _on_progress(fraction):
+        # Не чаще раза в секунду: каждый вызов — UPDATE в media_job
+        now = time.monotonic()
+        if now - last_report[0] >= 1:
+            last_report[0] = now
+            report_progress(5 + 90 * fraction)
+
+    hls_result = package_hls(
+        absolute_path,
+        output_dir,
+        renditions,
+        has_audio=has_audio,
+        duration=metadata.get('duration') or movie.trailer_duration,
+        segment_seconds=config.get('TRAILER_HLS_SEGMENT_SECONDS', 6),
+        timeout=config.get('TRAILER_HLS_TIMEOUT_SECONDS', 1800),
+        progress_callback=_on_progress,
+    )
+    if not hls_result['success']:
+        raise RuntimeError(hls_result['message'])
+
+    db.session.refresh(movie)
+    if movie.trailer_file_path != relative_path:
+        # Трейлер заменили во время упаковки — плейлист нужен, только если файл есть у других фильмов
+        if not is_stored_blob(relative_path):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        return {'status': 'skipped', 'message': 'Трейлер заменён во время обработки'}
+
+    publish_media_tree(hls_relative_dir)
+    movie.trailer_hls_path = posixpath.join(hls_relative_dir, 'master.m3u8')
+    db.session.commit()
+    return {
+        'status': 'processed',
+        'message': hls_result['message'],
+        'renditions': [f'{height}p' for height, _ in hls_result['renditions']],
+        'trailer_hls_path': movie.trailer_hls_path,
+    }
+
+
+@register_job_handler(JOB_THUMBNAILS)
+def run_thumbnails_job(payload, report_progress):
+    movie = db.session.get(LibraryMovie, payload.get('movie_id'))
+    relative_path = payload.get('relative_path')
+    if movie is None or not relative_path or movie.trailer_file_path != relative_path:
+        return {'status': 'skipped', 'message': 'Трейлер удалён или заменён'}
+
+    config = current_app.config
+    media_root = config.get('TRAILER_MEDIA_ROOT') or ''
+    absolute_path = resolve_media_path(media_root, relative_path)
+    thumbs_relative_dir = trailer_derivative_dir(relative_path, 'thumbs')
+    output_dir = resolve_media_path(media_root, thumbs_relative_dir)
+    if absolute_path is None or output_dir is None:
+        raise RuntimeError('Недопустимый путь к файлу трейлера')
+    if ensure_local_media(relative_path) is None:
+        return {'status': 'skipped', 'message': 'Файл не найден'}
+
+    def _asset_path(name):
+        return posixpath.join(thumbs_relative_dir, name) if name else None
+
+    if os.path.exists(os.path.join(output_dir, 'poster.jpg')):
+        # Превью этого файла уже построены для другого фильма
+        movie.trailer_poster_frame_path = _asset_path('poster.jpg')
+        movie.trailer_sprite_path = _asset_path('sprite.jpg') if os.path.exists(os.path.join(output_dir, 'sprite.jpg')) else None
+        movie.trailer_thumbnails_path = _asset_path('thumbnails.vtt') if movie.trailer_sprite_path else None
+        db.session.commit()
+        return {
+            'status': 'skipped',
+            'message': 'Превью уже построены',
+            'trailer_poster_frame_path': movie.trailer_poster_frame_path,
+        }
+
+    report_progress(5)
+    previews = build_trailer_previews(
+        absolute_path,
+        output_dir,
+        duration=movie.trailer_duration,
+        width=movie.trailer_width,
+        height=movie.trailer_height,
+        interval=config.get('TRAILER_THUMBNAIL_INTERVAL_SECONDS', 10),
+        thumb_width=config.get('TRAILER_THUMBNAIL_WIDTH', 160),
+    )
+    if not previews['success']:
+        raise RuntimeError(previews['message'])
+
+    db.session.refresh(movie)
+    if movie.trailer_file_path != relative_path:
+        if not is_stored_blob(relative_path):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        return {'status': 'skipped', 'message': 'Трейлер заменён во время обработки'}
+
+    publish_media_tree(thumbs_relative_dir)
+    movie.trailer_poster_frame_path = _asset_path(previews['poster'])
+    movie.trailer_sprite_path = _asset_path(previews['sprite'])
+    movie.trailer_thumbnails_path = _asset_path(previews['vtt'])
+    db.session.commit()
+    return {
+        'status': 'processed',
+        'message': previews['message'],
+        'thumbnails': previews['thumbnails'],
+        'trailer_poster_frame_path': movie.trailer_poster_frame_path,
+    }
+
+
+@register_job_handler(JOB_POSTER_VARIANTS)
+def run_poster_variants_job(payload, report_progress):
+    movie = db.session.get(LibraryMovie, payload.get('movie_id'))
+    relative_path = payload.get('relative_path')
+    if movie is None or not relative_path or movie.poster_file_path != relative_path:
+        return {'status': 'skipped', 'message': 'Постер удалён или заменён'}
+
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+    absolute_path = resolve_media_path(media_root, relative_path)
+    variants_relative_dir = trailer_derivative_dir(relative_path, 'variants')
+    output_dir = resolve_media_path(media_root, variants_relative_dir)
+    if absolute_path is None or output_dir is None:
+        raise RuntimeError('Недопустимый путь к файлу постера')
+    if ensure_local_media(relative_path) is None:
+        return {'status': 'skipped', 'message': 'Файл не найден'}
+
+    report_progress(5)
+    result = build_poster_variants(absolute_path, output_dir, poster_variant_widths(), POSTER_VARIANT_FORMATS)
+    if not result['success']:
+        raise RuntimeError(result['message'])
+    publish_media_tree(variants_relative_dir)
+    return {'status': 'processed', 'message': result['message'], 'variants': result['variants']}
+
+
+def movies_without_local_poster():
+    """Запрос (id, URL постера) фильмов, у которых постер ещё не скачан."""
+    return (
+        select(LibraryMovie.id, LibraryMovie.poster)
+        .where(
+            or_(LibraryMovie.poster_file_path.is_(None), LibraryMovie.poster_file_path == ''),
+            LibraryMovie.poster.isnot(None),
+            LibraryMovie.poster != '',
+        )
+        .order_by(LibraryMovie.id)
+    )
+
+
+def _download_in_app(app, poster_url, session):
+    # Потоку пула нужен контекст приложения только ради настроек хранилища — БД здесь не трогаем
+    with app.app_context():
+        return download_poster(poster_url, session=session)
+
+
+@register_job_handler(JOB_POSTER_MIGRATION)
+def run_poster_migration_job(payload, report_progress):
+    """
+    Скачать постеры всех фильмов без локального постера пулом потоков.
+
+    Каждый постер сохраняется отдельным commit, поэтому прерванная миграция
+    (рестарт, повтор задания) продолжается с ещё не скачанных фильмов.
+    """
+    app = current_app._get_current_object()
+    concurrency = max(1, int(app.config.get('POSTER_MIGRATION_CONCURRENCY') or 1))
+    pending = db.session.execute(movies_without_local_poster()).all()
+    db.session.rollback()
+    total = len(pending)
+    counts = {'total': total, 'downloaded': 0, 'skipped': 0, 'failed': 0}
+    if not total:
+        return {'status': 'processed', 'message': 'Все постеры уже скачаны', **counts}
+
+    session = build_http_session(pool_size=concurrency)
+    remaining = iter(pending)
+    in_flight = {}
+    finished = 0
+    last_report = 0.0
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='poster-migration') as pool:
+        while True:
+            # Окно в 2×concurrency: незакоммиченные файлы не копятся, пока идёт запись в БД
+            while len(in_flight) < concurrency * 2:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                movie_id, poster_url = item
+                in_flight[pool.submit(_download_in_app, app, poster_url, session)] = movie_id
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                movie_id = in_flight.pop(future)
+                finished += 1
+                try:
+                    writer, ext = future.result()
+                except Exception as exc:
+                    current_app.logger.warning('Не удалось скачать постер фильма %s: %s', movie_id, exc)
+                    counts['failed'] += 1
+                    continue
+
+                movie = db.session.get(LibraryMovie, movie_id)
+                if movie is None or movie.poster_file_path:
+                    # Фильм удалён или постер появился, пока шла загрузка
+                    writer.abort()
+                    counts['skipped'] += 1
+                    continue
+                try:
+                    check_media_quota(KIND_POSTER, writer.size)
+                except MediaQuotaExceeded as exc:
+                    current_app.logger.warning('Постер фильма %s не сохранён: %s', movie_id, exc)
+                    writer.abort()
+                    counts['skipped'] += 1
+                    continue
+                set_movie_poster(movie, writer.commit(ext), writer.size)
+                enqueue_poster_variants(movie.id, movie.poster_file_path)
+                enqueue_poster_atlas(movie.id)
+                db.session.commit()
+                counts['downloaded'] += 1
+
+            now = time.monotonic()
+            if now - last_report >= 1:
+                last_report = now
+                report_progress(100 * finished / total)
+
+    session.close()
+    return {
+        'status': 'processed',
+        'message': f"Скачано: {counts['downloaded']}, пропущено: {counts['skipped']}, ошибок: {counts['failed']}",
+        **counts,
+    }
+
+
+def poster_atlas_enabled():
+    return bool(current_app.config.get('POSTER_ATLAS_ENABLED'))
+
+
+def poster_atlas_size():
+    return max(1, int(current_app.config.get('POSTER_ATLAS_SIZE') or 64))
+
+
+def poster_atlas_bucket(movie_id):
+    """Номер атласа фильма: фильмы с id из одного диапазона попадают в один атлас."""
+    return int(movie_id) // poster_atlas_size()
+
+
+def _poster_atlas_tile_size():
+    width = max(16, int(current_app.config.get('POSTER_ATLAS_TILE_WIDTH') or 160))
+    return width, width * 3 // 2
+
+
+def poster_atlas_dir():
+    """Каталог атласов относительно TRAILER_MEDIA_ROOT."""
+    return posixpath.join(kind_subdir(KIND_POSTER), 'atlas')
+
+
+def poster_atlas_paths(bucket, entries):
+    """
+    Пути атласа и его карты для набора ``(movie_id, poster_file_path)``.
+
+    Ключ в имени зависит от состава фильмов, их постеров и размера плитки,
+    поэтому добавление или замена постера даёт новый файл только для одного
+    диапазона, а старые URL можно кэшировать навсегда.
+    """
+    tile_width, tile_height = _poster_atlas_tile_size()
+    digest = hashlib.sha256(
+        json.dumps([tile_width, tile_height, sorted(entries)]).encode('utf-8')
+    ).hexdigest()[:16]
+    base = posixpath.join(poster_atlas_dir(), f'{bucket}-{digest}')
+    return f'{base}.webp', f'{base}.json'
+
+
+def poster_atlas_url(atlas_path):
+    """/media/posters/atlas/<файл>: статика (nginx, middleware) или маршрут приложения."""
+    return posixpath.join(POSTER_STATIC_URL_PATH, 'atlas', posixpath.basename(atlas_path))
+
+
+def poster_atlas_entries(bucket):
+    """``(movie_id, poster_file_path)`` фильмов диапазона с локальным постером."""
+    size = poster_atlas_size()
+    rows = db.session.execute(
+        select(LibraryMovie.id, LibraryMovie.poster_file_path)
+        .where(
+            LibraryMovie.id >= bucket * size,
+            LibraryMovie.id < (bucket + 1) * size,
+            LibraryMovie.poster_file_path.isnot(None),
+            LibraryMovie.poster_file_path != '',
+        )
+        .order_by(LibraryMovie.id)
+    ).all()
+    return [(movie_id, path) for movie_id, path in rows]
+
+
+def load_poster_atlas_map(map_path):
+    """Карта координат атласа (dict) или None, если атлас ещё не собран."""
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+    absolute_path = resolve_media_path(media_root, map_path)
+    if absolute_path is None or not os.path.exists(absolute_path):
+        return None
+    try:
+        with open(absolute_path, encoding='utf-8') as source:
+            return json.load(source)
+    except (OSError, ValueError) as exc:
+        current_app.logger.warning('Не удалось прочитать карту атласа %s: %s', map_path, exc)
+        return None
+
+
+def poster_atlas_tile_style(atlas_map, movie_id):
+    """CSS плитки фильма (background-*) в процентах — масштабируется вместе с карточкой."""
+    tile = (atlas_map.get('tiles') or {}).get(str(movie_id))
+    if not tile:
+        return None
+    columns, rows = atlas_map['columns'], atlas_map['rows']
+    column, row = tile['column'], tile['row']
+    x = 100 * column / (columns - 1) if columns > 1 else 0
+    y = 100 * row / (rows - 1) if rows > 1 else 0
+    return (
+        f"background-image: url('{atlas_map['url']}'); "
+        f"background-size: {columns * 100}% {rows * 100}%; "
+        f"background-position: {x:g}% {y:g}%;"
+    )
+
+
+def _has_queued_job(job_type, payload, statuses=(JOB_QUEUED,)):
+    return db.session.execute(
+        select(MediaJob.id)
+        .where(
+            MediaJob.job_type == job_type,
+            MediaJob.status.in_(statuses),
+            MediaJob.payload == json.dumps(payload),
+        )
+        .limit(1)
+    ).first() is not None
+
+
+def enqueue_poster_atlas(movie_id, batch_id=None):
+    """
+    Поставить в очередь пересборку атласа, в который входит фильм (commit —
+    у вызывающего). Ещё не начатое задание того же диапазона не дублируется.
+    """
+    if not poster_atlas_enabled() or movie_id is None:
+        return None
+    payload = {'bucket': poster_atlas_bucket(movie_id)}
+    if _has_queued_job(JOB_POSTER_ATLAS, payload):
+        return None
+    return enqueue_job(JOB_POSTER_ATLAS, payload, batch_id=batch_id)
+
+
+def library_poster_atlas_styles(movies):
+    """
+    Стили плиток атласа для карточек библиотеки: ``{movie_id: css}``.
+
+    Для диапазонов, атлас которых ещё не собран (или устарел), ставится
+    задание сборки; такие карточки пока показывают постер как обычно.
+    """
+    if not poster_atlas_enabled():
+        return {}
+    buckets = {}
+    for movie in movies:
+        if movie.poster_file_path:
+            buckets.setdefault(poster_atlas_bucket(movie.id), []).append((movie.id, movie.poster_file_path))
+
+    styles = {}
+    missing = []
+    for bucket, entries in buckets.items():
+        _, map_path = poster_atlas_paths(bucket, entries)
+        atlas_map = load_poster_atlas_map(map_path)
+        if atlas_map is None:
+            missing.append(entries[0][0])
+            continue
+        for movie_id, _ in entries:
+            style = poster_atlas_tile_style(atlas_map, movie_id)
+            if style:
+                styles[movie_id] = style
+
+    if missing:
+        for movie_id in missing:
+            enqueue_poster_atlas(movie_id)
+        db.session.commit()
+    return styles
+
+
+def _remove_stale_atlases(bucket, keep_paths, media_root):
+    atlas_dir = resolve_media_path(media_root, poster_atlas_dir())
+    if atlas_dir is None or not os.path.isdir(atlas_dir):
+        return
+    keep_names = {posixpath.basename(path) for path in keep_paths}
+    prefix = f'{bucket}-'
+    for name in os.listdir(atlas_dir):
+        if name.startswith(prefix) and name not in keep_names:
+            try:
+                os.remove(os.path.join(atlas_dir, name))
+            except OSError as exc:
+                current_app.logger.warning('Не удалось удалить старый атлас %s: %s', name, exc)
+            delete_remote_media(posixpath.join(poster_atlas_dir(), name))
+
+
+@register_job_handler(JOB_POSTER_ATLAS)
+def run_poster_atlas_job(payload, report_progress):
+    """Собрать атлас диапазона фильмов и карту координат плиток, удалить прежние версии."""
+    bucket = int(payload.get('bucket'))
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+    entries = poster_atlas_entries(bucket)
+    db.session.rollback()
+    if not entries:
+        _remove_stale_atlases(bucket, (), media_root)
+        return {'status': 'skipped', 'message': 'В диапазоне нет локальных постеров'}
+
+    atlas_path, map_path = poster_atlas_paths(bucket, entries)
+    atlas_absolute = resolve_media_path(media_root, atlas_path)
+    map_absolute = resolve_media_path(media_root, map_path)
+    if atlas_absolute is None or map_absolute is None:
+        raise RuntimeError('Недопустимый путь к атласу постеров')
+    if os.path.exists(map_absolute) and os.path.exists(atlas_absolute):
+        _remove_stale_atlases(bucket, (atlas_path, map_path), media_root)
+        return {'status': 'skipped', 'message': 'Атлас уже собран', 'atlas': atlas_path}
+
+    # Плитки получают только фильмы, файл постера которых на месте
+    tiled = []
+    for movie_id, poster_path in entries:
+        absolute_path = ensure_local_media(poster_path)
+        if absolute_path:
+            tiled.append((movie_id, absolute_path))
+    if not tiled:
+        return {'status': 'skipped', 'message': 'Файлы постеров не найдены'}
+
+    report_progress(5)
+    os.makedirs(os.path.dirname(atlas_absolute), exist_ok=True)
+    tile_width, tile_height = _poster_atlas_tile_size()
+    result = build_poster_atlas(
+        [path for _, path in tiled], atlas_absolute, tile_width, tile_height, POSTER_ATLAS_COLUMNS,
+    )
+    if not result['success']:
+        raise RuntimeError(result['message'])
+
+    columns = result['columns']
+    atlas_map = {
+        'bucket': bucket,
+        'url': poster_atlas_url(atlas_path),
+        'columns': columns,
+        'rows': result['rows'],
+        'tile_width': tile_width,
+        'tile_height': tile_height,
+        'tiles': {
+            str(movie_id): {
+                'column': index % columns,
+                'row': index // columns,
+                'x': (index % columns) * tile_width,
+                'y': (index // columns) * tile_height,
+            }
+            for index, (movie_id, _) in enumerate(tiled)
+        },
+    }
+    temp_map = f'{map_absolute}.tmp'
+    with open(temp_map, 'w', encoding='utf-8') as target:
+        json.dump(atlas_map, target)
+    os.replace(temp_map, map_absolute)
+    publish_media(atlas_path)
+    publish_media(map_path)
+    _remove_stale_atlases(bucket, (atlas_path, map_path), media_root)
+    return {'status': 'processed', 'message': result['message'], 'atlas': atlas_path, 'tiles': len(tiled)}
+
+
+def low_quality_trailer_path(relative_path):
+    """Облегчённая копия: <подкаталог трейлеров>/low/<версия файла>/<высота>p.mp4."""
+    height = current_app.config.get('TRAILER_LOW_QUALITY_HEIGHT') or 480
+    return posixpath.join(trailer_derivative_dir(relative_path, 'low'), f'{height}p.mp4')
+
+
+def _touch_access_time(absolute_path, stat_result):
+    # mtime не трогаем: от него зависит ETag, и If-Range перестал бы совпадать
+    now = time.time()
+    if now - stat_result.st_atime >= LOW_QUALITY_TOUCH_SECONDS:
+        try:
+            os.utime(absolute_path, (now, stat_result.st_mtime))
+        except OSError:
+            pass
+
+
+def find_low_quality_trailer(relative_path):
+    """
+    Путь готовой облегчённой копии трейлера или None. Обращение отмечается
+    во времени доступа файла — по нему кэш вытесняет давно не нужные копии.
+    """
+    config = current_app.config
+    if not config.get('TRAILER_LOW_QUALITY_ENABLED') or not relative_path:
+        return None
+    low_path = low_quality_trailer_path(relative_path)
+    absolute_path = resolve_media_path(config.get('TRAILER_MEDIA_ROOT') or '', low_path)
+    if absolute_path is None:
+        return None
+    try:
+        stat_result = os.stat(absolute_path)
+    except OSError:
+        storage = get_media_storage()
+        # Копию мог собрать worker на другом узле — она уже в бакете
+        return low_path if storage.remote and storage.exists(low_path) else None
+    _touch_access_time(absolute_path, stat_result)
+    return low_path
+
+
+def enqueue_low_quality_trailer(relative_path):
+    """
+    Поставить сборку облегчённой копии в очередь (commit — у вызывающего).
+    Пока задание ждёт или выполняется, повторные запросы новых не создают.
+    """
+    if not current_app.config.get('TRAILER_LOW_QUALITY_ENABLED') or not relative_path:
+        return None
+    payload = {'relative_path': relative_path}
+    if _has_queued_job(JOB_LOW_QUALITY_TRAILER, payload, statuses=(JOB_QUEUED, JOB_RUNNING)):
+        return None
+    return enqueue_job(JOB_LOW_QUALITY_TRAILER, payload)
+
+
+def evict_low_quality_trailers(keep=None):
+    """
+    Удалить давно не запрошенные облегчённые копии, пока кэш больше
+    TRAILER_LOW_QUALITY_CACHE_MB; вернуть число удалённых копий.
+    """
+    config = current_app.config
+    media_root = config.get('TRAILER_MEDIA_ROOT') or ''
+    max_bytes = max(0, int(config.get('TRAILER_LOW_QUALITY_CACHE_MB') or 0)) * 1024 * 1024
+    cache_dir = resolve_media_path(media_root, posixpath.join(kind_subdir(KIND_TRAILER), 'low'))
+    if cache_dir is None or not os.path.isdir(cache_dir):
+        return 0
+
+    copies = []
+    total = 0
+    for version_entry in os.scandir(cache_dir):
+        if not version_entry.is_dir(follow_symlinks=False):
+            continue
+        size = 0
+        last_access = 0
+        for entry in os.scandir(version_entry.path):
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                stat_result = entry.stat()
+                size += stat_result.st_size
+                last_access = max(last_access, stat_result.st_atime)
+        total += size
+        copies.append((last_access, version_entry.name, size))
+
+    removed = 0
+    for _, version, size in sorted(copies):
+        if total <= max_bytes:
+            break
+        relative_dir = posixpath.join(kind_subdir(KIND_TRAILER), 'low', version)
+        if keep and posixpath.dirname(keep) == relative_dir:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, version), ignore_errors=True)
+        delete_remote_media(relative_dir=relative_dir)
+        total -= size
+        removed += 1
+    if removed:
+        current_app.logger.info('Кэш облегчённых трейлеров: вытеснено копий — %s', removed)
+    return removed
+
+
+@register_job_handler(JOB_LOW_QUALITY_TRAILER)
+def run_low_quality_trailer_job(payload, report_progress):
+    relative_path = payload.get('relative_path')
+    in_use = db.session.execute(
+        select(LibraryMovie.id)
+        .where(LibraryMovie.trailer_file_path == relative_path)
+        .limit(1)
+    ).first() if relative_path else None
+    if in_use is None:
+        return {'status': 'skipped', 'message': 'Трейлер удалён или заменён'}
+
+    config = current_app.config
+    media_root = config.get('TRAILER_MEDIA_ROOT') or ''
+    low_path = low_quality_trailer_path(relative_path)
+    output_path = resolve_media_path(media_root, low_path)
+    if output_path is None:
+        raise RuntimeError('Недопустимый путь к файлу трейлера')
+    if os.path.exists(output_path):
+        return {'status': 'skipped', 'message': 'Облегчённая копия уже есть', 'low_quality_path': low_path}
+    absolute_path = ensure_local_media(relative_path)
+    if absolute_path is None:
+        return {'status': 'skipped', 'message': 'Файл не найден'}
+
+    metadata = inspect_mp4(absolute_path) or {}
+    report_progress(5)
+    result = build_low_quality_trailer(
+        absolute_path,
+        output_path,
+        height=config.get('TRAILER_LOW_QUALITY_HEIGHT') or 480,
+        video_kbps=config.get('TRAILER_LOW_QUALITY_VIDEO_KBPS') or 700,
+        audio_kbps=config.get('TRAILER_LOW_QUALITY_AUDIO_KBPS') or 96,
+        has_audio=metadata.get('has_audio', True) if metadata else True,
+        timeout=config.get('TRAILER_HLS_TIMEOUT_SECONDS', 1800),
+    )
+    if not result['success']:
+        raise RuntimeError(result['message'])
+
+    publish_media(low_path)
+    evict_low_quality_trailers(keep=low_path)
+    return {'status': 'processed', 'message': result['message'], 'low_quality_path': low_path, 'size': result['size']}
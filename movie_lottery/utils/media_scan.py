@@ -0,0 +1,434 @@
+"""
+Инкрементальная проверка целостности TRAILER_MEDIA_ROOT.
+
+Каталоги трейлеров и постеров обходятся короткими шагами (планировщик
+раз в MEDIA_SCAN_INTERVAL_MINUTES): за шаг просматривается не больше
+MEDIA_SCAN_BATCH_SIZE файлов после сохранённого курсора и столько же
+фильмов. Размер и mtime каждого файла попадают в индекс
+``media_scan_entry``, туда же записываются найденные проблемы:
+
+- ``orphan`` — файл хранилища, копия или HLS/превью, на которые никто не ссылается;
+- ``temp`` — брошенный временный файл (faststart, незавершённая загрузка, сборка HLS);
+- ``size_mismatch`` — размер файла не совпадает с ``media_blob.size``
+  или ``LibraryMovie.trailer_file_size``;
+- ``missing`` — фильм ссылается на файл, которого нет на диске.
+
+Файлы моложе MEDIA_SCAN_GRACE_SECONDS не считаются брошенными: их может
+дописывать загрузка или задание. ``reclaim_media_issues`` удаляет брошенные
+файлы, заново проверив каждый перед удалением.
+"""
+import os
+import time
+from itertools import islice
+
+from flask import current_app
+from sqlalchemy import delete, func, or_, select
+
+from .. import db
+from ..models import LibraryMovie, MediaBlob, MediaScanEntry, MediaScanState, TrailerUpload
+from .helpers import vladivostok_now
+from .media_delivery import resolve_media_path
+from .media_store import KIND_POSTER, KIND_TRAILER, collect_orphan_blobs, kind_subdir
+
+ISSUE_ORPHAN = 'orphan'
+ISSUE_TEMP = 'temp'
+ISSUE_SIZE_MISMATCH = 'size_mismatch'
+ISSUE_MISSING = 'missing'
+
+RECLAIMABLE_ISSUES = (ISSUE_ORPHAN, ISSUE_TEMP)
+
+# Каталоги производных файлов: <подкаталог>/<вид>/<версия файла>/...
+_DERIVATIVE_DIRS = ('hls', 'thumbs', 'variants', 'low')
+# Атласы постеров пересобирает и чистит их собственное задание
+_SELF_MANAGED_DIRS = ('atlas',)
+
+
+def _media_root():
+    return current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+
+
+def _config_int(name, default):
+    try:
+        return int(current_app.config.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _is_sha256(value):
+    return len(value) == 64 and all(ch in '0123456789abcdef' for ch in value)
+
+
+def _is_temp_name(parts):
+    """Временные файлы: скрытые (.incoming-, .hls-, .variant-…), mkstemp faststart и *.tmp."""
+    if any(part.startswith('.') for part in parts):
+        return True
+    name = parts[-1]
+    return (name.startswith('tmp') and name.endswith('.mp4')) or name.endswith('.tmp')
+
+
+def _iter_files_after(absolute_dir, rel_parts, cursor_parts, top_dirs):
+    """
+    Файлы каталога в лексикографическом порядке путей, строго после курсора.
+
+    Каталоги читаются лениво (readdir без stat), поддеревья до курсора
+    пропускаются целиком, поэтому шаг стоит O(размер шага), а не O(дерева).
+    """
+    try:
+        with os.scandir(absolute_dir) as iterator:
+            entries = sorted(iterator, key=lambda item: item.name)
+    except OSError:
+        return
+    for entry in entries:
+        if not rel_parts and entry.name not in top_dirs:
+            continue
+        parts = rel_parts + (entry.name,)
+        prefix = cursor_parts[:len(parts)]
+        if cursor_parts and parts < prefix:
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            inner_cursor = cursor_parts if cursor_parts and parts == prefix else ()
+            yield from _iter_files_after(entry.path, parts, inner_cursor, top_dirs)
+        elif entry.is_file(follow_symlinks=False):
+            if cursor_parts and parts == prefix:
+                continue
+            yield '/'.join(parts), entry
+
+
+def get_scan_state():
+    state = MediaScanState.query.order_by(MediaScanState.id).first()
+    if state is None:
+        state = MediaScanState(pass_number=1, movie_cursor=0, files_done=False, movies_done=False)
+        db.session.add(state)
+        db.session.flush()
+    return state
+
+
+def _upsert_entry(entries, relative_path, pass_number, **values):
+    entry = entries.get(relative_path)
+    if entry is None:
+        entry = MediaScanEntry(relative_path=relative_path)
+        db.session.add(entry)
+        entries[relative_path] = entry
+    issue = values.get('issue')
+    if issue and (entry.issue != issue or entry.detected_at is None):
+        entry.detected_at = vladivostok_now()
+    elif not issue:
+        entry.detected_at = None
+    for key, value in values.items():
+        setattr(entry, key, value)
+    entry.seen_pass = pass_number
+    return entry
+
+
+class _BatchContext:
+    """Ссылки из БД для пачки путей — несколько запросов на шаг вместо запросов на файл."""
+
+    def __init__(self, paths):
+        self.blobs = {
+            blob.relative_path: blob
+            for blob in MediaBlob.query.filter(MediaBlob.relative_path.in_(paths)).all()
+        } if paths else {}
+        self.trailers = {}
+        self.posters = set()
+        if paths:
+            rows = db.session.execute(
+                select(LibraryMovie.id, LibraryMovie.trailer_file_path, LibraryMovie.trailer_file_size,
+                       LibraryMovie.poster_file_path)
+                .where(or_(LibraryMovie.trailer_file_path.in_(paths), LibraryMovie.poster_file_path.in_(paths)))
+            ).all()
+            for movie_id, trailer_path, trailer_size, poster_path in rows:
+                if trailer_path in paths:
+                    self.trailers[trailer_path] = (movie_id, trailer_size)
+                if poster_path in paths:
+                    self.posters.add(poster_path)
+        self.uploads = set(
+            path for (path,) in db.session.execute(
+                select(TrailerUpload.relative_path).where(TrailerUpload.relative_path.in_(paths))
+            ).all()
+        ) if paths else set()
+        self._versions = {}
+
+    def version_referenced(self, version):
+        """Есть ли ещё файл, к которому относятся производные с этой версией."""
+        if version not in self._versions:
+            if _is_sha256(version):
+                referenced = db.session.execute(
+                    select(MediaBlob.id).where(MediaBlob.sha256 == version, MediaBlob.ref_count > 0).limit(1)
+                ).first() is not None
+            else:
+                # Старые имена: версия — имя файла трейлера или постера без расширения
+                pattern = f'%/{version}.%'
+                referenced = db.session.execute(
+                    select(LibraryMovie.id)
+                    .where(or_(LibraryMovie.trailer_file_path.like(pattern),
+                               LibraryMovie.poster_file_path.like(pattern)))
+                    .limit(1)
+                ).first() is not None
+            self._versions[version] = referenced
+        return self._versions[version]
+
+
+def _classify(relative_path, size, mtime, context, now):
+    """Проблема файла (issue, ожидаемый размер, id фильма) или (None, None, None)."""
+    parts = tuple(relative_path.split('/'))
+    settled = now - mtime >= _config_int('MEDIA_SCAN_GRACE_SECONDS', 86400)
+
+    if _is_temp_name(parts):
+        if relative_path in context.uploads or not settled:
+            return None, None, None
+        return ISSUE_TEMP, None, None
+
+    if len(parts) >= 3 and parts[1] in _SELF_MANAGED_DIRS:
+        return None, None, None
+
+    if len(parts) >= 4 and parts[1] in _DERIVATIVE_DIRS:
+        if settled and not context.version_referenced(parts[2]):
+            return ISSUE_ORPHAN, None, None
+        return None, None, None
+
+    trailer_ref = context.trailers.get(relative_path)
+    if trailer_ref and trailer_ref[1] is not None and trailer_ref[1] != size:
+        return ISSUE_SIZE_MISMATCH, trailer_ref[1], trailer_ref[0]
+
+    blob = context.blobs.get(relative_path)
+    if blob is not None:
+        if blob.size != size:
+            return ISSUE_SIZE_MISMATCH, blob.size, trailer_ref[0] if trailer_ref else None
+        if blob.ref_count <= 0 and settled:
+            return ISSUE_ORPHAN, None, None
+        return None, None, None
+
+    if trailer_ref or relative_path in context.posters:
+        return None, None, None
+    if len(parts) >= 2 and settled:
+        # Файл хранилища без записи media_blob или старый файл, на который не ссылается ни один фильм
+        return ISSUE_ORPHAN, None, None
+    return None, None, None
+
+
+def _scan_files(state, batch_size):
+    media_root = _media_root()
+    if not media_root or not os.path.isdir(media_root):
+        state.files_done = True
+        return 0
+
+    top_dirs = {kind_subdir(KIND_TRAILER), kind_subdir(KIND_POSTER)}
+    cursor_parts = tuple(state.file_cursor.split('/')) if state.file_cursor else ()
+    batch = []
+    for relative_path, entry in islice(_iter_files_after(media_root, (), cursor_parts, top_dirs), batch_size):
+        try:
+            file_stat = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        batch.append((relative_path, file_stat.st_size, file_stat.st_mtime))
+
+    if not batch:
+        state.files_done = True
+        return 0
+
+    paths = [relative_path for relative_path, _, _ in batch]
+    context = _BatchContext(paths)
+    entries = {
+        entry.relative_path: entry
+        for entry in MediaScanEntry.query.filter(MediaScanEntry.relative_path.in_(paths)).all()
+    }
+    now = time.time()
+    for relative_path, size, mtime in batch:
+        issue, expected_size, movie_id = _classify(relative_path, size, mtime, context, now)
+        _upsert_entry(
+            entries, relative_path, state.pass_number,
+            size=size, mtime=mtime, issue=issue, expected_size=expected_size, movie_id=movie_id,
+        )
+
+    state.file_cursor = batch[-1][0]
+    if len(batch) < batch_size:
+        state.files_done = True
+    return len(batch)
+
+
+def _scan_movies(state, batch_size):
+    rows = db.session.execute(
+        select(LibraryMovie.id, LibraryMovie.trailer_file_path, LibraryMovie.trailer_file_size,
+               LibraryMovie.poster_file_path)
+        .where(LibraryMovie.id > state.movie_cursor)
+        .order_by(LibraryMovie.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        state.movies_done = True
+        return 0
+
+    media_root = _media_root()
+    references = []
+    for movie_id, trailer_path, trailer_size, poster_path in rows:
+        if trailer_path:
+            references.append((trailer_path, movie_id, trailer_size))
+        if poster_path:
+            references.append((poster_path, movie_id, None))
+
+    paths = [relative_path for relative_path, _, _ in references]
+    entries = {
+        entry.relative_path: entry
+        for entry in MediaScanEntry.query.filter(MediaScanEntry.relative_path.in_(paths)).all()
+    } if paths else {}
+    for relative_path, movie_id, expected_size in references:
+        absolute_path = resolve_media_path(media_root, relative_path)
+        if absolute_path is not None and os.path.isfile(absolute_path):
+            entry = entries.get(relative_path)
+            if entry is not None and entry.issue == ISSUE_MISSING:
+                # Файл появился — его размер и прочие проверки возьмёт на себя обход каталога
+                db.session.delete(entry)
+            continue
+        _upsert_entry(
+            entries, relative_path, state.pass_number,
+            size=None, mtime=None, issue=ISSUE_MISSING, expected_size=expected_size, movie_id=movie_id,
+        )
+
+    state.movie_cursor = rows[-1][0]
+    if len(rows) < batch_size:
+        state.movies_done = True
+    return len(rows)
+
+
+def _finish_pass(state):
+    # Записи, не подтверждённые за проход, относятся к удалённым файлам или исправленным ссылкам
+    db.session.execute(
+        delete(MediaScanEntry)
+        .where(MediaScanEntry.seen_pass < state.pass_number)
+        .execution_options(synchronize_session=False)
+    )
+    now = vladivostok_now()
+    state.pass_number += 1
+    state.file_cursor = None
+    state.files_done = False
+    state.movie_cursor = 0
+    state.movies_done = False
+    state.pass_started_at = now
+    state.last_pass_finished_at = now
+
+
+def scan_media_step(batch_size=None):
+    """Один шаг проверки: следующая пачка файлов и фильмов. Возвращает сводку шага."""
+    batch_size = max(1, batch_size or _config_int('MEDIA_SCAN_BATCH_SIZE', 500))
+    state = get_scan_state()
+    pass_number = state.pass_number
+    files = 0 if state.files_done else _scan_files(state, batch_size)
+    movies = 0 if state.movies_done else _scan_movies(state, batch_size)
+    finished = state.files_done and state.movies_done
+    if finished:
+        _finish_pass(state)
+    db.session.commit()
+
+    reclaimed = None
+    if current_app.config.get('MEDIA_SCAN_RECLAIM'):
+        reclaimed = reclaim_media_issues(limit=batch_size)
+    return {
+        'pass': pass_number,
+        'files_scanned': files,
+        'movies_checked': movies,
+        'pass_finished': finished,
+        'reclaimed': reclaimed,
+    }
+
+
+def _recheck(entry, now):
+    """Повторная проверка перед удалением: файл на месте и всё ещё брошен."""
+    absolute_path = resolve_media_path(_media_root(), entry.relative_path)
+    if absolute_path is None or not os.path.isfile(absolute_path):
+        return None
+    file_stat = os.stat(absolute_path)
+    context = _BatchContext([entry.relative_path])
+    issue, _, _ = _classify(entry.relative_path, file_stat.st_size, file_stat.st_mtime, context, now)
+    return absolute_path if issue in RECLAIMABLE_ISSUES else None
+
+
+def _remove_empty_parents(absolute_path):
+    """Убрать опустевшие каталоги (версии HLS, подкаталоги хэшей), не поднимаясь выше трейлеров и постеров."""
+    media_root = os.path.abspath(_media_root())
+    parent = os.path.dirname(os.path.abspath(absolute_path))
+    while os.path.dirname(parent) != media_root and parent.startswith(media_root + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break
+        parent = os.path.dirname(parent)
+
+
+def reclaim_media_issues(limit=None):
+    """Удалить брошенные файлы (orphan, temp) из отчёта; вернуть число файлов и байт."""
+    # Файлы хранилища с нулевым счётчиком удаляются штатно, вместе с их HLS и превью
+    collect_orphan_blobs()
+
+    query = (
+        MediaScanEntry.query
+        .filter(MediaScanEntry.issue.in_(RECLAIMABLE_ISSUES))
+        .order_by(MediaScanEntry.id)
+    )
+    if limit:
+        query = query.limit(limit)
+    removed = freed = 0
+    now = time.time()
+    for entry in query.all():
+        absolute_path = _recheck(entry, now)
+        if absolute_path is not None:
+            try:
+                os.remove(absolute_path)
+            except OSError as exc:
+                current_app.logger.warning('Не удалось удалить брошенный файл %s: %s', entry.relative_path, exc)
+                continue
+            removed += 1
+            freed += entry.size or 0
+            _remove_empty_parents(absolute_path)
+            current_app.logger.info('Удалён брошенный медиафайл %s', entry.relative_path)
+        db.session.delete(entry)
+    db.session.commit()
+    return {'removed': removed, 'bytes': freed}
+
+
+def _serialize_entry(entry):
+    return {
+        'relative_path': entry.relative_path,
+        'issue': entry.issue,
+        'size': entry.size,
+        'expected_size': entry.expected_size,
+        'movie_id': entry.movie_id,
+        'detected_at': entry.detected_at.isoformat() if entry.detected_at else None,
+    }
+
+
+def media_scan_report(issue=None, limit=100):
+    """Состояние проверки, число проблем по видам и первые ``limit`` записей."""
+    state = get_scan_state()
+    counts = dict(db.session.execute(
+        select(MediaScanEntry.issue, func.count(MediaScanEntry.id))
+        .where(MediaScanEntry.issue.isnot(None))
+        .group_by(MediaScanEntry.issue)
+    ).all())
+    reclaimable_bytes = db.session.execute(
+        select(func.coalesce(func.sum(MediaScanEntry.size), 0))
+        .where(MediaScanEntry.issue.in_(RECLAIMABLE_ISSUES))
+    ).scalar()
+    query = MediaScanEntry.query.filter(MediaScanEntry.issue.isnot(None))
+    if issue:
+        query = query.filter(MediaScanEntry.issue == issue)
+    entries = query.order_by(MediaScanEntry.relative_path).limit(limit).all()
+    indexed = db.session.execute(
+        select(func.count(MediaScanEntry.id)).where(MediaScanEntry.size.isnot(None))
+    ).scalar()
+    return {
+        'state': {
+            'pass': state.pass_number,
+            'file_cursor': state.file_cursor,
+            'files_done': state.files_done,
+            'movie_cursor': state.movie_cursor,
+            'movies_done': state.movies_done,
+            'pass_started_at': state.pass_started_at.isoformat() if state.pass_started_at else None,
+            'last_pass_finished_at': (
+                state.last_pass_finished_at.isoformat() if state.last_pass_finished_at else None
+            ),
+        },
+        'indexed_files': indexed,
+        'issues': {kind: counts.get(kind, 0) for kind in (ISSUE_ORPHAN, ISSUE_TEMP, ISSUE_SIZE_MISMATCH, ISSUE_MISSING)},
+        'reclaimable_bytes': int(reclaimable_bytes or 0),
+        'entries': [_serialize_entry(entry) for entry in entries],
+    }
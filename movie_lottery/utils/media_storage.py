@@ -0,0 +1,282 @@
+"""
+Где лежат медиафайлы: локальный диск или S3-совместимое хранилище.
+
+Рабочая копия всегда на диске под TRAILER_MEDIA_ROOT: ffmpeg, faststart и
+хэширование работают с файлами. Драйвер ``local`` на этом и останавливается.
+Драйвер ``s3`` (AWS S3, MinIO, Yandex Object Storage…) дополнительно:
+
+- выгружает каждый новый файл хранилища SHA-256 и его производные (HLS,
+  превью, копии постеров) в бакет под тем же относительным путём;
+- отдаёт трейлеры и сегменты HLS перенаправлением на presigned GET — браузер
+  шлёт Range-запросы прямо в бакет, байты не проходят через Flask;
+- докачивает файл на диск узла, если его там нет (``ensure_local_media``),
+  поэтому веб-узлы и worker не обязаны делить один том;
+- удаляет объекты вместе с локальными файлами.
+
+boto3 нужен только для драйвера ``s3`` и импортируется при первом обращении.
+"""
+import os
+import posixpath
+import tempfile
+
+from flask import current_app
+
+from .media_delivery import resolve_media_path
+
+BACKEND_LOCAL = 'local'
+BACKEND_S3 = 's3'
+
+_EXTENSION_KEY = 'media_storage'
+
+_CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.webm': 'video/webm',
+    '.mov': 'video/quicktime',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.ts': 'video/mp2t',
+    '.vtt': 'text/vtt',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.webp': 'image/webp',
+    '.json': 'application/json',
+}
+_IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def guess_content_type(relative_path):
+    return _CONTENT_TYPES.get(posixpath.splitext(relative_path)[1].lower(), 'application/octet-stream')
+
+
+class LocalMediaStorage:
+    """Файлы только на локальном диске — прежнее поведение."""
+
+    remote = False
+
+    def put_file(self, local_path, relative_path, content_type=None):
+        pass
+
+    def get_file(self, relative_path, local_path):
+        return False
+
+    def delete(self, relative_path):
+        pass
+
+    def delete_prefix(self, relative_dir):
+        pass
+
+    def exists(self, relative_path):
+        return False
+
+    def presigned_url(self, relative_path, content_type=None):
+        return None
+
+
+class S3MediaStorage:
+    """S3-совместимый бакет; ключ объекта — ``<prefix><относительный путь>``."""
+
+    remote = True
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key_id=None,
+                 secret_access_key=None, presign_seconds=3600, client=None):
+        if not bucket:
+            raise ValueError('Не задан MEDIA_S3_BUCKET')
+        self.bucket = bucket
+        self.prefix = (prefix or '').strip('/')
+        self.presign_seconds = presign_seconds
+        self._client = client
+        self._client_options = {
+            'endpoint_url': endpoint_url or None,
+            'region_name': region or None,
+            'aws_access_key_id': access_key_id or None,
+            'aws_secret_access_key': secret_access_key or None,
+        }
+
+    @property
+    def client(self):
+        if self._client is None:
+            try:
+                import boto3
+                from botocore.config import Config as BotoConfig
+            except ImportError as exc:
+                raise RuntimeError('Для MEDIA_STORAGE_BACKEND=s3 установите пакет boto3') from exc
+            # path-style адреса нужны MinIO и большинству самостоятельно развёрнутых S3
+            self._client = boto3.client(
+                's3',
+                config=BotoConfig(signature_version='s3v4', s3={'addressing_style': 'path'}),
+                **self._client_options,
+            )
+        return self._client
+
+    def key(self, relative_path):
+        relative_path = relative_path.replace(os.sep, '/').lstrip('/')
+        return f'{self.prefix}/{relative_path}' if self.prefix else relative_path
+
+    def put_file(self, local_path, relative_path, content_type=None):
+        self.client.upload_file(
+            local_path,
+            self.bucket,
+            self.key(relative_path),
+            ExtraArgs={
+                'ContentType': content_type or guess_content_type(relative_path),
+                # Пути хранилища меняются вместе с содержимым
+                'CacheControl': _IMMUTABLE_CACHE_CONTROL,
+            },
+        )
+
+    def get_file(self, relative_path, local_path):
+        """Скачать объект в ``local_path`` (атомарно); False, если объекта нет."""
+        directory = os.path.dirname(local_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.download-', dir=directory)
+        os.close(fd)
+        try:
+            self.client.download_file(self.bucket, self.key(relative_path), temp_path)
+            os.replace(temp_path, local_path)
+            return True
+        except Exception as exc:
+            if _is_not_found(exc):
+                return False
+            raise
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def delete(self, relative_path):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(relative_path))
+
+    def delete_prefix(self, relative_dir):
+        prefix = self.key(relative_dir).rstrip('/') + '/'
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            objects = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if objects:
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': objects, 'Quiet': True})
+
+    def exists(self, relative_path):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(relative_path))
+            return True
+        except Exception as exc:
+            if _is_not_found(exc):
+                return False
+            raise
+
+    def presigned_url(self, relative_path, content_type=None):
+        """Presigned GET: подпись в query string, поэтому браузер может добавлять Range сам."""
+        params = {'Bucket': self.bucket, 'Key': self.key(relative_path)}
+        if content_type:
+            params['ResponseContentType'] = content_type
+        return self.client.generate_presigned_url(
+            'get_object', Params=params, ExpiresIn=self.presign_seconds,
+        )
+
+
+def _is_not_found(exc):
+    response = getattr(exc, 'response', None) or {}
+    code = str((response.get('Error') or {}).get('Code', ''))
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+def create_media_storage(config):
+    backend = (config.get('MEDIA_STORAGE_BACKEND') or BACKEND_LOCAL).lower()
+    if backend == BACKEND_LOCAL:
+        return LocalMediaStorage()
+    if backend == BACKEND_S3:
+        return S3MediaStorage(
+            bucket=config.get('MEDIA_S3_BUCKET'),
+            prefix=config.get('MEDIA_S3_PREFIX'),
+            endpoint_url=config.get('MEDIA_S3_ENDPOINT_URL'),
+            region=config.get('MEDIA_S3_REGION'),
+            access_key_id=config.get('MEDIA_S3_ACCESS_KEY_ID'),
+            secret_access_key=config.get('MEDIA_S3_SECRET_ACCESS_KEY'),
+            presign_seconds=config.get('MEDIA_S3_PRESIGN_SECONDS') or 3600,
+        )
+    raise ValueError(f'Неизвестный MEDIA_STORAGE_BACKEND: {backend}')
+
+
+def get_media_storage():
+    """Драйвер хранилища текущего приложения (создаётся при первом обращении)."""
+    storage = current_app.extensions.get(_EXTENSION_KEY)
+    if storage is None:
+        storage = current_app.extensions[_EXTENSION_KEY] = create_media_storage(current_app.config)
+    return storage
+
+
+def _media_root():
+    return current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+
+
+def publish_media(relative_path, content_type=None):
+    """Выгрузить локальный файл в удалённое хранилище (для ``local`` ничего не делает)."""
+    storage = get_media_storage()
+    if not storage.remote or not relative_path:
+        return
+    absolute_path = resolve_media_path(_media_root(), relative_path)
+    if absolute_path is None or not os.path.isfile(absolute_path):
+        return
+    storage.put_file(absolute_path, relative_path.replace(os.sep, '/'), content_type)
+
+
+def publish_media_tree(relative_dir):
+    """Выгрузить каталог производных файлов (HLS, превью, копии постеров)."""
+    storage = get_media_storage()
+    if not storage.remote or not relative_dir:
+        return 0
+    absolute_dir = resolve_media_path(_media_root(), relative_dir)
+    if absolute_dir is None or not os.path.isdir(absolute_dir):
+        return 0
+    uploaded = 0
+    for directory, _, filenames in os.walk(absolute_dir):
+        for filename in filenames:
+            if filename.startswith('.'):
+                continue
+            absolute_path = os.path.join(directory, filename)
+            relative_path = posixpath.join(
+                relative_dir.replace(os.sep, '/'),
+                os.path.relpath(absolute_path, absolute_dir).replace(os.sep, '/'),
+            )
+            storage.put_file(absolute_path, relative_path)
+            uploaded += 1
+    return uploaded
+
+
+def ensure_local_media(relative_path):
+    """
+    Абсолютный путь файла на диске этого узла, при необходимости скачанного
+    из удалённого хранилища; None, если файла нет нигде.
+    """
+    absolute_path = resolve_media_path(_media_root(), relative_path)
+    if absolute_path is None:
+        return None
+    if os.path.isfile(absolute_path):
+        return absolute_path
+    storage = get_media_storage()
+    if storage.remote and storage.get_file(relative_path.replace(os.sep, '/'), absolute_path):
+        current_app.logger.info('Медиафайл %s скачан из удалённого хранилища', relative_path)
+        return absolute_path
+    return None
+
+
+def remote_media_url(relative_path, content_type=None):
+    """Presigned URL объекта или None, если хранилище локальное."""
+    storage = get_media_storage()
+    if not storage.remote or not relative_path:
+        return None
+    return storage.presigned_url(relative_path.replace(os.sep, '/'), content_type)
+
+
+def delete_remote_media(relative_path=None, relative_dir=None):
+    """Удалить объект и/или каталог производных из удалённого хранилища; ошибки только в лог."""
+    storage = get_media_storage()
+    if not storage.remote:
+        return
+    try:
+        if relative_path:
+            storage.delete(relative_path.replace(os.sep, '/'))
+        if relative_dir:
+            storage.delete_prefix(relative_dir.replace(os.sep, '/'))
+    except Exception as exc:
+        current_app.logger.warning(
+            'Не удалось удалить %s из удалённого хранилища: %s', relative_path or relative_dir, exc,
+        )
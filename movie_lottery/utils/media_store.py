@@ -0,0 +1,272 @@
+"""
+Хранение трейлеров и постеров по SHA-256 содержимого.
+
+Файл лежит в ``<подкаталог>/sha256/<2 символа хэша>/<хэш><расширение>``:
+одинаковые байты, загруженные или скачанные повторно под другим фильмом,
+хранятся один раз. Хэш считается по мере записи потока (``BlobWriter``),
+без отдельного прохода по файлу.
+
+Ссылки из ``LibraryMovie.trailer_file_path`` и ``poster_file_path``
+учитываются в ``media_blob.ref_count``: ``adopt_file`` добавляет ссылку,
+``release_media`` снимает её, а ``collect_orphan_blobs`` удаляет файлы,
+на которые больше никто не ссылается. Файлы со старыми именами
+(``movie_<id>_<uuid>.mp4``, ``poster_<id>.jpg``) в таблице не учтены и
+удаляются сразу, как только на них не остаётся ссылок.
+"""
+import hashlib
+import os
+import posixpath
+import tempfile
+
+from flask import current_app
+from sqlalchemy import insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .. import db
+from ..models import LibraryMovie, MediaBlob
+from .helpers import vladivostok_now
+from .media_delivery import resolve_media_path
+from .media_storage import delete_remote_media, publish_media
+
+KIND_TRAILER = 'trailer'
+KIND_POSTER = 'poster'
+
+_KIND_SUBDIR_SETTINGS = {
+    KIND_TRAILER: ('TRAILER_UPLOAD_SUBDIR', 'trailers'),
+    KIND_POSTER: ('POSTER_UPLOAD_SUBDIR', 'posters'),
+}
+
+# Временные файлы пишутся в каталог хранилища, чтобы перенос был атомарным os.replace
+INCOMING_PREFIX = '.incoming-'
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+# Сколько раз acquire_blob повторяет UPDATE/INSERT, проигрывая гонку параллельным запросам
+_ACQUIRE_ATTEMPTS = 5
+
+_PURGE_HOOKS = {}
+
+
+def register_purge_hook(kind):
+    """Декоратор: вызвать ``func(relative_path, media_root)`` после удаления файла вида ``kind``."""
+    def decorator(func):
+        _PURGE_HOOKS.setdefault(kind, []).append(func)
+        return func
+    return decorator
+
+
+def _media_root():
+    return current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+
+
+def kind_subdir(kind):
+    setting, default = _KIND_SUBDIR_SETTINGS[kind]
+    return current_app.config.get(setting, default)
+
+
+def store_relative_dir(kind):
+    """Каталог хранилища вида ``kind`` относительно TRAILER_MEDIA_ROOT."""
+    return posixpath.join(kind_subdir(kind), 'sha256')
+
+
+def blob_relative_path(kind, sha256, ext):
+    return posixpath.join(store_relative_dir(kind), sha256[:2], f'{sha256}{(ext or "").lower()}')
+
+
+def hash_file(path):
+    """SHA-256 (hex) и размер готового файла."""
+    hasher = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(_HASH_CHUNK_SIZE), b''):
+            hasher.update(block)
+            size += len(block)
+    return hasher.hexdigest(), size
+
+
+class BlobWriter:
+    """Пишет поток во временный файл хранилища, попутно считая SHA-256 и размер."""
+
+    def __init__(self, kind):
+        self.kind = kind
+        incoming_dir = os.path.join(_media_root(), store_relative_dir(kind))
+        os.makedirs(incoming_dir, exist_ok=True)
+        fd, self.temp_path = tempfile.mkstemp(prefix=INCOMING_PREFIX, dir=incoming_dir)
+        self._file = os.fdopen(fd, 'wb')
+        self._hasher = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self._hasher.update(data)
+        self.size += len(data)
+
+    def commit(self, ext):
+        """Перенести записанный файл в хранилище; вернуть его относительный путь."""
+        self._file.close()
+        return adopt_file(self.temp_path, self._hasher.hexdigest(), self.size, self.kind, ext)
+
+    def abort(self):
+        self._file.close()
+        try:
+            os.remove(self.temp_path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.abort()
+        return False
+
+
+def acquire_blob(relative_path, sha256, size, kind):
+    """
+    Добавить ссылку на файл хранилища (commit — у вызывающего). Вернуть
+    True, если запись уже была: UPDATE держит блокировку строки до commit,
+    и сборщик сирот не удалит файл, пока ссылка не сохранена.
+
+    Без учтённой ссылки файл нельзя класть в хранилище, поэтому, если запись
+    так и не удалось ни обновить, ни создать, поднимается IntegrityError.
+    """
+    values = {'ref_count': MediaBlob.ref_count + 1, 'updated_at': vladivostok_now()}
+    for attempt in range(_ACQUIRE_ATTEMPTS):
+        updated = db.session.execute(
+            update(MediaBlob)
+            .where(MediaBlob.relative_path == relative_path)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated:
+            return True
+        try:
+            # INSERT через Core: объект в identity map после отката savepoint
+            # конфликтовал бы со строкой, созданной параллельным запросом
+            with db.session.begin_nested():
+                db.session.execute(insert(MediaBlob).values(
+                    sha256=sha256, kind=kind, relative_path=relative_path, size=size, ref_count=1,
+                ))
+            return False
+        except IntegrityError:
+            if attempt + 1 == _ACQUIRE_ATTEMPTS:
+                raise
+            # Ту же запись только что создал параллельный запрос — увеличиваем её счётчик
+            # (а если сборщик сирот успел её удалить, следующий INSERT создаст новую)
+            continue
+
+
+def adopt_file(source_path, sha256, size, kind, ext):
+    """
+    Перенести готовый файл в хранилище по его хэшу и добавить ссылку.
+
+    Если такие байты уже хранятся, ``source_path`` просто удаляется.
+    Возвращает относительный путь файла в хранилище; commit — у вызывающего.
+    """
+    relative_path = blob_relative_path(kind, sha256, ext)
+    target_path = resolve_media_path(_media_root(), relative_path)
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+    # Сначала ссылка, потом файл: пока строка media_blob заблокирована нашим
+    # UPDATE, сборщик сирот её не удалит. Если строки не было, файл на диске
+    # мог остаться от только что собранной сироты — заменяем его своим.
+    blob_existed = acquire_blob(relative_path, sha256, size, kind)
+    if blob_existed and os.path.exists(target_path) and os.path.getsize(target_path) == size:
+        os.remove(source_path)
+        current_app.logger.info('Файл %s уже хранится, копия не нужна', relative_path)
+    else:
+        os.replace(source_path, target_path)
+        # С драйвером s3 новый файл сразу уходит в бакет — его могут запросить с любого узла
+        publish_media(relative_path)
+    return relative_path
+
+
+def _is_referenced(relative_path):
+    return db.session.execute(
+        select(LibraryMovie.id)
+        .where(or_(LibraryMovie.trailer_file_path == relative_path, LibraryMovie.poster_file_path == relative_path))
+        .limit(1)
+    ).first() is not None
+
+
+def _run_purge_hooks(relative_path, kind):
+    for hook in _PURGE_HOOKS.get(kind, []):
+        hook(relative_path, _media_root())
+
+
+def _purge_file(relative_path, kind):
+    absolute_path = resolve_media_path(_media_root(), relative_path)
+    try:
+        if absolute_path and os.path.exists(absolute_path):
+            os.remove(absolute_path)
+    except OSError as exc:
+        current_app.logger.warning('Не удалось удалить медиафайл %s: %s', absolute_path, exc)
+    delete_remote_media(relative_path)
+    _run_purge_hooks(relative_path, kind)
+
+
+def release_media(relative_path, kind):
+    """
+    Снять ссылку фильма на файл — после того, как путь в LibraryMovie уже
+    заменён или фильм удалён (и изменения отправлены в сессию).
+    """
+    if not relative_path:
+        return
+    updated = db.session.execute(
+        update(MediaBlob)
+        .where(MediaBlob.relative_path == relative_path, MediaBlob.ref_count > 0)
+        .values(ref_count=MediaBlob.ref_count - 1, updated_at=vladivostok_now())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if updated:
+        return
+
+    blob_exists = db.session.execute(
+        select(MediaBlob.id).where(MediaBlob.relative_path == relative_path)
+    ).first() is not None
+    if blob_exists or _is_referenced(relative_path):
+        return
+    # Файл со старым именем — вне учёта хранилища, удаляем сразу
+    _purge_file(relative_path, kind)
+
+
+def adopt_legacy_file(relative_path, kind):
+    """
+    Перенести файл со старым именем в хранилище; вернуть новый путь
+    (или None, если файла нет). Путь в LibraryMovie и commit — у вызывающего.
+    """
+    absolute_path = resolve_media_path(_media_root(), relative_path)
+    if absolute_path is None or not os.path.isfile(absolute_path):
+        return None
+    sha256, size = hash_file(absolute_path)
+    new_path = adopt_file(absolute_path, sha256, size, kind, os.path.splitext(relative_path)[1])
+    # Производные файлы (HLS, превью) строились по старому имени
+    _run_purge_hooks(relative_path, kind)
+    return new_path
+
+
+def collect_orphan_blobs():
+    """Удалить файлы хранилища, на которые не осталось ссылок; вернуть их число."""
+    orphans = db.session.execute(
+        select(MediaBlob.id, MediaBlob.relative_path, MediaBlob.kind).where(MediaBlob.ref_count <= 0)
+    ).all()
+    removed = 0
+    for blob_id, relative_path, kind in orphans:
+        # Счётчик перепроверяется в самом DELETE, а файл удаляется до commit: до
+        # этого момента строка заблокирована, и adopt_file того же хэша ждёт её,
+        # а затем создаёт новую запись и кладёт файл заново
+        deleted = db.session.execute(
+            MediaBlob.__table__.delete()
+            .where(MediaBlob.id == blob_id, MediaBlob.ref_count <= 0)
+        ).rowcount
+        if deleted:
+            _purge_file(relative_path, kind)
+            removed += 1
+        db.session.commit()
+    return removed
+
+
+def is_stored_blob(relative_path):
+    return db.session.execute(
+        select(MediaBlob.id).where(MediaBlob.relative_path == relative_path)
+    ).first() is not None
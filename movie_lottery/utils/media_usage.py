@@ -0,0 +1,299 @@
+"""
+Учёт места, занятого трейлерами и постерами фильмов.
+
+Размер файла каждого фильма лежит в ``LibraryMovie.trailer_file_size`` и
+``poster_file_size``, а суммы по фильмам — в таблице ``media_usage``. Суммы
+меняются на ту же разницу при загрузке, замене, faststart и удалении
+(``track_media_size``), поэтому отчёт не обходит медиакаталог.
+``recount_media_usage`` пересчитывает их по library_movie (заодно заполняя
+размеры старых постеров) на случай расхождения.
+
+Файл хранилища SHA-256 может принадлежать нескольким фильмам, поэтому
+место на диске и квоты считаются отдельно (``stored_media_totals``): по
+``media_blob.size`` каждого файла, на который есть ссылки, плюс файлы со
+старыми именами вне хранилища.
+
+Квоты в мегабайтах (0 — без ограничения): MEDIA_QUOTA_TOTAL_MB,
+MEDIA_QUOTA_TRAILERS_MB, MEDIA_QUOTA_POSTERS_MB.
+"""
+import os
+
+from flask import current_app
+from sqlalchemy import func, select, update
+
+from .. import db
+from ..models import LibraryMovie, MediaBlob, MediaUsage
+from .helpers import vladivostok_now
+from .media_delivery import resolve_media_path
+from .media_store import KIND_POSTER, KIND_TRAILER
+
+KINDS = (KIND_TRAILER, KIND_POSTER)
+
+_MOVIE_COLUMNS = {
+    KIND_TRAILER: ('trailer_file_path', 'trailer_file_size'),
+    KIND_POSTER: ('poster_file_path', 'poster_file_size'),
+}
+_QUOTA_SETTINGS = {
+    KIND_TRAILER: 'MEDIA_QUOTA_TRAILERS_MB',
+    KIND_POSTER: 'MEDIA_QUOTA_POSTERS_MB',
+}
+_KIND_LABELS = {
+    KIND_TRAILER: 'трейлеры',
+    KIND_POSTER: 'постеры',
+}
+_MEGABYTE = 1024 * 1024
+
+
+class MediaQuotaExceeded(Exception):
+    """Загрузка превысила бы квоту места."""
+
+    def __init__(self, message, scope, limit_bytes, used_bytes):
+        super().__init__(message)
+        self.scope = scope
+        self.limit_bytes = limit_bytes
+        self.used_bytes = used_bytes
+
+
+def movie_media_size(movie, kind):
+    """Размер файла фильма вида ``kind``: None — файла нет, 0 — размер не записан."""
+    path_attribute, size_attribute = _MOVIE_COLUMNS[kind]
+    if not getattr(movie, path_attribute):
+        return None
+    return getattr(movie, size_attribute) or 0
+
+
+def _backfill_poster_sizes():
+    """Заполнить poster_file_size постеров, сохранённых до учёта места."""
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT') or ''
+    rows = db.session.execute(
+        select(LibraryMovie.id, LibraryMovie.poster_file_path, MediaBlob.size)
+        .outerjoin(MediaBlob, MediaBlob.relative_path == LibraryMovie.poster_file_path)
+        .where(
+            LibraryMovie.poster_file_path.isnot(None),
+            LibraryMovie.poster_file_path != '',
+            LibraryMovie.poster_file_size.is_(None),
+        )
+    ).all()
+    filled = 0
+    for movie_id, relative_path, blob_size in rows:
+        size = blob_size
+        if size is None:
+            # Старые poster_<id>.jpg вне хранилища SHA-256
+            absolute_path = resolve_media_path(media_root, relative_path)
+            if absolute_path is None or not os.path.isfile(absolute_path):
+                continue
+            size = os.path.getsize(absolute_path)
+        db.session.execute(
+            update(LibraryMovie).where(LibraryMovie.id == movie_id).values(poster_file_size=size)
+        )
+        filled += 1
+    return filled
+
+
+def recount_media_usage(kinds=KINDS):
+    """Пересчитать итоги по library_movie (commit — у вызывающего)."""
+    if KIND_POSTER in kinds:
+        _backfill_poster_sizes()
+    now = vladivostok_now()
+    for kind in kinds:
+        path_attribute, size_attribute = _MOVIE_COLUMNS[kind]
+        path_column = getattr(LibraryMovie, path_attribute)
+        total_bytes, file_count = db.session.execute(
+            select(func.coalesce(func.sum(getattr(LibraryMovie, size_attribute)), 0), func.count(path_column))
+            .where(path_column.isnot(None), path_column != '')
+        ).one()
+        usage = db.session.get(MediaUsage, kind)
+        if usage is None:
+            usage = MediaUsage(kind=kind)
+            db.session.add(usage)
+        usage.total_bytes = int(total_bytes or 0)
+        usage.file_count = int(file_count or 0)
+        usage.recounted_at = now
+    db.session.flush()
+    return media_usage_totals()
+
+
+def track_media_size(kind, old_size, new_size):
+    """
+    Учесть смену файла фильма в итогах (commit — у вызывающего).
+
+    ``old_size`` / ``new_size`` — значения ``movie_media_size`` до и после
+    изменения LibraryMovie (None — файла нет).
+    """
+    delta_bytes = (new_size or 0) - (old_size or 0)
+    delta_files = int(new_size is not None) - int(old_size is not None)
+    if not delta_bytes and not delta_files:
+        return
+    db.session.flush()
+    result = db.session.execute(
+        update(MediaUsage)
+        .where(MediaUsage.kind == kind)
+        .values(
+            total_bytes=MediaUsage.total_bytes + delta_bytes,
+            file_count=MediaUsage.file_count + delta_files,
+            updated_at=vladivostok_now(),
+        )
+    )
+    if result.rowcount == 0:
+        # Итоги ещё не считались: пересчёт уже увидит изменённую строку фильма
+        recount_media_usage((kind,))
+
+
+def _stored_file_size(relative_path):
+    size = db.session.execute(
+        select(MediaBlob.size).where(MediaBlob.relative_path == relative_path)
+    ).scalar()
+    if size is not None:
+        return size
+    absolute_path = resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', relative_path)
+    if absolute_path is None or not os.path.isfile(absolute_path):
+        return None
+    return os.path.getsize(absolute_path)
+
+
+def set_movie_poster(movie, relative_path, size=None):
+    """Сделать ``relative_path`` постером фильма и учесть его размер (по умолчанию — из media_blob)."""
+    if relative_path and size is None:
+        size = _stored_file_size(relative_path)
+    old_size = movie_media_size(movie, KIND_POSTER)
+    movie.poster_file_path = relative_path
+    movie.poster_file_size = size if relative_path else None
+    track_media_size(KIND_POSTER, old_size, movie_media_size(movie, KIND_POSTER))
+
+
+def media_usage_totals():
+    """Суммы по фильмам ``{вид: {'bytes', 'files'}}``; отсутствующие пересчитываются."""
+    rows = {usage.kind: usage for usage in MediaUsage.query.filter(MediaUsage.kind.in_(KINDS)).all()}
+    missing = [kind for kind in KINDS if kind not in rows]
+    if missing:
+        recount_media_usage(tuple(missing))
+        rows = {usage.kind: usage for usage in MediaUsage.query.filter(MediaUsage.kind.in_(KINDS)).all()}
+    return {kind: {'bytes': rows[kind].total_bytes, 'files': rows[kind].file_count} for kind in KINDS}
+
+
+def stored_media_totals():
+    """
+    Место на диске ``{вид: {'bytes', 'files'}}``: файл хранилища учитывается
+    один раз, сколько бы фильмов на него ни ссылалось. Сироты, ожидающие
+    сборщика (``ref_count`` 0), в итог не входят.
+    """
+    # Первый пересчёт сумм заполняет и размеры старых постеров, нужные ниже
+    media_usage_totals()
+    totals = {kind: {'bytes': 0, 'files': 0} for kind in KINDS}
+    blob_rows = db.session.execute(
+        select(MediaBlob.kind, func.coalesce(func.sum(MediaBlob.size), 0), func.count(MediaBlob.id))
+        .where(MediaBlob.ref_count > 0, MediaBlob.kind.in_(KINDS))
+        .group_by(MediaBlob.kind)
+    ).all()
+    for kind, total_bytes, file_count in blob_rows:
+        totals[kind]['bytes'] += int(total_bytes or 0)
+        totals[kind]['files'] += int(file_count or 0)
+
+    for kind in KINDS:
+        # Старые movie_<id>_<uuid>.mp4 и poster_<id>.jpg принадлежат одному фильму
+        path_attribute, size_attribute = _MOVIE_COLUMNS[kind]
+        path_column = getattr(LibraryMovie, path_attribute)
+        legacy_bytes, legacy_files = db.session.execute(
+            select(func.coalesce(func.sum(getattr(LibraryMovie, size_attribute)), 0), func.count(path_column))
+            .where(
+                path_column.isnot(None),
+                path_column != '',
+                ~select(MediaBlob.id).where(MediaBlob.relative_path == path_column).exists(),
+            )
+        ).one()
+        totals[kind]['bytes'] += int(legacy_bytes or 0)
+        totals[kind]['files'] += int(legacy_files or 0)
+    return totals
+
+
+def media_quotas():
+    """Квоты в байтах: ``{'total': …, 'trailer': …, 'poster': …}``, None — без ограничения."""
+    quotas = {}
+    for scope, setting in (('total', 'MEDIA_QUOTA_TOTAL_MB'), *_QUOTA_SETTINGS.items()):
+        try:
+            megabytes = int(current_app.config.get(setting) or 0)
+        except (TypeError, ValueError):
+            megabytes = 0
+        quotas[scope] = megabytes * _MEGABYTE if megabytes > 0 else None
+    return quotas
+
+
+def check_media_quota(kind, added_bytes, replaced_bytes=0):
+    """
+    Бросить ``MediaQuotaExceeded``, если файл ``added_bytes`` (вместо
+    ``replaced_bytes``) не помещается в квоту. Пока квота исчерпана,
+    отклоняется и загрузка неизвестного размера (``added_bytes=0``).
+    """
+    quotas = media_quotas()
+    if not any(quotas.values()):
+        return
+    totals = stored_media_totals()
+    delta = (added_bytes or 0) - (replaced_bytes or 0)
+    if delta < 0:
+        # Замена файла меньшим освобождает место
+        return
+    checks = (
+        (kind, quotas[kind], totals[kind]['bytes'], _KIND_LABELS[kind]),
+        ('total', quotas['total'], sum(item['bytes'] for item in totals.values()), 'медиафайлы'),
+    )
+    for scope, limit, used, label in checks:
+        if limit is not None and (used >= limit or used + delta > limit):
+            raise MediaQuotaExceeded(
+                f'Превышена квота на {label}: занято {used / _MEGABYTE:.1f} из {limit / _MEGABYTE:.0f} МБ',
+                scope,
+                limit,
+                used,
+            )
+
+
+def media_usage_report(limit=20, movie_id=None):
+    """Место на диске, квоты, суммы по фильмам и фильмы, занимающие больше всего места."""
+    movie_totals = media_usage_totals()
+    totals = stored_media_totals()
+    quotas = media_quotas()
+    total_bytes = sum(item['bytes'] for item in totals.values())
+
+    movie_bytes = (
+        func.coalesce(LibraryMovie.trailer_file_size, 0) + func.coalesce(LibraryMovie.poster_file_size, 0)
+    )
+    query = select(
+        LibraryMovie.id, LibraryMovie.name, LibraryMovie.trailer_file_size, LibraryMovie.poster_file_size,
+    )
+    if movie_id is not None:
+        query = query.where(LibraryMovie.id == movie_id)
+    else:
+        query = query.where(movie_bytes > 0).order_by(movie_bytes.desc(), LibraryMovie.id).limit(limit)
+    movies = [
+        {
+            'id': row.id,
+            'name': row.name,
+            'trailer_bytes': row.trailer_file_size or 0,
+            'poster_bytes': row.poster_file_size or 0,
+            'total_bytes': (row.trailer_file_size or 0) + (row.poster_file_size or 0),
+        }
+        for row in db.session.execute(query)
+    ]
+
+    def _quota(scope, used):
+        limit = quotas[scope]
+        return {'limit_bytes': limit, 'remaining_bytes': max(0, limit - used) if limit is not None else None}
+
+    return {
+        'totals': {
+            'trailers': totals[KIND_TRAILER],
+            'posters': totals[KIND_POSTER],
+            'bytes': total_bytes,
+        },
+        'quotas': {
+            'total': _quota('total', total_bytes),
+            'trailers': _quota(KIND_TRAILER, totals[KIND_TRAILER]['bytes']),
+            'posters': _quota(KIND_POSTER, totals[KIND_POSTER]['bytes']),
+        },
+        # Общий файл входит в сумму каждого фильма, который на него ссылается
+        'movie_totals': {
+            'trailers': movie_totals[KIND_TRAILER],
+            'posters': movie_totals[KIND_POSTER],
+            'bytes': sum(item['bytes'] for item in movie_totals.values()),
+        },
+        'movies': movies,
+    }
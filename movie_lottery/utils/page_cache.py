@@ -0,0 +1,156 @@
+"""
+Прогрев page cache для трейлеров только что созданного опроса.
+
+После публикации опроса голосующие в первые минуты открывают одни и те же
+несколько трейлеров, и первые чтения идут с холодного диска. Прогрев
+находит трейлеры фильмов опроса в библиотеке и в фоновом потоке просит ядро
+подгрузить первые TRAILER_PREWARM_MEGABYTES каждого файла: через
+``posix_fadvise(POSIX_FADV_WILLNEED)`` (асинхронный readahead), а где его
+нет — последовательным чтением. Для HLS тот же бюджет делится между
+плейлистами и первыми сегментами всех качеств.
+
+Прогрев не нужен, когда байты отдаёт удалённое хранилище (S3), и
+пропускается.
+"""
+import os
+import posixpath
+import re
+import threading
+
+from flask import current_app
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import OperationalError, ProgrammingError
+
+from .. import db
+from ..models import LibraryMovie
+from .media_delivery import resolve_media_path
+from .media_storage import get_media_storage
+
+_READ_CHUNK_SIZE = 1024 * 1024
+_SEGMENT_RE = re.compile(r'(\d+)\.ts$')
+
+
+def _prewarm_budget():
+    try:
+        megabytes = int(current_app.config.get('TRAILER_PREWARM_MEGABYTES') or 0)
+    except (TypeError, ValueError):
+        return 0
+    return max(0, megabytes) * 1024 * 1024
+
+
+def warm_file(path, length):
+    """Подгрузить первые ``length`` байт файла в page cache; вернуть объём прогретых байт."""
+    with open(path, 'rb') as fh:
+        length = min(length, os.fstat(fh.fileno()).st_size)
+        if length <= 0:
+            return 0
+        fadvise = getattr(os, 'posix_fadvise', None)
+        if fadvise is not None:
+            fadvise(fh.fileno(), 0, length, os.POSIX_FADV_WILLNEED)
+            return length
+        remaining = length
+        while remaining > 0:
+            chunk = fh.read(min(_READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+        return length - remaining
+
+
+def _hls_files(hls_dir):
+    """Файлы HLS в порядке воспроизведения: плейлисты, затем сегменты по номеру во всех качествах."""
+    playlists = []
+    segments = []
+    for directory, _, filenames in os.walk(hls_dir):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if filename.endswith('.m3u8'):
+                playlists.append(path)
+                continue
+            match = _SEGMENT_RE.search(filename)
+            if match:
+                segments.append((int(match.group(1)), path))
+    segments.sort()
+    return sorted(playlists) + [path for _, path in segments]
+
+
+def _warm_targets(targets, budget, logger):
+    warmed = 0
+    for path, is_hls in targets:
+        try:
+            if not is_hls:
+                warmed += warm_file(path, budget)
+                continue
+            remaining = budget
+            for file_path in _hls_files(path):
+                if remaining <= 0:
+                    break
+                done = warm_file(file_path, remaining)
+                remaining -= done
+                warmed += done
+        except OSError as exc:
+            logger.warning('Не удалось прогреть %s: %s', path, exc)
+    logger.info('Прогрев трейлеров опроса: %s файлов, %.1f МБ', len(targets), warmed / (1024 * 1024))
+    return warmed
+
+
+def _poll_library_movies(poll):
+    conditions = []
+    kinopoisk_ids = {movie.kinopoisk_id for movie in poll.movies if movie.kinopoisk_id}
+    if kinopoisk_ids:
+        conditions.append(LibraryMovie.kinopoisk_id.in_(kinopoisk_ids))
+    # Как и watch-trailer: без kinopoisk_id фильм ищется по названию и году
+    for movie in poll.movies:
+        if not movie.kinopoisk_id and movie.name and movie.year:
+            conditions.append(and_(LibraryMovie.name == movie.name, LibraryMovie.year == movie.year))
+    if not conditions:
+        return []
+    return db.session.execute(
+        select(LibraryMovie.trailer_file_path, LibraryMovie.trailer_hls_path)
+        .where(
+            LibraryMovie.trailer_file_path.isnot(None),
+            LibraryMovie.trailer_file_path != '',
+            or_(*conditions),
+        )
+    ).all()
+
+
+def prewarm_poll_trailers(poll):
+    """
+    Запустить фоновый прогрев трейлеров опроса; вернуть поток или None,
+    если прогрев выключен или прогревать нечего.
+    """
+    if not current_app.config.get('TRAILER_PREWARM_ENABLED'):
+        return None
+    budget = _prewarm_budget()
+    media_root = current_app.config.get('TRAILER_MEDIA_ROOT')
+    if not budget or not media_root or get_media_storage().remote:
+        return None
+
+    try:
+        rows = _poll_library_movies(poll)
+    except (ProgrammingError, OperationalError) as exc:
+        db.session.rollback()
+        current_app.logger.warning('Не удалось найти трейлеры опроса %s для прогрева: %s', poll.id, exc)
+        return None
+
+    targets = []
+    for trailer_path, hls_path in rows:
+        absolute_path = resolve_media_path(media_root, trailer_path)
+        if absolute_path and os.path.isfile(absolute_path):
+            targets.append((absolute_path, False))
+        hls_dir = resolve_media_path(media_root, posixpath.dirname(hls_path)) if hls_path else None
+        if hls_dir and os.path.isdir(hls_dir):
+            targets.append((hls_dir, True))
+    if not targets:
+        return None
+
+    # Пути уже разрешены: потоку не нужны ни контекст приложения, ни БД
+    thread = threading.Thread(
+        target=_warm_targets,
+        args=(targets, budget, current_app.logger),
+        name=f'trailer-prewarm-{poll.id}',
+        daemon=True,
+    )
+    thread.start()
+    return thread
@@ -0,0 +1,92 @@
+"""
+Скачивание постеров по внешним URL в хранилище (media_store).
+
+Все загрузки процесса идут через одну ``requests.Session`` с пулом
+соединений и повторами с экспоненциальной задержкой: keep-alive к
+CDN Кинопоиска экономит TCP/TLS-рукопожатие на каждом постере.
+``download_poster`` только скачивает файл и считает его хэш, не трогая
+БД, поэтому её можно вызывать из потоков пула миграции.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .media_store import KIND_POSTER, BlobWriter
+
+_POSTER_TIMEOUT = 15
+_CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def fix_poster_url(poster_url):
+    """Исправляет URL постера с нерабочего домена на рабочий."""
+    if not poster_url:
+        return poster_url
+    if 'image.openmoviedb.com/kinopoisk-images/' in poster_url:
+        return poster_url.replace(
+            'image.openmoviedb.com/kinopoisk-images/',
+            'avatars.mds.yandex.net/get-kinopoisk-image/'
+        )
+    return poster_url
+
+
+def poster_extension(content_type):
+    content_type = (content_type or '').lower()
+    if 'png' in content_type:
+        return '.png'
+    if 'webp' in content_type:
+        return '.webp'
+    return '.jpg'
+
+
+def build_http_session(pool_size=10, retries=3, backoff=0.5):
+    """Session с пулом keep-alive соединений и повторами на 429/5xx и сетевых ошибках."""
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(['GET']),
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_http_session(pool_size=10):
+    """Общая для процесса Session (создаётся при первом вызове)."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = build_http_session(pool_size=pool_size)
+        return _session
+
+
+def download_poster(poster_url, session=None):
+    """
+    Скачать постер во временный файл хранилища, попутно считая SHA-256.
+
+    Возвращает ``(writer, ext)``: вызывающий делает ``writer.commit(ext)``
+    (это уже работа с БД) или ``writer.abort()``. Ошибки сети пробрасываются.
+    """
+    session = session or get_http_session()
+    with session.get(fix_poster_url(poster_url), timeout=_POSTER_TIMEOUT, stream=True) as response:
+        response.raise_for_status()
+        ext = poster_extension(response.headers.get('Content-Type'))
+        writer = BlobWriter(KIND_POSTER)
+        try:
+            for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+                writer.write(chunk)
+        except Exception:
+            writer.abort()
+            raise
+    if not writer.size:
+        writer.abort()
+        raise ValueError('Пустой ответ вместо постера')
+    return writer, ext
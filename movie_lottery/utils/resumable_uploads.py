@@ -0,0 +1,286 @@
+"""
+Возобновляемая загрузка трейлеров по протоколу tus 1.0.0
+(расширения creation, termination, checksum, expiration).
+
+Клиент создаёт загрузку (POST с Upload-Length), затем отправляет куски
+PATCH-запросами с Upload-Offset. Каждый кусок дописывается прямо в
+итоговый файл трейлера — без временного файла Werkzeug и без повторного
+копирования. После обрыва клиент спрашивает смещение (HEAD) и продолжает
+с него. SHA-256 всего файла считается по мере записи и сверяется с
+ожидаемым, когда загружен последний байт; по нему же готовый файл
+переносится в хранилище (media_store) без повторного чтения.
+"""
+import base64
+import binascii
+import hashlib
+import mimetypes
+import os
+import threading
+import uuid
+from datetime import timedelta
+
+try:
+    import fcntl
+except ImportError:  # Windows: куски одной загрузки не защищены от параллельной записи
+    fcntl = None
+
+from flask import current_app
+from sqlalchemy import select, update
+from werkzeug.exceptions import ClientDisconnected
+
+from .. import db
+from ..models import TrailerUpload
+from .helpers import vladivostok_now
+from .media_delivery import resolve_media_path
+from .media_store import INCOMING_PREFIX, KIND_TRAILER, store_relative_dir
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,termination,checksum,expiration'
+TUS_CHECKSUM_ALGORITHMS = 'sha256'
+# Статус tus для несовпадения контрольной суммы куска
+CHECKSUM_MISMATCH_STATUS = 460
+
+_CHUNK_SIZE = 1024 * 1024
+
+# Незавершённые хэши по id загрузки: (смещение, hashlib-объект). Если следующий
+# кусок пришёл в другой процесс, хэш досчитывается чтением файла при завершении.
+_running_hashes = {}
+_running_hashes_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Ошибка протокола загрузки с HTTP-статусом для ответа клиенту."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_upload_metadata(header):
+    """Разобрать Upload-Metadata: 'key base64value,key2 base64value2'."""
+    metadata = {}
+    for item in (header or '').split(','):
+        key, _, encoded = item.strip().partition(' ')
+        if not key:
+            continue
+        try:
+            metadata[key] = base64.b64decode(encoded.strip()).decode('utf-8') if encoded else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f'Некорректное значение Upload-Metadata для {key}')
+    return metadata
+
+
+def _parse_checksum_header(header):
+    """Upload-Checksum: 'sha256 <base64-дайджест>' -> байты дайджеста."""
+    algorithm, _, encoded = (header or '').strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise UploadError('Поддерживается только контрольная сумма sha256')
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except binascii.Error:
+        raise UploadError('Некорректное значение Upload-Checksum')
+
+
+def upload_absolute_path(upload):
+    return resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', upload.relative_path)
+
+
+def _expiry_from(now):
+    hours = current_app.config.get('TRAILER_UPLOAD_EXPIRY_HOURS', 24)
+    return now + timedelta(hours=hours)
+
+
+def create_upload(movie, settings, upload_length, metadata):
+    """Создать загрузку и пустой файл в хранилище; вернуть TrailerUpload (commit — у вызывающего)."""
+    max_size = settings.get('max_size') or 0
+    if upload_length <= 0:
+        raise UploadError('Пустой файл трейлера')
+    if max_size and upload_length > max_size:
+        raise UploadError('Размер файла превышает допустимый лимит.', 413)
+
+    mimetype = (metadata.get('filetype') or '').lower()
+    allowed_mime_types = settings.get('allowed_mime_types', [])
+    if allowed_mime_types and mimetype and mimetype not in allowed_mime_types:
+        raise UploadError('Недопустимый тип файла. Загрузите видеофайл.')
+
+    checksum = (metadata.get('checksum') or '').strip().lower() or None
+    if checksum and (len(checksum) != 64 or any(ch not in '0123456789abcdef' for ch in checksum)):
+        raise UploadError('checksum должен быть SHA-256 в шестнадцатеричном виде')
+
+    original_ext = os.path.splitext(metadata.get('filename') or '')[1].lower()
+    guessed_ext = mimetypes.guess_extension(mimetype) or '' if mimetype else ''
+    upload_id = uuid.uuid4().hex
+    # Файл копится рядом с хранилищем: после проверки хэша его переносит os.replace
+    relative_path = os.path.join(
+        store_relative_dir(KIND_TRAILER),
+        f"{INCOMING_PREFIX}upload-{upload_id}{original_ext or guessed_ext}",
+    )
+    absolute_path = resolve_media_path(current_app.config.get('TRAILER_MEDIA_ROOT') or '', relative_path)
+    os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+    with open(absolute_path, 'wb'):
+        pass
+
+    now = vladivostok_now()
+    upload = TrailerUpload(
+        id=upload_id,
+        movie_id=movie.id,
+        relative_path=relative_path,
+        mime_type=mimetype or None,
+        upload_length=upload_length,
+        upload_offset=0,
+        checksum=checksum,
+        created_at=now,
+        updated_at=now,
+        expires_at=_expiry_from(now),
+    )
+    db.session.add(upload)
+    with _running_hashes_lock:
+        _running_hashes[upload.id] = (0, hashlib.sha256())
+    return upload
+
+
+def _lock_upload_file(target):
+    """Захватить файл загрузки на время записи куска; занят — UploadError 409."""
+    if fcntl is None:
+        return
+    try:
+        fcntl.flock(target.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (BlockingIOError, OSError):
+        raise UploadError('Загрузка уже принимает кусок, повторите по актуальному Upload-Offset', 409)
+
+
+def append_chunk(upload, stream, content_length=None, chunk_checksum=None):
+    """
+    Дописать кусок из ``stream`` по текущему смещению загрузки и
+    зафиксировать новое смещение (commit — здесь, пока файл захвачен).
+
+    Пока кусок пишется, файл загрузки захвачен flock, а транзакция БД уже
+    закрыта: строка ``trailer_upload`` не блокируется на всё время передачи.
+    Параллельный PATCH той же загрузки сразу получает 409. Смещение
+    записывается условным UPDATE: если загрузку за это время удалили или
+    сдвинули, кусок отклоняется с 409.
+
+    При обрыве соединения сохраняется всё, что успело записаться (если у
+    куска нет Upload-Checksum), — клиент продолжит с нового смещения.
+    Возвращает новое смещение.
+    """
+    absolute_path = upload_absolute_path(upload)
+    if absolute_path is None or not os.path.exists(absolute_path):
+        raise UploadError('Файл загрузки не найден', 404)
+
+    offset = upload.upload_offset
+    upload_id = upload.id
+    remaining = upload.upload_length - offset
+    if content_length is not None and content_length > remaining:
+        raise UploadError('Кусок выходит за пределы Upload-Length', 413)
+
+    expected_digest = _parse_checksum_header(chunk_checksum) if chunk_checksum else None
+    chunk_hasher = hashlib.sha256() if expected_digest is not None else None
+
+    with open(absolute_path, 'r+b') as target:
+        _lock_upload_file(target)
+        # Предыдущий кусок мог завершиться после того, как запрос прочитал строку
+        committed_offset = db.session.execute(
+            select(TrailerUpload.upload_offset).where(TrailerUpload.id == upload_id)
+        ).scalar()
+        if committed_offset is None:
+            raise UploadError('Загрузка не найдена или истекла', 404)
+        if committed_offset != offset:
+            raise UploadError('Upload-Offset не совпадает с загруженным объёмом', 409)
+        # Передача куска может длиться минутами — транзакцию не держим открытой
+        db.session.commit()
+
+        with _running_hashes_lock:
+            cached = _running_hashes.pop(upload_id, None)
+        file_hasher = cached[1] if cached and cached[0] == offset else None
+
+        written = 0
+        disconnected = False
+        # Байты после подтверждённого смещения (недописанный кусок) отбрасываются
+        target.seek(offset)
+        target.truncate()
+        while written < remaining:
+            try:
+                data = stream.read(min(_CHUNK_SIZE, remaining - written))
+            except (ClientDisconnected, OSError):
+                disconnected = True
+                break
+            if not data:
+                break
+            target.write(data)
+            written += len(data)
+            if chunk_hasher is not None:
+                chunk_hasher.update(data)
+            if file_hasher is not None:
+                file_hasher.update(data)
+
+        if chunk_hasher is not None and (disconnected or chunk_hasher.digest() != expected_digest):
+            # Кусок целиком отбрасывается — клиент отправит его заново
+            target.truncate(offset)
+            if disconnected:
+                raise UploadError('Соединение прервано', 400)
+            raise UploadError('Контрольная сумма куска не совпадает', CHECKSUM_MISMATCH_STATUS)
+
+        target.flush()
+        os.fsync(target.fileno())
+
+        new_offset = offset + written
+        now = vladivostok_now()
+        result = db.session.execute(
+            update(TrailerUpload)
+            .where(TrailerUpload.id == upload_id, TrailerUpload.upload_offset == offset)
+            .values(upload_offset=new_offset, updated_at=now, expires_at=_expiry_from(now))
+        )
+        if result.rowcount != 1:
+            db.session.rollback()
+            raise UploadError('Смещение загрузки изменилось во время записи куска', 409)
+        # Смещение фиксируется до снятия flock: следующий кусок увидит его сразу
+        db.session.commit()
+
+    if file_hasher is not None:
+        with _running_hashes_lock:
+            _running_hashes[upload_id] = (new_offset, file_hasher)
+    return new_offset
+
+
+def finish_upload(upload):
+    """SHA-256 полностью загруженного файла; при несовпадении с ожидаемым — UploadError."""
+    with _running_hashes_lock:
+        cached = _running_hashes.pop(upload.id, None)
+
+    if cached and cached[0] == upload.upload_length:
+        digest = cached[1].hexdigest()
+    else:
+        # Куски приходили в разные процессы — досчитываем хэш чтением файла
+        hasher = hashlib.sha256()
+        with open(upload_absolute_path(upload), 'rb') as source:
+            for block in iter(lambda: source.read(_CHUNK_SIZE), b''):
+                hasher.update(block)
+        digest = hasher.hexdigest()
+
+    if upload.checksum and upload.checksum != digest:
+        raise UploadError('Контрольная сумма файла не совпадает', CHECKSUM_MISMATCH_STATUS)
+    return digest
+
+
+def discard_upload(upload):
+    """Удалить незавершённую загрузку вместе с файлом (commit — у вызывающего)."""
+    with _running_hashes_lock:
+        _running_hashes.pop(upload.id, None)
+    absolute_path = upload_absolute_path(upload)
+    try:
+        if absolute_path and os.path.exists(absolute_path):
+            os.remove(absolute_path)
+    except OSError as exc:
+        current_app.logger.warning('Не удалось удалить файл загрузки %s: %s', absolute_path, exc)
+    db.session.delete(upload)
+
+
+def cleanup_expired_uploads(now=None):
+    """Удалить брошенные загрузки, срок которых истёк; вернуть их число."""
+    now = now or vladivostok_now()
+    expired = TrailerUpload.query.filter(TrailerUpload.expires_at <= now).all()
+    for upload in expired:
+        discard_upload(upload)
+    db.session.commit()
+    return len(expired)
@@ -0,0 +1,227 @@
+"""
+Ограничение одновременных потоков трейлеров и скорости их отдачи.
+
+Каждый поток, который отдаёт сам gunicorn (без offload на nginx и без S3),
+занимает поток worker'а на всё время просмотра. Чтобы несколько зрителей
+не заняли все потоки и канал, перед отдачей берётся «слот»:
+
+- не больше MEDIA_STREAM_MAX_CONCURRENT потоков всего;
+- не больше MEDIA_STREAM_MAX_PER_IP с одного IP;
+- не больше MEDIA_STREAM_MAX_PER_VOTER на один voter_token.
+
+Слот освобождается, когда сервер закрывает тело ответа (досмотрели или
+клиент оборвал соединение). Сверх лимита клиент получает 429 с
+``Retry-After``. Дополнительно скорость можно ограничить token bucket'ами:
+MEDIA_STREAM_RATE_BYTES — на клиента (voter_token или IP),
+MEDIA_STREAM_GLOBAL_RATE_BYTES — на все потоки процесса. При включённом
+ограничении скорости файл идёт чанками из Python, а не через sendfile.
+
+Счётчики живут в памяти процесса: лимиты действуют на один worker gunicorn
+(по умолчанию он один, см. gunicorn_config.py).
+"""
+import threading
+import time
+import types
+from collections import Counter
+
+from flask import current_app, request
+
+_EXTENSION_KEY = 'stream_limiter'
+# Мелкие порции сглаживают отдачу при ограничении скорости
+_SHAPE_CHUNK_SIZE = 64 * 1024
+# Ведро наполняется максимум на столько секунд вперёд (допустимый всплеск)
+_BURST_SECONDS = 2
+# Неиспользуемые вёдра клиентов удаляются, когда их становится больше
+_MAX_IDLE_BUCKETS = 1024
+
+SCOPE_GLOBAL = 'global'
+SCOPE_IP = 'ip'
+SCOPE_VOTER = 'voter'
+
+
+class StreamLimitExceeded(Exception):
+    """Лимит одновременных потоков исчерпан."""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(scope)
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Ведро токенов (байт): ``consume`` возвращает, сколько секунд подождать перед отправкой."""
+
+    def __init__(self, rate, burst_seconds=_BURST_SECONDS):
+        self.rate = float(rate)
+        self.capacity = self.rate * burst_seconds
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount):
+        with self._lock:
+            self._refill(time.monotonic())
+            # Долг допускается: следующий отправитель подождёт дольше
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def is_full(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens >= self.capacity
+
+
+class StreamLimiter:
+    """Счётчики активных потоков и вёдра скорости одного процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = Counter()
+        self._buckets = {}
+        self._global_bucket = None
+
+    def active(self, key):
+        with self._lock:
+            return self._active[key]
+
+    def try_acquire(self, limits):
+        """Занять слоты ``[(ключ, лимит), ...]`` разом; вернуть ключ, упёршийся в лимит, или None."""
+        with self._lock:
+            for key, limit in limits:
+                if limit and self._active[key] >= limit:
+                    return key
+            for key, _ in limits:
+                self._active[key] += 1
+        return None
+
+    def release(self, keys):
+        with self._lock:
+            for key in keys:
+                self._active[key] -= 1
+                if self._active[key] <= 0:
+                    del self._active[key]
+
+    def client_bucket(self, client_key, rate):
+        with self._lock:
+            bucket = self._buckets.get(client_key)
+            if bucket is None or bucket.rate != rate:
+                if len(self._buckets) >= _MAX_IDLE_BUCKETS:
+                    self._drop_idle_buckets()
+                bucket = self._buckets[client_key] = TokenBucket(rate)
+            return bucket
+
+    def global_bucket(self, rate):
+        with self._lock:
+            if self._global_bucket is None or self._global_bucket.rate != rate:
+                self._global_bucket = TokenBucket(rate)
+            return self._global_bucket
+
+    def _drop_idle_buckets(self):
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full()]:
+            del self._buckets[key]
+
+
+class StreamLease:
+    """Занятые слоты одного потока; освобождаются при закрытии ответа."""
+
+    def __init__(self, limiter, keys, buckets):
+        self._limiter = limiter
+        self._keys = keys
+        self._buckets = buckets
+        self._released = False
+        self._lock = threading.Lock()
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self._limiter.release(self._keys)
+
+    def shape(self, body):
+        """Отдавать тело порциями не быстрее вёдер скорости."""
+        try:
+            for chunk in body:
+                for offset in range(0, len(chunk), _SHAPE_CHUNK_SIZE):
+                    piece = chunk[offset:offset + _SHAPE_CHUNK_SIZE]
+                    wait = max(bucket.consume(len(piece)) for bucket in self._buckets)
+                    if wait > 0:
+                        time.sleep(wait)
+                    yield piece
+        finally:
+            _close_body(body)
+            self.release()
+
+    def _release_when_done(self, body):
+        try:
+            yield from body
+        finally:
+            _close_body(body)
+            self.release()
+
+    def attach(self, response):
+        """Привязать слот к ответу: держим его, пока сервер отдаёт тело."""
+        if response.status_code not in (200, 206) or request.method == 'HEAD':
+            self.release()
+            return response
+        body = response.response
+        if self._buckets:
+            response.response = self.shape(body)
+        elif isinstance(body, types.GeneratorType):
+            # Тело из Python (без sendfile): слот свободен сразу после последнего чанка
+            response.response = self._release_when_done(body)
+        response.call_on_close(self.release)
+        return response
+
+
+def _close_body(body):
+    close = getattr(body, 'close', None)
+    if close is not None:
+        close()
+
+
+def get_stream_limiter():
+    limiter = current_app.extensions.get(_EXTENSION_KEY)
+    if limiter is None:
+        limiter = current_app.extensions[_EXTENSION_KEY] = StreamLimiter()
+    return limiter
+
+
+def _config_int(name, default=0):
+    try:
+        return max(0, int(current_app.config.get(name, default) or 0))
+    except (TypeError, ValueError):
+        return default
+
+
+def acquire_stream_slot(remote_addr=None, voter_token=None):
+    """
+    Занять слот потока для клиента или выбросить ``StreamLimitExceeded``.
+
+    Возвращает ``StreamLease``: ``lease.attach(response)`` отпустит слот,
+    когда сервер закроет тело ответа.
+    """
+    limiter = get_stream_limiter()
+    limits = [(SCOPE_GLOBAL, _config_int('MEDIA_STREAM_MAX_CONCURRENT'))]
+    if remote_addr:
+        limits.append((f'{SCOPE_IP}:{remote_addr}', _config_int('MEDIA_STREAM_MAX_PER_IP')))
+    if voter_token:
+        limits.append((f'{SCOPE_VOTER}:{voter_token}', _config_int('MEDIA_STREAM_MAX_PER_VOTER')))
+
+    blocked = limiter.try_acquire(limits)
+    if blocked is not None:
+        raise StreamLimitExceeded(blocked.split(':', 1)[0], _config_int('MEDIA_STREAM_RETRY_AFTER_SECONDS', 5) or 1)
+
+    buckets = []
+    client_rate = _config_int('MEDIA_STREAM_RATE_BYTES')
+    if client_rate:
+        client_key = f'{SCOPE_VOTER}:{voter_token}' if voter_token else f'{SCOPE_IP}:{remote_addr}'
+        buckets.append(limiter.client_bucket(client_key, client_rate))
+    global_rate = _config_int('MEDIA_STREAM_GLOBAL_RATE_BYTES')
+    if global_rate:
+        buckets.append(limiter.global_bucket(global_rate))
+    return StreamLease(limiter, [key for key, _ in limits], buckets)
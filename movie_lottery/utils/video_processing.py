@@ -1,9 +1,13 @@
 """Video processing utilities using FFmpeg."""
 import logging
 import os
+import queue
 import shutil
+import struct
 import subprocess
 import tempfile
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -11,17 +15,30 @@ logger = logging.getLogger(__name__)
 FASTSTART_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.m4a'}
 
 
+# Результат проверки ffmpeg кэшируется: worker вызывает её для каждого файла
+_FFMPEG_CHECK_TTL = 300
+_ffmpeg_check = {'available': None, 'checked_at': 0.0}
+
+
 def is_ffmpeg_available():
-    """Check if FFmpeg is available on the system."""
+    """Check if FFmpeg is available on the system (cached for a few minutes)."""
+    now = time.monotonic()
+    if _ffmpeg_check['available'] is not None and now - _ffmpeg_check['checked_at'] < _FFMPEG_CHECK_TTL:
+        return _ffmpeg_check['available']
+
     try:
         result = subprocess.run(
             ['ffmpeg', '-version'],
             capture_output=True,
             timeout=10
         )
-        return result.returncode == 0
+        available = result.returncode == 0
     except (FileNotFoundError, subprocess.TimeoutExpired):
-        return False
+        available = False
+
+    _ffmpeg_check['available'] = available
+    _ffmpeg_check['checked_at'] = now
+    return available
 
 
 def should_apply_faststart(file_path):
@@ -30,21 +47,242 @@ def should_apply_faststart(file_path):
     return ext in FASTSTART_EXTENSIONS
 
 
-def apply_faststart(input_path):
+# Boxes that only wrap other boxes on the way to the sample descriptions
+_MP4_CONTAINER_BOXES = {b'trak', b'mdia', b'minf', b'stbl'}
+# Top-level box types that identify an ISO BMFF (MP4/MOV) file
+_MP4_TOP_LEVEL_BOXES = {b'ftyp', b'styp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid'}
+# moov is read into memory for parsing; larger ones are only located, not parsed
+_MAX_MOOV_PARSE_SIZE = 64 * 1024 * 1024
+_MAX_TOP_LEVEL_BOXES = 10000
+
+
+def _iter_file_boxes(file_obj, start, end):
+    """Yield (type, offset, header_size, size) for boxes in [start, end) reading headers only."""
+    offset = start
+    count = 0
+    while offset + 8 <= end and count < _MAX_TOP_LEVEL_BOXES:
+        file_obj.seek(offset)
+        header = file_obj.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large_size = file_obj.read(8)
+            if len(large_size) < 8:
+                return
+            size = struct.unpack('>Q', large_size)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset, header_size, size
+        offset += size
+        count += 1
+
+
+def _iter_buffer_boxes(data, start=0, end=None):
+    """Yield (type, payload_start, payload_end) for boxes inside an in-memory buffer."""
+    end = len(data) if end is None else end
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                return
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def _read_descriptor(data, offset, end):
+    """Read an MPEG-4 descriptor header (tag + variable-length size) from esds."""
+    if offset >= end:
+        return None, offset, offset
+    tag = data[offset]
+    offset += 1
+    length = 0
+    for _ in range(4):
+        if offset >= end:
+            return None, offset, offset
+        byte = data[offset]
+        offset += 1
+        length = (length << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, offset, min(offset + length, end)
+
+
+def _parse_esds_codec(data, start, end):
+    """Return the RFC 6381 codec string for an mp4a esds box, e.g. 'mp4a.40.2'."""
+    tag, offset, descriptor_end = _read_descriptor(data, start + 4, end)
+    if tag != 0x03 or offset + 3 > descriptor_end:
+        return None
+    flags = data[offset + 2]
+    offset += 3
+    if flags & 0x80:
+        offset += 2
+    if flags & 0x40:
+        if offset >= descriptor_end:
+            return None
+        offset += 1 + data[offset]
+    if flags & 0x20:
+        offset += 2
+
+    tag, offset, config_end = _read_descriptor(data, offset, descriptor_end)
+    if tag != 0x04 or offset >= config_end:
+        return None
+    object_type = data[offset]
+    codec = f'mp4a.{object_type:x}'
+
+    tag, offset, specific_end = _read_descriptor(data, offset + 13, config_end)
+    if tag == 0x05 and offset < specific_end:
+        audio_object_type = data[offset] >> 3
+        codec = f'{codec}.{audio_object_type}'
+    return codec
+
+
+def _parse_sample_entry(data, start, end):
+    """Describe the first sample entry of an stsd box (codec and, for video, size)."""
+    if start + 8 > end:
+        return {}
+    for entry_type, entry_start, entry_end in _iter_buffer_boxes(data, start + 8, end):
+        fourcc = entry_type.decode('latin-1')
+        info = {'codec': fourcc}
+        if entry_type in (b'avc1', b'avc3', b'hvc1', b'hev1', b'av01', b'vp09', b'mp4v'):
+            children_start = entry_start + 78
+            if children_start <= entry_end:
+                info['width'], info['height'] = struct.unpack_from('>HH', data, entry_start + 24)
+                for child_type, child_start, child_end in _iter_buffer_boxes(data, children_start, entry_end):
+                    if child_type == b'avcC' and child_start + 4 <= child_end:
+                        profile, compatibility, level = data[child_start + 1:child_start + 4]
+                        info['codec'] = f'{fourcc}.{profile:02X}{compatibility:02X}{level:02X}'
+        elif entry_type == b'mp4a':
+            children_start = entry_start + 28
+            for child_type, child_start, child_end in _iter_buffer_boxes(data, children_start, entry_end):
+                if child_type == b'esds':
+                    info['codec'] = _parse_esds_codec(data, child_start, child_end) or fourcc
+        return info
+    return {}
+
+
+def _parse_track(data, start, end):
+    track = {}
+
+    def walk(box_start, box_end):
+        for box_type, payload_start, payload_end in _iter_buffer_boxes(data, box_start, box_end):
+            if box_type == b'tkhd' and payload_end - payload_start >= 84:
+                width, height = struct.unpack_from('>II', data, payload_end - 8)
+                track['tkhd_width'] = width >> 16
+                track['tkhd_height'] = height >> 16
+            elif box_type == b'hdlr' and payload_end - payload_start >= 12:
+                track['handler'] = data[payload_start + 8:payload_start + 12].decode('latin-1')
+            elif box_type == b'stsd':
+                track.update(_parse_sample_entry(data, payload_start, payload_end))
+            elif box_type in _MP4_CONTAINER_BOXES:
+                walk(payload_start, payload_end)
+
+    walk(start, end)
+    return track
+
+
+def _parse_moov(data):
+    """Extract duration, codecs and video size from a moov payload."""
+    metadata = {'duration': None, 'codecs': [], 'width': None, 'height': None, 'has_audio': False}
+    for box_type, payload_start, payload_end in _iter_buffer_boxes(data):
+        if box_type == b'mvhd' and payload_end - payload_start >= 20:
+            version = data[payload_start]
+            if version == 1 and payload_end - payload_start >= 32:
+                timescale, duration = struct.unpack_from('>IQ', data, payload_start + 20)
+            else:
+                timescale, duration = struct.unpack_from('>II', data, payload_start + 12)
+            if timescale:
+                metadata['duration'] = round(duration / timescale, 3)
+        elif box_type == b'trak':
+            track = _parse_track(data, payload_start, payload_end)
+            if track.get('codec') and track.get('handler') in ('vide', 'soun'):
+                metadata['codecs'].append(track['codec'])
+            if track.get('handler') == 'soun':
+                metadata['has_audio'] = True
+            if track.get('handler') == 'vide' and metadata['width'] is None:
+                metadata['width'] = track.get('width') or track.get('tkhd_width')
+                metadata['height'] = track.get('height') or track.get('tkhd_height')
+    return metadata
+
+
+def inspect_mp4(file_path):
+    """
+    Inspect an MP4/MOV file by walking its top-level boxes.
+
+    Only box headers are read while scanning, plus the moov box itself,
+    so an already optimized file costs a few kilobytes of I/O and no
+    subprocess.
+
+    Returns:
+        None if the file is not an ISO BMFF file, otherwise a dict with keys:
+            - faststart: bool (moov precedes the first mdat/moof)
+            - moov_offset, moov_size: int or None
+            - duration: float seconds or None
+            - codecs: list of RFC 6381 codec strings (e.g. 'avc1.64001F')
+            - width, height: int or None
+            - has_audio: bool
+    """
+    try:
+        file_size = os.path.getsize(file_path)
+        with open(file_path, 'rb') as file_obj:
+            boxes = list(_iter_file_boxes(file_obj, 0, file_size))
+            if not boxes or boxes[0][0] not in _MP4_TOP_LEVEL_BOXES:
+                return None
+
+            moov = next((box for box in boxes if box[0] == b'moov'), None)
+            first_media = next((box[1] for box in boxes if box[0] in (b'mdat', b'moof')), None)
+
+            result = {
+                'faststart': bool(moov) and (first_media is None or moov[1] < first_media),
+                'moov_offset': moov[1] if moov else None,
+                'moov_size': moov[3] if moov else None,
+                'duration': None,
+                'codecs': [],
+                'width': None,
+                'height': None,
+                'has_audio': False,
+            }
+
+            if moov and moov[3] - moov[2] <= _MAX_MOOV_PARSE_SIZE:
+                file_obj.seek(moov[1] + moov[2])
+                result.update(_parse_moov(file_obj.read(moov[3] - moov[2])))
+            return result
+    except (OSError, struct.error, IndexError, ValueError) as exc:
+        logger.warning('Не удалось разобрать MP4 %s: %s', file_path, exc)
+        return None
+
+
+def apply_faststart(input_path, output_path=None):
     """
     Apply faststart optimization to a video file.
     
     Moves the moov atom to the beginning of the file for faster web playback.
-    The file is modified in-place using a temporary file.
+    The file is modified in-place using a temporary file, or the result is
+    written to ``output_path`` and the input is left untouched.
     
     Args:
         input_path: Path to the video file to process
+        output_path: Optional destination for the remuxed file
         
     Returns:
         dict with keys:
             - success: bool
             - message: str
             - new_size: int (file size after processing, if successful)
+            - metadata: dict from inspect_mp4 (if the file is MP4)
+            - skipped: bool (True when moov was already at the front)
     """
     if not os.path.exists(input_path):
         return {
@@ -61,6 +299,17 @@ def apply_faststart(input_path):
             'new_size': os.path.getsize(input_path)
         }
     
+    # Проверяем расположение moov по заголовкам боксов — без ffmpeg и без копирования файла
+    metadata = inspect_mp4(input_path)
+    if metadata and metadata['faststart']:
+        return {
+            'success': True,
+            'message': 'Faststart не требуется: moov уже в начале файла',
+            'new_size': os.path.getsize(input_path),
+            'metadata': metadata,
+            'skipped': True,
+        }
+
     if not is_ffmpeg_available():
         logger.warning('FFmpeg не установлен, пропускаем faststart оптимизацию')
         return {
@@ -70,7 +319,8 @@ def apply_faststart(input_path):
         }
     
     # Create temporary file in the same directory to ensure same filesystem
-    dir_path = os.path.dirname(input_path)
+    target_path = output_path or input_path
+    dir_path = os.path.dirname(target_path)
     fd, temp_path = tempfile.mkstemp(suffix='.mp4', dir=dir_path)
     os.close(fd)
     
@@ -105,16 +355,17 @@ def apply_faststart(input_path):
                 'new_size': None
             }
         
-        # Replace original file with processed one
-        shutil.move(temp_path, input_path)
-        new_size = os.path.getsize(input_path)
+        # Replace original file (or fill output_path) with processed one
+        shutil.move(temp_path, target_path)
+        new_size = os.path.getsize(target_path)
         
         logger.info('Faststart успешно применён к %s (размер: %d)', input_path, new_size)
         
         return {
             'success': True,
             'message': 'Faststart успешно применён',
-            'new_size': new_size
+            'new_size': new_size,
+            'metadata': inspect_mp4(target_path),
         }
         
     except subprocess.TimeoutExpired:
@@ -140,32 +391,458 @@ def apply_faststart(input_path):
                 pass
 
 
+def parse_hls_renditions(value):
+    """Parse 'height:kbps,...' (e.g. '360:800,720:2500') into [(height, kbps), ...]."""
+    renditions = []
+    for item in (value or '').split(','):
+        height, _, bitrate = item.strip().partition(':')
+        try:
+            renditions.append((int(height), int(bitrate)))
+        except ValueError:
+            continue
+    return sorted(set(renditions))
+
+
+def select_hls_renditions(renditions, source_height=None):
+    """Drop renditions taller than the source; always keep at least the smallest one."""
+    if not renditions:
+        return []
+    if not source_height:
+        return renditions
+    selected = [rendition for rendition in renditions if rendition[0] <= source_height]
+    return selected or renditions[:1]
+
+
+def _build_hls_command(input_path, work_dir, renditions, has_audio, segment_seconds):
+    split_outputs = ''.join(f'[v{index}]' for index in range(len(renditions)))
+    filters = [f'[0:v]split={len(renditions)}{split_outputs}']
+    for index, (height, _) in enumerate(renditions):
+        filters.append(f'[v{index}]scale=-2:{height}[v{index}out]')
+
+    cmd = ['ffmpeg', '-y', '-i', input_path, '-filter_complex', ';'.join(filters)]
+    stream_map = []
+    for index, (height, bitrate) in enumerate(renditions):
+        cmd += [
+            '-map', f'[v{index}out]',
+            f'-c:v:{index}', 'libx264',
+            f'-b:v:{index}', f'{bitrate}k',
+            f'-maxrate:v:{index}', f'{int(bitrate * 1.07)}k',
+            f'-bufsize:v:{index}', f'{bitrate * 2}k',
+        ]
+        if has_audio:
+            cmd += ['-map', '0:a:0', f'-c:a:{index}', 'aac', f'-b:a:{index}', '128k']
+            stream_map.append(f'v:{index},a:{index},name:{height}p')
+        else:
+            stream_map.append(f'v:{index},name:{height}p')
+
+    cmd += [
+        '-preset', 'veryfast',
+        '-profile:v', 'main',
+        '-sc_threshold', '0',
+        # Ключевой кадр на границе каждого сегмента — сегменты переключаемы между качествами
+        '-force_key_frames', f'expr:gte(t,n_forced*{segment_seconds})',
+        '-f', 'hls',
+        '-hls_time', str(segment_seconds),
+        '-hls_playlist_type', 'vod',
+        '-hls_segment_filename', os.path.join(work_dir, '%v', 'seg_%03d.ts'),
+        '-master_pl_name', 'master.m3u8',
+        '-var_stream_map', ' '.join(stream_map),
+        '-progress', 'pipe:1',
+        '-nostats',
+        os.path.join(work_dir, '%v', 'index.m3u8'),
+    ]
+    return cmd
+
+
+def package_hls(input_path, output_dir, renditions, has_audio=True, duration=None,
+                segment_seconds=6, timeout=1800, progress_callback=None):
+    """
+    Package a video into HLS renditions with a master playlist.
 
+    The output is written to a temporary sibling directory and moved into
+    ``output_dir`` only when ffmpeg succeeds, so clients never see a
+    half-written playlist.
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+            - renditions: list of (height, kbps) actually packaged
+    """
+    if not renditions:
+        return {'success': False, 'message': 'Не заданы качества HLS', 'renditions': []}
+    if not os.path.exists(input_path):
+        return {'success': False, 'message': f'Файл не найден: {input_path}', 'renditions': []}
+    if not is_ffmpeg_available():
+        return {'success': False, 'message': 'FFmpeg не установлен на сервере', 'renditions': []}
 
+    parent_dir = os.path.dirname(output_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.hls-', dir=parent_dir)
+    cmd = _build_hls_command(input_path, work_dir, renditions, has_audio, segment_seconds)
+    logger.info('Упаковываем HLS для %s: %s', input_path, renditions)
 
+    try:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        stderr_tail = []
+        progress_lines = queue.Queue()
+
+        def _drain_stderr():
+            for line in process.stderr:
+                stderr_tail.append(line)
+                del stderr_tail[:-20]
+
+        def _drain_stdout():
+            for line in process.stdout:
+                progress_lines.put(line)
+            progress_lines.put(None)
+
+        stderr_thread = threading.Thread(target=_drain_stderr, daemon=True)
+        stderr_thread.start()
+        threading.Thread(target=_drain_stdout, daemon=True).start()
+
+        # Срок не зависит от вывода ffmpeg: зависший процесс без строк прогресса
+        # тоже будет убит. Прогресс сообщается из этого потока — колбэк пишет в БД
+        deadline = time.monotonic() + timeout
+        timed_out = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            try:
+                line = progress_lines.get(timeout=remaining)
+            except queue.Empty:
+                timed_out = True
+                break
+            if line is None:
+                break
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us' and duration and progress_callback and value.isdigit():
+                progress_callback(min(int(value) / 1_000_000 / duration, 1.0))
+
+        returncode = None
+        if not timed_out:
+            try:
+                returncode = process.wait(timeout=max(deadline - time.monotonic(), 1))
+            except subprocess.TimeoutExpired:
+                timed_out = True
+        if timed_out:
+            process.kill()
+            process.wait()
+        stderr_thread.join(timeout=5)
+
+        if timed_out:
+            logger.error('FFmpeg таймаут упаковки HLS для %s', input_path)
+            return {'success': False, 'message': 'Таймаут упаковки HLS', 'renditions': []}
+        if returncode != 0:
+            stderr = ''.join(stderr_tail)
+            logger.error('FFmpeg ошибка упаковки HLS для %s: %s', input_path, stderr)
+            return {'success': False, 'message': f'FFmpeg ошибка: {stderr[-200:]}', 'renditions': []}
+
+        if os.path.isdir(output_dir):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(work_dir, output_dir)
+        return {'success': True, 'message': 'HLS упакован', 'renditions': renditions}
+    except Exception as exc:
+        logger.exception('Ошибка упаковки HLS %s: %s', input_path, exc)
+        return {'success': False, 'message': f'Ошибка упаковки HLS: {exc}', 'renditions': []}
+    finally:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _format_vtt_timestamp(seconds):
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3_600_000)
+    minutes, milliseconds = divmod(milliseconds, 60_000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}'
+
+
+def build_thumbnail_vtt(sprite_name, duration, interval, count, columns, thumb_width, thumb_height):
+    """Build a WebVTT track whose cues point at tiles of a sprite (``sprite.jpg#xywh=...``)."""
+    lines = ['WEBVTT', '']
+    for index in range(count):
+        start = index * interval
+        if start >= duration:
+            break
+        end = min(start + interval, duration)
+        x = (index % columns) * thumb_width
+        y = (index // columns) * thumb_height
+        lines.append(f'{_format_vtt_timestamp(start)} --> {_format_vtt_timestamp(end)}')
+        lines.append(f'{sprite_name}#xywh={x},{y},{thumb_width},{thumb_height}')
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def _run_ffmpeg(cmd, timeout):
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f'FFmpeg ошибка: {result.stderr[-200:]}')
+
+
+def build_trailer_previews(input_path, output_dir, duration=None, width=None, height=None,
+                           interval=10, thumb_width=160, columns=10, max_thumbnails=100, timeout=300):
+    """
+    Extract a poster frame and a seek-preview sprite sheet with a WebVTT track.
 
+    Writes ``poster.jpg``, ``sprite.jpg`` and ``thumbnails.vtt`` into a
+    temporary sibling directory and moves it to ``output_dir`` on success.
+    The sprite and the track are skipped when the duration is unknown.
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+            - poster: file name or None
+            - sprite: file name or None
+            - vtt: file name or None
+            - thumbnails: int (number of sprite tiles)
+    """
+    empty = {'poster': None, 'sprite': None, 'vtt': None, 'thumbnails': 0}
+    if not os.path.exists(input_path):
+        return {'success': False, 'message': f'Файл не найден: {input_path}', **empty}
+    if not is_ffmpeg_available():
+        return {'success': False, 'message': 'FFmpeg не установлен на сервере', **empty}
 
+    parent_dir = os.path.dirname(output_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix='.thumbs-', dir=parent_dir)
+    result = dict(empty)
 
+    try:
+        # Кадр для постера — на 10% длительности, чтобы миновать чёрные заставки
+        poster_at = min(max(duration * 0.1, 0), max(duration - 0.5, 0)) if duration else 1
+        _run_ffmpeg([
+            'ffmpeg', '-y', '-ss', f'{poster_at:.3f}', '-i', input_path,
+            '-frames:v', '1', '-vf', "scale=-2:'min(720,ih)'", '-q:v', '3',
+            os.path.join(work_dir, 'poster.jpg'),
+        ], timeout)
+        result['poster'] = 'poster.jpg'
+
+        if duration:
+            # Не больше max_thumbnails кадров: у длинных трейлеров шаг увеличивается
+            interval = max(interval, duration / max_thumbnails)
+            count = max(1, int(-(-duration // interval)))
+            rows = -(-count // columns)
+            aspect = (height / width) if width and height else 9 / 16
+            thumb_height = max(2, int(round(thumb_width * aspect / 2)) * 2)
+            _run_ffmpeg([
+                'ffmpeg', '-y', '-i', input_path,
+                '-vf', f'fps=1/{interval:.3f},scale={thumb_width}:{thumb_height},tile={columns}x{rows}',
+                '-frames:v', '1', '-q:v', '5',
+                os.path.join(work_dir, 'sprite.jpg'),
+            ], timeout)
+            with open(os.path.join(work_dir, 'thumbnails.vtt'), 'w', encoding='utf-8') as vtt_file:
+                vtt_file.write(build_thumbnail_vtt(
+                    'sprite.jpg', duration, interval, count, columns, thumb_width, thumb_height,
+                ))
+            result.update(sprite='sprite.jpg', vtt='thumbnails.vtt', thumbnails=count)
+
+        if os.path.isdir(output_dir):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(work_dir, output_dir)
+        return {'success': True, 'message': 'Превью трейлера созданы', **result}
+    except subprocess.TimeoutExpired:
+        logger.error('FFmpeg таймаут создания превью для %s', input_path)
+        return {'success': False, 'message': 'Таймаут создания превью', **empty}
+    except Exception as exc:
+        logger.exception('Ошибка создания превью %s: %s', input_path, exc)
+        return {'success': False, 'message': f'Ошибка создания превью: {exc}', **empty}
+    finally:
+        if os.path.isdir(work_dir):
+            shutil.rmtree(work_dir, ignore_errors=True)
 
 
+def build_low_quality_trailer(input_path, output_path, height=480, video_kbps=700, audio_kbps=96,
+                              has_audio=True, timeout=1800):
+    """
+    Transcode a trailer into a single low-bitrate H.264/AAC MP4 for slow clients.
 
+    The frame is scaled down to ``height`` (never up), the bitrate is capped
+    with ``-maxrate`` and ``moov`` is moved to the front so playback starts
+    before the download ends. The file is written next to ``output_path``
+    and renamed into place on success.
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+            - size: int or None (bytes written)
+    """
+    if not os.path.exists(input_path):
+        return {'success': False, 'message': f'Файл не найден: {input_path}', 'size': None}
+    if not is_ffmpeg_available():
+        return {'success': False, 'message': 'FFmpeg не установлен на сервере', 'size': None}
 
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.low-', suffix='.mp4', dir=output_dir)
+    os.close(fd)
 
+    audio_args = ['-c:a', 'aac', '-b:a', f'{int(audio_kbps)}k', '-ac', '2'] if has_audio else ['-an']
+    try:
+        _run_ffmpeg([
+            'ffmpeg', '-y', '-i', input_path,
+            '-map', '0:v:0', *(['-map', '0:a:0?'] if has_audio else []),
+            '-vf', f"scale=-2:'min({int(height)},ih)'",
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+            '-b:v', f'{int(video_kbps)}k', '-maxrate', f'{int(video_kbps)}k', '-bufsize', f'{int(video_kbps) * 2}k',
+            *audio_args,
+            '-movflags', '+faststart',
+            temp_path,
+        ], timeout)
+        os.replace(temp_path, output_path)
+        return {
+            'success': True,
+            'message': 'Облегчённая копия трейлера создана',
+            'size': os.path.getsize(output_path),
+        }
+    except subprocess.TimeoutExpired:
+        logger.error('FFmpeg таймаут создания облегчённой копии %s', input_path)
+        return {'success': False, 'message': 'Таймаут создания облегчённой копии', 'size': None}
+    except Exception as exc:
+        logger.exception('Ошибка создания облегчённой копии %s: %s', input_path, exc)
+        return {'success': False, 'message': f'Ошибка создания облегчённой копии: {exc}', 'size': None}
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 
+# Кодеки для уменьшенных копий постеров по расширению файла
+_POSTER_CODEC_ARGS = {
+    '.webp': ['-c:v', 'libwebp', '-quality', '80'],
+    '.jpg': ['-q:v', '4'],
+}
 
 
+def resize_poster(input_path, output_path, width, timeout=60):
+    """
+    Scale a poster down to ``width`` pixels (never up) and encode it by the
+    extension of ``output_path`` (``.webp`` or ``.jpg``).
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    if ext not in _POSTER_CODEC_ARGS:
+        return {'success': False, 'message': f'Неподдерживаемый формат постера: {ext}'}
+    if not os.path.exists(input_path):
+        return {'success': False, 'message': f'Файл не найден: {input_path}'}
+    if not is_ffmpeg_available():
+        return {'success': False, 'message': 'FFmpeg не установлен на сервере'}
 
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.variant-', suffix=ext, dir=output_dir)
+    os.close(fd)
 
+    try:
+        _run_ffmpeg([
+            'ffmpeg', '-y', '-i', input_path,
+            '-vf', f"scale='min(iw,{int(width)})':-2",
+            *_POSTER_CODEC_ARGS[ext],
+            '-frames:v', '1',
+            temp_path,
+        ], timeout)
+        os.replace(temp_path, output_path)
+        return {'success': True, 'message': 'Копия постера создана'}
+    except subprocess.TimeoutExpired:
+        logger.error('FFmpeg таймаут уменьшения постера %s', input_path)
+        return {'success': False, 'message': 'Таймаут уменьшения постера'}
+    except Exception as exc:
+        logger.exception('Ошибка уменьшения постера %s: %s', input_path, exc)
+        return {'success': False, 'message': f'Ошибка уменьшения постера: {exc}'}
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
 
+def build_poster_variants(input_path, output_dir, widths, formats=('webp', 'jpg'), timeout=60):
+    """
+    Create ``<width>.<format>`` copies of a poster in ``output_dir``.
 
+    Copies that already exist are kept, so the call is cheap to repeat.
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+            - variants: list of file names present in ``output_dir``
+    """
+    variants = []
+    for width in widths:
+        for fmt in formats:
+            name = f'{width}.{fmt}'
+            output_path = os.path.join(output_dir, name)
+            if not os.path.exists(output_path):
+                result = resize_poster(input_path, output_path, width, timeout=timeout)
+                if not result['success']:
+                    return {'success': False, 'message': result['message'], 'variants': variants}
+            variants.append(name)
+    return {'success': True, 'message': 'Копии постера созданы', 'variants': variants}
+
+
+def build_poster_atlas(input_paths, output_path, tile_width, tile_height, columns, timeout=120):
+    """
+    Pack posters into one WebP sprite: each input is cropped to
+    ``tile_width``x``tile_height`` and placed row by row, ``columns`` per row.
 
+    Returns:
+        dict with keys:
+            - success: bool
+            - message: str
+            - columns: int
+            - rows: int
+    """
+    count = len(input_paths)
+    columns = max(1, min(int(columns), count or 1))
+    rows = -(-count // columns) if count else 0
+    empty = {'columns': columns, 'rows': rows}
+    if not count:
+        return {'success': False, 'message': 'Нет постеров для атласа', **empty}
+    if not is_ffmpeg_available():
+        return {'success': False, 'message': 'FFmpeg не установлен на сервере', **empty}
 
+    output_dir = os.path.dirname(output_path)
+    os.makedirs(output_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.atlas-', suffix='.webp', dir=output_dir)
+    os.close(fd)
 
+    cmd = ['ffmpeg', '-y']
+    filters = []
+    for index, path in enumerate(input_paths):
+        cmd += ['-i', path]
+        filters.append(
+            f'[{index}:v]scale={tile_width}:{tile_height}:force_original_aspect_ratio=increase,'
+            f'crop={tile_width}:{tile_height},setsar=1,format=yuv420p[v{index}]'
+        )
+    # concat собирает кадры в последовательность, tile раскладывает их сеткой
+    # (неполный последний ряд остаётся пустым)
+    filters.append(
+        ''.join(f'[v{index}]' for index in range(count))
+        + f'concat=n={count}:v=1:a=0,tile={columns}x{rows}[atlas]'
+    )
+    cmd += [
+        '-filter_complex', ';'.join(filters),
+        '-map', '[atlas]', '-frames:v', '1',
+        '-c:v', 'libwebp', '-quality', '75',
+        temp_path,
+    ]
 
+    try:
+        _run_ffmpeg(cmd, timeout)
+        os.replace(temp_path, output_path)
+        return {'success': True, 'message': 'Атлас постеров создан', **empty}
+    except subprocess.TimeoutExpired:
+        logger.error('FFmpeg таймаут сборки атласа %s', output_path)
+        return {'success': False, 'message': 'Таймаут сборки атласа', **empty}
+    except Exception as exc:
+        logger.exception('Ошибка сборки атласа %s: %s', output_path, exc)
+        return {'success': False, 'message': f'Ошибка сборки атласа: {exc}', **empty}
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -3,18 +3,33 @@ import sys
 import calendar
 import shutil
 import tempfile
+from types import SimpleNamespace
 from unittest.mock import MagicMock
 
 import pytest
-from sqlalchemy import inspect, text
-from datetime import datetime, time, timedelta
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import event, inspect, text
+from datetime import date, datetime, time, timedelta
+from sqlalchemy.exc import IntegrityError, OperationalError
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from movie_lottery import create_app, db
-from movie_lottery.models import LibraryMovie, Poll, PollVoterProfile, Vote
-from movie_lottery.utils import helpers
+from movie_lottery.models import (
+    LibraryMovie,
+    MediaJob,
+    PointsBalanceSnapshot,
+    PointsMonthlyRollup,
+    PointsTransaction,
+    Poll,
+    PollVoterProfile,
+    PollVoterStats,
+    PollVoteRollup,
+    PollVoterRollup,
+    TrailerUpload,
+    Vote,
+    VoteMonthlyRollup,
+)
+from movie_lottery.utils import helpers, leaderboard, media_delivery
 from movie_lottery.routes import api_routes
 
 
@@ -1103,3 +1118,1853 @@ def test_patch_user_id_allows_clearing_value(app):
 
     refreshed = PollVoterProfile.query.get(token)
     assert refreshed.user_id is None
+
+
+def test_voter_stats_uses_maintained_vote_aggregates(app):
+    client = app.test_client()
+
+    response = _create_poll_via_api(client, [_build_movie('First', points=3), _build_movie('Second')])
+    poll = Poll.query.get(response.get_json()['poll_id'])
+
+    db.session.add(PollVoterProfile(token='stats-token', total_points=0))
+    db.session.add(Vote(poll_id=poll.id, movie_id=poll.movies[0].id, voter_token='stats-token', points_awarded=3))
+    helpers.record_vote_in_voter_stats('stats-token', 3)
+    db.session.commit()
+
+    stats = PollVoterStats.query.get('stats-token')
+    assert stats.votes_count == 1
+    assert stats.votes_points == 3
+    assert stats.last_vote_at is not None
+
+    response = client.get('/api/polls/voter-stats', query_string={'sort_by': 'votes_count'})
+    assert response.status_code == 200
+    item = response.get_json()['items'][0]
+    assert item['voter_token'] == 'stats-token'
+    assert item['votes_count'] == 1
+    assert item['filtered_points'] == 3
+    assert 'votes' not in item
+
+    votes_response = client.get('/api/polls/voter-stats/stats-token/votes')
+    assert votes_response.status_code == 200
+    votes_payload = votes_response.get_json()
+    assert len(votes_payload['votes']) == 1
+    assert votes_payload['votes'][0]['movie_name'] == 'First'
+    assert votes_payload['has_more'] is False
+
+    client.set_cookie('poll_creator_token', 'a' * 32)
+    poll.creator_token = 'a' * 32
+    db.session.commit()
+    assert client.delete(f'/api/polls/{poll.id}').status_code == 200
+
+    stats = PollVoterStats.query.get('stats-token')
+    assert stats.votes_count == 0
+    assert stats.votes_points == 0
+    assert stats.last_vote_at is None
+
+
+def test_voter_stats_sorts_by_filtered_values_when_vote_filters_active(app):
+    client = app.test_client()
+    polls = []
+    for name in ('Sort A', 'Sort B', 'Sort C'):
+        response = _create_poll_via_api(client, [_build_movie(f'{name} 1'), _build_movie(f'{name} 2')])
+        polls.append(Poll.query.get(response.get_json()['poll_id']))
+    first_poll = polls[0]
+
+    # busy-token набрал больше баллов в целом, focused-token — в первом опросе
+    votes = {
+        'busy-token': [(polls[1], 5), (polls[2], 5), (first_poll, 1)],
+        'focused-token': [(first_poll, 4)],
+    }
+    for token, token_votes in votes.items():
+        db.session.add(PollVoterProfile(token=token, total_points=0))
+        for poll, points in token_votes:
+            db.session.add(Vote(
+                poll_id=poll.id, movie_id=poll.movies[0].id, voter_token=token, points_awarded=points,
+            ))
+            helpers.record_vote_in_voter_stats(token, points)
+    db.session.add(PollVoterProfile(token='idle-token', total_points=0))
+    db.session.commit()
+
+    def _rows(**params):
+        response = client.get('/api/polls/voter-stats', query_string={'sort_by': 'votes_points', **params})
+        assert response.status_code == 200
+        payload = response.get_json()
+        return payload['total'], [(item['voter_token'], item['filtered_points']) for item in payload['items']]
+
+    total, rows = _rows()
+    assert total == 3
+    assert rows[:2] == [('busy-token', 11), ('focused-token', 4)]
+    # Порядок совпадает с отфильтрованными значениями, которые видит администратор
+    assert _rows(poll_id=first_poll.id) == (2, [('focused-token', 4), ('busy-token', 1)])
+    assert _rows(poll_id=first_poll.id, sort_order='asc') == (2, [('busy-token', 1), ('focused-token', 4)])
+    assert _rows(poll_id=first_poll.id, per_page=1, page=2) == (2, [('busy-token', 1)])
+
+    # Фильтр по датам включает и свёрнутые месяцы — в сортировке и в значениях одинаково
+    db.session.add(VoteMonthlyRollup(
+        month=date(2026, 1, 1), voter_token='idle-token', votes_count=3, votes_points=30,
+        last_vote_at=datetime(2026, 1, 20, 12, 0),
+    ))
+    db.session.commit()
+    response = client.get('/api/polls/voter-stats', query_string={
+        'sort_by': 'last_vote_at', 'sort_order': 'asc', 'date_from': '2026-01-01',
+    })
+    items = response.get_json()['items']
+    assert [item['voter_token'] for item in items][0] == 'idle-token'
+    assert (items[0]['votes_count'], items[0]['filtered_points']) == (3, 30)
+    assert items[0]['last_vote_at'].startswith('2026-01-20T12:00')
+
+
+def test_leaderboard_tracks_balance_changes_incrementally(app):
+    client = app.test_client()
+    db.session.add(PollVoterProfile(token='leader-a', user_id='alice', total_points=10, points_accrued_total=10))
+    db.session.add(PollVoterProfile(token='leader-b', user_id='bob', total_points=5, points_accrued_total=20))
+    db.session.add(PollVoterProfile(token='leader-c', user_id='carol', total_points=5, points_accrued_total=5))
+    db.session.commit()
+
+    response = client.get('/api/polls/leaderboard', query_string={'metric': 'total_points'})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload['total'] == 3
+    assert [(item['rank'], item['user_id'], item['value']) for item in payload['items']] == [
+        (1, 'alice', 10),
+        (2, 'bob', 5),
+        (2, 'carol', 5),
+    ]
+
+    # Изменение баланса попадает в индекс после commit, без пересборки из БД
+    helpers.change_voter_points_balance('leader-c', 7)
+    db.session.commit()
+    helpers.change_voter_points_balance('leader-b', 100)
+    db.session.rollback()
+
+    client.set_cookie('voter_token', 'leader-c')
+    payload = client.get('/api/polls/leaderboard', query_string={'metric': 'total_points', 'limit': 1}).get_json()
+    assert [(item['user_id'], item['value'], item['is_me']) for item in payload['items']] == [('carol', 12, True)]
+    assert payload['me'] == {'rank': 1, 'user_id': 'carol', 'value': 12}
+
+    earned = client.get('/api/polls/leaderboard', query_string={'metric': 'points_earned'}).get_json()
+    assert [item['user_id'] for item in earned['items']] == ['bob', 'carol', 'alice']
+
+    assert client.get('/api/polls/leaderboard', query_string={'metric': 'unknown'}).status_code == 400
+
+    # Изменение в обход индекса (другой процесс) видно сразу — по updated_at, без перестройки
+    rebuilds = []
+    original_load_boards = leaderboard._load_boards
+
+    def _counting_load_boards():
+        rebuilds.append(True)
+        return original_load_boards()
+
+    leaderboard._load_boards = _counting_load_boards
+    try:
+        PollVoterProfile.query.filter_by(token='leader-a').update({'total_points': 50})
+        db.session.commit()
+        payload = client.get('/api/polls/leaderboard', query_string={'metric': 'total_points', 'limit': 1}).get_json()
+    finally:
+        leaderboard._load_boards = original_load_boards
+    assert [(item['user_id'], item['value']) for item in payload['items']] == [('alice', 50)]
+    assert payload['me'] == {'rank': 2, 'user_id': 'carol', 'value': 12}
+    assert rebuilds == []
+
+    # Удаление профиля другим процессом подхватывает перестройка планировщика
+    PollVoterProfile.query.filter_by(token='leader-a').delete()
+    db.session.commit()
+    assert client.get('/api/polls/leaderboard', query_string={'metric': 'total_points'}).get_json()['total'] == 3
+    assert leaderboard.refresh_leaderboard() is True
+    assert client.get('/api/polls/leaderboard', query_string={'metric': 'total_points'}).get_json()['total'] == 2
+
+
+def test_reconcile_points_checks_only_new_ledger_entries(app):
+    db.session.add(PollVoterProfile(token='ledger-a', total_points=0))
+    db.session.add(PollVoterProfile(token='ledger-b', total_points=0))
+    db.session.commit()
+
+    for token in ('ledger-a', 'ledger-b'):
+        new_balance = helpers.change_voter_points_balance(token, 5)
+        helpers.log_points_transaction(token, PointsTransaction.TYPE_VOTE, 5, 0, new_balance)
+    db.session.commit()
+
+    # Баланс изменён в обход журнала
+    PollVoterProfile.query.get('ledger-b').total_points = 50
+    db.session.commit()
+
+    result = helpers.reconcile_points_balances(grace_seconds=0)
+    assert result['checked'] == 2
+    assert result['drifted'] == 1
+    assert result['fixed'] == 1
+    db.session.expire_all()
+    assert PollVoterProfile.query.get('ledger-b').total_points == 5
+    snapshot = (
+        PointsBalanceSnapshot.query.filter_by(voter_token='ledger-b')
+        .order_by(PointsBalanceSnapshot.id.desc())
+        .first()
+    )
+    assert (snapshot.balance, snapshot.drift) == (5, 45)
+
+    # Повторный запуск начинает с последних снимков и трогает только новые записи
+    new_balance = helpers.change_voter_points_balance('ledger-a', -2)
+    helpers.log_points_transaction('ledger-a', PointsTransaction.TYPE_TRAILER, -2, 5, new_balance)
+    db.session.commit()
+
+    result = helpers.reconcile_points_balances(grace_seconds=0)
+    assert (result['checked'], result['drifted']) == (1, 0)
+    assert helpers.reconcile_points_balances(grace_seconds=0)['checked'] == 0
+
+    with pytest.raises(ValueError):
+        PointsTransaction.query.first().amount = 100
+        db.session.flush()
+    db.session.rollback()
+
+
+def test_compact_history_rolls_old_rows_into_monthly_tables(app):
+    client = app.test_client()
+    response = _create_poll_via_api(client, [_build_movie('Old First'), _build_movie('Old Second')])
+    poll = Poll.query.get(response.get_json()['poll_id'])
+    old_time = datetime(2026, 1, 15, 12, 0)
+    poll.finalized = True
+
+    db.session.add(PollVoterProfile(token='history-token', total_points=3))
+    db.session.add(Vote(
+        poll_id=poll.id, movie_id=poll.movies[0].id, voter_token='history-token',
+        points_awarded=3, voted_at=old_time,
+    ))
+    db.session.add(PointsTransaction(
+        voter_token='history-token', transaction_type=PointsTransaction.TYPE_VOTE,
+        amount=3, balance_before=0, balance_after=3, created_at=old_time,
+    ))
+    db.session.commit()
+    helpers.reconcile_points_balances(grace_seconds=0)
+
+    result = helpers.compact_history(retention_months=3, now=datetime(2026, 10, 19))
+    assert result['cutoff'] == datetime(2026, 7, 1)
+    assert (result['votes'], result['points_transactions']) == (1, 1)
+    assert Vote.query.count() == 0
+    assert PointsTransaction.query.count() == 0
+
+    rollup = VoteMonthlyRollup.query.get((date(2026, 1, 1), 'history-token'))
+    assert (rollup.votes_count, rollup.votes_points) == (1, 3)
+    assert PollVoteRollup.query.get((poll.id, poll.movies[0].id)).votes_count == 1
+    assert PointsMonthlyRollup.query.get((date(2026, 1, 1), 'history-token', 'vote')).amount_total == 3
+
+    # Итоги опроса и сводки читают агрегаты вместе с построчными записями
+    db.session.expire_all()
+    poll = Poll.query.get(poll.id)
+    assert poll.total_votes == 1
+    assert [movie.name for movie in poll.winners] == ['Old First']
+
+    summary = helpers.get_voter_transactions_summary('history-token')
+    assert (summary['total_earned'], summary['transaction_count']) == (3, 1)
+
+    filters = {'poll_id': '', 'date_from': datetime(2026, 1, 1), 'date_to': datetime(2026, 1, 31, 23, 59, 59, 999999)}
+    assert api_routes._aggregate_votes_by_token(['history-token'], filters)['history-token']['votes_count'] == 1
+
+    assert helpers.compact_history(retention_months=0)['cutoff'] is None
+
+
+def test_deleting_poll_discounts_compacted_votes(app):
+    client = app.test_client()
+    client.set_cookie('poll_creator_token', 'c' * 32)
+    polls = []
+    for name in ('Compact A', 'Compact B', 'Compact C'):
+        response = _create_poll_via_api(client, [_build_movie(f'{name} 1'), _build_movie(f'{name} 2')])
+        poll = Poll.query.get(response.get_json()['poll_id'])
+        poll.creator_token = 'c' * 32
+        polls.append(poll)
+    poll_a, poll_b, poll_c = polls
+    poll_a.finalized = poll_b.finalized = True
+
+    votes = (
+        (poll_a, 3, datetime(2026, 1, 10, 12, 0)),
+        (poll_b, 2, datetime(2026, 1, 20, 12, 0)),
+        (poll_c, 1, datetime(2026, 10, 1, 12, 0)),
+    )
+    for poll, points, voted_at in votes:
+        db.session.add(Vote(
+            poll_id=poll.id, movie_id=poll.movies[0].id, voter_token='compact-token',
+            points_awarded=points, voted_at=voted_at,
+        ))
+    db.session.add(PollVoterStats(
+        voter_token='compact-token', votes_count=3, votes_points=6, last_vote_at=datetime(2026, 10, 1, 12, 0),
+    ))
+    db.session.commit()
+    poll_ids = [poll.id for poll in polls]
+
+    assert helpers.compact_history(retention_months=3, now=datetime(2026, 10, 19))['votes'] == 2
+    assert PollVoterRollup.query.count() == 2
+
+    def _state():
+        db.session.expire_all()
+        stats = PollVoterStats.query.get('compact-token')
+        rollup = VoteMonthlyRollup.query.get((date(2026, 1, 1), 'compact-token'))
+        return (
+            (stats.votes_count, stats.votes_points, stats.last_vote_at),
+            (rollup.votes_count, rollup.votes_points, rollup.last_vote_at) if rollup else None,
+        )
+
+    # Свёрнутые голоса удалённого опроса уходят и из статистики, и из месячного агрегата
+    assert client.delete(f'/api/polls/{poll_ids[1]}').status_code == 200
+    assert _state() == (
+        (2, 4, datetime(2026, 10, 1, 12, 0)),
+        (1, 3, datetime(2026, 1, 10, 12, 0)),
+    )
+    assert PollVoterRollup.query.filter_by(poll_id=poll_ids[1]).count() == 0
+
+    # Последний голос берётся из агрегатов, если построчных голосов не осталось
+    assert client.delete(f'/api/polls/{poll_ids[2]}').status_code == 200
+    assert _state() == ((1, 3, datetime(2026, 1, 10, 12, 0)), (1, 3, datetime(2026, 1, 10, 12, 0)))
+
+    assert client.delete(f'/api/polls/{poll_ids[0]}').status_code == 200
+    assert _state() == ((0, 0, None), None)
+    assert PollVoterRollup.query.count() == 0
+
+
+def test_backfill_commands_use_set_based_updates(app):
+    client = app.test_client()
+    response = _create_poll_via_api(client, [_build_movie('Backfill A'), _build_movie('Backfill B')])
+    first_poll = Poll.query.get(response.get_json()['poll_id'])
+    response = _create_poll_via_api(client, [_build_movie('Backfill C'), _build_movie('Backfill D')])
+    second_poll = Poll.query.get(response.get_json()['poll_id'])
+
+    db.session.add(PollVoterProfile(token='backfill-token', total_points=0, points_accrued_total=0))
+    db.session.add(PollVoterProfile(token='backfill-empty', total_points=0))
+    db.session.add(PollVoterStats(voter_token='backfill-empty', votes_count=4, votes_points=4))
+    today = datetime.combine(helpers.vladivostok_now().date(), time(12, 0))
+    db.session.add(Vote(
+        poll_id=first_poll.id, movie_id=first_poll.movies[0].id, voter_token='backfill-token',
+        points_awarded=2, voted_at=today - timedelta(days=1),
+    ))
+    db.session.add(Vote(
+        poll_id=second_poll.id, movie_id=second_poll.movies[0].id, voter_token='backfill-token',
+        points_awarded=3, voted_at=today,
+    ))
+    db.session.commit()
+
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['backfill-poll-voter-points', '--dry-run'])
+    assert 'Would update 1 profiles' in result.output
+    db.session.expire_all()
+    assert PollVoterProfile.query.get('backfill-token').points_accrued_total == 0
+
+    result = runner.invoke(args=['backfill-poll-voter-points', '--chunk-size', '1'])
+    assert 'Updated 1 profiles in 2 chunk(s)' in result.output
+    result = runner.invoke(args=['backfill-voting-streaks'])
+    assert 'Updated 1 profiles' in result.output
+    result = runner.invoke(args=['backfill-vote-counters'])
+    assert 'Updated 2 vote counter rows' in result.output
+
+    db.session.expire_all()
+    profile = PollVoterProfile.query.get('backfill-token')
+    assert profile.points_accrued_total == 5
+    assert (profile.voting_streak, profile.max_voting_streak) == (2, 2)
+    assert profile.last_vote_date == today.date()
+    assert PollVoterStats.query.get('backfill-token').votes_count == 2
+    assert PollVoterStats.query.get('backfill-empty').votes_count == 0
+
+    # Голоса давнего участника уже свёрнуты: пересчёт по построчным голосам не уменьшает итог
+    db.session.add(PollVoterProfile(token='backfill-veteran', total_points=0, points_accrued_total=40))
+    db.session.add(Vote(
+        poll_id=second_poll.id, movie_id=second_poll.movies[1].id, voter_token='backfill-veteran',
+        points_awarded=1, voted_at=today,
+    ))
+    db.session.commit()
+    result = runner.invoke(args=['backfill-poll-voter-points'])
+    assert 'Updated 0 profiles' in result.output
+    db.session.expire_all()
+    assert PollVoterProfile.query.get('backfill-veteran').points_accrued_total == 40
+
+
+def _create_library_trailer(app, payload=b'0123456789' * 10, mime_type='video/mp4', allow_unsigned=True):
+    media_root = app.config['TRAILER_MEDIA_ROOT'] = tempfile.mkdtemp(prefix='movie-lottery-media-')
+    app.config['TRAILER_ALLOW_UNSIGNED_STREAM'] = allow_unsigned
+    os.makedirs(os.path.join(media_root, 'trailers'), exist_ok=True)
+    relative_path = 'trailers/movie_1_test.mp4'
+    with open(os.path.join(media_root, relative_path), 'wb') as trailer_file:
+        trailer_file.write(payload)
+
+    movie = LibraryMovie(
+        name='Trailer Movie',
+        year='2024',
+        trailer_file_path=relative_path,
+        trailer_mime_type=mime_type,
+        trailer_file_size=len(payload),
+    )
+    db.session.add(movie)
+    db.session.commit()
+    return movie, media_root
+
+
+def test_stream_trailer_serves_ranges_and_offload_headers(app):
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    try:
+        response = client.get(f'/api/trailers/{movie.id}/stream', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 206
+        assert response.data == b'0123456789'
+        assert response.headers['Content-Range'] == 'bytes 10-19/100'
+        assert response.headers['Content-Length'] == '10'
+
+        app.config['MEDIA_OFFLOAD_MODE'] = 'x-accel'
+        response = client.get(f'/api/trailers/{movie.id}/stream', headers={'Range': 'bytes=10-19'})
+        assert response.status_code == 200
+        assert response.data == b''
+        assert response.headers['X-Accel-Redirect'] == '/protected-media/trailers/movie_1_test.mp4'
+
+        app.config['MEDIA_OFFLOAD_MODE'] = 'x-sendfile'
+        response = client.get(f'/api/trailers/{movie.id}/stream')
+        assert response.headers['X-Sendfile'] == os.path.join(media_root, 'trailers', 'movie_1_test.mp4')
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_stream_trailer_versioned_url_supports_conditional_requests(app):
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    url = f'/api/trailers/{movie.id}/stream?v=movie_1_test'
+    try:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.data == b'0123456789' * 10
+        assert 'immutable' in response.headers['Cache-Control']
+        etag = response.headers['ETag']
+        assert etag.startswith('"movie_1_test-')
+        assert response.headers['Last-Modified']
+
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+        response = client.get(url, headers={'Range': 'bytes=0-4', 'If-Range': etag})
+        assert response.status_code == 206
+        assert response.data == b'01234'
+
+        response = client.get(url, headers={'Range': 'bytes=0-4', 'If-Range': '"stale"'})
+        assert response.status_code == 200
+        assert len(response.data) == 100
+
+        response = client.get(f'/api/trailers/{movie.id}/stream?v=old')
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(url)
+
+        response = client.get(f'/api/trailers/{movie.id}/stream')
+        assert response.headers['Cache-Control'] == 'no-cache'
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_stream_trailer_range_engine_handles_suffix_multi_and_unsatisfiable(app):
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    url = f'/api/trailers/{movie.id}/stream'
+    try:
+        response = client.get(url, headers={'Range': 'bytes=-5'})
+        assert response.status_code == 206
+        assert response.data == b'56789'
+        assert response.headers['Content-Range'] == 'bytes 95-99/100'
+
+        response = client.get(url, headers={'Range': 'bytes=90-'})
+        assert response.status_code == 206
+        assert response.headers['Content-Length'] == '10'
+
+        response = client.get(url, headers={'Range': 'bytes=100-200'})
+        assert response.status_code == 416
+        assert response.headers['Content-Range'] == 'bytes */100'
+
+        response = client.get(url, headers={'Range': 'bytes=5-1'})
+        assert response.status_code == 200
+        assert len(response.data) == 100
+
+        # Пересекающиеся диапазоны объединяются в один
+        response = client.get(url, headers={'Range': 'bytes=0-4,3-9'})
+        assert response.status_code == 206
+        assert response.headers['Content-Range'] == 'bytes 0-9/100'
+
+        response = client.get(url, headers={'Range': 'bytes=0-1, -2'})
+        assert response.status_code == 206
+        content_type = response.headers['Content-Type']
+        assert content_type.startswith('multipart/byteranges; boundary=')
+        boundary = content_type.split('boundary=', 1)[1]
+        assert int(response.headers['Content-Length']) == len(response.data)
+        assert response.data == (
+            f'--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 0-1/100\r\n\r\n'.encode()
+            + b'01'
+            + f'\r\n--{boundary}\r\nContent-Type: video/mp4\r\nContent-Range: bytes 98-99/100\r\n\r\n'.encode()
+            + b'89'
+            + f'\r\n--{boundary}--\r\n'.encode()
+        )
+
+        poster_relative = 'posters/poster_1.jpg'
+        os.makedirs(os.path.join(media_root, 'posters'), exist_ok=True)
+        with open(os.path.join(media_root, poster_relative), 'wb') as poster_file:
+            poster_file.write(b'JPEGDATA')
+        movie.poster_file_path = poster_relative
+        db.session.commit()
+
+        response = client.get(f'/api/posters/{movie.id}', headers={'Range': 'bytes=-4'})
+        assert response.status_code == 206
+        assert response.data == b'DATA'
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000'
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_stream_trailer_signed_url_is_issued_after_payment_and_bound_to_voter(app, monkeypatch):
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app, allow_unsigned=False)
+    movie.trailer_view_cost = 2
+    db.session.commit()
+    movie_id = movie.id
+    response = _create_poll_via_api(client, [_build_movie('Trailer Movie'), _build_movie('Other')])
+    poll = Poll.query.get(response.get_json()['poll_id'])
+    poll_movie_id = next(item.id for item in poll.movies if item.name == 'Trailer Movie')
+    db.session.add(PollVoterProfile(token='viewer-token', total_points=5))
+    db.session.commit()
+    try:
+        assert client.get(f'/api/trailers/{movie_id}/stream', headers={'Range': 'bytes=0-4'}).status_code == 403
+
+        client.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'viewer-token')
+        response = client.post(f'/api/polls/{poll.id}/watch-trailer', json={'movie_id': poll_movie_id})
+        assert response.status_code == 200
+        assert response.get_json()['points_balance'] == 3
+        signed_url = response.get_json()['trailer_url']
+        assert signed_url.startswith(f'/api/trailers/{movie_id}/stream?token=')
+        payload = media_delivery.URLSafeSerializer('x').loads_unsafe(signed_url.split('token=', 1)[1])[1]
+        assert payload['p'] == 'trailers/movie_1_test.mp4'
+        assert payload['s'] == 100
+        assert payload['h'] == 'movie_1_test'
+
+        # Range-запросы по подписанной ссылке не обращаются к БД
+        queries = []
+
+        def _count_queries(*args, **kwargs):
+            queries.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', _count_queries)
+        try:
+            response = client.get(signed_url, headers={'Range': 'bytes=0-4'})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _count_queries)
+        assert response.status_code == 206
+        assert response.data == b'01234'
+        assert queries == []
+        assert response.headers['Cache-Control'] == 'private, max-age=31536000, immutable'
+        etag = response.headers['ETag']
+        assert etag.startswith('"movie_1_test-')
+        assert client.get(signed_url, headers={'If-None-Match': etag}).status_code == 304
+
+        tampered_url = signed_url[:-2] + ('aa' if not signed_url.endswith('aa') else 'bb')
+        assert client.get(tampered_url).status_code == 403
+
+        # Подпись привязана к фильму и к зрителю
+        other_url = signed_url.replace(f'/api/trailers/{movie_id}/', f'/api/trailers/{movie_id + 1}/')
+        assert client.get(other_url).status_code == 403
+        stranger = app.test_client()
+        assert stranger.get(signed_url).status_code == 403
+        stranger.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'stranger-token')
+        assert stranger.get(signed_url).status_code == 403
+
+        # Файл заменён на месте — ссылка с прежним размером больше не действует
+        with open(os.path.join(media_root, 'trailers', 'movie_1_test.mp4'), 'ab') as trailer_file:
+            trailer_file.write(b'tail')
+        assert client.get(signed_url).status_code == 404
+
+        expired_at = media_delivery.time.time() + 3 * 3600
+        monkeypatch.setattr(media_delivery, 'time', SimpleNamespace(time=lambda: expired_at))
+        assert client.get(signed_url).status_code == 403
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_library_trailer_preview_requires_admin_secret(app, monkeypatch):
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app, allow_unsigned=False)
+    movie_id = movie.id
+    monkeypatch.setenv('ADMIN_SECRET_KEY', 'admin-secret')
+    try:
+        assert client.get(f'/api/trailers/{movie_id}/stream').status_code == 403
+
+        # Публичная библиотека не раздаёт ссылок на платные трейлеры
+        library = client.get('/api/library').get_json()
+        serialized = next(item for item in library['movies'] if item['id'] == movie_id)
+        assert 'trailer_url' not in serialized and 'trailer_previews' not in serialized
+        page = client.get('/library')
+        assert page.status_code == 200
+        assert b'/stream?token=' not in page.data
+
+        assert client.get(f'/api/library/{movie_id}/trailer-preview').status_code == 401
+        assert client.get(
+            f'/api/library/{movie_id}/trailer-preview', headers={'Authorization': 'Bearer wrong'},
+        ).status_code == 403
+        preview = client.get(
+            f'/api/library/{movie_id}/trailer-preview', headers={'Authorization': 'Bearer admin-secret'},
+        )
+        assert preview.status_code == 200
+        assert 'no-store' in preview.headers['Cache-Control']
+        preview_url = preview.get_json()['trailer_url']
+        assert preview_url.startswith(f'/api/trailers/{movie_id}/stream?token=')
+
+        # Ссылка администратора работает при TRAILER_ALLOW_UNSIGNED_STREAM=0
+        response = client.get(preview_url, headers={'Range': 'bytes=0-4'})
+        assert response.status_code == 206
+        assert response.data == b'01234'
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_faststart_runs_through_job_queue_with_retries(app, monkeypatch):
+    from io import BytesIO
+
+    from movie_lottery.utils import job_queue, media_jobs
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['MEDIA_JOB_RETRY_DELAY_SECONDS'] = 0
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    calls = []
+
+    def fake_faststart(path, output_path=None):
+        calls.append(path)
+        if len(calls) == 1:
+            return {'success': False, 'message': 'ffmpeg упал', 'new_size': None}
+        with open(path, 'rb') as source, open(output_path, 'wb') as video_file:
+            video_file.write(source.read() + b'moov')
+        return {'success': True, 'message': 'ok', 'new_size': os.path.getsize(output_path)}
+
+    monkeypatch.setattr(media_jobs, 'apply_faststart', fake_faststart)
+    try:
+        response = client.post('/api/trailers/apply-faststart')
+        assert response.status_code == 202
+        batch_id = response.get_json()['batch_id']
+        job_id = response.get_json()['results']['details'][0]['job_id']
+        assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'queued'
+
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 2
+
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        assert job['status'] == 'done'
+        assert job['progress'] == 100
+        assert job['attempts'] == 2
+        assert job['result']['new_size'] == 104
+
+        batch = client.get(f'/api/jobs?batch={batch_id}').get_json()
+        assert batch['finished'] is True
+        assert batch['counts']['done'] == 1
+
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_file_size == 104
+        assert refreshed.trailer_file_path != 'trailers/movie_1_test.mp4'
+        assert os.path.exists(os.path.join(media_root, refreshed.trailer_file_path))
+
+        # Загрузка отвечает сразу, faststart остаётся в очереди
+        response = client.post(
+            f'/api/movies/{movie.id}/trailer-local',
+            data={'trailer': (BytesIO(b'new-trailer'), 'trailer.mp4', 'video/mp4')},
+            content_type='multipart/form-data',
+        )
+        assert response.status_code == 200
+        upload_job = response.get_json()['faststart_job']
+        assert upload_job['status'] == 'queued'
+        assert len(calls) == 2
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def _mp4_box(box_type, payload=b''):
+    import struct
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def _build_test_mp4(faststart=True):
+    import struct
+
+    mvhd = _mp4_box(b'mvhd', b'\x00' * 12 + struct.pack('>II', 1000, 12500) + b'\x00' * 80)
+    tkhd = _mp4_box(b'tkhd', b'\x00' * 76 + struct.pack('>II', 1280 << 16, 720 << 16))
+    hdlr = _mp4_box(b'hdlr', b'\x00' * 8 + b'vide' + b'\x00' * 12)
+    avcc = _mp4_box(b'avcC', bytes([1, 0x64, 0x00, 0x1F]) + b'\x00' * 3)
+    avc1 = _mp4_box(b'avc1', b'\x00' * 24 + struct.pack('>HH', 1280, 720) + b'\x00' * 50 + avcc)
+    stsd = _mp4_box(b'stsd', b'\x00' * 4 + struct.pack('>I', 1) + avc1)
+    trak = _mp4_box(b'trak', tkhd + _mp4_box(b'mdia', hdlr + _mp4_box(b'minf', _mp4_box(b'stbl', stsd))))
+    moov = _mp4_box(b'moov', mvhd + trak)
+    ftyp = _mp4_box(b'ftyp', b'isom' + b'\x00\x00\x02\x00' + b'isomavc1')
+    mdat = _mp4_box(b'mdat', b'\x00' * 4096)
+    return ftyp + (moov + mdat if faststart else mdat + moov)
+
+
+def test_mp4_box_scanner_detects_faststart_and_skips_ffmpeg(app, monkeypatch):
+    from movie_lottery.utils import video_processing
+
+    media_root = tempfile.mkdtemp(prefix='movie-lottery-mp4-')
+    try:
+        optimized = os.path.join(media_root, 'optimized.mp4')
+        unoptimized = os.path.join(media_root, 'unoptimized.mp4')
+        with open(optimized, 'wb') as video_file:
+            video_file.write(_build_test_mp4(faststart=True))
+        with open(unoptimized, 'wb') as video_file:
+            video_file.write(_build_test_mp4(faststart=False))
+
+        metadata = video_processing.inspect_mp4(optimized)
+        assert metadata['faststart'] is True
+        assert metadata['duration'] == 12.5
+        assert metadata['codecs'] == ['avc1.64001F']
+        assert (metadata['width'], metadata['height']) == (1280, 720)
+        assert video_processing.inspect_mp4(unoptimized)['faststart'] is False
+
+        def _no_subprocess(*args, **kwargs):
+            raise AssertionError('ffmpeg не должен запускаться для оптимизированного файла')
+
+        monkeypatch.setattr(video_processing.subprocess, 'run', _no_subprocess)
+        result = video_processing.apply_faststart(optimized)
+        assert result['success'] is True
+        assert result['skipped'] is True
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    movie, media_root = _create_library_trailer(app, payload=_build_test_mp4(faststart=True))
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    try:
+        response = app.test_client().post('/api/trailers/apply-faststart')
+        assert response.get_json()['results']['skipped'] == 1
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_faststart is True
+        assert refreshed.trailer_codecs == 'avc1.64001F'
+        assert refreshed.trailer_duration == 12.5
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_hls_packaging_job_publishes_static_playlist(app, monkeypatch):
+    from movie_lottery.utils import job_queue, media_jobs
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(
+        app, payload=_build_test_mp4(faststart=True), allow_unsigned=False,
+    )
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = True
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    app.config['TRAILER_HLS_RENDITIONS'] = '360:800,720:2500,1080:5000'
+    packaged = []
+
+    def fake_package_hls(input_path, output_dir, renditions, **kwargs):
+        packaged.append(renditions)
+        os.makedirs(os.path.join(output_dir, '360p'))
+        with open(os.path.join(output_dir, 'master.m3u8'), 'w') as playlist:
+            playlist.write('#EXTM3U\n360p/index.m3u8\n')
+        with open(os.path.join(output_dir, '360p', 'seg_000.ts'), 'wb') as segment:
+            segment.write(b'\x47' * 188)
+        kwargs['progress_callback'](0.5)
+        return {'success': True, 'message': 'HLS упакован', 'renditions': renditions}
+
+    monkeypatch.setattr(media_jobs, 'package_hls', fake_package_hls)
+    try:
+        # Трейлер уже faststart — в пакет попадает только упаковка HLS
+        response = client.post('/api/trailers/apply-faststart')
+        assert response.get_json()['results']['queued'] == 1
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+
+        # Исходник 720p: качество 1080p не апскейлится
+        assert packaged == [[(360, 800), (720, 2500)]]
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_hls_path == 'trailers/hls/movie_1_test/master.m3u8'
+        assert refreshed.trailer_hls_url == '/api/trailers/hls/movie_1_test/master.m3u8'
+
+        # Без оплаченной ссылки ни плейлист, ни сегменты не отдаются
+        assert client.get(refreshed.trailer_hls_url).status_code == 403
+        assert client.get('/api/trailers/hls/movie_1_test/360p/seg_000.ts').status_code == 403
+        client.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'hls-viewer')
+        signed_url = media_delivery.sign_trailer_asset_url(refreshed.trailer_hls_url, 'hls', 'hls-viewer')
+
+        statements = []
+
+        def _count(*args):
+            statements.append(args)
+
+        event.listen(db.engine, 'before_cursor_execute', _count)
+        try:
+            playlist = client.get(signed_url)
+            variant_token = playlist.get_data(as_text=True).split('360p/index.m3u8?token=', 1)[1].strip()
+            segment = client.get(f'/api/trailers/hls/movie_1_test/360p/seg_000.ts?token={variant_token}')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', _count)
+        assert statements == []
+        assert playlist.status_code == 200
+        assert playlist.mimetype == 'application/vnd.apple.mpegurl'
+        assert playlist.headers['Cache-Control'] == 'private, no-cache'
+        assert segment.status_code == 200
+        assert segment.mimetype == 'video/mp2t'
+        assert segment.headers['Cache-Control'].startswith('private, ')
+        # Токен выдан другому зрителю
+        stranger = app.test_client()
+        stranger.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'someone-else')
+        assert stranger.get(signed_url).status_code == 403
+
+        assert client.get('/api/trailers/hls/../movie_1_test.mp4').status_code == 404
+        assert client.get(
+            f'/api/trailers/hls/movie_1_test/../../movie_1_test.m3u8?token={variant_token}'
+        ).status_code in (400, 404)
+
+        # Удаление фильма убирает и каталог HLS
+        assert client.delete(f'/api/library/{movie.id}').status_code == 200
+        assert not os.path.exists(os.path.join(media_root, 'trailers', 'hls', 'movie_1_test'))
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_package_hls_kills_silent_ffmpeg_at_the_deadline(monkeypatch):
+    import threading
+
+    from movie_lottery.utils import video_processing
+
+    killed = threading.Event()
+
+    class _SilentProcess:
+        """ffmpeg, который завис и не пишет ни строки прогресса."""
+
+        def __init__(self, *args, **kwargs):
+            self.stdout = self._silent()
+            self.stderr = iter(())
+
+        @staticmethod
+        def _silent():
+            killed.wait(10)
+            yield from ()
+
+        def kill(self):
+            killed.set()
+
+        def wait(self, timeout=None):
+            return -9
+
+    monkeypatch.setattr(video_processing, 'is_ffmpeg_available', lambda: True)
+    monkeypatch.setattr(video_processing.subprocess, 'Popen', _SilentProcess)
+    work_root = tempfile.mkdtemp(prefix='movie-lottery-hls-')
+    try:
+        input_path = os.path.join(work_root, 'trailer.mp4')
+        with open(input_path, 'wb') as video_file:
+            video_file.write(b'video')
+        started = video_processing.time.monotonic()
+        result = video_processing.package_hls(
+            input_path, os.path.join(work_root, 'hls', 'trailer'), [(360, 800)], timeout=0.2,
+        )
+        assert video_processing.time.monotonic() - started < 5
+        assert result == {'success': False, 'message': 'Таймаут упаковки HLS', 'renditions': []}
+        assert killed.is_set()
+        assert os.listdir(os.path.join(work_root, 'hls')) == []
+    finally:
+        shutil.rmtree(work_root, ignore_errors=True)
+
+
+def test_thumbnails_job_stores_poster_frame_sprite_and_vtt(app, monkeypatch):
+    from movie_lottery.utils import job_queue, media_jobs, video_processing
+
+    vtt = video_processing.build_thumbnail_vtt('sprite.jpg', 25, 10, 3, 2, 160, 90)
+    assert vtt.splitlines()[2:4] == ['00:00:00.000 --> 00:00:10.000', 'sprite.jpg#xywh=0,0,160,90']
+    assert '00:00:20.000 --> 00:00:25.000\nsprite.jpg#xywh=0,90,160,90' in vtt
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(
+        app, payload=_build_test_mp4(faststart=True), allow_unsigned=False,
+    )
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = True
+    calls = []
+
+    def fake_previews(input_path, output_dir, **kwargs):
+        calls.append(kwargs)
+        os.makedirs(output_dir)
+        for name in ('poster.jpg', 'sprite.jpg'):
+            with open(os.path.join(output_dir, name), 'wb') as image:
+                image.write(b'\xff\xd8\xff')
+        with open(os.path.join(output_dir, 'thumbnails.vtt'), 'w') as track:
+            track.write(vtt)
+        return {
+            'success': True, 'message': 'ok', 'poster': 'poster.jpg',
+            'sprite': 'sprite.jpg', 'vtt': 'thumbnails.vtt', 'thumbnails': 3,
+        }
+
+    monkeypatch.setattr(media_jobs, 'build_trailer_previews', fake_previews)
+    try:
+        movie.trailer_duration, movie.trailer_width, movie.trailer_height = 25.0, 1280, 720
+        jobs = media_jobs.enqueue_trailer_postprocessing(movie)
+        db.session.commit()
+        assert [job.job_type for job in jobs] == ['thumbnails']
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        assert (calls[0]['duration'], calls[0]['height']) == (25.0, 720)
+
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_poster_frame_path == 'trailers/thumbs/movie_1_test/poster.jpg'
+        assert refreshed.trailer_sprite_url == '/api/trailers/thumbs/movie_1_test/sprite.jpg'
+        assert refreshed.trailer_thumbnails_url == '/api/trailers/thumbs/movie_1_test/thumbnails.vtt'
+
+        # Превью отдаются только по ссылке, выданной зрителю после оплаты
+        assert client.get(refreshed.trailer_thumbnails_url).status_code == 403
+        assert client.get(refreshed.trailer_sprite_url).status_code == 403
+        client.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'thumbs-viewer')
+        track_url = media_delivery.sign_trailer_asset_url(refreshed.trailer_thumbnails_url, 'thumbs', 'thumbs-viewer')
+        track = client.get(track_url)
+        assert track.status_code == 200
+        assert track.mimetype == 'text/vtt'
+        assert track.headers['Cache-Control'] == 'private, no-cache'
+        sprite_cue = next(line for line in track.get_data(as_text=True).splitlines() if line.startswith('sprite.jpg'))
+        assert sprite_cue.startswith('sprite.jpg?token=') and sprite_cue.endswith('#xywh=0,0,160,90')
+        sprite = client.get(f"/api/trailers/thumbs/movie_1_test/{sprite_cue.split('#', 1)[0]}")
+        assert sprite.status_code == 200
+        poster_url = media_delivery.sign_trailer_asset_url(refreshed.trailer_poster_frame_url, 'thumbs', 'thumbs-viewer')
+        assert client.get(poster_url).mimetype == 'image/jpeg'
+        assert client.get('/api/trailers/thumbs/movie_1_test/poster.png').status_code == 404
+
+        # Превью без привязки к зрителю выдаются только администратору
+        library = app.test_client().get('/api/library').get_json()
+        serialized = next(item for item in library['movies'] if item['id'] == movie.id)
+        assert 'trailer_previews' not in serialized
+        monkeypatch.setenv('ADMIN_SECRET_KEY', 'admin-secret')
+        previews = app.test_client().get(
+            f'/api/library/{movie.id}/trailer-preview', headers={'Authorization': 'Bearer admin-secret'},
+        ).get_json()['trailer_previews']
+        assert previews['poster_frame'].startswith('/api/trailers/thumbs/movie_1_test/poster.jpg?token=')
+        admin = app.test_client()
+        assert admin.get(previews['poster_frame']).mimetype == 'image/jpeg'
+        assert admin.get(previews['sprite']).status_code == 200
+        assert admin.get(previews['thumbnails']).mimetype == 'text/vtt'
+
+        # Новая загрузка трейлера сбрасывает превью прежнего файла
+        from io import BytesIO
+        client.post(
+            f'/api/movies/{movie.id}/trailer-local',
+            data={'trailer': (BytesIO(b'new-trailer'), 'trailer.webm', 'video/webm')},
+            content_type='multipart/form-data',
+        )
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_poster_frame_path is None
+        assert not os.path.exists(os.path.join(media_root, 'trailers', 'thumbs', 'movie_1_test'))
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_resumable_trailer_upload_appends_chunks_and_verifies_checksum(app, monkeypatch):
+    import base64
+    import hashlib
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    payload = _build_test_mp4(faststart=True)
+
+    def _metadata(**values):
+        return ','.join(f'{key} {base64.b64encode(value.encode()).decode()}' for key, value in values.items())
+
+    def _patch(upload_url, offset, chunk, checksum=None):
+        headers = {'Tus-Resumable': '1.0.0', 'Upload-Offset': str(offset)}
+        if checksum:
+            headers['Upload-Checksum'] = checksum
+        return client.patch(upload_url, data=chunk, headers=headers, content_type='application/offset+octet-stream')
+
+    try:
+        response = client.post(f'/api/movies/{movie.id}/trailer-uploads', headers={
+            'Tus-Resumable': '1.0.0',
+            'Upload-Length': str(len(payload)),
+            'Upload-Metadata': _metadata(
+                filename='trailer.mp4',
+                filetype='video/mp4',
+                checksum=hashlib.sha256(payload).hexdigest(),
+            ),
+        })
+        assert response.status_code == 201
+        assert response.headers['Upload-Offset'] == '0'
+        upload_url = response.headers['Location']
+
+        first = _patch(upload_url, 0, payload[:1000])
+        assert first.status_code == 204
+        assert first.headers['Upload-Offset'] == '1000'
+
+        # Повтор с устаревшим смещением и кусок с неверной контрольной суммой отклоняются
+        assert _patch(upload_url, 0, payload[:1000]).status_code == 409
+        original_append = api_routes.append_chunk
+
+        def _racing_append(upload, *args, **kwargs):
+            # Параллельный PATCH успел сдвинуть смещение, пока этот писал кусок
+            db.session.execute(
+                text('UPDATE trailer_upload SET upload_offset = upload_offset + 1 WHERE id = :id'),
+                {'id': upload.id},
+            )
+            return original_append(upload, *args, **kwargs)
+
+        with monkeypatch.context() as patched:
+            patched.setattr(api_routes, 'append_chunk', _racing_append)
+            assert _patch(upload_url, 1000, payload[1000:2000]).status_code == 409
+
+        # Пока кусок передаётся, транзакция БД закрыта, а файл захвачен flock:
+        # параллельный PATCH сразу получает 409, не дожидаясь конца передачи
+        upload_row = db.session.get(TrailerUpload, upload_url.rsplit('/', 1)[1])
+        upload_path = os.path.join(media_root, upload_row.relative_path)
+        transaction_states = []
+        concurrent_statuses = []
+
+        class _SlowStream:
+            def __init__(self, stream):
+                self._stream = stream
+
+            def read(self, size):
+                if not transaction_states:
+                    transaction_states.append(db.session().in_transaction())
+                    concurrent_statuses.append(app.test_client().patch(
+                        upload_url, data=payload[1000:1010],
+                        headers={'Tus-Resumable': '1.0.0', 'Upload-Offset': '1000'},
+                        content_type='application/offset+octet-stream',
+                    ).status_code)
+                return b''
+
+        def _slow_append(upload, stream, *args, **kwargs):
+            return original_append(upload, _SlowStream(stream), *args, **kwargs)
+
+        with monkeypatch.context() as patched:
+            patched.setattr(api_routes, 'append_chunk', _slow_append)
+            assert _patch(upload_url, 1000, payload[1000:2000]).status_code == 204
+        assert transaction_states == [False]
+        assert concurrent_statuses == [409]
+        assert os.path.getsize(upload_path) == 1000
+        bad_checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(b'other').digest()).decode()
+        assert _patch(upload_url, 1000, payload[1000:2000], bad_checksum).status_code == 460
+
+        # Клиент после обрыва узнаёт смещение и продолжает с него
+        head = client.head(upload_url)
+        assert head.headers['Upload-Offset'] == '1000'
+
+        chunk = payload[1000:]
+        checksum = 'sha256 ' + base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+        done = _patch(upload_url, 1000, chunk, checksum)
+        assert done.status_code == 200
+        assert done.headers['Upload-Offset'] == str(len(payload))
+        body = done.get_json()
+        assert body['movie']['has_local_trailer'] is True
+        assert body['movie']['trailer_metadata']['faststart'] is True
+
+        db.session.expire_all()
+        refreshed = db.session.get(LibraryMovie, movie.id)
+        assert refreshed.trailer_file_size == len(payload)
+        with open(os.path.join(media_root, refreshed.trailer_file_path), 'rb') as uploaded:
+            assert uploaded.read() == payload
+        # Прежний файл трейлера удалён, запись о загрузке — тоже
+        assert not os.path.exists(os.path.join(media_root, 'trailers', 'movie_1_test.mp4'))
+        assert client.head(upload_url).status_code == 404
+
+        # Несовпадение SHA-256 всего файла отменяет загрузку
+        response = client.post(f'/api/movies/{movie.id}/trailer-uploads', headers={
+            'Tus-Resumable': '1.0.0',
+            'Upload-Length': '4',
+            'Upload-Metadata': _metadata(filetype='video/mp4', checksum='0' * 64),
+        })
+        upload_url = response.headers['Location']
+        assert _patch(upload_url, 0, b'abcd').status_code == 460
+        assert client.head(upload_url).status_code == 404
+        db.session.expire_all()
+        assert db.session.get(LibraryMovie, movie.id).trailer_file_path == refreshed.trailer_file_path
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_identical_trailers_are_stored_once_and_removed_with_last_reference(app):
+    import hashlib
+    from io import BytesIO
+
+    from movie_lottery.models import MediaBlob
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    other = LibraryMovie(name='Same Trailer', year='2024')
+    db.session.add(other)
+    db.session.commit()
+    payload = b'same-trailer-bytes' * 100
+    digest = hashlib.sha256(payload).hexdigest()
+
+    def _upload(movie_id):
+        return client.post(
+            f'/api/movies/{movie_id}/trailer-local',
+            data={'trailer': (BytesIO(payload), 'trailer.mp4', 'video/mp4')},
+            content_type='multipart/form-data',
+        )
+
+    try:
+        assert _upload(movie.id).status_code == 200
+        assert _upload(other.id).status_code == 200
+
+        db.session.expire_all()
+        first = db.session.get(LibraryMovie, movie.id)
+        second = db.session.get(LibraryMovie, other.id)
+        expected_path = f'trailers/sha256/{digest[:2]}/{digest}.mp4'
+        assert first.trailer_file_path == second.trailer_file_path == expected_path
+        assert first.trailer_file_size == len(payload)
+        # Файл со старым именем больше ни на что не ссылался и удалён сразу
+        assert not os.path.exists(os.path.join(media_root, 'trailers', 'movie_1_test.mp4'))
+        blob = MediaBlob.query.filter_by(relative_path=expected_path).one()
+        assert (blob.sha256, blob.ref_count, blob.size) == (digest, 2, len(payload))
+        assert [name for name in os.listdir(os.path.dirname(os.path.join(media_root, expected_path)))] == [
+            f'{digest}.mp4'
+        ]
+
+        assert client.delete(f'/api/library/{movie.id}').status_code == 200
+        assert os.path.exists(os.path.join(media_root, expected_path))
+        db.session.expire_all()
+        assert MediaBlob.query.filter_by(relative_path=expected_path).one().ref_count == 1
+
+        # Последняя ссылка снята, но запрос таблицу не обходит — файл удаляет задание сборщика
+        from movie_lottery.utils import media_store
+
+        assert client.delete(f'/api/library/{other.id}').status_code == 200
+        assert os.path.exists(os.path.join(media_root, expected_path))
+        assert MediaBlob.query.filter_by(relative_path=expected_path).one().ref_count == 0
+        assert media_store.collect_orphan_blobs() == 1
+        assert not os.path.exists(os.path.join(media_root, expected_path))
+        assert MediaBlob.query.filter_by(relative_path=expected_path).first() is None
+
+        # Сборщик уже удалил запись, но ещё не файл: новая копия не дедуплицируется
+        # с файлом, который вот-вот исчезнет, а занимает его место
+
+        stale_path = os.path.join(media_root, expected_path)
+        with open(stale_path, 'wb') as stale_file:
+            stale_file.write(payload)
+        source_path = os.path.join(media_root, 'trailers', 'incoming.mp4')
+        with open(source_path, 'wb') as source_file:
+            source_file.write(payload)
+        source_inode = os.stat(source_path).st_ino
+        assert media_store.adopt_file(source_path, digest, len(payload), 'trailer', '.mp4') == expected_path
+        db.session.commit()
+        assert os.stat(stale_path).st_ino == source_inode
+        assert MediaBlob.query.filter_by(relative_path=expected_path).one().ref_count == 1
+
+        # Ссылку так и не удалось учесть — файл не кладётся в хранилище без счётчика
+        other_payload = b'racing-trailer'
+        other_digest = hashlib.sha256(other_payload).hexdigest()
+        with open(source_path, 'wb') as source_file:
+            source_file.write(other_payload)
+        attempts = []
+
+        def _always_conflicting():
+            attempts.append(True)
+            raise IntegrityError('INSERT', {}, Exception('duplicate key'))
+
+        original_begin_nested = db.session.begin_nested
+        db.session.begin_nested = _always_conflicting
+        try:
+            with pytest.raises(IntegrityError):
+                media_store.adopt_file(source_path, other_digest, len(other_payload), 'trailer', '.mp4')
+        finally:
+            db.session.begin_nested = original_begin_nested
+        db.session.rollback()
+        assert len(attempts) == media_store._ACQUIRE_ATTEMPTS
+        assert os.path.exists(source_path)
+        assert not os.path.exists(os.path.join(media_root, media_store.blob_relative_path('trailer', other_digest, '.mp4')))
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_poster_variants_negotiate_webp_and_fall_back_to_original(app, monkeypatch):
+    from movie_lottery.routes import api_routes
+    from movie_lottery.utils import media_jobs
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config['POSTER_VARIANTS_ENABLED'] = True
+    app.config['POSTER_VARIANT_WIDTHS'] = '160,320,640'
+    poster_relative = 'posters/poster_1.jpg'
+    os.makedirs(os.path.join(media_root, 'posters'), exist_ok=True)
+    with open(os.path.join(media_root, poster_relative), 'wb') as poster_file:
+        poster_file.write(b'FULL-SIZE-JPEG')
+    movie.poster_file_path = poster_relative
+    db.session.commit()
+    calls = []
+
+    def fake_resize(input_path, output_path, width, timeout=60):
+        calls.append((os.path.basename(output_path), width))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as variant_file:
+            variant_file.write(f'{width}{os.path.splitext(output_path)[1]}'.encode())
+        return {'success': True, 'message': 'ok'}
+
+    monkeypatch.setattr(media_jobs, 'resize_poster', fake_resize)
+    try:
+        serialized = api_routes._serialize_library_movie(movie)
+        assert serialized['poster_srcset'] == (
+            f'/api/posters/{movie.id}?w=160 160w, /api/posters/{movie.id}?w=320 320w, /api/posters/{movie.id}?w=640 640w'
+        )
+
+        webp_accept = {'Accept': 'image/avif,image/webp,image/*,*/*;q=0.8'}
+        response = client.get(f'/api/posters/{movie.id}?w=200', headers=webp_accept)
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert response.data == b'320.webp'
+        assert 'Accept' in response.headers['Vary']
+        assert os.path.exists(os.path.join(media_root, 'posters', 'variants', 'poster_1', '320.webp'))
+
+        # Готовая копия отдаётся без повторного уменьшения
+        assert client.get(f'/api/posters/{movie.id}?w=300', headers=webp_accept).data == b'320.webp'
+        response = client.get(f'/api/posters/{movie.id}?w=2000', headers={'Accept': 'image/png,image/*;q=0.8'})
+        assert (response.mimetype, response.data) == ('image/jpeg', b'640.jpg')
+        assert calls == [('320.webp', 320), ('640.jpg', 640)]
+
+        monkeypatch.setattr(media_jobs, 'resize_poster', lambda *args, **kwargs: {'success': False, 'message': 'нет ffmpeg'})
+        response = client.get(f'/api/posters/{movie.id}?w=100', headers=webp_accept)
+        assert response.data == b'FULL-SIZE-JPEG'
+        assert response.headers['Cache-Control'] == 'public, max-age=300'
+        assert client.get(f'/api/posters/{movie.id}').data == b'FULL-SIZE-JPEG'
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_stored_posters_use_static_hashed_urls_with_redirect_shim(app, monkeypatch):
+    import hashlib
+
+    from movie_lottery.utils import media_jobs
+    from movie_lottery.utils.media_store import KIND_POSTER, BlobWriter
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config['POSTER_VARIANTS_ENABLED'] = True
+    app.config['POSTER_VARIANT_WIDTHS'] = '160,320'
+    app.config['POSTER_STATIC_URLS'] = True
+    with BlobWriter(KIND_POSTER) as writer:
+        writer.write(b'HASHED-POSTER')
+        movie.poster_file_path = writer.commit('.jpg')
+    db.session.commit()
+    digest = hashlib.sha256(b'HASHED-POSTER').hexdigest()
+    calls = []
+
+    def fake_resize(input_path, output_path, width, timeout=60):
+        calls.append(os.path.basename(output_path))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as variant_file:
+            variant_file.write(b'VARIANT')
+        return {'success': True, 'message': 'ok'}
+
+    monkeypatch.setattr(media_jobs, 'resize_poster', fake_resize)
+    try:
+        serialized = api_routes._serialize_library_movie(movie)
+        assert serialized['poster'] == f'/media/posters/sha256/{digest[:2]}/{digest}.jpg'
+        assert serialized['poster_webp_srcset'] == (
+            f'/media/posters/variants/{digest}/160.webp 160w, /media/posters/variants/{digest}/320.webp 320w'
+        )
+        assert serialized['poster_srcset'].startswith(f'/media/posters/variants/{digest}/160.jpg 160w')
+
+        # Старый URL перенаправляет на статику, с ?w= — на копию нужного формата
+        response = client.get(f'/api/posters/{movie.id}')
+        assert response.status_code == 302
+        assert response.headers['Location'] == serialized['poster']
+        response = client.get(f'/api/posters/{movie.id}?w=200', headers={'Accept': 'image/webp,*/*'})
+        assert response.headers['Location'] == f'/media/posters/variants/{digest}/320.webp'
+        assert 'Accept' in response.headers['Vary']
+
+        # Ещё не созданную копию делает приложение, дальше её отдаёт статика
+        response = client.get(f'/media/posters/variants/{digest}/320.webp')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        assert 'immutable' in response.headers['Cache-Control']
+        assert calls == ['320.webp']
+        assert client.get(f'/media/posters/variants/{digest}/999.webp').status_code == 404
+        assert client.get(f'/media/posters/variants/{"0" * 64}/320.webp').status_code == 404
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_poster_migration_runs_as_resumable_background_job(app, monkeypatch):
+    from movie_lottery.utils import job_queue, media_jobs
+    from movie_lottery.utils.media_store import KIND_POSTER, BlobWriter
+
+    client = app.test_client()
+    media_root = app.config['TRAILER_MEDIA_ROOT'] = tempfile.mkdtemp(prefix='movie-lottery-media-')
+    app.config['POSTER_VARIANTS_ENABLED'] = False
+    app.config['POSTER_MIGRATION_CONCURRENCY'] = 2
+    for name, poster in (('A', 'https://cdn/a.jpg'), ('B', 'https://cdn/b.jpg'), ('C', 'https://cdn/broken.jpg')):
+        db.session.add(LibraryMovie(name=name, year='2024', poster=poster))
+    db.session.add(LibraryMovie(name='Local', year='2024', poster='https://cdn/l.jpg', poster_file_path='posters/old.jpg'))
+    db.session.commit()
+    fetched = []
+
+    def fake_download(poster_url, session=None):
+        fetched.append(poster_url)
+        if 'broken' in poster_url:
+            raise ValueError('404')
+        writer = BlobWriter(KIND_POSTER)
+        writer.write(b'SAME-POSTER')
+        return writer, '.jpg'
+
+    monkeypatch.setattr(media_jobs, 'download_poster', fake_download)
+    try:
+        response = client.post('/api/posters/migrate-all')
+        assert response.status_code == 202
+        job_id = response.get_json()['job']['id']
+        # Повторный запуск возвращает уже поставленное задание
+        assert client.post('/api/posters/migrate-all').get_json()['job']['id'] == job_id
+
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        status = client.get('/api/posters/migration').get_json()
+        assert (status['total'], status['downloaded'], status['remaining']) == (4, 3, 1)
+        assert status['job']['status'] == 'done'
+        assert status['job']['result']['downloaded'] == 2
+        assert status['job']['result']['failed'] == 1
+        assert sorted(fetched) == ['https://cdn/a.jpg', 'https://cdn/b.jpg', 'https://cdn/broken.jpg']
+
+        # Одинаковые постеры хранятся одним файлом
+        paths = {movie.poster_file_path for movie in LibraryMovie.query.filter(LibraryMovie.name.in_(['A', 'B']))}
+        assert len(paths) == 1 and os.path.exists(os.path.join(media_root, paths.pop()))
+
+        # Новый запуск докачивает только оставшееся
+        fetched.clear()
+        new_job_id = client.post('/api/posters/migrate-all').get_json()['job']['id']
+        assert new_job_id != job_id
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        assert fetched == ['https://cdn/broken.jpg']
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_library_grid_uses_poster_atlas_rebuilt_per_id_range(app, monkeypatch):
+    from movie_lottery.utils import job_queue, media_jobs
+    from movie_lottery.utils.media_store import KIND_POSTER, BlobWriter
+
+    client = app.test_client()
+    media_root = app.config['TRAILER_MEDIA_ROOT'] = tempfile.mkdtemp(prefix='movie-lottery-media-')
+    app.config['POSTER_VARIANTS_ENABLED'] = False
+    app.config['POSTER_ATLAS_ENABLED'] = True
+    app.config['POSTER_ATLAS_SIZE'] = 64
+    movies = []
+    for name in ('A', 'B'):
+        movie = LibraryMovie(name=name, year='2024')
+        with BlobWriter(KIND_POSTER) as writer:
+            writer.write(f'POSTER-{name}'.encode())
+            movie.poster_file_path = writer.commit('.jpg')
+        db.session.add(movie)
+        movies.append(movie)
+    db.session.commit()
+    builds = []
+
+    def fake_atlas(input_paths, output_path, tile_width, tile_height, columns, timeout=120):
+        builds.append(len(input_paths))
+        with open(output_path, 'wb') as atlas_file:
+            atlas_file.write(b'ATLAS')
+        return {'success': True, 'message': 'ok', 'columns': min(columns, len(input_paths)), 'rows': 1}
+
+    monkeypatch.setattr(media_jobs, 'build_poster_atlas', fake_atlas)
+    try:
+        # Первый показ ставит сборку атласа (одно задание на диапазон) и рисует обычные постеры
+        assert client.get('/library').status_code == 200
+        assert client.get('/library').status_code == 200
+        assert MediaJob.query.filter_by(job_type=media_jobs.JOB_POSTER_ATLAS).count() == 1
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        assert builds == [2]
+
+        page = client.get('/library').get_data(as_text=True)
+        atlas_path, map_path = media_jobs.poster_atlas_paths(
+            0, [(movie.id, movie.poster_file_path) for movie in movies]
+        )
+        atlas_url = media_jobs.poster_atlas_url(atlas_path)
+        assert 'poster-atlas-tile' in page and atlas_url in page
+        atlas_map = client.get(media_jobs.poster_atlas_url(map_path)).get_json()
+        assert atlas_map['tiles'][str(movies[1].id)]['column'] == 1
+        assert client.get(atlas_url).mimetype == 'image/webp'
+
+        # Удаление фильма пересобирает только его атлас, прежняя версия удаляется
+        assert client.delete(f'/api/library/{movies[0].id}').status_code == 200
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        assert builds == [2, 1]
+        assert not os.path.exists(os.path.join(media_root, atlas_path))
+        assert len(os.listdir(os.path.join(media_root, media_jobs.poster_atlas_dir()))) == 2
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_media_scan_walks_incrementally_and_reclaims_abandoned_files(app, monkeypatch):
+    import time as time_module
+
+    from movie_lottery.utils import media_scan
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    monkeypatch.setenv('ADMIN_SECRET_KEY', 'admin-secret')
+    app.config['MEDIA_SCAN_GRACE_SECONDS'] = 3600
+    app.config['MEDIA_SCAN_RECLAIM'] = False
+    movie.trailer_file_size = 999
+    db.session.add(LibraryMovie(name='No Poster File', year='2024', poster_file_path='posters/gone.jpg'))
+    db.session.commit()
+
+    old = time_module.time() - 7200
+    files = {
+        'trailers/movie_9_orphan.mp4': True,
+        'trailers/sha256/.incoming-abc': True,
+        'trailers/hls/' + 'f' * 64 + '/master.m3u8': True,
+        'trailers/fresh_upload.mp4': False,
+    }
+    for relative_path, aged in files.items():
+        absolute_path = os.path.join(media_root, relative_path)
+        os.makedirs(os.path.dirname(absolute_path), exist_ok=True)
+        with open(absolute_path, 'wb') as media_file:
+            media_file.write(b'x' * 10)
+        if aged:
+            os.utime(absolute_path, (old, old))
+    headers = {'Authorization': 'Bearer admin-secret'}
+    try:
+        assert client.get('/api/admin/media-scan').status_code == 401
+        # Шаг по 2 файла: проход занимает несколько шагов, курсор сохраняется между ними
+        steps = []
+        while True:
+            summary = client.post('/api/admin/media-scan/step?batch=2', headers=headers).get_json()
+            steps.append(summary)
+            assert summary['files_scanned'] <= 2
+            if summary['pass_finished']:
+                break
+        assert len(steps) >= 3
+
+        report = client.get('/api/admin/media-scan', headers=headers).get_json()
+        issues = {entry['relative_path']: entry['issue'] for entry in report['entries']}
+        assert issues == {
+            'trailers/movie_9_orphan.mp4': 'orphan',
+            'trailers/sha256/.incoming-abc': 'temp',
+            'trailers/hls/' + 'f' * 64 + '/master.m3u8': 'orphan',
+            'trailers/movie_1_test.mp4': 'size_mismatch',
+            'posters/gone.jpg': 'missing',
+        }
+        assert report['indexed_files'] == 5
+        assert report['reclaimable_bytes'] == 30
+        assert report['state']['pass'] == 2
+
+        reclaimed = client.post('/api/admin/media-scan/reclaim', headers=headers).get_json()
+        assert reclaimed == {'removed': 3, 'bytes': 30}
+        assert not os.path.exists(os.path.join(media_root, 'trailers/movie_9_orphan.mp4'))
+        assert not os.path.exists(os.path.join(media_root, 'trailers/hls'))
+        assert os.path.exists(os.path.join(media_root, 'trailers/fresh_upload.mp4'))
+        assert os.path.exists(os.path.join(media_root, 'trailers/movie_1_test.mp4'))
+        assert media_scan.media_scan_report()['issues']['orphan'] == 0
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+class _FakeS3Client:
+    """S3 API в памяти: ровно те методы, которыми пользуется S3MediaStorage."""
+
+    class NotFound(Exception):
+        response = {'Error': {'Code': '404'}}
+
+    def __init__(self):
+        self.objects = {}
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, 'rb') as source:
+            self.objects[key] = (source.read(), dict(ExtraArgs or {}))
+
+    def download_file(self, bucket, key, filename):
+        if key not in self.objects:
+            raise self.NotFound(key)
+        with open(filename, 'wb') as target:
+            target.write(self.objects[key][0])
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.NotFound(Key)
+        return {'ContentLength': len(self.objects[Key][0])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'], None)
+
+    def get_paginator(self, operation):
+        client = self
+
+        class _Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': key} for key in sorted(client.objects) if key.startswith(Prefix)]}
+
+        return _Paginator()
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?X-Amz-Expires={ExpiresIn}"
+
+
+def test_s3_storage_backend_publishes_blobs_and_redirects_streams_to_presigned_urls(app):
+    import hashlib
+
+    from movie_lottery.utils.media_storage import S3MediaStorage, ensure_local_media
+    from movie_lottery.utils.media_store import KIND_TRAILER, BlobWriter, collect_orphan_blobs
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    fake_s3 = _FakeS3Client()
+    app.extensions['media_storage'] = S3MediaStorage(
+        bucket='media', prefix='lottery', presign_seconds=600, client=fake_s3,
+    )
+    payload = b'remote-trailer' * 50
+    digest = hashlib.sha256(payload).hexdigest()
+    try:
+        with BlobWriter(KIND_TRAILER) as writer:
+            writer.write(payload)
+            movie.trailer_file_path = writer.commit('.mp4')
+        movie.trailer_file_size = len(payload)
+        db.session.commit()
+        key = f'lottery/trailers/sha256/{digest[:2]}/{digest}.mp4'
+        assert fake_s3.objects[key][0] == payload
+        assert fake_s3.objects[key][1]['ContentType'] == 'video/mp4'
+
+        # Байты и Range-запросы идут в бакет, приложение только перенаправляет
+        response = client.get(f'/api/trailers/{movie.id}/stream', headers={'Range': 'bytes=0-9'})
+        assert response.status_code == 302
+        assert response.headers['Location'] == f'https://s3.test/media/{key}?X-Amz-Expires=600'
+        assert response.headers['Cache-Control'] == 'no-store'
+
+        # Узел без локальной копии докачивает файл из бакета
+        local_path = os.path.join(media_root, movie.trailer_file_path)
+        os.remove(local_path)
+        assert ensure_local_media(movie.trailer_file_path) == local_path
+        with open(local_path, 'rb') as restored:
+            assert restored.read() == payload
+
+        assert client.delete(f'/api/library/{movie.id}').status_code == 200
+        assert collect_orphan_blobs() == 1
+        assert key not in fake_s3.objects
+    finally:
+        app.extensions.pop('media_storage', None)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_trailer_streams_are_limited_per_voter_and_shaped_by_token_bucket(app, monkeypatch):
+    from movie_lottery.utils import stream_limits
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config.update(
+        MEDIA_STREAM_MAX_CONCURRENT=3,
+        MEDIA_STREAM_MAX_PER_IP=3,
+        MEDIA_STREAM_MAX_PER_VOTER=1,
+        MEDIA_STREAM_RETRY_AFTER_SECONDS=7,
+    )
+    client.set_cookie('voter_token', 'voter-a')
+    url = f'/api/trailers/{movie.id}/stream'
+    try:
+        # Пока первый поток не дочитан, второй поток того же зрителя получает 429
+        first = client.get(url, headers={'Range': 'bytes=0-9'})
+        assert first.status_code == 206
+        limited = client.get(url, headers={'Range': 'bytes=10-19'})
+        assert limited.status_code == 429
+        assert limited.headers['Retry-After'] == '7'
+        assert limited.get_json()['scope'] == 'voter'
+        assert first.get_data() == b'0123456789'
+        first.close()
+        assert client.get(url, headers={'Range': 'bytes=10-19'}).status_code == 206
+
+        # Общий лимит не зависит от зрителя
+        app.config['MEDIA_STREAM_MAX_CONCURRENT'] = 1
+        client.set_cookie('voter_token', 'voter-b')
+        held = client.get(url)
+        client.set_cookie('voter_token', 'voter-c')
+        assert client.get(url).get_json()['scope'] == 'global'
+        held.close()
+
+        # Token bucket: 10 байт/с с запасом на 2 с — на 100 байт ждём ещё 8 с
+        app.config['MEDIA_STREAM_MAX_CONCURRENT'] = 3
+        app.config['MEDIA_STREAM_RATE_BYTES'] = 10
+        waits = []
+        monkeypatch.setattr(stream_limits.time, 'sleep', waits.append)
+        shaped = client.get(url)
+        assert shaped.status_code == 200
+        assert len(shaped.get_data()) == 100
+        assert len(waits) == 1 and 7.9 < waits[0] <= 8.0
+        assert stream_limits.get_stream_limiter().active(stream_limits.SCOPE_GLOBAL) == 0
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_signed_trailer_streams_are_limited_by_token_voter_fingerprint(app):
+    import hashlib
+
+    from movie_lottery.utils import stream_limits
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app, allow_unsigned=False)
+    app.config.update(MEDIA_STREAM_MAX_CONCURRENT=3, MEDIA_STREAM_MAX_PER_IP=3, MEDIA_STREAM_MAX_PER_VOTER=1)
+    client.set_cookie('voter_token', 'voter-a')
+    url = movie.signed_trailer_url('voter-a')
+    fingerprint = hashlib.sha256(b'voter-a').hexdigest()[:16]
+    limiter = stream_limits.get_stream_limiter()
+    try:
+        # Слот зрителя считается по отпечатку из подписи ссылки, а не по cookie
+        first = client.get(url, headers={'Range': 'bytes=0-9'})
+        assert first.status_code == 206
+        assert limiter.active(f'{stream_limits.SCOPE_VOTER}:{fingerprint}') == 1
+        assert limiter.active(f'{stream_limits.SCOPE_VOTER}:voter-a') == 0
+        limited = client.get(url, headers={'Range': 'bytes=10-19'})
+        assert limited.status_code == 429
+        assert limited.get_json()['scope'] == 'voter'
+        first.close()
+        assert limiter.active(f'{stream_limits.SCOPE_VOTER}:{fingerprint}') == 0
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_create_poll_prewarms_library_trailers_in_background(app, monkeypatch):
+    from movie_lottery.utils import page_cache
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app, payload=b'x' * 3000)
+    hls_dir = os.path.join(media_root, 'trailers', 'hls', 'movie_1_test.mp4')
+    for rendition in ('0', '1'):
+        os.makedirs(os.path.join(hls_dir, rendition))
+        with open(os.path.join(hls_dir, rendition, 'index.m3u8'), 'w') as playlist:
+            playlist.write('#EXTM3U\n')
+        for index in range(3):
+            with open(os.path.join(hls_dir, rendition, f'seg_{index:03d}.ts'), 'wb') as segment:
+                segment.write(b's' * 400)
+    with open(os.path.join(hls_dir, 'master.m3u8'), 'w') as playlist:
+        playlist.write('#EXTM3U\n')
+    movie.trailer_hls_path = 'trailers/hls/movie_1_test.mp4/master.m3u8'
+    db.session.commit()
+
+    class InlineThread:
+        def __init__(self, target, args, **kwargs):
+            self.target, self.args = target, args
+
+        def start(self):
+            self.target(*self.args)
+
+    warmed = []
+
+    def fake_warm_file(path, length):
+        done = min(length, os.path.getsize(path))
+        warmed.append((os.path.relpath(path, media_root), done))
+        return done
+
+    monkeypatch.setattr(page_cache.threading, 'Thread', InlineThread)
+    monkeypatch.setattr(page_cache, 'warm_file', fake_warm_file)
+    monkeypatch.setattr(page_cache, '_prewarm_budget', lambda: 1000)
+    try:
+        movies = [_build_movie('Trailer Movie'), _build_movie('No Trailer')]
+        assert _create_poll_via_api(client, movies).status_code == 200
+        assert warmed == []
+
+        app.config['TRAILER_PREWARM_ENABLED'] = True
+        assert _create_poll_via_api(client, movies).status_code == 200
+        hls = os.path.join('trailers', 'hls', 'movie_1_test.mp4')
+        # Начало MP4 и начало каждого качества HLS в пределах одного бюджета
+        assert warmed == [
+            (os.path.join('trailers', 'movie_1_test.mp4'), 1000),
+            (os.path.join(hls, '0', 'index.m3u8'), 8),
+            (os.path.join(hls, '1', 'index.m3u8'), 8),
+            (os.path.join(hls, 'master.m3u8'), 8),
+            (os.path.join(hls, '0', 'seg_000.ts'), 400),
+            (os.path.join(hls, '1', 'seg_000.ts'), 400),
+            (os.path.join(hls, '0', 'seg_001.ts'), 176),
+        ]
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_warm_file_requests_only_the_file_prefix(tmp_path):
+    from movie_lottery.utils.page_cache import warm_file
+
+    path = tmp_path / 'trailer.mp4'
+    path.write_bytes(b'0' * 5000)
+    assert warm_file(str(path), 4096) == 4096
+    assert warm_file(str(path), 1 << 20) == 5000
+
+
+def test_low_quality_trailer_is_built_on_demand_and_evicted_by_lru(app, monkeypatch):
+    from movie_lottery.utils import job_queue, media_jobs
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    app.config.update(TRAILER_LOW_QUALITY_ENABLED=True, TRAILER_LOW_QUALITY_CACHE_MB=0)
+    movie.trailer_view_cost = 0
+    db.session.commit()
+    response = _create_poll_via_api(client, [_build_movie('Trailer Movie'), _build_movie('Other')])
+    poll = Poll.query.get(response.get_json()['poll_id'])
+    poll_movie_id = next(item.id for item in poll.movies if item.name == 'Trailer Movie')
+    db.session.add(PollVoterProfile(token='slow-viewer', total_points=0))
+    db.session.commit()
+    client.set_cookie(api_routes.VOTER_TOKEN_COOKIE, 'slow-viewer')
+    calls = []
+
+    def fake_build(input_path, output_path, **kwargs):
+        calls.append(kwargs)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, 'wb') as output:
+            output.write(b'low-quality')
+        return {'success': True, 'message': 'ok', 'size': 11}
+
+    monkeypatch.setattr(media_jobs, 'build_low_quality_trailer', fake_build)
+    # Давно не запрошенная копия другого трейлера вытесняется при сборке новой
+    stale_dir = os.path.join(media_root, 'trailers', 'low', 'old_version')
+    os.makedirs(stale_dir)
+    with open(os.path.join(stale_dir, '480p.mp4'), 'wb') as stale:
+        stale.write(b'x' * 64)
+    os.utime(os.path.join(stale_dir, '480p.mp4'), (1, 1))
+    try:
+        # Медленный клиент получает облегчённую ссылку, задание ставится один раз
+        for _ in range(2):
+            response = client.post(
+                f'/api/polls/{poll.id}/watch-trailer',
+                json={'movie_id': poll_movie_id, 'connection': {'effective_type': '3g'}},
+            )
+            assert response.status_code == 200
+            url = response.get_json()['trailer_url']
+            assert url == response.get_json()['low_quality_url']
+            assert url.endswith('&quality=low')
+        jobs = MediaJob.query.filter_by(job_type=media_jobs.JOB_LOW_QUALITY_TRAILER).all()
+        assert len(jobs) == 1
+
+        # Копии ещё нет: плеер уходит на исходный файл, стриминг заданий не ставит
+        response = client.get(url)
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(url[:-len('&quality=low')])
+        assert response.headers['Cache-Control'] == 'no-store'
+        assert MediaJob.query.filter_by(job_type=media_jobs.JOB_LOW_QUALITY_TRAILER).count() == 1
+
+        assert job_queue.process_pending_jobs('test-worker', concurrency=1) == 1
+        assert calls[0]['height'] == 480 and calls[0]['video_kbps'] == 700
+        assert not os.path.exists(stale_dir)
+
+        response = client.get(url, headers={'Range': 'bytes=0-2'})
+        assert response.status_code == 206
+        assert response.data == b'low'
+        assert response.headers['Content-Range'] == 'bytes 0-2/11'
+        assert 'immutable' not in response.headers['Cache-Control']
+        versioned_low = client.get(f'/api/trailers/{movie.id}/stream?v=movie_1_test&quality=low')
+        assert versioned_low.data == b'low-quality'
+        assert 'immutable' not in versioned_low.headers['Cache-Control']
+        # Исходный трейлер не тронут
+        assert client.get(f'/api/trailers/{movie.id}/stream?v=movie_1_test').data == b'0123456789' * 10
+
+        # Замена трейлера удаляет и облегчённую копию
+        media_jobs.remove_trailer_derivatives(movie.trailer_file_path, media_root)
+        assert not os.path.exists(os.path.join(media_root, 'trailers', 'low', 'movie_1_test'))
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_media_usage_totals_follow_uploads_and_quotas_reject_new_files(app, monkeypatch):
+    from io import BytesIO
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    monkeypatch.setenv('ADMIN_SECRET_KEY', 'admin-secret')
+    headers = {'Authorization': 'Bearer admin-secret'}
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    # Постер, сохранённый до учёта места: размер заполняет первый пересчёт
+    os.makedirs(os.path.join(media_root, 'posters'))
+    with open(os.path.join(media_root, 'posters', 'poster_1.jpg'), 'wb') as poster:
+        poster.write(b'p' * 50)
+    movie.poster_file_path = 'posters/poster_1.jpg'
+    db.session.commit()
+
+    def _upload(size):
+        return client.post(
+            f'/api/movies/{movie.id}/trailer-local',
+            data={'trailer': (BytesIO(b't' * size), 'trailer.mp4', 'video/mp4')},
+            content_type='multipart/form-data',
+        )
+
+    try:
+        assert client.get('/api/admin/media-usage').status_code == 401
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['totals']['trailers'] == {'bytes': 100, 'files': 1}
+        assert report['totals']['posters'] == {'bytes': 50, 'files': 1}
+        assert report['quotas']['total'] == {'limit_bytes': None, 'remaining_bytes': None}
+        assert report['movies'] == [{
+            'id': movie.id, 'name': 'Trailer Movie',
+            'trailer_bytes': 100, 'poster_bytes': 50, 'total_bytes': 150,
+        }]
+
+        # Замена трейлера: итог меняется на разницу размеров
+        assert _upload(300).status_code == 200
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['totals']['trailers'] == {'bytes': 300, 'files': 1}
+        assert report['totals']['bytes'] == 350
+
+        app.config['MEDIA_QUOTA_TRAILERS_MB'] = 1
+        assert _upload(2 * 1024 * 1024).status_code == 413
+        response = client.post(
+            f'/api/movies/{movie.id}/trailer-uploads',
+            headers={'Tus-Resumable': '1.0.0', 'Upload-Length': str(2 * 1024 * 1024)},
+        )
+        assert response.status_code == 413
+        assert _upload(1000).status_code == 200
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['quotas']['trailers']['remaining_bytes'] == 1024 * 1024 - 1000
+
+        other = LibraryMovie(name='Other', year='2023', trailer_file_path='trailers/other.mp4',
+                             trailer_file_size=7)
+        db.session.add(other)
+        db.session.commit()
+        # Фильм, добавленный в обход учёта, попадает в итоги после пересчёта
+        recount = client.post('/api/admin/media-usage/recount', headers=headers).get_json()
+        assert recount['totals']['trailers'] == {'bytes': 1007, 'files': 2}
+
+        assert client.delete(f'/api/library/{movie.id}').status_code == 200
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['totals']['trailers'] == {'bytes': 7, 'files': 1}
+        assert report['totals']['posters'] == {'bytes': 0, 'files': 0}
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+
+def test_media_usage_counts_shared_blob_once_for_totals_and_quotas(app, monkeypatch):
+    from io import BytesIO
+
+    client = app.test_client()
+    movie, media_root = _create_library_trailer(app)
+    monkeypatch.setenv('ADMIN_SECRET_KEY', 'admin-secret')
+    headers = {'Authorization': 'Bearer admin-secret'}
+    app.config['TRAILER_UPLOAD_DIR'] = os.path.join(media_root, 'trailers')
+    app.config['TRAILER_HLS_ENABLED'] = False
+    app.config['TRAILER_THUMBNAILS_ENABLED'] = False
+    other = LibraryMovie(name='Other', year='2023')
+    db.session.add(other)
+    db.session.commit()
+    size = 600 * 1024
+
+    def _upload(movie_id, payload):
+        return client.post(
+            f'/api/movies/{movie_id}/trailer-local',
+            data={'trailer': (BytesIO(payload), 'trailer.mp4', 'video/mp4')},
+            content_type='multipart/form-data',
+        )
+
+    try:
+        # Одинаковые байты у двух фильмов лежат на диске одним файлом
+        assert _upload(movie.id, b's' * size).status_code == 200
+        assert _upload(other.id, b's' * size).status_code == 200
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['totals']['trailers'] == {'bytes': size, 'files': 1}
+        assert report['movie_totals']['trailers'] == {'bytes': 2 * size, 'files': 2}
+        assert [item['trailer_bytes'] for item in report['movies']] == [size, size]
+
+        # Сумма по фильмам (1.2 МБ) превысила бы квоту, место на диске — нет
+        app.config['MEDIA_QUOTA_TRAILERS_MB'] = 1
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['quotas']['trailers']['remaining_bytes'] == 1024 * 1024 - size
+        third = LibraryMovie(name='Third', year='2022')
+        db.session.add(third)
+        db.session.commit()
+        assert _upload(third.id, b'n' * 1000).status_code == 200
+
+        # Снятая ссылка не освобождает место, пока файл нужен другому фильму
+        assert client.delete(f'/api/library/{movie.id}').status_code == 200
+        report = client.get('/api/admin/media-usage', headers=headers).get_json()
+        assert report['totals']['trailers'] == {'bytes': size + 1000, 'files': 2}
+        assert report['movie_totals']['trailers'] == {'bytes': size + 1000, 'files': 2}
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)